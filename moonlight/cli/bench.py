@@ -0,0 +1,171 @@
+"""Commands measuring moonlight's own performance"""
+
+import json
+import pathlib
+import sys
+import tempfile
+
+import click
+
+from moonlight.net import PacketReader
+from moonlight.net.bench import build_suite, compare_results, run_suite, select_cases
+from moonlight.util.click_util import typedef_option
+
+
+def _echo_result(result: dict) -> None:
+    click.echo(
+        f"{result['name']:<30}{result['per_sec']:>14,.0f} {result['unit']}/s"
+        f"{result['median'] * 1000:>12.3f} ms  ±{result['stdev'] * 1000:.3f}",
+        err=True,
+    )
+
+
+@click.command()
+@click.argument(
+    "message_def_dir",
+    type=click.Path(
+        exists=True, dir_okay=True, resolve_path=True, path_type=pathlib.Path
+    ),
+)
+@click.option(
+    "-o",
+    "--output",
+    "output_f",
+    default=None,
+    type=click.Path(dir_okay=False, allow_dash=True, path_type=pathlib.Path),
+    help="Write results as json to this file, or '-' for stdout",
+)
+@click.option(
+    "-b",
+    "--baseline",
+    "baseline_f",
+    default=None,
+    type=click.Path(exists=True, dir_okay=False, path_type=pathlib.Path),
+    help="Results of an earlier run to compare against",
+)
+@click.option(
+    "--tolerance",
+    type=click.FloatRange(min=0),
+    default=0.1,
+    show_default=True,
+    help="Throughput loss against the baseline allowed before failing, as a fraction",
+)
+@click.option(
+    "-k",
+    "--select",
+    "patterns",
+    multiple=True,
+    metavar="PATTERN",
+    help="Only run benchmarks matching this glob, e.g. 'dml.*'. Can be repeated",
+)
+@click.option(
+    "-n",
+    "--messages",
+    type=click.IntRange(min=1),
+    default=2000,
+    show_default=True,
+    help="Synthetic messages processed per benchmark call",
+)
+@click.option(
+    "--repeat",
+    type=click.IntRange(min=1),
+    default=5,
+    show_default=True,
+    help="Timed repeats per benchmark",
+)
+@click.option(
+    "--min-time",
+    type=click.FloatRange(min=0),
+    default=0.2,
+    show_default=True,
+    help="Least seconds per repeat. Calls are looped to reach it",
+)
+@click.option(
+    "--seed",
+    type=int,
+    default=0,
+    show_default=True,
+    help="Seed of the synthetic messages",
+)
+@click.option(
+    "--property-object",
+    "property_object_f",
+    default=None,
+    type=click.Path(exists=True, dir_okay=False, path_type=pathlib.Path),
+    help="Serialized character creation info to time property object "
+    "deserialization with. Requires --typedefs",
+)
+@typedef_option
+def bench(  # pylint: disable=too-many-arguments too-many-locals
+    message_def_dir: pathlib.Path,
+    output_f: pathlib.Path | None,
+    baseline_f: pathlib.Path | None,
+    tolerance: float,
+    patterns: tuple[str, ...],
+    messages: int,
+    repeat: int,
+    min_time: float,
+    seed: int,
+    property_object_f: pathlib.Path | None,
+    typedefs: pathlib.Path | None,
+):
+    """Benchmark decoding throughput
+
+    Times each layer of decoding over synthetic messages generated from the
+    definitions in MESSAGE_DEF_DIR: primitive reads, KI headers, DML and
+    control messages, json encoding and decoding a whole capture. Property
+    object deserialization is timed when --property-object and --typedefs
+    are given.
+
+    Results are printed as they finish and can be saved as json with
+    --output. Given the saved results of an earlier run with --baseline, the
+    command fails if any benchmark lost more throughput than --tolerance.
+
+    MESSAGE_DEF_DIR: Message definitions to generate messages from, such as
+    test/fixtures/dml/messages
+    """
+    if property_object_f is not None and typedefs is None:
+        raise click.UsageError("--property-object requires --typedefs")
+    baseline = None
+    if baseline_f is not None:
+        with open(baseline_f, encoding="utf8") as file:
+            baseline = json.load(file)
+
+    registry = PacketReader(msg_def_folder=message_def_dir).dml_protocol
+    with tempfile.TemporaryDirectory(prefix="moonlight-bench-") as work_dir:
+        try:
+            cases = build_suite(
+                registry,
+                work_dir,
+                messages=messages,
+                seed=seed,
+                property_object=property_object_f.read_bytes()
+                if property_object_f
+                else None,
+                typedef_path=typedefs,
+            )
+        except ValueError as err:
+            raise click.BadParameter(str(err), param_hint="MESSAGE_DEF_DIR") from err
+        cases = select_cases(cases, patterns)
+        if not cases:
+            raise click.BadParameter("No benchmarks match", param_hint="--select")
+        results = run_suite(
+            cases, repeat=repeat, min_time=min_time, progress=_echo_result
+        )
+
+    if output_f is not None:
+        if str(output_f) == "-":
+            click.echo(json.dumps(results, indent=2))
+        else:
+            with open(output_f, "w", encoding="utf8") as file:
+                json.dump(results, file, indent=2)
+
+    if baseline is None:
+        return
+    comparison = compare_results(results, baseline, tolerance=tolerance)
+    click.echo(err=True)
+    for entry in comparison:
+        flag = "REGRESSION" if entry["regression"] else ""
+        click.echo(f"{entry['name']:<30}{entry['change']:>+9.1%}  {flag}", err=True)
+    if any(entry["regression"] for entry in comparison):
+        sys.exit(1)
@@ -4,8 +4,11 @@ import logging
 import click
 
 # from .analyze import analyze as _analyze
+from .bench import bench
+from .codegen import codegen
 from .decode import decode
 from .pcap import pcap
+from .stats import stats
 
 STANDARD_LOG_FMT = "%(levelname)-8s %(message)s"
 STANDARD_LOG_LVL = logging.INFO
@@ -64,3 +67,6 @@ def cli_cmd(verbose, silent: bool, log_level: str):
 
 cli_cmd.add_command(decode)
 cli_cmd.add_command(pcap)
+cli_cmd.add_command(stats)
+cli_cmd.add_command(bench)
+cli_cmd.add_command(codegen)
@@ -0,0 +1,56 @@
+"""Commands generating python code from message definitions"""
+
+import pathlib
+
+import click
+
+from moonlight.net.codegen import generate_package
+
+
+@click.command()
+@click.argument(
+    "message_def_dir",
+    type=click.Path(
+        exists=True, dir_okay=True, resolve_path=True, path_type=pathlib.Path
+    ),
+)
+@click.argument(
+    "output_dir",
+    type=click.Path(file_okay=False, resolve_path=True, path_type=pathlib.Path),
+)
+@click.option(
+    "-n",
+    "--name",
+    "package_name",
+    default="moonlight_messages",
+    show_default=True,
+    help="Name of the generated package",
+)
+def codegen(message_def_dir: pathlib.Path, output_dir: pathlib.Path, package_name: str):
+    """
+    Generate a python package from message definitions
+
+    Writes an importable package with a module per service and a class per
+    message to OUTPUT_DIR. Classes have typed attributes and decode their
+    fields with precompiled structs. The package records a hash of the
+    definitions it was generated from.
+
+    Pass the package to `moonlight decode pcap --generated` to skip parsing
+    the xml definitions, or import it directly:
+
+    \b
+        import moonlight_messages
+        msg = moonlight_messages.decode(frame)
+
+    Generate again whenever the definitions change; moonlight refuses to use
+    a package that doesn't match them.
+
+    MSG_DEF_DIR: Directory holding KI DML definitions
+
+    OUTPUT_DIR: Directory to create the package in
+    """
+    try:
+        package_dir = generate_package(message_def_dir, output_dir, package_name)
+    except ValueError as err:
+        raise click.ClickException(str(err)) from err
+    click.echo(package_dir)
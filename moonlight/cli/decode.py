@@ -2,15 +2,43 @@
 
 
 import base64
+import binascii
+import contextlib
+import cProfile
 import json
 import logging
+import signal
+import struct
 import sys
 from pathlib import Path
+from typing import BinaryIO, ContextManager, Iterator, TextIO
 
 import click
 
-from moonlight.net import PacketReader, Message, KeepAliveMessage
-from moonlight.util import SerdeJSONEncoder, bytes_to_pretty_str
+from moonlight.net import (
+    DecodeMetrics,
+    DMLProtocolRegistry,
+    KeepAliveMessage,
+    Message,
+    MetricsLogReporter,
+    MetricsServer,
+    OverflowPolicy,
+    PacketReader,
+    RingRecorder,
+    SegmentDeduplicator,
+)
+from moonlight.net.batch import (
+    decode_file,
+    dump_capture_json,
+    expand_inputs,
+    run_batch,
+    split_capture_name,
+)
+from moonlight.net.follow import CaptureFollower
+from moonlight.net.memory import MemoryReporter
+from moonlight.net.metrics import message_type_name
+from moonlight.net.pcap import TruncatedCaptureError
+from moonlight.util import SerdeJSONEncoder, StageProfiler, bytes_to_pretty_str
 
 from moonlight.util.click_util import message_def_dir_arg, typedef_option
 
@@ -46,6 +74,85 @@ def decode():
     default=False,
     help="include service and order in the output json",
 )
+@click.option(
+    "-w",
+    "--workers",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="number of decode threads. Output order is only kept with one worker",
+)
+@click.option(
+    "--queue-size",
+    type=click.IntRange(min=1),
+    default=10000,
+    show_default=True,
+    help="maximum number of captured packets waiting to be decoded",
+)
+@click.option(
+    "--overflow",
+    type=click.Choice([policy.value for policy in OverflowPolicy]),
+    default=OverflowPolicy.BLOCK.value,
+    show_default=True,
+    help="what to do with captured packets when the decode queue is full",
+)
+@click.option(
+    "--metrics-port",
+    type=click.IntRange(min=0, max=65535),
+    default=None,
+    help="serve OpenMetrics on http://127.0.0.1:PORT/metrics",
+)
+@click.option(
+    "--metrics-interval",
+    type=click.FloatRange(min=0, min_open=True),
+    default=None,
+    help="log a metrics summary every this many seconds",
+)
+@click.option(
+    "--ring-buffer-mb",
+    type=click.FloatRange(min=0, min_open=True),
+    default=None,
+    help=(
+        "keep this many MiB of recent KI frames in memory. "
+        "Dumped to pcap on SIGUSR1 or when a --dump-on message is seen"
+    ),
+)
+@click.option(
+    "--ring-buffer-seconds",
+    type=click.FloatRange(min=0, min_open=True),
+    default=None,
+    help="only keep this many seconds of recent frames in the ring buffer",
+)
+@click.option(
+    "--dump-dir",
+    type=click.Path(file_okay=False, dir_okay=True, path_type=Path),
+    default=".",
+    show_default=True,
+    help="folder ring buffer dumps are written to",
+)
+@click.option(
+    "--dump-on",
+    multiple=True,
+    help="dump the ring buffer when a message with this name is decoded. Repeatable",
+)
+@click.option(
+    "--replay",
+    type=click.Path(
+        exists=True, file_okay=True, dir_okay=False, allow_dash=True, path_type=Path
+    ),
+    default=None,
+    help=(
+        "feed this capture file through the live pipeline instead of sniffing. "
+        "Use - for stdin. Compressed captures are decompressed while replaying"
+    ),
+)
+@click.option(
+    "--speed",
+    type=click.FloatRange(min=0),
+    default=1.0,
+    show_default=True,
+    help="replay speed relative to capture timestamps. 0 replays as fast as possible",
+)
 # @typedef_option
 # @click.option(
 #     "--filter-str",
@@ -65,6 +172,17 @@ def live(
     message_def_dir: Path,
     no_keep_alive: bool,
     show_service: bool,
+    workers: int,
+    queue_size: int,
+    overflow: str,
+    metrics_port: int | None,
+    metrics_interval: float | None,
+    ring_buffer_mb: float | None,
+    ring_buffer_seconds: float | None,
+    dump_dir: Path,
+    dump_on: tuple[str, ...],
+    replay: Path | None,
+    speed: float,
     # typedefs: Path,
     # filter_str: str,
     # iface: str
@@ -80,6 +198,10 @@ def live(
     Additionally, only traffic matching the provided filter is attempted to be
     decoded.
 
+    With --replay, a capture file is fed through the same decode queue and
+    workers at --speed times its recorded pace, which makes the live path
+    reproducible for load testing.
+
     MSG_DEF_DIR: Directory holding KI DML definitions
     """
 
@@ -87,6 +209,7 @@ def live(
     # pylint: disable=import-outside-toplevel
     from moonlight.net.scapy import (
         LiveSniffer,
+        PcapReplayer,
     )
 
     from scapy.packet import Packet
@@ -101,15 +224,70 @@ def live(
         click.echo(serde_encoder.encode(msg))
         click.echo("\n// " + ("~" * 15) + "\n")
 
-    rdr = LiveSniffer(
-        callback=echo_packet,
-        client_port=1337,
-        # typedef_path=typedefs,
-        msg_def_folder=message_def_dir,
-        filter_str=None,
-        silence_decode_errors=False,
-    )
-    rdr.open_livestream()
+    recorder = None
+    if ring_buffer_mb is not None or ring_buffer_seconds is not None or dump_on:
+        recorder = RingRecorder(
+            max_bytes=int((ring_buffer_mb or 64) * 1024 * 1024),
+            max_age=ring_buffer_seconds,
+            dump_dir=dump_dir,
+            min_dump_interval=ring_buffer_seconds or 0.0,
+        )
+        if dump_on:
+            dump_names = set(dump_on)
+            recorder.add_trigger(lambda msg: message_type_name(msg) in dump_names)
+        if hasattr(signal, "SIGUSR1"):
+            recorder.install_signal_handler()
+
+    metrics, reporters = _start_metrics(metrics_port, metrics_interval)
+    sniffer_kwargs = {
+        "callback": echo_packet,
+        "client_port": 1337,
+        # "typedef_path": typedefs,
+        "msg_def_folder": message_def_dir,
+        "filter_str": None,
+        "silence_decode_errors": False,
+        "queue_size": queue_size,
+        "workers": workers,
+        "overflow": overflow,
+        "metrics": metrics,
+        "recorder": recorder,
+    }
+    if replay is not None:
+        rdr = PcapReplayer(
+            pcap_path=sys.stdin.buffer if str(replay) == "-" else replay,
+            speed=speed,
+            **sniffer_kwargs,
+        )
+    else:
+        rdr = LiveSniffer(**sniffer_kwargs)
+    try:
+        rdr.open_livestream()
+    finally:
+        _stop_metrics(reporters)
+        if recorder is not None:
+            recorder.wait_for_dumps()
+
+
+def _start_metrics(
+    port: int | None, interval: float | None
+) -> tuple[DecodeMetrics | None, list]:
+    """Creates metrics and starts the requested exporters for them"""
+    if port is None and interval is None:
+        return None, []
+    metrics = DecodeMetrics()
+    reporters: list = []
+    if port is not None:
+        reporters.append(MetricsServer(metrics, port))
+    if interval is not None:
+        reporters.append(MetricsLogReporter(metrics, interval))
+    for reporter in reporters:
+        reporter.start()
+    return metrics, reporters
+
+
+def _stop_metrics(reporters: list) -> None:
+    for reporter in reporters:
+        reporter.stop()
 
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -147,53 +325,332 @@ def live(
     default=False,
     help="Interpret the information as a DML frame, skipping the control info",
 )
+@click.option(
+    "-b",
+    "--batch",
+    is_flag=True,
+    default=False,
+    help=(
+        "Stream many packets from stdin, writing one JSON line per packet. "
+        "hex and base64 input is newline delimited, raw input is framed with "
+        "a 4 byte little endian length prefix"
+    ),
+)
 def packet(  # pylint: disable=too-many-arguments
     message_def_dir: Path,
     input_str: bytes,
     typedefs: Path,
     in_fmt: str,
     dml_only: bool,
+    batch: bool,
 ):
     """Decodes packet from stdin
 
     Takes a variety of encoding formats of KI packets and converts them into
     a supported human-readable format.
 
+    With --batch, stdin is read as a stream of packets which are decoded one
+    at a time as they arrive. Each packet produces exactly one line of JSON
+    output (NDJSON). Packets that fail to decode produce an error line
+    instead of ending the stream.
+
     MSG_DEF_DIR: Directory holding KI DML definitions
     """
 
-    if input_str is None:
-        input_str = sys.stdin.buffer.read()
-
-    if in_fmt == "base64":
-        input_str = base64.b64decode(input_str)
-    elif in_fmt == "hex":
-        input_str = bytes.fromhex(str(input_str.replace(b" ", b"").replace(b"\n", b"")))
-
     rdr = PacketReader(
         typedef_path=typedefs,
         msg_def_folder=message_def_dir,
     )
 
-    if dml_only:
-        msg = rdr.dml_protocol.decode_packet(input_str, has_ki_header=False)
-    else:
-        msg = rdr.decode_ki_packet(input_str)
+    if batch:
+        if input_str is not None:
+            raise click.BadOptionUsage(
+                "input_str", "--input-str cannot be used with --batch"
+            )
+        _decode_packet_stream(rdr, sys.stdin.buffer, in_fmt, dml_only)
+        return
+
+    if input_str is None:
+        input_str = sys.stdin.buffer.read()
+
+    error = "failed to decode packet"
+    try:
+        msg = _decode_single_packet(rdr, _unpack_input(input_str, in_fmt), dml_only)
+    except ValueError as err:
+        msg = None
+        error = str(err.__cause__ if err.__cause__ is not None else err)
 
     click.echo()
     if msg is None:
-        click.echo(
-            json.dumps(
-                obj={"error": "failed to decode packet"}, cls=SerdeJSONEncoder, indent=2
-            )
-        )
+        click.echo(json.dumps(obj={"error": error}, cls=SerdeJSONEncoder, indent=2))
     else:
         click.echo(SerdeJSONEncoder(show_service=True, indent=2).encode(msg))
 
 
+BATCH_LEN_PREFIX = struct.Struct("<I")
+
+
+def _unpack_input(data: bytes | str, in_fmt: str) -> bytes:
+    """Converts a packet in the given input format to its raw bytes"""
+    if isinstance(data, str):
+        data = data.encode()
+    if in_fmt == "base64":
+        return base64.b64decode(data)
+    if in_fmt == "hex":
+        return bytes.fromhex(data.replace(b" ", b"").replace(b"\n", b"").decode())
+    return data
+
+
+def _decode_single_packet(
+    rdr: PacketReader, bites: bytes, dml_only: bool
+) -> Message | None:
+    if dml_only:
+        return rdr.dml_protocol.decode_packet(bites, has_ki_header=False)
+    return rdr.decode_ki_packet(bites)
+
+
+def _iter_batch_records(stream: BinaryIO, in_fmt: str) -> Iterator[bytes]:
+    """Yields packet records from a batch input stream without unpacking them
+
+    Text formats are one packet per line with blank lines ignored. Raw
+    packets are preceded by their length as a little endian uint32.
+    """
+    if in_fmt != "raw":
+        for line in stream:
+            line = line.strip()
+            if line:
+                yield line
+        return
+
+    while True:
+        prefix = stream.read(BATCH_LEN_PREFIX.size)
+        if not prefix:
+            return
+        if len(prefix) != BATCH_LEN_PREFIX.size:
+            raise ValueError("Truncated length prefix at end of input")
+        (length,) = BATCH_LEN_PREFIX.unpack(prefix)
+        bites = stream.read(length)
+        if len(bites) != length:
+            raise ValueError(
+                f"Truncated frame at end of input: expected {length}, found {len(bites)}"
+            )
+        yield bites
+
+
+def _decode_packet_stream(
+    rdr: PacketReader, stream: BinaryIO, in_fmt: str, dml_only: bool
+) -> None:
+    """Decodes a batch of packets, writing one JSON line per record to stdout
+
+    Every line has the "record" index of its input, counting from 0. Lines
+    are flushed as they are written, so a pipe sees each one right away.
+    """
+    serde_encoder = SerdeJSONEncoder(show_service=True, indent=None)
+    out = click.get_text_stream("stdout")
+    records = _iter_batch_records(stream, in_fmt)
+    i = 0
+    while True:
+        try:
+            record = next(records)
+        except StopIteration:
+            break
+        except ValueError as err:
+            out.write(json.dumps({"record": i, "error": str(err)}) + "\n")
+            out.flush()
+            break
+
+        try:
+            msg = _decode_single_packet(rdr, _unpack_input(record, in_fmt), dml_only)
+            if msg is None:
+                line = json.dumps({"record": i, "error": "failed to decode packet"})
+            else:
+                line = serde_encoder.encode(
+                    {"record": i, **msg.as_serde_dict(**serde_encoder.passthrough)}
+                )
+        except (ValueError, binascii.Error) as err:
+            cause = err.__cause__ if err.__cause__ is not None else err
+            line = json.dumps({"record": i, "error": str(cause)})
+        out.write(line + "\n")
+        out.flush()
+        i += 1
+
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 
+def _open_text_output(path: Path) -> ContextManager[TextIO]:
+    """Opens an output file for writing text, treating '-' as stdout"""
+    if str(path) == "-":
+        return contextlib.nullcontext(sys.stdout)
+    return open(path, "w", encoding="utf8")
+
+
+def _follow_capture(rdr, writer) -> None:
+    """Writes messages as JSON lines as the followed capture grows"""
+    # lazy load since scapy is kinda heavy
+    from scapy.layers.inet import TCP  # pylint: disable=import-outside-toplevel
+
+    serde_encoder = SerdeJSONEncoder(show_service=True, indent=None)
+    try:
+        while True:
+            try:
+                msg = next(rdr)
+            except ValueError as err:
+                msg = {
+                    "error": {
+                        "message": str(err),
+                        "raw": bytes_to_pretty_str(
+                            bytes(rdr.last_decoded_raw[TCP].payload)
+                        ),
+                    }
+                }
+            except StopIteration:
+                break
+            writer.write(serde_encoder.encode(msg) + "\n")
+            writer.flush()
+    except KeyboardInterrupt:
+        logger.info("Stopped following capture")
+
+
+@contextlib.contextmanager
+def _profiling(profiler: StageProfiler | None, cprofile: cProfile.Profile | None):
+    """Runs the enclosed code under the given profilers, if any"""
+    if profiler is not None:
+        profiler.start()
+    if cprofile is not None:
+        cprofile.enable()
+    try:
+        yield
+    finally:
+        if cprofile is not None:
+            cprofile.disable()
+        if profiler is not None:
+            profiler.stop()
+
+
+def _echo_profile(report: dict) -> None:
+    """Prints a `StageProfiler` report as tables to stderr"""
+    wall = report["wall"]
+    click.echo(f"\nProfiled {wall:.3f}s", err=True)
+    click.echo(
+        f"{'Stage':<18}{'calls':>10}{'own s':>10}{'own %':>8}{'total s':>10}{'us/call':>10}",
+        err=True,
+    )
+    for entry in report["stages"]:
+        click.echo(
+            f"{entry['name']:<18}{entry['calls']:>10}{entry['own']:>10.3f}"
+            f"{entry['share']:>8.1%}{entry['total']:>10.3f}{entry['per_call'] * 1e6:>10.1f}",
+            err=True,
+        )
+    unstaged = report["unstaged"]
+    click.echo(
+        f"{'(other)':<18}{'':>10}{unstaged:>10.3f}{unstaged / wall if wall else 0:>8.1%}",
+        err=True,
+    )
+
+    click.echo(
+        f"\n{'Message':<40}{'count':>10}{'decode s':>10}{'encode s':>10}{'us/msg':>10}",
+        err=True,
+    )
+    for entry in report["messages"]:
+        click.echo(
+            f"{entry['name']:<40}{entry['count']:>10}{entry.get('decode', 0):>10.3f}"
+            f"{entry.get('encode', 0):>10.3f}{entry['per_message'] * 1e6:>10.1f}",
+            err=True,
+        )
+
+
+def _generated_registry(package: Path, message_def_dir: Path) -> DMLProtocolRegistry:
+    # pylint: disable=import-outside-toplevel
+    from moonlight.net.codegen import load_generated
+
+    try:
+        return DMLProtocolRegistry.from_generated(
+            load_generated(package, message_def_dir)
+        )
+    except (ImportError, ValueError) as err:
+        raise click.ClickException(f"Cannot use generated package: {err}") from err
+
+
+def _echo_error_footer(decoded: int, errors: dict, top: int = 10) -> None:
+    """Prints decode totals and the most frequent kinds of failures to stderr"""
+    click.echo(f"\nDecoded {decoded} messages, {errors['total']} failed", err=True)
+    if not errors["buckets"]:
+        return
+    click.echo(f"{'Message':<24}{'error':<24}{'count':>10}  first error", err=True)
+    for bucket in errors["buckets"][:top]:
+        if bucket["control"]:
+            what = f"opcode {bucket['message_id']}"
+        elif bucket["service_id"] is None:
+            what = "?"
+        else:
+            what = f"{bucket['service_id']}:{bucket['message_id']}"
+        click.echo(
+            f"{what:<24}{bucket['error']:<24}{bucket['count']:>10}  "
+            f"{bucket['first_error'][:80]}",
+            err=True,
+        )
+    if len(errors["buckets"]) > top:
+        click.echo(f"... and {len(errors['buckets']) - top} more kinds", err=True)
+
+
+def _check_capture_error(rdr) -> None:
+    """Fails on a capture that was only read in part, unless it was stdin
+
+    A stream cut off part way through a record is how `tcpdump -w -` input
+    normally ends, so it only gets the reader's warning.
+    """
+    for reader in getattr(rdr, "readers", [rdr]):
+        err = reader.capture_error
+        if err is None:
+            continue
+        if not isinstance(err, TruncatedCaptureError):
+            raise click.ClickException(f"Capture is corrupt: {err}")
+        if reader.pcap_path is not sys.stdin.buffer:
+            raise click.ClickException(f"Capture is truncated: {err}")
+
+
+def _mib(value: int | None) -> str:
+    return "n/a" if value is None else f"{value / 1024 / 1024:.1f}"
+
+
+def _echo_memory_report(report: dict) -> None:
+    """Prints a `MemoryReporter` report as tables to stderr"""
+    click.echo(
+        f"\nPeak rss {_mib(report['peak_rss'])} MiB, "
+        f"peak traced {_mib(report['peak_traced'])} MiB",
+        err=True,
+    )
+    click.echo(
+        f"{'Seconds':>10}{'rss MiB':>12}{'traced MiB':>12}{'objects MiB':>13}", err=True
+    )
+    for sample in report["samples"]:
+        click.echo(
+            f"{sample['elapsed']:>10.1f}{_mib(sample['rss']):>12}"
+            f"{_mib(sample['traced']):>12}{_mib(sum(sample['census'].values())):>13}",
+            err=True,
+        )
+
+    final = report["final"]
+    for title, rows in (
+        ("Type", final["census"]["by_type"]),
+        ("Message", final["census"]["by_message"]),
+    ):
+        click.echo(f"\n{title:<40}{'count':>10}{'KiB':>12}", err=True)
+        for row in rows:
+            click.echo(
+                f"{row['name']:<40}{row['count']:>10}{row['bytes'] / 1024:>12.1f}",
+                err=True,
+            )
+
+    click.echo(f"\n{'Allocation site':<60}{'count':>10}{'KiB':>12}", err=True)
+    for site in final["sites"]:
+        click.echo(
+            f"{site['site'][-60:]:<60}{site['count']:>10}{site['bytes'] / 1024:>12.1f}",
+            err=True,
+        )
+
+
 @decode.command()
 # @message_def_dir_arg
 @click.argument(
@@ -202,18 +659,117 @@ def packet(  # pylint: disable=too-many-arguments
 )
 @click.argument(
     "input_f",
-    type=click.Path(exists=True, file_okay=True, resolve_path=True, path_type=Path),
+    nargs=-1,
+    required=True,
+    type=click.Path(
+        exists=True, file_okay=True, resolve_path=True, allow_dash=True, path_type=Path
+    ),
 )
 @click.argument(
     "output_f",
-    type=click.Path(file_okay=True, resolve_path=True, path_type=Path),
+    type=click.Path(file_okay=True, resolve_path=True, allow_dash=True, path_type=Path),
+)
+@click.option(
+    "--metrics-interval",
+    type=click.FloatRange(min=0, min_open=True),
+    default=None,
+    help="log a throughput summary every this many seconds",
+)
+@click.option(
+    "--dedupe/--no-dedupe",
+    default=False,
+    show_default=True,
+    help="skip retransmitted and duplicated TCP segments",
+)
+@click.option(
+    "-f",
+    "--follow",
+    is_flag=True,
+    default=False,
+    help="keep decoding records as they are appended, following ring buffer rotation",
+)
+@click.option(
+    "--poll-interval",
+    type=click.FloatRange(min=0, min_open=True),
+    default=0.1,
+    show_default=True,
+    help="first wait in seconds for new data when following",
+)
+@click.option(
+    "--max-poll-interval",
+    type=click.FloatRange(min=0, min_open=True),
+    default=2.0,
+    show_default=True,
+    help="longest wait in seconds for new data when following",
+)
+@click.option(
+    "--threaded-decompression",
+    is_flag=True,
+    default=False,
+    help="decompress gzip, xz or bzip2 input on a background thread",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    default=False,
+    help="print where decoding time went, by stage and message type, to stderr",
+)
+@click.option(
+    "--profile-output",
+    type=click.Path(dir_okay=False, resolve_path=True, path_type=Path),
+    default=None,
+    help="also write cProfile stats to this file, e.g. for snakeviz",
+)
+@click.option(
+    "--memory-report",
+    is_flag=True,
+    default=False,
+    help="trace memory use and print a breakdown by type and message to stderr",
+)
+@click.option(
+    "--memory-interval",
+    type=click.FloatRange(min=0, min_open=True),
+    default=5.0,
+    show_default=True,
+    help="seconds between memory samples",
+)
+@click.option(
+    "--memory-report-output",
+    type=click.Path(dir_okay=False, resolve_path=True, path_type=Path),
+    default=None,
+    help="also write the memory report as json to this file",
+)
+@click.option(
+    "--generated",
+    type=click.Path(exists=True, file_okay=False, resolve_path=True, path_type=Path),
+    default=None,
+    help="load definitions from a package made by `moonlight codegen` instead of xml",
+)
+@click.option(
+    "--lazy-definitions",
+    is_flag=True,
+    default=False,
+    help="only parse the definitions of services found in the capture",
 )
 @typedef_option
-def pcap(
+def pcap(  # pylint: disable=too-many-arguments too-many-locals
     message_def_dir: Path,
-    input_f: Path,
+    input_f: tuple[Path, ...],
     output_f: Path,
     typedefs: Path,
+    metrics_interval: float | None,
+    dedupe: bool,
+    follow: bool,
+    poll_interval: float,
+    max_poll_interval: float,
+    threaded_decompression: bool,
+    profile: bool,
+    profile_output: Path | None,
+    memory_report: bool,
+    memory_interval: float,
+    memory_report_output: Path | None,
+    generated: Path | None,
+    lazy_definitions: bool,
 ):
     """
     Decode pcap to a JSON representation
@@ -225,51 +781,197 @@ def pcap(
     A packet is naively considered to be of the KI protocol if it starts with
     the \\x0D\\xF0 magic (little endian F00D). This may be improved in the future.
 
+    When several captures are given, such as rotated files or client and
+    server sides recorded separately, their messages are merged into one
+    output in timestamp order. gzip, xz and bzip2 compressed captures are
+    decompressed while reading.
+
+    With --follow, a single capture that is still being written (for example
+    by dumpcap with a ring buffer) is decoded as records are appended, and
+    messages are written as JSON lines until interrupted.
+
+    With --profile, the time spent reading packets, decoding headers, DML
+    and control messages and property objects, encoding json and writing
+    output is printed when done, along with the decode and encode cost of
+    each message type. --profile-output additionally records a cProfile of
+    the whole run that can be opened with `snakeviz` or `pstats`. Stage
+    times include cProfile's overhead when both are used.
+
+    With --memory-report, resident and traced memory are sampled every
+    --memory-interval seconds, and the live messages, fields, headers,
+    property objects and raw payloads are sized by type and by message.
+    The timeline, the final breakdown and the allocation sites holding the
+    most memory are printed when done. Tracing allocations makes decoding
+    several times slower.
+
+    With --generated, definitions come from a package written by
+    `moonlight codegen` and messages decode with its generated code. The
+    package has to have been generated from MSG_DEF_DIR.
+
+    With --lazy-definitions, only the service id of each definition file is
+    read up front and a service is parsed when its first message is
+    decoded. This starts faster and uses less memory for captures that only
+    touch a few services.
+
     MSG_DEF_DIR: Directory holding KI DML definitions
 
-    INPUT_F: A valid packet capture file containing KI network traffic
+    INPUT_F: One or more valid packet capture files containing KI network
+    traffic. '-' reads a pcap or pcapng stream from stdin, e.g. from
+    `tcpdump -w -`.
 
-    OUTPUT_F: File to write filtered capture to
+    OUTPUT_F: File to write decoded messages to, or '-' for stdout
     """
 
     # lazy load since scapy is kinda heavy
     from moonlight.net.scapy import (
+        MergedPcapReader,
         PcapReader,
     )  # pylint: disable=import-outside-toplevel
 
-    from scapy.layers.inet import TCP
-
-    rdr = PcapReader(
-        pcap_path=input_f,
-        typedef_path=typedefs,
-        msg_def_folder=message_def_dir,
-        silence_decode_errors=False,
+    stdin_count = sum(str(path) == "-" for path in input_f)
+    if stdin_count > 1:
+        raise click.UsageError("stdin ('-') can only be read once")
+    if follow:
+        if len(input_f) != 1 or stdin_count:
+            raise click.UsageError("--follow takes exactly one input capture file")
+        if poll_interval > max_poll_interval:
+            raise click.BadParameter(
+                "must not exceed --max-poll-interval", param_hint="--poll-interval"
+            )
+    inputs = [sys.stdin.buffer if str(path) == "-" else path for path in input_f]
+    dml_protocol = (
+        _generated_registry(generated, message_def_dir) if generated else None
     )
-    with open(output_f, "w", encoding="utf8") as writer:
-        messages = []
-        i = 1
-        while True:
-            try:
-                messages.append(next(rdr))
-            except ValueError as err:
-                messages.append(
-                    {
-                        "error": {
-                            "message": str(err),
-                            "raw": bytes_to_pretty_str(
-                                bytes(rdr.last_decoded_raw[TCP].payload)
-                            ),
-                        }
-                    }
-                )
-                continue
-            except StopIteration:
-                break
-            finally:
-                i += 1
-            if i % 100 == 0:
-                logger.info("Progress: completed %d so far", i)
 
-        logger.info("Progress: Dumping to file")
-        json.dump(obj=messages, fp=writer, cls=SerdeJSONEncoder, indent=2)
+    metrics, reporters = _start_metrics(None, metrics_interval)
+    deduplicator = SegmentDeduplicator() if dedupe else None
+    reader_kwargs = {
+        "typedef_path": typedefs,
+        "msg_def_folder": message_def_dir,
+        "silence_decode_errors": False,
+        "metrics": metrics,
+        "deduplicator": deduplicator,
+        "threaded_decompression": threaded_decompression,
+        "dml_protocol": dml_protocol,
+        "lazy_definitions": lazy_definitions,
+    }
+    if follow:
+        reader_kwargs["follower"] = CaptureFollower(
+            input_f[0], poll_interval=poll_interval, max_poll_interval=max_poll_interval
+        )
+    try:
+        if len(inputs) == 1:
+            rdr = PcapReader(pcap_path=inputs[0], **reader_kwargs)
+        else:
+            rdr = MergedPcapReader(pcap_paths=inputs, **reader_kwargs)
+    except ValueError as err:
+        _stop_metrics(reporters)
+        raise click.ClickException(f"Cannot read capture: {err}") from err
+    profiler = StageProfiler() if profile or profile_output else None
+    cprofile = cProfile.Profile() if profile_output else None
+    memory = None
+    if memory_report or memory_report_output:
+        memory = MemoryReporter(interval=memory_interval)
+        memory.start()
+    try:
+        with _open_text_output(output_f) as writer, _profiling(profiler, cprofile):
+            if follow:
+                _follow_capture(rdr, writer)
+            else:
+                decoded, _ = dump_capture_json(rdr, writer)
+                _echo_error_footer(decoded, rdr.error_tracker.summary())
+    finally:
+        # the census runs before the reader lets go of its last packets
+        memory_results = memory.stop() if memory is not None else None
     rdr.close()
+    if cprofile is not None:
+        cprofile.dump_stats(profile_output)
+        logger.info("Wrote cProfile stats to %s", profile_output)
+    if profiler is not None:
+        _echo_profile(profiler.report())
+    if memory_results is not None:
+        if memory_report_output is not None:
+            with open(memory_report_output, "w", encoding="utf8") as file:
+                json.dump(memory_results, file, indent=2)
+        _echo_memory_report(memory_results)
+    if deduplicator is not None:
+        deduplicator.log_summary()
+    _stop_metrics(reporters)
+    _check_capture_error(rdr)
+
+
+@decode.command(name="batch")
+@click.argument(
+    "message_def_dir",
+    type=click.Path(exists=True, dir_okay=True, resolve_path=True, path_type=Path),
+)
+@click.argument(
+    "output_dir",
+    type=click.Path(file_okay=False, resolve_path=True, path_type=Path),
+)
+@click.argument("inputs", nargs=-1, required=True)
+@click.option(
+    "-w",
+    "--workers",
+    type=click.IntRange(min=1),
+    default=None,
+    help="worker processes. Defaults to the cpu count",
+)
+@click.option(
+    "--resume/--no-resume",
+    default=True,
+    show_default=True,
+    help="skip files a previous run into OUTPUT_DIR already finished",
+)
+@click.option(
+    "--dedupe/--no-dedupe",
+    default=False,
+    show_default=True,
+    help="skip retransmitted and duplicated TCP segments",
+)
+@typedef_option
+def batch(
+    message_def_dir: Path,
+    output_dir: Path,
+    inputs: tuple[str, ...],
+    workers: int | None,
+    resume: bool,
+    dedupe: bool,
+    typedefs: Path,
+):
+    """
+    Decode many pcaps to JSON representations
+
+    Works like `moonlight decode pcap` over every capture file matched by
+    INPUTS, using a pool of worker processes. Message definitions are only
+    parsed once. Each capture is written to OUTPUT_DIR as `<name>.json`, and
+    a summary of the whole run is printed as JSON when done.
+
+    Finished files are recorded in OUTPUT_DIR, so running the same command
+    again only processes files that failed, changed or weren't reached.
+
+    MSG_DEF_DIR: Directory holding KI DML definitions
+
+    OUTPUT_DIR: Directory to write decoded captures to
+
+    INPUTS: Capture files, directories of captures or glob patterns
+    """
+    try:
+        input_files = expand_inputs(inputs)
+    except ValueError as err:
+        raise click.BadParameter(str(err), param_hint="INPUTS") from err
+
+    summary = run_batch(
+        decode_file,
+        input_files,
+        output_dir,
+        name_output=lambda p: f"{split_capture_name(p)[0]}.json",
+        workers=workers,
+        resume=resume,
+        msg_def_folder=message_def_dir,
+        typedef_path=typedefs,
+        dedupe=dedupe,
+    )
+    click.echo(json.dumps(summary.as_dict(), indent=2))
+    if summary.failed:
+        sys.exit(1)
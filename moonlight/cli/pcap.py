@@ -1,11 +1,38 @@
 """Commands dealing with pcap file manipulation"""
 
+import json
 import pathlib
+import sys
+from datetime import datetime
+from itertools import islice
 from os import PathLike
 
 import click
 from click import Path
 
+from moonlight.net import MessageSender, PacketReader, Redactor, SegmentDeduplicator
+from moonlight.net.batch import (
+    expand_inputs,
+    filter_file,
+    run_batch,
+    split_capture_name,
+)
+from moonlight.net.detect import (
+    RevisionCache,
+    default_cache_path,
+    detect_capture_revision,
+)
+from moonlight.net.filter import filter_pcap
+from moonlight.net.index import (
+    CaptureIndex,
+    StaleIndexError,
+    build_index,
+    default_index_path,
+)
+from moonlight.net.pcap import CaptureFormatError, TruncatedCaptureError
+from moonlight.util import SerdeJSONEncoder, bytes_to_pretty_str
+from moonlight.util.click_util import typedef_option
+
 
 @click.group()
 def pcap():
@@ -20,12 +47,18 @@ def pcap():
 @click.argument(
     "input_f",
     type=click.Path(
-        exists=True, file_okay=True, resolve_path=True, path_type=pathlib.Path
+        exists=True,
+        file_okay=True,
+        resolve_path=True,
+        allow_dash=True,
+        path_type=pathlib.Path,
     ),
 )
 @click.argument(
     "output_f",
-    type=click.Path(file_okay=True, resolve_path=True, path_type=pathlib.Path),
+    type=click.Path(
+        file_okay=True, resolve_path=True, allow_dash=True, path_type=pathlib.Path
+    ),
 )
 @click.option(
     "-s",
@@ -40,8 +73,46 @@ def pcap():
     show_default=True,
     help="Output file compression via gzip",
 )
+@click.option(
+    "-r",
+    "--redact",
+    "redact_rules",
+    multiple=True,
+    metavar="[MSG_NAME.]FIELD",
+    help="Zero out a message field in kept packets. Can be repeated. "
+    "Requires --message-defs",
+)
+@click.option(
+    "-m",
+    "--message-defs",
+    "message_def_dir",
+    default=None,
+    type=click.Path(
+        exists=True, dir_okay=True, resolve_path=True, path_type=pathlib.Path
+    ),
+    help="Message definition directory used to locate redacted fields",
+)
+@click.option(
+    "--dedupe/--no-dedupe",
+    default=False,
+    show_default=True,
+    help="Drop retransmitted and duplicated TCP segments",
+)
+@click.option(
+    "--threaded-decompression",
+    is_flag=True,
+    default=False,
+    help="Decompress gzip, xz or bzip2 input on a background thread",
+)
 def filter_cmd(
-    input_f: Path, output_f: Path, sanitize: bool, zip: bool
+    input_f: Path,
+    output_f: Path,
+    sanitize: bool,
+    zip: bool,
+    redact_rules: tuple[str, ...],
+    message_def_dir: Path | None,
+    dedupe: bool,
+    threaded_decompression: bool,
 ):  # pylint: disable=redefined-builtin
     """Filter content of pcap files
 
@@ -52,16 +123,779 @@ def filter_cmd(
 
     A packet is naively considered to be of the KI protocol if it starts with
     the \\x0D\\xF0 magic (little endian F00D) and was sent via tcp.
-    This may be improved in the future.
+    This may be improved in the future. Only the packet headers are inspected,
+    so no message definitions are needed and kept packets are copied as-is.
+
+    Fields can be redacted with `--redact MSG_NAME.Field` (one message) or
+    `--redact Field` (every message with that field). Redacted bytes are
+    zeroed in place, keeping string length prefixes so packets keep their size.
+
+    INPUT_F: A valid packet capture file containing KI network traffic, or
+    '-' to read a pcap or pcapng stream from stdin. gzip, xz and bzip2
+    compressed input is decompressed on the fly
+
+    OUTPUT_F: File to write filtered capture to, or '-' for stdout
+    """
+
+    redactor = None
+    if redact_rules:
+        if message_def_dir is None:
+            raise click.UsageError("--redact requires --message-defs")
+        registry = PacketReader(msg_def_folder=message_def_dir).dml_protocol
+        try:
+            redactor = Redactor(registry, redact_rules, signed_messages=sanitize)
+        except ValueError as err:
+            raise click.BadParameter(str(err), param_hint="--redact") from err
+
+    try:
+        filter_pcap(
+            sys.stdin.buffer if str(input_f) == "-" else input_f,
+            sys.stdout.buffer if str(output_f) == "-" else output_f,
+            compress=zip,
+            sanitize=sanitize,
+            redactor=redactor,
+            deduplicator=SegmentDeduplicator() if dedupe else None,
+            threaded_decompression=threaded_decompression,
+        )
+    except (CaptureFormatError, RuntimeError) as err:
+        # filter_pcap reports errors after opening the capture as RuntimeError
+        cause = err if isinstance(err, CaptureFormatError) else err.__cause__
+        if isinstance(cause, TruncatedCaptureError):
+            raise click.ClickException(f"Capture is truncated: {cause}") from err
+        if isinstance(cause, CaptureFormatError):
+            raise click.ClickException(f"Cannot read capture: {cause}") from err
+        raise
+
+
+@pcap.command(name="filter-batch")
+@click.argument(
+    "output_dir",
+    type=click.Path(file_okay=False, resolve_path=True, path_type=pathlib.Path),
+)
+@click.argument("inputs", nargs=-1, required=True)
+@click.option(
+    "-w",
+    "--workers",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Worker processes. Defaults to the cpu count",
+)
+@click.option(
+    "--resume/--no-resume",
+    default=True,
+    show_default=True,
+    help="Skip files a previous run into OUTPUT_DIR already finished",
+)
+@click.option(
+    "-s",
+    "--sanitize",
+    is_flag=True,
+    help="Nullify session offer and accept signed messages",
+)
+@click.option(
+    "-z/-Z",
+    "--zip/--no-zip",
+    default=False,
+    show_default=True,
+    help="Output file compression via gzip",
+)
+@click.option(
+    "-r",
+    "--redact",
+    "redact_rules",
+    multiple=True,
+    metavar="[MSG_NAME.]FIELD",
+    help="Zero out a message field in kept packets. Can be repeated. "
+    "Requires --message-defs",
+)
+@click.option(
+    "-m",
+    "--message-defs",
+    "message_def_dir",
+    default=None,
+    type=click.Path(
+        exists=True, dir_okay=True, resolve_path=True, path_type=pathlib.Path
+    ),
+    help="Message definition directory used to locate redacted fields",
+)
+@click.option(
+    "--dedupe/--no-dedupe",
+    default=False,
+    show_default=True,
+    help="Drop retransmitted and duplicated TCP segments",
+)
+def filter_batch_cmd(  # pylint: disable=too-many-arguments
+    output_dir: Path,
+    inputs: tuple[str, ...],
+    workers: int | None,
+    resume: bool,
+    sanitize: bool,
+    zip: bool,  # pylint: disable=redefined-builtin
+    redact_rules: tuple[str, ...],
+    message_def_dir: Path | None,
+    dedupe: bool,
+):
+    """Filter many pcap files
+
+    Works like `moonlight pcap filter` over every capture file matched by
+    INPUTS, using a pool of worker processes. Each capture is written to
+    OUTPUT_DIR under its own name with `.filtered` added, and a summary of
+    the whole run is printed as JSON when done.
+
+    Finished files are recorded in OUTPUT_DIR, so running the same command
+    again only processes files that failed, changed or weren't reached.
+
+    OUTPUT_DIR: Directory to write filtered captures to
+
+    INPUTS: Capture files, directories of captures or glob patterns
+    """
+    if redact_rules:
+        if message_def_dir is None:
+            raise click.UsageError("--redact requires --message-defs")
+        # fail on bad rules before starting any workers
+        try:
+            Redactor(
+                PacketReader(msg_def_folder=message_def_dir).dml_protocol, redact_rules
+            )
+        except ValueError as err:
+            raise click.BadParameter(str(err), param_hint="--redact") from err
+    try:
+        input_files = expand_inputs(inputs)
+    except ValueError as err:
+        raise click.BadParameter(str(err), param_hint="INPUTS") from err
+
+    summary = run_batch(
+        filter_file,
+        input_files,
+        output_dir,
+        name_output=lambda p: "{}.filtered{}".format(*split_capture_name(p))
+        + (".gz" if zip else ""),
+        workers=workers,
+        resume=resume,
+        msg_def_folder=message_def_dir if redact_rules else None,
+        compress=zip,
+        sanitize=sanitize,
+        dedupe=dedupe,
+        redact_rules=redact_rules,
+    )
+    click.echo(json.dumps(summary.as_dict(), indent=2))
+    if summary.failed:
+        sys.exit(1)
+
+
+@pcap.command(name="index")
+@click.argument(
+    "capture_f",
+    type=click.Path(
+        exists=True, dir_okay=False, resolve_path=True, path_type=pathlib.Path
+    ),
+)
+@click.option(
+    "-o",
+    "--output",
+    "index_f",
+    default=None,
+    type=click.Path(dir_okay=False, resolve_path=True, path_type=pathlib.Path),
+    help="Where to write the index. Defaults to CAPTURE_F with .mlidx added",
+)
+def index_cmd(capture_f: Path, index_f: Path | None):
+    """Index a capture for random access
+
+    Scans CAPTURE_F once and writes a sidecar index recording where every KI
+    frame is, when it was captured, its connection and message ids. Only
+    packet headers are read, so no message definitions are needed.
+    `moonlight pcap query` uses the index to jump straight to matching
+    frames instead of reading the whole capture.
+
+    The index is tied to the capture's size and modification time and has
+    to be rebuilt if the capture changes.
+
+    CAPTURE_F: An uncompressed pcap or pcapng capture file
+    """
+    try:
+        count = build_index(capture_f, index_f)
+    except ValueError as err:
+        raise click.BadParameter(str(err), param_hint="CAPTURE_F") from err
+    click.echo(
+        f"Indexed {count} frames to {index_f or default_index_path(capture_f)}",
+        err=True,
+    )
+
+
+def _parse_time(
+    ctx, param, value: str | None
+) -> float | None:  # pylint: disable=unused-argument
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError as err:
+        raise click.BadParameter(
+            "expected a unix timestamp or an ISO 8601 date and time"
+        ) from err
+
+
+def _parse_records(
+    ctx, param, value: str | None
+) -> range | None:  # pylint: disable=unused-argument
+    if value is None:
+        return None
+    first, sep, last = value.partition(":")
+    try:
+        if not sep:
+            return range(int(first), int(first) + 1)
+        return range(int(first) if first else 0, int(last) if last else sys.maxsize)
+    except ValueError as err:
+        raise click.BadParameter("expected FIRST:END record numbers") from err
+
+
+def _resolve_message(message: str, reader: PacketReader | None) -> tuple[int, int]:
+    service, sep, msg = message.partition(":")
+    if sep:
+        try:
+            return int(service, 0), int(msg, 0)
+        except ValueError as err:
+            raise click.BadParameter(
+                "expected SERVICE_ID:MESSAGE_ID", param_hint="--message"
+            ) from err
+    if reader is None:
+        raise click.UsageError("Looking up messages by name requires --message-defs")
+    for protocol in reader.dml_protocol.protocol_map.values():
+        for msg_id, msg_def in protocol.message_map.items():
+            if msg_def.name == message:
+                return protocol.id, msg_id
+    raise click.BadParameter(f"Unknown message {message}", param_hint="--message")
+
+
+@pcap.command(name="query")
+@click.argument(
+    "capture_f",
+    type=click.Path(
+        exists=True, dir_okay=False, resolve_path=True, path_type=pathlib.Path
+    ),
+)
+@click.option(
+    "-i",
+    "--index",
+    "index_f",
+    default=None,
+    type=click.Path(
+        exists=True, dir_okay=False, resolve_path=True, path_type=pathlib.Path
+    ),
+    help="Index built by `moonlight pcap index`. Defaults to CAPTURE_F with .mlidx added",
+)
+@click.option(
+    "--start",
+    callback=_parse_time,
+    help="Earliest capture time, as a unix timestamp or ISO 8601 date and time",
+)
+@click.option(
+    "--end",
+    callback=_parse_time,
+    help="Capture time to stop before, as a unix timestamp or ISO 8601 date and time",
+)
+@click.option(
+    "--message",
+    default=None,
+    metavar="MSG_NAME|SERVICE_ID:MESSAGE_ID",
+    help="Only this DML message. Names require --message-defs",
+)
+@click.option(
+    "--opcode",
+    type=click.IntRange(0, 255),
+    default=None,
+    help="Only control messages with this opcode",
+)
+@click.option(
+    "--records",
+    callback=_parse_records,
+    metavar="FIRST:END",
+    help="Only frames in these packet records, counted from 0 and end exclusive",
+)
+@click.option(
+    "-n",
+    "--limit",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Stop after this many frames",
+)
+@click.option(
+    "-m",
+    "--message-defs",
+    "message_def_dir",
+    default=None,
+    type=click.Path(
+        exists=True, dir_okay=True, resolve_path=True, path_type=pathlib.Path
+    ),
+    help="Message definition directory used for names and --decode",
+)
+@click.option(
+    "-d",
+    "--decode",
+    is_flag=True,
+    default=False,
+    help="Decode matching frames. Requires --message-defs",
+)
+@typedef_option
+def query_cmd(  # pylint: disable=too-many-arguments too-many-locals
+    capture_f: Path,
+    index_f: Path | None,
+    start: float | None,
+    end: float | None,
+    message: str | None,
+    opcode: int | None,
+    records: range | None,
+    limit: int | None,
+    message_def_dir: Path | None,
+    decode: bool,
+    typedefs: Path | None,
+):
+    """Look up frames in an indexed capture
+
+    Selects KI frames from CAPTURE_F using the index written by
+    `moonlight pcap index` and prints one json object per line for each
+    matching frame.
+    Time ranges are found without reading the rest of the index, and only
+    the packets holding matching frames are read from the capture.
 
-    INPUT_F: A valid packet capture file containing KI network traffic
+    With --decode each frame is decoded, and frames that fail to decode
+    are printed with their error and raw bytes.
 
-    OUTPUT_F: File to write filtered capture to
+    CAPTURE_F: The indexed capture file
     """
+    if message is not None and opcode is not None:
+        raise click.UsageError("--message and --opcode are mutually exclusive")
+    if decode and message_def_dir is None:
+        raise click.UsageError("--decode requires --message-defs")
+
+    reader = None
+    if message_def_dir is not None:
+        reader = PacketReader(msg_def_folder=message_def_dir, typedef_path=typedefs)
+    criteria = {}
+    if message is not None:
+        criteria["service_id"], criteria["message_id"] = _resolve_message(
+            message, reader
+        )
+        criteria["is_control"] = False
+    elif opcode is not None:
+        criteria.update(message_id=opcode, is_control=True)
+
+    try:
+        index = CaptureIndex(index_f or default_index_path(capture_f), capture_f)
+    except FileNotFoundError as err:
+        raise click.ClickException(
+            f"No index found for {capture_f}. Run `moonlight pcap index` first"
+        ) from err
+    except StaleIndexError as err:
+        raise click.ClickException(f"{err}. Run `moonlight pcap index` again") from err
+    except ValueError as err:
+        raise click.ClickException(str(err)) from err
+
+    # one object per line
+    encoder = SerdeJSONEncoder(indent=None)
+    with index:
+        entries = islice(
+            index.select(start=start, end=end, records=records, **criteria), limit
+        )
+        for entry, frame in index.frames(entries):
+            flow = index.flows[entry.flow_id]
+            result = {
+                "record": entry.record_number,
+                "timestamp": entry.timestamp,
+                "flow": str(flow),
+                "length": entry.frame_len,
+            }
+            if entry.is_control:
+                result["opcode"] = entry.message_id
+            else:
+                result["service_id"] = entry.service_id
+                result["message_id"] = entry.message_id
+                if reader is not None:
+                    protocol = reader.dml_protocol.protocol_map.get(entry.service_id)
+                    msg_def = (
+                        protocol.message_map.get(entry.message_id) if protocol else None
+                    )
+                    result["name"] = msg_def.name if msg_def else None
+            if decode:
+                try:
+                    result["message"] = _decoded_entry(reader, entry, flow, frame)
+                except ValueError as err:
+                    result["error"] = {
+                        "message": str(err.args[0]),
+                        "raw": bytes_to_pretty_str(frame),
+                    }
+            click.echo(encoder.encode(result))
+
+
+def _decoded_entry(reader: PacketReader, entry, flow, frame: bytes) -> dict | None:
+    """Decodes an indexed frame with the capture data `PcapReader` adds"""
+    msg = reader.decode_ki_packet(frame)
+    if msg is None:
+        return None
+    msg.sender = MessageSender.from_capture_port(flow.dport)
+    msg.timestamp = datetime.fromtimestamp(entry.timestamp)
+    serde = msg.as_serde_dict()
+    # the frame's bytes aren't kept by the decoder, and are in the error
+    # entry when it fails
+    if not serde.get("raw"):
+        serde.pop("raw", None)
+    return serde
+
+
+def _parse_range(
+    ctx, param, value: str | None
+) -> tuple[int, int] | None:  # pylint: disable=unused-argument
+    if value is None:
+        return None
+    low, sep, high = value.partition(":")
+    try:
+        bounds = (int(low), int(high if sep else low))
+    except ValueError as err:
+        raise click.BadParameter("expected MIN:MAX") from err
+    if not 0 <= bounds[0] <= bounds[1]:
+        raise click.BadParameter("expected MIN:MAX with 0 <= MIN <= MAX")
+    return bounds
+
 
-    # lazy load since scapy is kinda heavy
-    from moonlight.net.scapy import (  # pylint: disable=import-outside-toplevel
-        filter_pcap,
+def _parse_mix(
+    ctx, param, value: tuple[str, ...]
+) -> dict | None:  # pylint: disable=unused-argument
+    if not value:
+        return None
+    weights = {}
+    for entry in value:
+        message, sep, weight = entry.rpartition("=")
+        try:
+            if not sep:
+                raise ValueError
+            weight = float(weight)
+        except ValueError as err:
+            raise click.BadParameter(f"expected MSG=WEIGHT, got {entry}") from err
+        service, sep, msg = message.partition(":")
+        try:
+            key = (int(service, 0), int(msg, 0)) if sep else message
+        except ValueError:
+            key = message
+        weights[key] = weight
+    return weights
+
+
+@pcap.command(name="generate")
+@click.argument(
+    "message_def_dir",
+    type=click.Path(
+        exists=True, dir_okay=True, resolve_path=True, path_type=pathlib.Path
+    ),
+)
+@click.argument(
+    "output_f",
+    type=click.Path(
+        dir_okay=False, resolve_path=True, allow_dash=True, path_type=pathlib.Path
+    ),
+)
+@click.option(
+    "--size-mb",
+    type=click.FloatRange(min=0, min_open=True),
+    default=None,
+    help="Stop once the uncompressed capture reaches this many megabytes",
+)
+@click.option(
+    "-n",
+    "--messages",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Stop after this many DML messages",
+)
+@click.option(
+    "--seed",
+    type=int,
+    default=0,
+    show_default=True,
+    help="Seed of the generated traffic. The same seed gives the same capture",
+)
+@click.option(
+    "--mix",
+    multiple=True,
+    callback=_parse_mix,
+    metavar="MSG_NAME|SERVICE_ID:MESSAGE_ID=WEIGHT",
+    help="Relative frequency of a message. Can be repeated. Only listed messages "
+    "are sent. Defaults to every message equally",
+)
+@click.option(
+    "--flows",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="Concurrent client connections",
+)
+@click.option(
+    "--rate",
+    type=click.FloatRange(min=0, min_open=True),
+    default=200.0,
+    show_default=True,
+    help="DML messages per second of capture time over all flows",
+)
+@click.option(
+    "--string-length",
+    callback=_parse_range,
+    default="4:32",
+    show_default=True,
+    metavar="MIN:MAX",
+    help="Length of string fields in characters, which sets message sizes",
+)
+@click.option(
+    "--batch",
+    callback=_parse_range,
+    default="1:1",
+    show_default=True,
+    metavar="MIN:MAX",
+    help="KI frames sent together in one TCP segment",
+)
+@click.option(
+    "--mss",
+    type=click.IntRange(min=1),
+    default=1460,
+    show_default=True,
+    help="Largest TCP payload. Bigger batches are split across segments",
+)
+@click.option(
+    "--fragment-rate",
+    type=click.FloatRange(0, 1),
+    default=0.0,
+    show_default=True,
+    help="Chance of splitting a segment at a random point",
+)
+@click.option(
+    "--keep-alive",
+    type=click.FloatRange(min=0),
+    default=10.0,
+    show_default=True,
+    help="Seconds between keep alives on each flow, 0 to disable",
+)
+@click.option(
+    "-z/-Z",
+    "--zip/--no-zip",
+    default=False,
+    show_default=True,
+    help="Output file compression via gzip",
+)
+def generate_cmd(  # pylint: disable=too-many-arguments too-many-locals
+    message_def_dir: Path,
+    output_f: Path,
+    size_mb: float | None,
+    messages: int | None,
+    seed: int,
+    mix: dict | None,
+    flows: int,
+    rate: float,
+    string_length: tuple[int, int],
+    batch: tuple[int, int],
+    mss: int,
+    fragment_rate: float,
+    keep_alive: float,
+    zip: bool,  # pylint: disable=redefined-builtin
+):
+    """Generate a synthetic capture for load testing
+
+    Writes made-up KI sessions to OUTPUT_F: every flow opens with a session
+    offer and accept, then carries DML messages in both directions with
+    periodic keep alives. Messages are encoded from random field values of
+    the definitions in MESSAGE_DEF_DIR, so they decode like real traffic.
+
+    Generation stops at --size-mb or --messages, whichever comes first.
+    The capture only depends on the options and --seed. Compressed output
+    also differs by the time in its gzip header.
+
+    Captures with --batch above 1 or fragmentation hold segments that carry
+    several frames or parts of one, which `moonlight decode` reads one
+    packet at a time and can't decode.
+
+    MESSAGE_DEF_DIR: Message definitions to generate messages from
+
+    OUTPUT_F: Capture file to write, or '-' for stdout
+    """
+    # lazy load so the other commands don't pay for it
+    from moonlight.net.generate import (  # pylint: disable=import-outside-toplevel
+        TrafficGenerator,
+        TrafficProfile,
     )
 
-    filter_pcap(input_f, output_f, compress=zip, sanitize=sanitize)  # type: ignore
+    if size_mb is None and messages is None:
+        raise click.UsageError("One of --size-mb or --messages is required")
+    registry = PacketReader(msg_def_folder=message_def_dir).dml_protocol
+    try:
+        profile = TrafficProfile(
+            message_weights=mix,
+            string_length=string_length,
+            flows=flows,
+            messages_per_second=rate,
+            keep_alive_interval=keep_alive,
+            batch=batch,
+            mss=mss,
+            fragment_rate=fragment_rate,
+        )
+        generator = TrafficGenerator(registry, profile, seed=seed)
+    except ValueError as err:
+        raise click.BadParameter(str(err)) from err
+
+    target = sys.stdout.buffer if str(output_f) == "-" else output_f
+    stats = generator.write_pcap(
+        target,
+        max_bytes=int(size_mb * 1024 * 1024) if size_mb is not None else None,
+        max_messages=messages,
+        compress=zip,
+    )
+    click.echo(
+        f"Wrote {stats.packets} packets with {stats.dml_messages} DML and "
+        f"{stats.control_messages} control messages "
+        f"({stats.bytes / 1024 / 1024:.1f} MB uncompressed)",
+        err=True,
+    )
+
+
+@pcap.command(name="detect-revision")
+@click.argument(
+    "capture_f",
+    type=click.Path(
+        exists=True, dir_okay=False, resolve_path=True, path_type=pathlib.Path
+    ),
+)
+@click.argument(
+    "message_def_dirs",
+    nargs=-1,
+    required=True,
+    type=click.Path(
+        exists=True, file_okay=False, resolve_path=True, path_type=pathlib.Path
+    ),
+)
+@click.option(
+    "-n",
+    "--frames",
+    type=click.IntRange(min=1),
+    default=200,
+    show_default=True,
+    help="most DML frames to trial decode",
+)
+@click.option(
+    "--min-frames",
+    type=click.IntRange(min=1),
+    default=20,
+    show_default=True,
+    help="DML frames to trial decode before stopping early",
+)
+@click.option(
+    "--lead",
+    type=click.IntRange(min=1),
+    default=3,
+    show_default=True,
+    help="frames the best folder has to decode beyond the runner up to settle it",
+)
+@click.option(
+    "--min-rate",
+    type=click.FloatRange(min=0, max=1),
+    default=0.9,
+    show_default=True,
+    help="share of frames the best folder has to decode to settle it",
+)
+@click.option(
+    "--cache",
+    "cache_f",
+    type=click.Path(dir_okay=False, resolve_path=True, path_type=pathlib.Path),
+    default=None,
+    help="revision cache file. Defaults to moonlight/revisions.json in the user cache directory",
+)
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    default=False,
+    help="always sample the capture and don't record the result",
+)
+@click.option(
+    "--json",
+    "as_json",
+    is_flag=True,
+    default=False,
+    help="print the result as json instead of the chosen folder",
+)
+def detect_revision_cmd(  # pylint: disable=too-many-arguments
+    capture_f: pathlib.Path,
+    message_def_dirs: tuple[pathlib.Path, ...],
+    frames: int,
+    min_frames: int,
+    lead: int,
+    min_rate: float,
+    cache_f: pathlib.Path | None,
+    no_cache: bool,
+    as_json: bool,
+):
+    """Find the message definitions a capture was recorded with
+
+    Trial decodes the first DML frames of CAPTURE_F with each definition
+    folder and scores them by clean decodes: known messages that decode
+    without error and consume exactly the length in their DML header.
+    Sampling stops early once one folder decodes nearly every frame and
+    several more than any other. Definitions are only parsed for the
+    services that are sampled, and files the folders share are parsed once.
+
+    The best folder is printed, so it can be passed straight to `moonlight
+    decode pcap`, and the scores are printed to stderr. The result is
+    cached by a hash of the capture's start, so a capture is only sampled
+    once, until the candidate folders or their files change. Exits with 1 if
+    no folder decodes any frame cleanly.
+
+    CAPTURE_F: A pcap or pcapng capture, optionally compressed
+
+    MESSAGE_DEF_DIRS: Candidate directories holding KI DML definitions
+    """
+    # folders mostly hold the same files, which are only parsed once
+    shared: dict = {}
+    try:
+        candidates = {
+            str(path): PacketReader(
+                path, lazy_definitions=True, shared_definitions=shared
+            ).dml_protocol
+            for path in message_def_dirs
+        }
+    except ValueError as err:
+        raise click.BadParameter(str(err), param_hint="MESSAGE_DEF_DIRS") from err
+    cache = None if no_cache else RevisionCache(cache_f or default_cache_path())
+    try:
+        result = detect_capture_revision(
+            candidates,
+            capture_f,
+            cache=cache,
+            folders={str(path): path for path in message_def_dirs},
+            max_frames=frames,
+            min_frames=min_frames,
+            lead=lead,
+            min_rate=min_rate,
+        )
+    except ValueError as err:
+        raise click.ClickException(f"Cannot read capture: {err}") from err
+
+    if as_json:
+        click.echo(json.dumps(result.as_dict(), indent=2))
+    if result.cached:
+        click.echo(f"Cached revision of {capture_f.name}", err=True)
+    else:
+        click.echo(f"Trial decoded {result.frames} DML frames", err=True)
+        click.echo(
+            f"{'clean':>8}{'partial':>9}{'failed':>8}{'rate':>8}  definitions", err=True
+        )
+        for score in result.scores:
+            click.echo(
+                f"{score.clean:>8}{score.partial:>9}{score.failed:>8}"
+                f"{score.rate:>8.0%}  {score.name}",
+                err=True,
+            )
+        if result.revision is not None and not result.decisive:
+            click.echo("No definitions clearly lead, the best is a guess", err=True)
+    if result.revision is None:
+        click.echo("No definitions decode this capture", err=True)
+        sys.exit(1)
+    if not as_json:
+        click.echo(result.revision)
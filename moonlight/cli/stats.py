@@ -0,0 +1,180 @@
+"""Commands summarizing capture contents"""
+
+import json
+import pathlib
+import sys
+from datetime import datetime
+
+import click
+
+from moonlight.net import PacketReader
+from moonlight.net.batch import expand_inputs
+from moonlight.net.pcap import CaptureFormatError, TruncatedCaptureError
+from moonlight.net.stats import PERCENTILES, collect_stats
+
+_GROUP_TITLES = {
+    "services": ("Services", lambda g: _label(g["service_id"], g["name"])),
+    "messages": (
+        "Messages",
+        lambda g: _label(f"{g['service_id']}:{g['message_id']}", g["name"]),
+    ),
+    "control_opcodes": ("Control opcodes", lambda g: _label(g["opcode"], g["name"])),
+    "senders": ("Senders", lambda g: g["sender"]),
+    "flows": ("Flows", lambda g: g["flow"]),
+}
+
+
+def _label(ids, name) -> str:
+    return f"{name} ({ids})" if name else str(ids)
+
+
+def _rate(value) -> str:
+    return "-" if value is None else f"{value:.1f}"
+
+
+def _echo_report(report: dict) -> None:
+    total = report["total"]
+    if total["first_timestamp"] is None:
+        click.echo("No KI frames found")
+        return
+    first = datetime.fromtimestamp(total["first_timestamp"]).isoformat(sep=" ")
+    last = datetime.fromtimestamp(total["last_timestamp"]).isoformat(sep=" ")
+    click.echo(f"{first} - {last} ({total['duration']:.1f}s)")
+    click.echo(
+        f"{total['frames']} frames, {total['bytes']} bytes, "
+        f"{_rate(total['frames_per_sec'])} frames/s, {_rate(total['bytes_per_sec'])} B/s, "
+        f"{total['incomplete_frames']} continued in later segments"
+    )
+
+    header = (
+        ["frames", "bytes", "frames/s", "B/s"]
+        + [f"p{p}" for p in PERCENTILES]
+        + ["max"]
+    )
+    for key, (title, label) in _GROUP_TITLES.items():
+        groups = report[key]
+        if not groups:
+            continue
+        labels = [label(g) for g in groups]
+        width = max(len(title), *map(len, labels))
+        click.echo()
+        click.echo(f"{title:<{width}}" + "".join(f"{h:>12}" for h in header))
+        for name, group in zip(labels, groups):
+            size = group["size"]
+            cells = [
+                group["frames"],
+                group["bytes"],
+                _rate(group["frames_per_sec"]),
+                _rate(group["bytes_per_sec"]),
+                *(size[f"p{p}"] for p in PERCENTILES),
+                size["max"],
+            ]
+            click.echo(f"{name:<{width}}" + "".join(f"{c:>12}" for c in cells))
+
+    timeline = report["timeline"]
+    click.echo()
+    click.echo(f"Timeline ({timeline['bucket_seconds']:g}s buckets)")
+    most = max(b["frames"] for b in timeline["buckets"])
+    for bucket in timeline["buckets"]:
+        start = datetime.fromtimestamp(bucket["start"]).isoformat(sep=" ")
+        bar = "#" * max(1, round(40 * bucket["frames"] / most))
+        click.echo(f"{start}{bucket['frames']:>10}{bucket['bytes']:>12} {bar}")
+
+
+@click.command()
+@click.argument("inputs", nargs=-1, required=True)
+@click.option(
+    "-m",
+    "--message-defs",
+    "message_def_dir",
+    default=None,
+    type=click.Path(
+        exists=True, dir_okay=True, resolve_path=True, path_type=pathlib.Path
+    ),
+    help="Message definition directory used to name services and messages",
+)
+@click.option(
+    "-b",
+    "--bucket",
+    "bucket_seconds",
+    type=click.FloatRange(min=0, min_open=True),
+    default=60.0,
+    show_default=True,
+    help="Seconds per timeline bucket",
+)
+@click.option(
+    "--top",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Only list the busiest groups of each kind, by bytes",
+)
+@click.option(
+    "--json",
+    "as_json",
+    is_flag=True,
+    default=False,
+    help="Print the report as json",
+)
+@click.option(
+    "--dedupe/--no-dedupe",
+    default=False,
+    show_default=True,
+    help="Skip retransmitted and duplicated TCP segments",
+)
+@click.option(
+    "--threaded-decompression",
+    is_flag=True,
+    default=False,
+    help="Decompress gzip, xz or bzip2 input on a background thread",
+)
+def stats(  # pylint: disable=too-many-arguments
+    inputs: tuple[str, ...],
+    message_def_dir: pathlib.Path | None,
+    bucket_seconds: float,
+    top: int | None,
+    as_json: bool,
+    dedupe: bool,
+    threaded_decompression: bool,
+):
+    """Summarize KI traffic in captures
+
+    Counts frames, bytes, rates and frame size percentiles per service, DML
+    message, control opcode, sender and connection, and a timeline of
+    frames over time. Only KI and DML headers are read, so no messages are
+    decoded and large captures are summarized quickly. Message definitions
+    are only used to name services and messages in the report.
+
+    Several captures are summarized together.
+
+    INPUTS: Capture files, directories of captures or glob patterns, or '-'
+    to read a capture from stdin. gzip, xz and bzip2 compressed input is
+    decompressed on the fly
+    """
+    if inputs == ("-",):
+        sources = [sys.stdin.buffer]
+    else:
+        try:
+            sources = expand_inputs(inputs)
+        except ValueError as err:
+            raise click.BadParameter(str(err), param_hint="INPUTS") from err
+
+    try:
+        totals = collect_stats(
+            sources,
+            bucket_seconds=bucket_seconds,
+            dedupe=dedupe,
+            threaded_decompression=threaded_decompression,
+        )
+    except TruncatedCaptureError as err:
+        raise click.ClickException(f"Capture is truncated: {err}") from err
+    except CaptureFormatError as err:
+        raise click.ClickException(f"Cannot read capture: {err}") from err
+
+    registry = None
+    if message_def_dir is not None:
+        registry = PacketReader(msg_def_folder=message_def_dir).dml_protocol
+    report = totals.report(registry, top=top)
+    if as_json:
+        click.echo(json.dumps(report, indent=2))
+    else:
+        _echo_report(report)
@@ -32,3 +32,10 @@ from .dml import (
 )
 from .object_property import ObjectPropertyDecoder
 from .flagtool import FlagtoolMessage
+from .dedupe import DedupeStats, SegmentDeduplicator
+from .errors import DecodeErrorTracker, DMLDecodeError
+from .metrics import DecodeMetrics, MetricsLogReporter, MetricsServer
+from .pipeline import CapturedPayload, DecodePipeline, OverflowPolicy
+from .recorder import RecordedFrame, RingRecorder
+from .redact import RedactionRule, Redactor
+from .revisions import DefinitionInterner, RevisionRegistry
@@ -0,0 +1,590 @@
+"""
+Processing many capture files at once
+
+`run_batch` spreads a per-file job over a process pool. Message definitions
+are parsed once: in the parent before the pool forks where fork is
+available, otherwise once per worker process by the pool initializer. A
+manifest in the output directory records which inputs are done so an
+interrupted or partially failed run can be resumed.
+
+A worker process that dies, e.g. killed for running out of memory, breaks
+the pool. The files it may have been running are then retried one process
+each, so the file that kills its worker is recorded as failed while the
+rest of the batch carries on in a fresh pool.
+"""
+
+from __future__ import annotations
+
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict, dataclass, field
+from os import PathLike
+from pathlib import Path
+from typing import IO, Any, Callable, Iterable
+
+from moonlight.util import SerdeJSONEncoder, active_profiler, bytes_to_pretty_str, stage
+
+from .compression import COMPRESSED_SUFFIXES
+from .decode import PacketReader
+from .dedupe import SegmentDeduplicator
+from .dml import DMLProtocolRegistry
+from .filter import filter_pcap
+from .metrics import message_type_name
+from .redact import Redactor
+
+logger = logging.getLogger(__name__)
+
+CAPTURE_SUFFIXES = (".pcap", ".pcapng", ".cap")
+MANIFEST_NAME = ".moonlight-batch.json"
+
+# Definitions shared by every job run in this process. See `run_batch`.
+_WORKER_REGISTRY: DMLProtocolRegistry | None = None
+
+
+def split_capture_name(path: Path) -> tuple[str, str]:
+    """
+    split_capture_name splits a capture's file name into its stem and
+        capture suffix, ignoring a compression suffix. "a.pcap.gz" gives
+        ("a", ".pcap").
+
+    Args:
+        path (Path): capture file
+
+    Returns:
+        tuple[str, str]: stem and suffix
+    """
+    name = path.name
+    for suffix in COMPRESSED_SUFFIXES:
+        if name.endswith(suffix):
+            name = name[: -len(suffix)]
+            break
+    bare = Path(name)
+    return bare.stem, bare.suffix
+
+
+def expand_inputs(patterns: Iterable[str | PathLike]) -> list[Path]:
+    """
+    expand_inputs resolves files, directories and glob patterns to a sorted,
+        de-duplicated list of capture files. Directories contribute the
+        capture files directly inside them, compressed or not.
+
+    Args:
+        patterns (Iterable[str | PathLike]): files, directories or globs
+
+    Raises:
+        ValueError: a pattern matched nothing
+
+    Returns:
+        list[Path]: capture files to process
+    """
+    found: set[Path] = set()
+    for pattern in patterns:
+        path = Path(pattern)
+        if path.is_dir():
+            matches = [
+                p
+                for p in path.iterdir()
+                if p.is_file() and split_capture_name(p)[1] in CAPTURE_SUFFIXES
+            ]
+        elif path.is_file():
+            matches = [path]
+        else:
+            matches = [Path(p) for p in glob.glob(str(pattern)) if os.path.isfile(p)]
+        if not matches:
+            raise ValueError(f"No capture files found for '{pattern}'")
+        found.update(p.resolve() for p in matches)
+    return sorted(found)
+
+
+def assign_outputs(
+    inputs: list[Path], output_dir: Path, name_output: Callable[[Path], str]
+) -> dict[Path, Path]:
+    """
+    assign_outputs picks a unique output path for every input. Inputs from
+        different directories sharing a name are prefixed with their parent
+        directory's name, then numbered if that still isn't unique.
+
+    Args:
+        inputs (list[Path]): input files
+        output_dir (Path): directory outputs are written to
+        name_output (Callable[[Path], str]): output file name for an input
+
+    Returns:
+        dict[Path, Path]: output path of every input
+    """
+    outputs: dict[Path, Path] = {}
+    used: set[str] = set()
+    for input_f in inputs:
+        name = name_output(input_f)
+        if name in used:
+            name = f"{input_f.parent.name}_{name}"
+        base, counter = name, 1
+        while name in used:
+            name = f"{counter}_{base}"
+            counter += 1
+        used.add(name)
+        outputs[input_f] = output_dir / name
+    return outputs
+
+
+@dataclass(kw_only=True)
+class FileResult:
+    """Outcome of one input file"""
+
+    input: str
+    output: str
+    ok: bool
+    elapsed: float = 0.0
+    error: str | None = None
+    stats: dict[str, int] = field(default_factory=dict)
+
+
+@dataclass(kw_only=True)
+class BatchSummary:
+    """Aggregate of a `run_batch` call"""
+
+    files: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    skipped: int = 0
+    elapsed: float = 0.0
+    totals: dict[str, int] = field(default_factory=dict)
+    failures: list[FileResult] = field(default_factory=list)
+
+    def add(self, result: FileResult) -> None:
+        """
+        add folds a file's result into the summary
+
+        Args:
+            result (FileResult): finished file
+        """
+        if not result.ok:
+            self.failed += 1
+            self.failures.append(result)
+            return
+        self.succeeded += 1
+        for key, value in result.stats.items():
+            self.totals[key] = self.totals.get(key, 0) + value
+
+    def as_dict(self) -> dict[str, Any]:
+        """Returns the summary as plain json-compatible data"""
+        return asdict(self)
+
+
+class BatchManifest:
+    """
+    Record of finished inputs, kept as json next to the outputs. An input
+    counts as done only if it succeeded and hasn't changed size or mtime
+    since.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.entries: dict[str, dict[str, Any]] = {}
+        if path.is_file():
+            with open(path, encoding="utf8") as file:
+                self.entries = json.load(file).get("files", {})
+
+    @staticmethod
+    def _fingerprint(input_f: Path) -> dict[str, int]:
+        stat = input_f.stat()
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    def is_done(self, input_f: Path, output_f: Path) -> bool:
+        """
+        is_done checks whether an input was already processed successfully
+
+        Args:
+            input_f (Path): input file
+            output_f (Path): where its output should be
+
+        Returns:
+            bool: the input can be skipped
+        """
+        entry = self.entries.get(str(input_f))
+        if entry is None or not entry.get("ok") or not output_f.exists():
+            return False
+        return all(entry.get(k) == v for k, v in self._fingerprint(input_f).items())
+
+    def record(self, result: FileResult) -> None:
+        """
+        record stores a result and rewrites the manifest atomically
+
+        Args:
+            result (FileResult): finished file
+        """
+        entry = asdict(result)
+        entry.update(self._fingerprint(Path(result.input)))
+        self.entries[result.input] = entry
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "w", encoding="utf8") as file:
+            json.dump({"files": self.entries}, file, indent=2)
+        os.replace(tmp, self.path)
+
+
+def load_registry(
+    msg_def_folder: PathLike,
+    typedef_path: PathLike | None = None,
+    workers: int | None = None,
+) -> DMLProtocolRegistry:
+    """
+    load_registry parses a message definition folder the same way
+        `PacketReader` does
+
+    Args:
+        msg_def_folder (PathLike): folder containing message definitions
+        typedef_path (PathLike | None, optional): wizwalker typedefs.
+            Defaults to None.
+        workers (int | None, optional): processes parsing the definitions.
+            Defaults to None.
+
+    Returns:
+        DMLProtocolRegistry: loaded definitions
+    """
+    return PacketReader(
+        msg_def_folder, typedef_path=typedef_path, load_workers=workers
+    ).dml_protocol
+
+
+def _init_worker(
+    msg_def_folder: PathLike | None, typedef_path: PathLike | None
+) -> None:
+    global _WORKER_REGISTRY  # pylint: disable=global-statement
+    if _WORKER_REGISTRY is None and msg_def_folder is not None:
+        # the pool already uses every core
+        _WORKER_REGISTRY = load_registry(msg_def_folder, typedef_path, workers=1)
+
+
+def dump_capture_json(reader, fp: IO[str]) -> tuple[int, int]:
+    """
+    dump_capture_json decodes every message of a
+        `moonlight.net.scapy.PcapReader` into a json list. Messages that
+        fail to decode are written as an error entry with their raw bytes.
+        A capture that is truncated or corrupt ends the list without an
+        entry, see the reader's `capture_error`.
+
+    Messages are written as soon as they are decoded, so memory use doesn't
+    grow with the capture and streamed input produces output right away.
+    The result is the same as `json.dump` of the whole list with an indent
+    of 2.
+
+    Args:
+        reader (moonlight.net.scapy.PcapReader): open capture reader
+        fp (IO[str]): file to write the json to
+
+    Returns:
+        tuple[int, int]: messages decoded and messages that failed
+    """
+    # lazy load since scapy is kinda heavy
+    from scapy.layers.inet import TCP  # pylint: disable=import-outside-toplevel
+
+    encoder = SerdeJSONEncoder(indent=2)
+    profiler = active_profiler()
+    decoded = 0
+    errors = 0
+    i = 0
+    while True:
+        try:
+            entry = next(reader)
+            decoded += 1
+            entry_type = message_type_name(entry) if entry is not None else "None"
+        except ValueError as err:
+            errors += 1
+            entry_type = "error"
+            entry = {
+                "error": {
+                    "message": str(err),
+                    "raw": bytes_to_pretty_str(
+                        bytes(reader.last_decoded_raw[TCP].payload)
+                    ),
+                }
+            }
+        except StopIteration:
+            break
+        finally:
+            i += 1
+        start = time.perf_counter()
+        text = encoder.encode(entry).replace("\n", "\n  ")
+        if profiler is not None:
+            profiler.add_message(entry_type, "encode", time.perf_counter() - start)
+        with stage("write"):
+            fp.write("[\n  " if decoded + errors == 1 else ",\n  ")
+            fp.write(text)
+        if i % 100 == 0:
+            logger.info("Progress: completed %d so far", i)
+
+    fp.write("\n]" if decoded + errors else "[]")
+    return decoded, errors
+
+
+def decode_file(input_f: Path, output_f: Path, dedupe: bool = False) -> dict[str, int]:
+    """
+    decode_file is the batch job behind `moonlight decode batch`. It decodes
+        one capture to json using the process' shared definitions.
+
+    Args:
+        input_f (Path): capture to decode
+        output_f (Path): json file to write
+        dedupe (bool, optional): skip duplicated TCP segments. Defaults to False.
+
+    Returns:
+        dict[str, int]: counts to aggregate
+    """
+    from moonlight.net.scapy import (  # pylint: disable=import-outside-toplevel
+        PcapReader,
+    )
+
+    deduplicator = SegmentDeduplicator() if dedupe else None
+    with PcapReader(
+        pcap_path=input_f,
+        msg_def_folder=None,
+        dml_protocol=_WORKER_REGISTRY,
+        deduplicator=deduplicator,
+    ) as reader, open(output_f, "w", encoding="utf8") as writer:
+        decoded, errors = dump_capture_json(reader, writer)
+    reader.error_tracker.log_summary()
+    if reader.capture_error is not None:
+        # the json is complete, but the capture wasn't read to its end
+        raise reader.capture_error
+    stats = {"messages": decoded, "errors": errors}
+    if deduplicator is not None:
+        stats["duplicates"] = deduplicator.stats.dropped
+    return stats
+
+
+def filter_file(  # pylint: disable=too-many-arguments
+    input_f: Path,
+    output_f: Path,
+    compress: bool = False,
+    sanitize: bool = False,
+    dedupe: bool = False,
+    redact_rules: tuple[str, ...] = (),
+) -> dict[str, int]:
+    """
+    filter_file is the batch job behind `moonlight pcap filter-batch`. See
+        `moonlight.net.filter.filter_pcap`.
+
+    Args:
+        input_f (Path): capture to filter
+        output_f (Path): capture to write
+        compress (bool, optional): gzip the output. Defaults to False.
+        sanitize (bool, optional): zero signed messages. Defaults to False.
+        dedupe (bool, optional): drop duplicated TCP segments. Defaults to False.
+        redact_rules (tuple[str, ...], optional): fields to redact using the
+            process' shared definitions. Defaults to ().
+
+    Returns:
+        dict[str, int]: counts to aggregate
+    """
+    redactor = None
+    if redact_rules:
+        redactor = Redactor(_WORKER_REGISTRY, redact_rules, signed_messages=sanitize)
+    stats = filter_pcap(
+        input_f,
+        output_f,
+        compress=compress,
+        sanitize=sanitize,
+        redactor=redactor,
+        deduplicator=SegmentDeduplicator() if dedupe else None,
+    )
+    return asdict(stats)
+
+
+def _run_job(
+    job: Callable[..., dict[str, int]],
+    input_f: Path,
+    output_f: Path,
+    options: dict[str, Any],
+) -> FileResult:
+    start = time.perf_counter()
+    try:
+        stats = job(input_f, output_f, **options)
+    except Exception as err:  # pylint: disable=broad-except
+        logger.error("Failed to process %s", input_f, exc_info=True)
+        return _failed_result(input_f, output_f, err, time.perf_counter() - start)
+    return FileResult(
+        input=str(input_f),
+        output=str(output_f),
+        ok=True,
+        elapsed=time.perf_counter() - start,
+        stats=stats,
+    )
+
+
+def _failed_result(
+    input_f: Path, output_f: Path, err: BaseException, elapsed: float
+) -> FileResult:
+    return FileResult(
+        input=str(input_f),
+        output=str(output_f),
+        ok=False,
+        elapsed=elapsed,
+        error=f"{type(err).__name__}: {err}",
+    )
+
+
+def _make_pool(workers: int, msg_def_folder, typedef_path) -> ProcessPoolExecutor:
+    can_fork = "fork" in multiprocessing.get_all_start_methods()
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("fork" if can_fork else None),
+        initializer=_init_worker,
+        initargs=(msg_def_folder, typedef_path),
+    )
+
+
+def _run_pool(  # pylint: disable=too-many-arguments
+    job: Callable[..., dict[str, int]],
+    pending: list[tuple[Path, Path]],
+    options: dict[str, Any],
+    workers: int,
+    finish: Callable[[FileResult], None],
+    msg_def_folder: PathLike | None,
+    typedef_path: PathLike | None,
+) -> None:
+    queue = deque(pending)
+    # files running when a worker died, any of which may have killed it
+    suspects: list[tuple[Path, Path]] = []
+    while queue:
+        broken = False
+        with _make_pool(workers, msg_def_folder, typedef_path) as pool:
+            # only as many files as workers are submitted, so a broken pool
+            # fails the files that were running and no queued ones
+            running: dict[Future, tuple[Path, Path]] = {}
+            try:
+                while queue or running:
+                    while queue and not broken and len(running) < workers:
+                        input_f, output_f = queue.popleft()
+                        future = pool.submit(_run_job, job, input_f, output_f, options)
+                        running[future] = (input_f, output_f)
+                    if not running:
+                        break
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        input_f, output_f = running.pop(future)
+                        try:
+                            finish(future.result())
+                        except BrokenProcessPool:
+                            broken = True
+                            suspects.append((input_f, output_f))
+                        except Exception as err:  # pylint: disable=broad-except
+                            finish(_failed_result(input_f, output_f, err, 0.0))
+            except KeyboardInterrupt:
+                logger.warning("Cancelling remaining files")
+                pool.shutdown(wait=True, cancel_futures=True)
+                raise
+        if broken:
+            logger.warning(
+                "A worker process died, restarting the pool for %d remaining files",
+                len(queue),
+            )
+
+    for input_f, output_f in suspects:
+        logger.info("Retrying %s in its own process", input_f)
+        start = time.perf_counter()
+        with _make_pool(1, msg_def_folder, typedef_path) as pool:
+            try:
+                finish(pool.submit(_run_job, job, input_f, output_f, options).result())
+            except Exception as err:  # pylint: disable=broad-except
+                logger.error("Worker process died processing %s", input_f)
+                finish(
+                    _failed_result(input_f, output_f, err, time.perf_counter() - start)
+                )
+
+
+def run_batch(  # pylint: disable=too-many-arguments too-many-locals
+    job: Callable[..., dict[str, int]],
+    inputs: list[Path],
+    output_dir: Path,
+    name_output: Callable[[Path], str],
+    workers: int | None = None,
+    resume: bool = True,
+    msg_def_folder: PathLike | None = None,
+    typedef_path: PathLike | None = None,
+    **options,
+) -> BatchSummary:
+    """
+    run_batch runs `job(input, output, **options)` for every input across a
+        process pool and aggregates the results
+
+    Args:
+        job (Callable[..., dict[str, int]]): module level function processing
+            one file, such as `decode_file` or `filter_file`. Returned counts
+            are summed into `BatchSummary.totals`.
+        inputs (list[Path]): files to process. See `expand_inputs`.
+        output_dir (Path): directory outputs and the manifest are written to
+        name_output (Callable[[Path], str]): output file name for an input
+        workers (int | None, optional): worker processes. `1` processes files
+            in this process. Defaults to the cpu count.
+        resume (bool, optional): skip inputs the manifest records as done.
+            Defaults to True.
+        msg_def_folder (PathLike | None, optional): definitions to load once
+            and share with every job. Defaults to None.
+        typedef_path (PathLike | None, optional): wizwalker typedefs.
+            Defaults to None.
+
+    Returns:
+        BatchSummary: aggregate results
+    """
+    global _WORKER_REGISTRY  # pylint: disable=global-statement
+    started = time.perf_counter()
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest = BatchManifest(output_dir / MANIFEST_NAME)
+    summary = BatchSummary(files=len(inputs))
+
+    pending: list[tuple[Path, Path]] = []
+    for input_f, output_f in assign_outputs(inputs, output_dir, name_output).items():
+        if resume and manifest.is_done(input_f, output_f):
+            summary.skipped += 1
+        else:
+            pending.append((input_f, output_f))
+    if summary.skipped:
+        logger.info(
+            "Resuming: %d of %d files already done", summary.skipped, len(inputs)
+        )
+
+    def finish(result: FileResult) -> None:
+        manifest.record(result)
+        summary.add(result)
+        logger.info(
+            "[%d/%d] %s %s in %.2fs",
+            summary.succeeded + summary.failed + summary.skipped,
+            summary.files,
+            "Finished" if result.ok else "FAILED",
+            result.input,
+            result.elapsed,
+        )
+
+    workers = min(workers or os.cpu_count() or 1, max(len(pending), 1))
+    can_fork = "fork" in multiprocessing.get_all_start_methods()
+    if msg_def_folder is not None and (workers == 1 or can_fork):
+        # forked workers inherit the parsed definitions
+        _WORKER_REGISTRY = load_registry(msg_def_folder, typedef_path)
+
+    try:
+        if workers == 1:
+            for input_f, output_f in pending:
+                finish(_run_job(job, input_f, output_f, options))
+        else:
+            _run_pool(
+                job, pending, options, workers, finish, msg_def_folder, typedef_path
+            )
+    finally:
+        _WORKER_REGISTRY = None
+        summary.elapsed = time.perf_counter() - started
+
+    logger.info(
+        "Batch done in %.2fs: %d succeeded, %d failed, %d skipped",
+        summary.elapsed,
+        summary.succeeded,
+        summary.failed,
+        summary.skipped,
+    )
+    return summary
@@ -0,0 +1,409 @@
+"""
+Throughput benchmarks of the decoding stack
+
+`build_suite` creates benchmark cases for each layer of decoding:
+- `BytestreamReader` primitive reads
+- KI headers
+- DML messages
+- control messages
+- property objects
+- json encoding of decoded messages
+- decoding a whole capture through `moonlight.net.scapy.PcapReader`
+
+The inputs are synthetic. Every message of the given definitions is
+filled with deterministic values, so the numbers of different runs and
+machines measure the same work.
+
+`run_suite` times the cases like `timeit`. The loop count is calibrated
+per case and the best, median and spread of several repeats are kept.
+Results are plain dicts that can be saved as json and checked against a
+saved baseline with `compare_results`.
+"""
+
+from __future__ import annotations
+
+import fnmatch
+import platform
+import random
+import statistics
+import struct
+import timeit
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from importlib import metadata
+from os import PathLike
+from pathlib import Path
+from typing import Any, Callable, Iterable
+
+from moonlight.util import SerdeJSONEncoder
+
+from .common import (
+    DML_HEADER_LEN,
+    PACKET_HEADER_LEN,
+    BytestreamReader,
+    BytestreamWriter,
+    DMLType,
+    KIHeader,
+)
+from .control import (
+    ControlProtocol,
+    KeepAliveMessage,
+    KeepAliveResponseMessage,
+    SessionAcceptMessage,
+    SessionOfferMessage,
+)
+from .decode import PacketReader
+from .dml import DMLMessageDef, DMLProtocolRegistry
+from .generate import random_field_value
+from .object_property import ObjectPropertyDecoder
+from .pcap import PcapWriter, build_tcp_frame
+
+RESULTS_VERSION = 1
+
+
+@dataclass
+class BenchCase:
+    """A timed operation that processes `items` units of work per call"""
+
+    name: str
+    func: Callable[[], Any]
+    items: int
+    unit: str
+
+
+def synthetic_dml_frame(
+    service_id: int, msg_id: int, msg_def: DMLMessageDef, rng: random.Random
+) -> bytes:
+    """
+    synthetic_dml_frame builds a KI frame holding a message with arbitrary
+        but valid field values
+
+    Args:
+        service_id (int): DML service of the message
+        msg_id (int): message id within the service
+        msg_def (DMLMessageDef): definition of the message
+        rng (random.Random): source of the field values
+
+    Returns:
+        bytes: KI frame
+    """
+    values = {f.name: random_field_value(f.dml_type, rng) for f in msg_def.fields}
+    payload = msg_def.encode_message(values)
+    writer = BytestreamWriter()
+    writer.write(DMLType.UBYT, service_id)
+    writer.write(DMLType.UBYT, msg_id)
+    writer.write(DMLType.USHRT, len(payload) + DML_HEADER_LEN + 2)
+    writer.write_raw(payload)
+    body = writer.getvalue()
+    return KIHeader.for_content(body).to_bytes() + body
+
+
+def synthetic_control_frames(rng: random.Random) -> list[bytes]:
+    """
+    synthetic_control_frames builds one KI frame of each control message
+        moonlight decodes
+
+    Args:
+        rng (random.Random): source of the field values
+
+    Returns:
+        list[bytes]: session offer, session accept, keep alive and keep
+            alive response frames
+    """
+    session_id = rng.getrandbits(16)
+    now = 1650000000
+    signed = rng.randbytes(256)
+    keep_alive = rng.randbytes(4)
+    messages = [
+        SessionOfferMessage(
+            original_bytes=None,
+            session_id=session_id,
+            unix_timestamp_seconds=now,
+            unix_timestamp_millis_into_second=500,
+            signed_msg_len=len(signed),
+            signed_msg=signed,
+        ),
+        SessionAcceptMessage(
+            original_bytes=None,
+            reserved_start=0,
+            session_id=session_id,
+            unix_timestamp_seconds=now,
+            unix_timestamp_millis_into_second=500,
+            signed_msg_len=len(signed),
+            signed_msg=signed,
+        ),
+        KeepAliveMessage(
+            original_bytes=None, session_id=session_id, variable_timestamp=keep_alive
+        ),
+        KeepAliveResponseMessage(
+            original_bytes=None, session_id=session_id, variable_timestamp=keep_alive
+        ),
+    ]
+    return [message.to_bytes() for message in messages]
+
+
+def build_suite(  # pylint: disable=too-many-locals
+    registry: DMLProtocolRegistry,
+    work_dir: PathLike,
+    messages: int = 2000,
+    seed: int = 0,
+    property_object: bytes | None = None,
+    typedef_path: PathLike | None = None,
+) -> list[BenchCase]:
+    """
+    build_suite creates the benchmark cases over synthetic data
+
+    Args:
+        registry (DMLProtocolRegistry): message definitions to generate
+            messages from
+        work_dir (PathLike): directory to write the synthetic capture to
+        messages (int, optional): messages per case. Defaults to 2000.
+        seed (int, optional): seed of the synthetic data. Defaults to 0.
+        property_object (bytes | None, optional): serialized property object
+            to time deserializing. Needs `typedef_path`. Defaults to None.
+        typedef_path (PathLike | None, optional): wizwalker typedefs for
+            `property_object`. Defaults to None.
+
+    Raises:
+        ValueError: the registry has no messages
+
+    Returns:
+        list[BenchCase]: benchmark cases
+    """
+    rng = random.Random(seed)
+    defs = [
+        (protocol.id, msg_id, msg_def)
+        for protocol in registry.protocol_map.values()
+        for msg_id, msg_def in protocol.message_map.items()
+    ]
+    if not defs:
+        raise ValueError("No message definitions to generate messages from")
+    dml_frames = [
+        synthetic_dml_frame(*defs[i % len(defs)], rng) for i in range(messages)
+    ]
+    control_frames = synthetic_control_frames(rng)
+    control_frames = [control_frames[i % len(control_frames)] for i in range(messages)]
+    reader = PacketReader(None, dml_protocol=registry)  # type: ignore
+
+    uint32s = struct.pack(
+        f"<{messages}I", *(rng.getrandbits(32) for _ in range(messages))
+    )
+    strings = BytestreamWriter()
+    for _ in range(messages):
+        strings.write(DMLType.STR, random_field_value(DMLType.STR, rng))
+    strings = strings.getvalue()
+
+    def read_uint32s():
+        stream = BytestreamReader(uint32s)
+        for _ in range(messages):
+            stream.read(DMLType.UINT32)
+
+    def read_strs():
+        stream = BytestreamReader(strings)
+        for _ in range(messages):
+            stream.read(DMLType.STR)
+
+    def read_headers():
+        for frame in dml_frames:
+            KIHeader.from_bytes(frame)
+
+    # decode_message starts after the KI header and DML ids
+    bodies = [
+        (defs[i % len(defs)][2], frame[PACKET_HEADER_LEN + DML_HEADER_LEN + 2 :])
+        for i, frame in enumerate(dml_frames)
+    ]
+
+    def decode_dml():
+        for msg_def, body in bodies:
+            msg_def.decode_message(body)
+
+    control = ControlProtocol()
+    control_headers = [(KIHeader.from_bytes(f), f) for f in control_frames]
+
+    def decode_control():
+        for header, frame in control_headers:
+            control.decode_packet(frame, header, original_data=frame)
+
+    decoded = [reader.decode_ki_packet(frame) for frame in dml_frames]
+    encoder = SerdeJSONEncoder(indent=None)
+
+    def encode_json():
+        for message in decoded:
+            encoder.encode(message)
+
+    capture_path = Path(work_dir) / "bench.pcap"
+    with PcapWriter(capture_path) as writer:
+        for i, frame in enumerate(dml_frames):
+            writer.write(1650000000 + i / 100, build_tcp_frame(frame, seq=1 + i))
+
+    def decode_capture():
+        # lazy load since scapy is kinda heavy
+        from .scapy import PcapReader  # pylint: disable=import-outside-toplevel
+
+        with PcapReader(capture_path, None, dml_protocol=registry) as capture:  # type: ignore
+            for _ in capture:
+                pass
+
+    cases = [
+        BenchCase("reader.uint32", read_uint32s, messages, "reads"),
+        BenchCase("reader.str", read_strs, messages, "reads"),
+        BenchCase("ki_header.from_bytes", read_headers, messages, "headers"),
+        BenchCase("dml.decode_message", decode_dml, messages, "messages"),
+        BenchCase("control.decode", decode_control, messages, "messages"),
+        BenchCase("serde.json", encode_json, messages, "messages"),
+        BenchCase("pcap.decode", decode_capture, messages, "messages"),
+    ]
+    if property_object is not None and typedef_path is not None:
+        # flags and mask of character creation info, the sample moonlight tests with
+        po_decoder = ObjectPropertyDecoder(
+            flags=0, exhaustive=False, property_mask=24, typedef_path=typedef_path
+        )
+        cases.append(
+            BenchCase(
+                "property_object.deserialize",
+                lambda: po_decoder.deserialize(property_object),
+                1,
+                "objects",
+            )
+        )
+    return cases
+
+
+def select_cases(cases: list[BenchCase], patterns: Iterable[str]) -> list[BenchCase]:
+    """
+    select_cases keeps the cases whose name matches any glob pattern
+
+    Args:
+        cases (list[BenchCase]): cases to choose from
+        patterns (Iterable[str]): patterns such as "dml.*". No patterns
+            keeps every case.
+
+    Returns:
+        list[BenchCase]: matching cases in suite order
+    """
+    patterns = list(patterns)
+    if not patterns:
+        return cases
+    return [c for c in cases if any(fnmatch.fnmatchcase(c.name, p) for p in patterns)]
+
+
+def run_case(case: BenchCase, repeat: int = 5, min_time: float = 0.2) -> dict[str, Any]:
+    """
+    run_case times a benchmark case. The call is looped until a repeat
+        takes at least `min_time` seconds, as `timeit` does.
+
+    Args:
+        case (BenchCase): case to time
+        repeat (int, optional): timed repeats. Defaults to 5.
+        min_time (float, optional): least seconds per repeat. Defaults to 0.2.
+
+    Returns:
+        dict[str, Any]: seconds per call and items per second of the case
+    """
+    timer = timeit.Timer(case.func)
+    loops = 1
+    while timer.timeit(loops) < min_time:
+        loops *= 2
+    times = [t / loops for t in timer.repeat(repeat, loops)]
+    median = statistics.median(times)
+    return {
+        "name": case.name,
+        "unit": case.unit,
+        "items": case.items,
+        "loops": loops,
+        "repeat": repeat,
+        "best": min(times),
+        "median": median,
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "per_sec": case.items / median if median else None,
+    }
+
+
+def environment() -> dict[str, Any]:
+    """
+    environment describes what the benchmarks ran on
+
+    Returns:
+        dict[str, Any]: moonlight and python versions and platform
+    """
+    try:
+        version = metadata.version("moonlight")
+    except metadata.PackageNotFoundError:
+        version = None
+    return {
+        "moonlight": version,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+    }
+
+
+def run_suite(
+    cases: list[BenchCase],
+    repeat: int = 5,
+    min_time: float = 0.2,
+    progress: Callable[[dict[str, Any]], None] | None = None,
+) -> dict[str, Any]:
+    """
+    run_suite times every case
+
+    Args:
+        cases (list[BenchCase]): cases to time
+        repeat (int, optional): timed repeats per case. Defaults to 5.
+        min_time (float, optional): least seconds per repeat. Defaults to 0.2.
+        progress (Callable[[dict[str, Any]], None] | None, optional): called
+            with each case's result as it finishes. Defaults to None.
+
+    Returns:
+        dict[str, Any]: json serializable results with their environment
+    """
+    results = []
+    for case in cases:
+        result = run_case(case, repeat=repeat, min_time=min_time)
+        results.append(result)
+        if progress is not None:
+            progress(result)
+    return {
+        "version": RESULTS_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "environment": environment(),
+        "results": results,
+    }
+
+
+def compare_results(
+    results: dict[str, Any], baseline: dict[str, Any], tolerance: float = 0.1
+) -> list[dict[str, Any]]:
+    """
+    compare_results checks throughput against a baseline run
+
+    Args:
+        results (dict[str, Any]): output of `run_suite`
+        baseline (dict[str, Any]): earlier output of `run_suite`
+        tolerance (float, optional): slowdown allowed before a case counts
+            as a regression, as a fraction of the baseline throughput.
+            Defaults to 0.1.
+
+    Returns:
+        list[dict[str, Any]]: every case present in both runs with its
+            baseline and current throughput, relative change and whether
+            it regressed
+    """
+    before = {r["name"]: r for r in baseline.get("results", [])}
+    comparison = []
+    for result in results["results"]:
+        old = before.get(result["name"])
+        if old is None or not old.get("per_sec") or result["per_sec"] is None:
+            continue
+        change = result["per_sec"] / old["per_sec"] - 1
+        comparison.append(
+            {
+                "name": result["name"],
+                "baseline_per_sec": old["per_sec"],
+                "per_sec": result["per_sec"],
+                "change": change,
+                "regression": change < -tolerance,
+            }
+        )
+    return comparison
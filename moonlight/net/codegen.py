@@ -0,0 +1,514 @@
+"""
+Ahead of time code generation from DML message definitions
+
+`generate_package` turns a folder of message definition xml into a
+standalone python package, so definitions don't have to be parsed at
+runtime. The package holds:
+- one module per service, with a `__slots__` class per message, typed
+  attributes and a decoder built from precompiled `struct.Struct`s.
+  Neighbouring fixed size fields are read with a single unpack.
+- a dispatch table from (service id, message id) to message class
+- `SOURCE_HASH`, the `definition_hash` of the xml it was generated from
+
+Generated packages only depend on the standard library:
+
+    import my_messages
+    msg = my_messages.decode(frame)
+    msg.TestField_00_INT8
+
+`load_generated` imports a generated package and checks it still matches
+the xml. `DMLProtocolRegistry.from_generated` then rebuilds the
+definitions from it without parsing xml. The registry's messages decode
+through the generated code but still produce regular `DMLMessage`s.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import importlib
+import importlib.util
+import keyword
+import re
+import sys
+from os import PathLike, listdir
+from os.path import isfile, join
+from pathlib import Path
+from types import ModuleType
+from typing import Iterable
+
+from .common import DMLType
+from .dml import DMLMessageDef, DMLProtocol, DMLProtocolRegistry
+
+CODEGEN_VERSION = 1
+
+_STRING_READERS = {DMLType.STR: "_str", DMLType.WSTR: "_wstr"}
+_UNREADABLE = (DMLType.PO_STR, DMLType.PO_WSTR)
+_ANNOTATIONS = {
+    DMLType.BOOL: "bool",
+    DMLType.STR: "str | bytes",
+    DMLType.WSTR: "str | bytes",
+}
+_RESERVED = {"decode", "unpack", "as_dict", "values"}
+
+
+class StaleCodegenError(ValueError):
+    """A generated package doesn't match the definitions it is used with"""
+
+
+def definition_files(msg_def_folder: PathLike) -> list[str]:
+    """
+    definition_files lists the files `PacketReader` loads from a folder
+
+    Args:
+        msg_def_folder (PathLike): message definition folder
+
+    Returns:
+        list[str]: paths in name order
+    """
+    return sorted(
+        join(msg_def_folder, f)
+        for f in listdir(msg_def_folder)
+        if isfile(join(msg_def_folder, f))
+    )
+
+
+def definition_hash(files: Iterable[PathLike]) -> str:
+    """
+    definition_hash fingerprints message definition files by name and
+        content
+
+    Args:
+        files (Iterable[PathLike]): definition files
+
+    Returns:
+        str: sha256 hex digest
+    """
+    digest = hashlib.sha256()
+    for path in sorted(Path(f) for f in files):
+        content = path.read_bytes()
+        digest.update(path.name.encode("utf8") + b"\0")
+        digest.update(len(content).to_bytes(8, "little") + content)
+    return digest.hexdigest()
+
+
+def _identifier(name: str, taken: set[str]) -> str:
+    ident = re.sub(r"\W", "_", name)
+    if not ident or ident[0].isdigit():
+        ident = f"_{ident}"
+    if keyword.iskeyword(ident) or ident in _RESERVED or ident.startswith("__"):
+        ident = f"{ident}_"
+    base = ident
+    suffix = 2
+    while ident in taken:
+        ident = f"{base}_{suffix}"
+        suffix += 1
+    taken.add(ident)
+    return ident
+
+
+def _annotation(dml_type: DMLType) -> str:
+    if dml_type in _ANNOTATIONS:
+        return _ANNOTATIONS[dml_type]
+    if dml_type in _UNREADABLE:
+        return "bytes"
+    return "float" if dml_type.struct_code[-1] in "fd" else "int"
+
+
+def _unpack_body(msg_def: DMLMessageDef, structs: dict[str, str]) -> list[str]:
+    """Lines of a message's unpack function, registering the structs it uses"""
+    lines = []
+    parts = []
+    run = ""
+    for field_def in msg_def.fields:
+        if field_def.dml_type in _UNREADABLE:
+            lines.append(
+                f'raise ValueError("{field_def.name}: {field_def.dml_type.name} '
+                'fields are not supported")'
+            )
+            return lines
+        if field_def.dml_type in _STRING_READERS:
+            if run:
+                parts.append(run)
+                run = ""
+            parts.append(field_def.dml_type)
+        else:
+            run += field_def.dml_type.struct_code[1:]
+    if run:
+        parts.append(run)
+
+    names = []
+    for i, part in enumerate(parts):
+        name = f"_v{i}"
+        if isinstance(part, str):
+            struct_name = structs.setdefault(part, f"_S{len(structs)}")
+            lines.append(f"{name} = {struct_name}.unpack_from(buf, offset)")
+            lines.append(f"offset += {struct_name}.size")
+            names.append(f"*{name}")
+        else:
+            lines.append(f"{name}, offset = {_STRING_READERS[part]}(buf, offset)")
+            names.append(name)
+    if len(names) == 1 and names[0].startswith("*"):
+        values = names[0][1:]
+    else:
+        values = f"({', '.join(names)}{',' if len(names) == 1 else ''})"
+    lines.append(f"return {values}, offset")
+    return lines
+
+
+def _message_source(
+    msg_def: DMLMessageDef, class_name: str, structs: dict[str, str]
+) -> list[str]:
+    taken: set[str] = set()
+    attrs = [_identifier(f.name, taken) for f in msg_def.fields]
+    lines = [f"class {class_name}(GeneratedMessage):"]
+    if msg_def.desc:
+        lines.append(f"    {_docstring(msg_def.desc)}")
+        lines.append("")
+    lines.append("    __slots__ = (")
+    lines.extend(f"        {attr!r}," for attr in attrs)
+    lines.append("    )")
+    lines.append(f"    SERVICE_ID = {msg_def.protocol.id!r}")
+    lines.append(f"    MESSAGE_ID = {msg_def.order_id!r}")
+    lines.append(f"    NAME = {msg_def.name!r}")
+    lines.append(f"    DESCRIPTION = {msg_def.desc!r}")
+    lines.append(f"    HANDLER = {msg_def.handler!r}")
+    lines.append("    # (name, attribute, dml type, noxfer)")
+    lines.append("    FIELDS = (")
+    for field_def, attr in zip(msg_def.fields, attrs):
+        lines.append(
+            f"        ({field_def.name!r}, {attr!r}, {field_def.dml_type.name!r}, "
+            f"{bool(field_def.noxfer)!r}),"
+        )
+    lines.append("    )")
+    lines.append("")
+    for field_def, attr in zip(msg_def.fields, attrs):
+        lines.append(f"    {attr}: {_annotation(field_def.dml_type)}")
+    if attrs:
+        lines.append("")
+
+    lines.append("    @staticmethod")
+    lines.append("    def unpack(buf, offset: int = 0) -> tuple[tuple, int]:")
+    lines.append("        try:")
+    lines.extend(f"            {line}" for line in _unpack_body(msg_def, structs))
+    lines.append("        except struct.error as err:")
+    lines.append('            raise ValueError(f"Buffer overread: {err}") from err')
+    lines.append("")
+    lines.append("    @classmethod")
+    lines.append(f"    def decode(cls, buf, offset: int = 0) -> {class_name}:")
+    lines.append("        values, _ = cls.unpack(buf, offset)")
+    lines.append("        self = cls.__new__(cls)")
+    if len(attrs) == 1:
+        lines.append(f"        (self.{attrs[0]},) = values")
+    elif attrs:
+        lines.append("        (")
+        lines.extend(f"            self.{attr}," for attr in attrs)
+        lines.append("        ) = values")
+    lines.append("        return self")
+    return lines
+
+
+def _docstring(text: str) -> str:
+    text = " ".join(text.split()).replace("\\", "\\\\").replace('"""', '\\"\\"\\"')
+    return f'"""{text}"""'
+
+
+_BASE_SOURCE = '''\
+"""Runtime shared by the generated message classes"""
+
+from __future__ import annotations
+
+import struct
+
+_U16 = struct.Struct("<H")
+
+
+def _str(buf, offset: int):
+    (length,) = _U16.unpack_from(buf, offset)
+    offset += 2
+    raw = bytes(buf[offset : offset + length])
+    offset += len(raw)
+    try:
+        return raw.decode("ascii"), offset
+    except UnicodeDecodeError:
+        return raw, offset
+
+
+def _wstr(buf, offset: int):
+    (length,) = _U16.unpack_from(buf, offset)
+    offset += 2
+    raw = bytes(buf[offset : offset + length])
+    offset += len(raw)
+    try:
+        return raw.decode("utf-16-le"), offset
+    except UnicodeDecodeError:
+        return raw, offset
+
+
+class GeneratedMessage:
+    """Base of generated message classes"""
+
+    __slots__ = ()
+    SERVICE_ID: int
+    MESSAGE_ID: int
+    NAME: str
+    DESCRIPTION: str | None
+    HANDLER: str | None
+    FIELDS: tuple[tuple[str, str, str, bool], ...]
+
+    @staticmethod
+    def unpack(buf, offset: int = 0) -> tuple[tuple, int]:
+        """
+        unpack reads the message's field values from a payload
+
+        Args:
+            buf (bytes): buffer holding the payload
+            offset (int, optional): where the fields start, after the DML
+                header. Defaults to 0.
+
+        Raises:
+            ValueError: the payload is too short
+
+        Returns:
+            tuple[tuple, int]: field values in definition order and the
+                offset after them
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def decode(cls, buf, offset: int = 0) -> GeneratedMessage:
+        """
+        decode reads a message from a payload. See `unpack`.
+        """
+        raise NotImplementedError
+
+    def values(self) -> tuple:
+        """Field values in definition order"""
+        return tuple(getattr(self, attr) for _, attr, _, _ in self.FIELDS)
+
+    def as_dict(self) -> dict:
+        """Field values by their names in the definitions"""
+        return {name: getattr(self, attr) for name, attr, _, _ in self.FIELDS}
+
+    def __eq__(self, other) -> bool:
+        return type(other) is type(self) and other.values() == self.values()
+
+    def __hash__(self) -> int:
+        return hash((type(self), self.values()))
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{attr}={getattr(self, attr)!r}" for _, attr, _, _ in self.FIELDS)
+        return f"{type(self).__name__}({fields})"
+'''
+
+_INIT_TEMPLATE = '''\
+"""
+Message classes generated by `moonlight codegen` from {file_count} DML
+definition files. Don't edit, generate again instead.
+"""
+
+from ._base import GeneratedMessage
+{imports}
+
+CODEGEN_VERSION = {version}
+SOURCE_HASH = {source_hash!r}
+
+# service id -> (protocol type, protocol version, description, module)
+SERVICES = {{
+{services}
+}}
+
+MESSAGES: dict[tuple[int, int], type[GeneratedMessage]] = {{
+{messages}
+}}
+
+
+def decode(bites, has_ki_header: bool = True) -> GeneratedMessage:
+    """
+    decode reads a DML message using the generated classes
+
+    Args:
+        bites (bytes): DML frame
+        has_ki_header (bool, optional): `bites` starts with the KI frame
+            header. Defaults to True.
+
+    Raises:
+        ValueError: not a DML frame, an unknown message or too short
+
+    Returns:
+        GeneratedMessage: decoded message
+    """
+    offset = 0
+    if has_ki_header:
+        if bites[:2] != b"\\x0D\\xF0" or len(bites) < 8:
+            raise ValueError("Not a KI game protocol packet")
+        if bites[4]:
+            raise ValueError("Control messages are not generated")
+        offset = 8
+    if len(bites) < offset + 4:
+        raise ValueError("Missing DML header")
+    cls = MESSAGES.get((bites[offset], bites[offset + 1]))
+    if cls is None:
+        raise ValueError(f"Unknown message {{bites[offset]}}:{{bites[offset + 1]}}")
+    # service id, message id and the unused message length
+    return cls.decode(bites, offset + 4)
+'''
+
+
+def _module_source(protocol: DMLProtocol, source_hash: str) -> str:
+    structs: dict[str, str] = {}
+    classes = []
+    taken: set[str] = set()
+    names = {}
+    for msg_id in sorted(protocol.message_map):
+        msg_def = protocol.message_map[msg_id]
+        class_name = _identifier(msg_def.name, taken)
+        names[msg_id] = class_name
+        classes.append("\n".join(_message_source(msg_def, class_name, structs)))
+
+    lines = [
+        f'"""{protocol.type} ({protocol.id}): {" ".join((protocol.desc or "").split())}',
+        "",
+        f"Generated by `moonlight codegen` from definitions {source_hash[:12]}.",
+        'Don\'t edit, generate again instead.\n"""',
+        "",
+        "from __future__ import annotations",
+        "",
+        "import struct",
+        "",
+        "from ._base import GeneratedMessage, _str, _wstr  # pylint: disable=unused-import",
+        "",
+    ]
+    lines.extend(
+        f'{name} = struct.Struct("<{codes}")' for codes, name in structs.items()
+    )
+    lines.append("")
+    lines.append("")
+    lines.append("\n\n\n".join(classes))
+    lines.append("")
+    lines.append("")
+    lines.append("MESSAGES = {")
+    lines.extend(f"    {msg_id}: {name}," for msg_id, name in names.items())
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def generate_package(
+    msg_def_folder: PathLike,
+    output_dir: PathLike,
+    package_name: str = "moonlight_messages",
+) -> Path:
+    """
+    generate_package writes a python package of message classes generated
+        from a definition folder
+
+    Args:
+        msg_def_folder (PathLike): message definition folder, as given to
+            `PacketReader`
+        output_dir (PathLike): directory to create the package in
+        package_name (str, optional): package name. Defaults to
+            "moonlight_messages".
+
+    Raises:
+        ValueError: `package_name` isn't a valid identifier or the
+            definitions can't be loaded
+
+    Returns:
+        Path: package directory
+    """
+    if not package_name.isidentifier() or keyword.iskeyword(package_name):
+        raise ValueError(f"Invalid package name {package_name}")
+    files = definition_files(msg_def_folder)
+    registry = DMLProtocolRegistry(*files)
+    source_hash = definition_hash(files)
+
+    package_dir = Path(output_dir) / package_name
+    package_dir.mkdir(parents=True, exist_ok=True)
+    (package_dir / "_base.py").write_text(_BASE_SOURCE, encoding="utf8")
+
+    taken = {"_base"}
+    imports = []
+    services = []
+    messages = []
+    for service_id in sorted(registry.protocol_map):
+        protocol = registry.protocol_map[service_id]
+        module = _identifier((protocol.type or f"service_{service_id}").lower(), taken)
+        (package_dir / f"{module}.py").write_text(
+            _module_source(protocol, source_hash), encoding="utf8"
+        )
+        imports.append(f"from . import {module}")
+        services.append(
+            f"    {service_id}: ({protocol.type!r}, {protocol.version!r}, "
+            f"{protocol.desc!r}, {module}),"
+        )
+        messages.extend(
+            f"    ({service_id}, {msg_id}): {module}.MESSAGES[{msg_id}],"
+            for msg_id in sorted(protocol.message_map)
+        )
+
+    (package_dir / "__init__.py").write_text(
+        _INIT_TEMPLATE.format(
+            file_count=len(files),
+            imports="\n".join(imports),
+            version=CODEGEN_VERSION,
+            source_hash=source_hash,
+            services="\n".join(services),
+            messages="\n".join(messages),
+        ),
+        encoding="utf8",
+    )
+    return package_dir
+
+
+def load_generated(
+    package: PathLike | str | ModuleType, msg_def_folder: PathLike | None = None
+) -> ModuleType:
+    """
+    load_generated imports a generated package and checks that it is
+        current
+
+    Args:
+        package (PathLike | str | ModuleType): package directory, importable
+            module name or the imported module
+        msg_def_folder (PathLike | None, optional): definitions the package
+            has to match. Not checked if None. Defaults to None.
+
+    Raises:
+        StaleCodegenError: the package was generated from other definitions
+            or by another version of moonlight
+        ImportError: the package can't be imported
+
+    Returns:
+        ModuleType: generated package
+    """
+    if isinstance(package, ModuleType):
+        module = package
+    elif Path(package).is_dir():
+        path = Path(package).resolve()
+        module = sys.modules.get(path.name)
+        if module is None or Path(getattr(module, "__file__", "")).parent != path:
+            spec = importlib.util.spec_from_file_location(
+                path.name, path / "__init__.py", submodule_search_locations=[str(path)]
+            )
+            if spec is None or spec.loader is None:
+                raise ImportError(f"Cannot import generated package {path}")
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[path.name] = module
+            try:
+                spec.loader.exec_module(module)
+            except BaseException:
+                del sys.modules[path.name]
+                raise
+    else:
+        module = importlib.import_module(str(package))
+
+    if getattr(module, "CODEGEN_VERSION", None) != CODEGEN_VERSION:
+        raise StaleCodegenError(
+            f"{module.__name__} was generated by another version of moonlight codegen"
+        )
+    if msg_def_folder is not None:
+        expected = definition_hash(definition_files(msg_def_folder))
+        if module.SOURCE_HASH != expected:
+            raise StaleCodegenError(
+                f"{module.__name__} was generated from other definitions than {msg_def_folder}"
+            )
+    return module
@@ -380,6 +380,60 @@ class BytestreamReader:
         return bites
 
 
+class BytestreamWriter:
+    """Byte writing utility with `DMLType` integration
+
+    The inverse of `BytestreamReader`. Values are packed the way the
+    reader unpacks them, including the length prefix of string types.
+    """
+
+    def __init__(self) -> None:
+        self.stream = BytesIO()
+
+    def write_raw(self, bites: bytes) -> None:
+        """Appends bytes as they are
+
+        Args:
+            bites (bytes): bytes to append
+        """
+        self.stream.write(bites)
+
+    def write(self, dml_type: DMLType, value: Any) -> None:
+        """Appends a value encoded as a `DMLType`
+
+        Args:
+            dml_type (DMLType): type of the field
+            value (Any): value as `BytestreamReader.read` would return it.
+                Strings may also be given as bytes.
+
+        Raises:
+            ValueError: the value doesn't fit the type
+        """
+        if dml_type in (DMLType.STR, DMLType.PO_STR, DMLType.WSTR, DMLType.PO_WSTR):
+            if isinstance(value, str):
+                wide = dml_type in (DMLType.WSTR, DMLType.PO_WSTR)
+                value = value.encode("utf-16-le" if wide else "utf8")
+            if len(value) > 0xFFFF:
+                raise ValueError(
+                    f"{dml_type.name} value is too long: {len(value)} bytes"
+                )
+            self.stream.write(struct.pack("<H", len(value)))
+            self.stream.write(value)
+            return
+        try:
+            self.stream.write(struct.pack(dml_type.struct_code, value))
+        except struct.error as err:
+            raise ValueError(f"Value {value!r} doesn't fit {dml_type.name}") from err
+
+    def getvalue(self) -> bytes:
+        """Everything written so far
+
+        Returns:
+            bytes: written bytes
+        """
+        return self.stream.getvalue()
+
+
 @dataclass(repr=True, kw_only=True)
 class KIHeader(SerdeMixin):
     """Dataclass holding the KI packet header fields."""
@@ -427,3 +481,43 @@ class KIHeader(SerdeMixin):
             control_opcode=control_opcode,
             mystery_bytes=mystery_bytes,
         )
+
+    def to_bytes(self) -> bytes:
+        """Packs the header
+
+        Returns:
+            bytes: packed Kingsisle TCP frame header
+        """
+        return struct.pack(
+            "<2sHBBH",
+            self.food,
+            self.content_len,
+            self.content_is_control,
+            self.control_opcode,
+            self.mystery_bytes,
+        )
+
+    @classmethod
+    def for_content(
+        cls, content: bytes, is_control: bool = False, control_opcode: int = 0
+    ) -> KIHeader:
+        """Creates the header of a frame holding `content`
+
+        Args:
+            content (bytes): everything following the header
+            is_control (bool, optional): the content is a control message.
+                Defaults to False.
+            control_opcode (int, optional): opcode of the control message.
+                Defaults to 0.
+
+        Returns:
+            KIHeader: header describing the content
+        """
+        # the length counts everything after itself
+        return cls(
+            food=b"\x0D\xF0",
+            content_len=len(content) + PACKET_HEADER_LEN - 4,
+            content_is_control=int(is_control),
+            control_opcode=control_opcode,
+            mystery_bytes=0,
+        )
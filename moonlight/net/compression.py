@@ -0,0 +1,234 @@
+"""
+Transparent decompression of capture input
+
+Captures are archived as gzip, xz or bzip2. `open_capture_input` recognizes
+them by their magic bytes rather than their name and hands back a stream
+of the decompressed capture, so nothing has to be decompressed to disk
+first. Decompression can optionally run on a background thread to overlap
+with decoding.
+"""
+
+from __future__ import annotations
+
+import bz2
+import gzip
+import io
+import logging
+import lzma
+import queue
+import threading
+from os import PathLike
+from typing import BinaryIO
+
+logger = logging.getLogger(__name__)
+
+GZIP_MAGIC = b"\x1f\x8b"
+BZIP2_MAGIC = b"BZh"
+XZ_MAGIC = b"\xfd7zXZ\x00"
+COMPRESSED_SUFFIXES = (".gz", ".xz", ".bz2")
+
+_MAGIC_LEN = len(XZ_MAGIC)
+_OPENERS = {
+    "gzip": lambda f: gzip.GzipFile(fileobj=f, mode="rb"),
+    "xz": lambda f: lzma.LZMAFile(f, mode="rb"),
+    "bzip2": lambda f: bz2.BZ2File(f, mode="rb"),
+}
+# bytes handed from a background decompression thread at a time
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+def detect_compression(prefix: bytes) -> str | None:
+    """
+    detect_compression identifies a compression format by its magic bytes
+
+    Args:
+        prefix (bytes): first bytes of the input, at least 6 to detect xz
+
+    Returns:
+        str | None: "gzip", "xz", "bzip2" or `None` if uncompressed
+    """
+    if prefix.startswith(GZIP_MAGIC):
+        return "gzip"
+    if prefix.startswith(XZ_MAGIC):
+        return "xz"
+    # the block size digit follows the bzip2 magic
+    if prefix.startswith(BZIP2_MAGIC) and prefix[3:4] in b"123456789":
+        return "bzip2"
+    return None
+
+
+class _PrefixedReader(io.RawIOBase):
+    """Puts bytes already read from a non-seekable stream back in front of it"""
+
+    def __init__(self, prefix: bytes, stream: BinaryIO) -> None:
+        super().__init__()
+        self._prefix = prefix
+        self._stream = stream
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self._prefix:
+            size = min(len(buffer), len(self._prefix))
+            buffer[:size] = self._prefix[:size]
+            self._prefix = self._prefix[size:]
+            return size
+        data = self._stream.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+
+class BackgroundReader(io.RawIOBase):
+    """
+    Reads a stream on a daemon thread into a bounded queue of chunks, so
+    that work done while reading (decompression) overlaps with whatever
+    consumes the data.
+    """
+
+    def __init__(
+        self,
+        stream: BinaryIO,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        max_chunks: int = 8,
+    ) -> None:
+        """
+        Args:
+            stream (BinaryIO): stream to read
+            chunk_size (int, optional): bytes read per chunk. Defaults to 1 MiB.
+            max_chunks (int, optional): chunks buffered ahead of the consumer.
+                Defaults to 8.
+        """
+        super().__init__()
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._queue: queue.Queue[bytes | BaseException] = queue.Queue(
+            maxsize=max_chunks
+        )
+        self._current = memoryview(b"")
+        self._eof = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="moonlight-decompress", daemon=True
+        )
+        self._thread.start()
+
+    def _put(self, item: bytes | BaseException) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self) -> None:
+        try:
+            while not self._stop.is_set():
+                chunk = self._stream.read(self._chunk_size)
+                if not self._put(chunk) or not chunk:
+                    return
+        except BaseException as err:  # pylint: disable=broad-except
+            self._put(err)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if not self._current:
+            if self._eof:
+                return 0
+            item = self._queue.get()
+            if isinstance(item, BaseException):
+                self._eof = True
+                raise item
+            if not item:
+                self._eof = True
+                return 0
+            self._current = memoryview(item)
+        size = min(len(buffer), len(self._current))
+        buffer[:size] = self._current[:size]
+        self._current = self._current[size:]
+        return size
+
+    def close(self) -> None:
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+        super().close()
+
+
+class CaptureInput:
+    """
+    A capture source opened for reading, decompressed if needed. Owns every
+    stream it opened and closes them together.
+    """
+
+    def __init__(
+        self, source: PathLike | str | BinaryIO, threaded: bool = False
+    ) -> None:
+        """
+        Args:
+            source (PathLike | str | BinaryIO): path or readable binary file
+                object positioned at the start of the capture. File objects
+                passed in are not closed by `close`.
+            threaded (bool, optional): decompress on a background thread.
+                Has no effect on uncompressed input. Defaults to False.
+        """
+        self._closers: list[BinaryIO] = []
+        if hasattr(source, "read"):
+            raw: BinaryIO = source  # type: ignore
+            self.name = str(getattr(source, "name", source))
+        else:
+            raw = open(source, "rb")  # pylint: disable=consider-using-with
+            self._closers.append(raw)
+            self.name = str(source)
+
+        if raw.seekable():
+            start = raw.tell()
+            prefix = raw.read(_MAGIC_LEN)
+            raw.seek(start)
+        else:
+            prefix = raw.read(_MAGIC_LEN)
+            raw = io.BufferedReader(_PrefixedReader(prefix, raw))  # type: ignore
+
+        self.compression = detect_compression(prefix)
+        if self.compression is None:
+            self.file = raw
+            return
+
+        logger.debug("Reading %s compressed capture %s", self.compression, self.name)
+        stream = _OPENERS[self.compression](raw)
+        self._closers.append(stream)
+        if threaded:
+            stream = io.BufferedReader(BackgroundReader(stream))  # type: ignore
+            self._closers.append(stream)
+        self.file = stream
+
+    def close(self) -> None:
+        """
+        close closes everything this input opened, outermost first
+        """
+        for stream in reversed(self._closers):
+            stream.close()
+        self._closers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def is_compressed(path: PathLike | str) -> bool:
+    """
+    is_compressed checks a file's magic bytes for a supported compression
+
+    Args:
+        path (PathLike | str): file to check
+
+    Returns:
+        bool: the file is gzip, xz or bzip2 compressed
+    """
+    with open(path, "rb") as file:
+        return detect_compression(file.read(_MAGIC_LEN)) is not None
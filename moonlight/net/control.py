@@ -39,6 +39,23 @@ class ControlMessage(Message):
     def _session_offer_serde_field(self) -> dict:
         return {"value": self.session_id, "format": "int"}
 
+    def _content(self) -> bytes:
+        raise NotImplementedError
+
+    def to_bytes(self) -> bytes:
+        """
+        to_bytes encodes the message into a KI frame. The inverse of
+            `ControlProtocol.decode_packet`.
+
+        Returns:
+            bytes: KI frame
+        """
+        content = self._content()
+        header = KIHeader.for_content(
+            content, is_control=True, control_opcode=self.OPCODE
+        )
+        return header.to_bytes() + content
+
 
 @dataclass(init=True, repr=True, kw_only=True)
 class SessionOfferMessage(ControlMessage):
@@ -73,6 +90,20 @@ class SessionOfferMessage(ControlMessage):
             },
         }
 
+    def _content(self) -> bytes:
+        # the timestamp follows a zeroed word, see `_unpack_weirdo_timestamp`
+        return (
+            struct.pack(
+                "<HIIII",
+                self.session_id,
+                0,
+                self.unix_timestamp_seconds,
+                self.unix_timestamp_millis_into_second,
+                len(self.signed_msg),
+            )
+            + self.signed_msg
+        )
+
     @classmethod
     def from_bytes(
         cls,
@@ -141,6 +172,20 @@ class SessionAcceptMessage(ControlMessage):
             },
         }
 
+    def _content(self) -> bytes:
+        return (
+            struct.pack(
+                "<HIIIHI",
+                self.reserved_start,
+                0,
+                self.unix_timestamp_seconds,
+                self.unix_timestamp_millis_into_second,
+                self.session_id,
+                len(self.signed_msg),
+            )
+            + self.signed_msg
+        )
+
     @classmethod
     def from_bytes(
         cls,
@@ -220,6 +265,9 @@ class KeepAliveMessage(ControlMessage):
             },
         }
 
+    def _content(self) -> bytes:
+        return struct.pack("<H", self.session_id) + self.variable_timestamp
+
     @classmethod
     def from_bytes(
         cls,
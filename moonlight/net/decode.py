@@ -1,9 +1,13 @@
 from os import PathLike, listdir
+from types import ModuleType
 from os.path import isfile, join
 import logging
 
+from moonlight.util import stage
+
 from .control import ControlProtocol, ControlMessage
-from .dml import DMLMessage, DMLProtocolRegistry
+from .errors import DecodeErrorTracker
+from .dml import DMLMessage, DMLProtocol, DMLProtocolRegistry
 from .flagtool import FlagtoolMessage
 from .common import Message, KIHeader, BytestreamReader
 
@@ -22,6 +26,12 @@ class PacketReader:
         msg_def_folder: PathLike,
         typedef_path: PathLike | None = None,
         silence_decode_errors: bool = False,
+        dml_protocol: DMLProtocolRegistry | None = None,
+        error_tracker: DecodeErrorTracker | None = None,
+        generated: PathLike | str | ModuleType | None = None,
+        load_workers: int | None = None,
+        lazy_definitions: bool = False,
+        shared_definitions: dict[bytes, DMLProtocol] | None = None,
     ):
         """
         __init__
@@ -37,26 +47,67 @@ class PacketReader:
             silence_decode_errors (bool, optional): when a message cannot be
                 decoded, return None instead of raising an error.
                 Defaults to False.
+            dml_protocol (DMLProtocolRegistry | None, optional): already
+                loaded definitions to share instead of parsing `msg_def_folder`
+                again. Defaults to None.
+            error_tracker (DecodeErrorTracker | None, optional): counts
+                messages that fail to decode. Defaults to a new tracker.
+            generated (PathLike | str | ModuleType | None, optional): package
+                generated by `moonlight codegen` to load definitions from
+                instead of parsing xml. Must match `msg_def_folder` when that
+                is given. Defaults to None.
+            load_workers (int | None, optional): processes parsing
+                `msg_def_folder`, see `DMLProtocolRegistry`. Defaults to None.
+            lazy_definitions (bool, optional): parse each protocol of
+                `msg_def_folder` when a message of it is first decoded.
+                Defaults to False.
+            shared_definitions (dict[bytes, DMLProtocol] | None, optional):
+                with `lazy_definitions`, protocols shared with other readers
+                given the same dict. Identical files are parsed once.
+                Defaults to None.
+
+        Raises:
+            StaleCodegenError: `generated` doesn't match `msg_def_folder`
         """
         self.msg_def_folder = msg_def_folder
         self.silence_decode_errors = silence_decode_errors
+        self.error_tracker = (
+            error_tracker if error_tracker is not None else DecodeErrorTracker()
+        )
 
         # Load dml decoder
-        if msg_def_folder is not None:
-            dml_services = [
-                f for f in listdir(msg_def_folder) if isfile(join(msg_def_folder, f))
-            ]
+        if dml_protocol is not None:
+            self.dml_protocol = dml_protocol
+        elif generated is not None:
+            # pylint: disable=import-outside-toplevel
+            from .codegen import load_generated
+
+            self.dml_protocol = DMLProtocolRegistry.from_generated(
+                load_generated(generated, msg_def_folder)
+            )
         else:
-            dml_services = []
-        dml_services = map(lambda x: join(msg_def_folder, x), dml_services)
-        self.dml_protocol = DMLProtocolRegistry(
-            *dml_services, typedef_path=typedef_path
-        )
+            if msg_def_folder is not None:
+                dml_services = [
+                    f
+                    for f in listdir(msg_def_folder)
+                    if isfile(join(msg_def_folder, f))
+                ]
+            else:
+                dml_services = []
+            dml_services = map(lambda x: join(msg_def_folder, x), dml_services)
+            self.dml_protocol = DMLProtocolRegistry(
+                *dml_services,
+                typedef_path=typedef_path,
+                workers=load_workers,
+                lazy=lazy_definitions,
+                shared_protocols=shared_definitions,
+            )
 
         # Load control decoder
         self.control_protocol: ControlProtocol = ControlProtocol()
 
     def _handle_decode_exc(self, exc, original_bytes):
+        self.error_tracker.record(exc, original_bytes)
         if self.silence_decode_errors:
             logger.debug(
                 "An error occurred while attempting to decode a packet. Original bytes are %s",
@@ -103,7 +154,8 @@ class PacketReader:
         packets: list[ControlMessage | DMLMessage] = []
 
         try:
-            header = KIHeader.from_bytes(reader)
+            with stage("ki_header"):
+                header = KIHeader.from_bytes(reader)
             # 4 bytes remain in what we consider the header but KI doesn't
             if header.content_len < reader.bytes_remaining() + 4:
                 logger.warning(
@@ -116,9 +168,10 @@ class PacketReader:
                 # packets.extend(self.decode_packet(bites[:]))
 
             if header.content_is_control != 0:
-                return self.control_protocol.decode_packet(
-                    reader, header, original_data=bites, has_ki_header=False
-                )
+                with stage("control"):
+                    return self.control_protocol.decode_packet(
+                        reader, header, original_data=bites, has_ki_header=False
+                    )
 
             return self.dml_protocol.decode_packet(bites)
 
@@ -0,0 +1,212 @@
+"""
+Elimination of retransmitted and duplicated TCP segments
+
+Captures from lossy links contain the same TCP payload several times.
+`SegmentDeduplicator` remembers which sequence ranges of each flow have
+already been seen, within a bounded window, so repeated payloads can be
+dropped before they are decoded or written out again.
+"""
+
+from __future__ import annotations
+
+import logging
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Hashable
+
+from .pcap import TcpSegment
+
+logger = logging.getLogger(__name__)
+
+_SEQ_MOD = 1 << 32
+_SEQ_HALF = 1 << 31
+
+
+@dataclass(kw_only=True)
+class DedupeStats:
+    """Totals of what a `SegmentDeduplicator` saw and dropped"""
+
+    segments: int = 0
+    retransmissions: int = 0
+    overlaps: int = 0
+    partial_overlaps: int = 0
+    evicted_flows: int = 0
+
+    @property
+    def dropped(self) -> int:
+        """Segments that should not be processed again"""
+        return self.retransmissions + self.overlaps
+
+
+@dataclass
+class _FlowState:
+    # last absolute (unwrapped) sequence number seen, to unwrap the next one
+    last_seq: int
+    # disjoint, sorted [start, end) ranges of absolute sequence numbers seen
+    ranges: list[list[int]] = field(default_factory=list)
+    # recent exact (start, length) pairs to tell retransmissions from overlaps
+    recent: deque = field(default_factory=deque)
+    recent_set: set = field(default_factory=set)
+
+
+class SegmentDeduplicator:
+    """
+    Per-flow TCP sequence tracking. A flow is one direction of a connection.
+
+    A segment whose payload lies entirely within ranges already seen on its
+    flow is a duplicate. It is an exact retransmission if a segment with the
+    same sequence number and length was seen before, and an overlap
+    otherwise. Segments that only partially overlap carry new bytes and are
+    kept. Sequence numbers are unwrapped, so the 32 bit wraparound is
+    handled.
+
+    Memory is bounded three ways: at most `max_flows` flows are tracked
+    (least recently used first out), ranges further than `window` bytes
+    behind the newest one are forgotten, and at most `max_ranges` gaps are
+    remembered per flow.
+    """
+
+    def __init__(
+        self,
+        max_flows: int = 4096,
+        window: int = 4 * 1024 * 1024,
+        max_ranges: int = 64,
+        max_recent: int = 256,
+    ) -> None:
+        """
+        Args:
+            max_flows (int, optional): flows to track at once. Defaults to 4096.
+            window (int, optional): bytes of sequence space remembered behind
+                the newest data of a flow. Defaults to 4 MiB.
+            max_ranges (int, optional): disjoint ranges kept per flow. Older
+                ranges are dropped first. Defaults to 64.
+            max_recent (int, optional): exact segments remembered per flow to
+                classify retransmissions. Defaults to 256.
+        """
+        if max_flows < 1 or window < 1 or max_ranges < 1:
+            raise ValueError("Deduplication limits must be positive")
+        self.max_flows = max_flows
+        self.window = window
+        self.max_ranges = max_ranges
+        self.max_recent = max_recent
+        self.stats = DedupeStats()
+        self._flows: OrderedDict[Hashable, _FlowState] = OrderedDict()
+
+    def _flow(self, key: Hashable, seq: int) -> _FlowState:
+        flow = self._flows.get(key)
+        if flow is None:
+            flow = _FlowState(last_seq=seq)
+            self._flows[key] = flow
+            if len(self._flows) > self.max_flows:
+                self._flows.popitem(last=False)
+                self.stats.evicted_flows += 1
+        else:
+            self._flows.move_to_end(key)
+        return flow
+
+    @staticmethod
+    def _unwrap(flow: _FlowState, seq: int) -> int:
+        delta = (seq - flow.last_seq) % _SEQ_MOD
+        if delta >= _SEQ_HALF:
+            delta -= _SEQ_MOD
+        absolute = flow.last_seq + delta
+        flow.last_seq = absolute
+        return absolute
+
+    def is_duplicate(self, flow_key: Hashable, seq: int, length: int) -> bool:
+        """
+        is_duplicate records a segment and reports whether all of its payload
+            was already seen on the same flow
+
+        Args:
+            flow_key (Hashable): identifies one direction of a connection,
+                typically (src, dst, sport, dport)
+            seq (int): TCP sequence number of the segment
+            length (int): payload length of the segment
+
+        Returns:
+            bool: `True` if the segment should be dropped
+        """
+        if length <= 0:
+            return False
+        self.stats.segments += 1
+        flow = self._flow(flow_key, seq)
+        start = self._unwrap(flow, seq)
+        end = start + length
+
+        exact = (start, length) in flow.recent_set
+        if not exact:
+            flow.recent.append((start, length))
+            flow.recent_set.add((start, length))
+            if len(flow.recent) > self.max_recent:
+                flow.recent_set.discard(flow.recent.popleft())
+
+        covered, overlapped = self._insert(flow, start, end)
+        if covered:
+            if exact:
+                self.stats.retransmissions += 1
+            else:
+                self.stats.overlaps += 1
+            return True
+        if overlapped:
+            self.stats.partial_overlaps += 1
+        return False
+
+    def _insert(self, flow: _FlowState, start: int, end: int) -> tuple[bool, bool]:
+        """Adds [start, end) to the flow, returning (fully covered, overlapped)"""
+        ranges = flow.ranges
+        covered = False
+        overlapped = False
+        merged = [start, end]
+        keep: list[list[int]] = []
+        for r_start, r_end in ranges:
+            if r_end < merged[0] or r_start > merged[1]:
+                keep.append([r_start, r_end])
+                continue
+            if r_start < end and r_end > start:
+                overlapped = True
+                if r_start <= start and r_end >= end:
+                    covered = True
+            merged[0] = min(merged[0], r_start)
+            merged[1] = max(merged[1], r_end)
+        if covered:
+            return True, True
+
+        keep.append(merged)
+        keep.sort()
+        horizon = max(r[1] for r in keep) - self.window
+        keep = [r for r in keep if r[1] > horizon]
+        if len(keep) > self.max_ranges:
+            keep = keep[-self.max_ranges :]
+        flow.ranges = keep
+        return False, overlapped
+
+    def is_duplicate_segment(self, segment: TcpSegment) -> bool:
+        """
+        is_duplicate_segment is `is_duplicate` for a parsed `TcpSegment`
+
+        Args:
+            segment (TcpSegment): parsed segment
+
+        Returns:
+            bool: `True` if the segment should be dropped
+        """
+        return self.is_duplicate(
+            (segment.src, segment.dst, segment.sport, segment.dport),
+            segment.seq,
+            segment.payload_len,
+        )
+
+    def log_summary(self) -> None:
+        """
+        log_summary logs what was dropped so far
+        """
+        logger.info(
+            "Dropped %d duplicate TCP segments of %d (%d retransmissions, %d overlaps). "
+            "%d partially overlapping segments kept",
+            self.stats.dropped,
+            self.stats.segments,
+            self.stats.retransmissions,
+            self.stats.overlaps,
+            self.stats.partial_overlaps,
+        )
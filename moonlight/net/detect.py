@@ -0,0 +1,404 @@
+"""
+Detection of the definition revision a capture was recorded with
+
+Decoding with the wrong revision's definitions only shows as a flood of
+decode errors. `detect_revision` instead trial decodes the first DML frames
+of a capture with every candidate revision. Each candidate is scored by its
+clean decodes: the message is known, decodes without error and consumes
+exactly the length its DML header declares. Sampling stops early once one
+candidate decodes nearly every frame and several more than any other.
+
+Candidates sharing definitions through a `RevisionRegistry` decode a
+shared message once per frame rather than once per revision.
+
+`detect_capture_revision` adds a `RevisionCache`, so a capture is only
+sampled the first time it is seen, even if it is copied or renamed. Cached
+revisions are only trusted while the candidates and the content of their
+definition folders stay the same.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import struct
+from dataclasses import asdict, dataclass, field
+from os import PathLike
+from pathlib import Path
+from typing import Any, BinaryIO, Iterable, Iterator, Mapping
+
+from .codegen import definition_files, definition_hash
+from .common import PACKET_HEADER_LEN, BytestreamReader
+from .dml import DMLMessageDef, DMLProtocolRegistry
+from .scan import scan_capture
+
+logger = logging.getLogger(__name__)
+
+CLEAN = "clean"
+PARTIAL = "partial"
+FAILED = "failed"
+
+# service id, message id and message length
+_DML_HEADER = struct.Struct("<BBH")
+_FIELDS_OFFSET = PACKET_HEADER_LEN + _DML_HEADER.size
+# bytes of a capture hashed to identify it
+HASH_SAMPLE_BYTES = 1 << 20
+
+
+@dataclass
+class RevisionScore:
+    """Trial decode results of one candidate revision"""
+
+    name: str
+    frames: int = 0
+    # known, decoded without error and consumed exactly the DML length
+    clean: int = 0
+    # decoded, but consumed more or less than the DML length
+    partial: int = 0
+    # unknown message or decode error
+    failed: int = 0
+
+    @property
+    def rate(self) -> float:
+        """Share of frames decoded cleanly"""
+        return self.clean / self.frames if self.frames else 0.0
+
+    def add(self, outcome: str) -> None:
+        """
+        add counts a trial decode
+
+        Args:
+            outcome (str): `CLEAN`, `PARTIAL` or `FAILED`
+        """
+        self.frames += 1
+        setattr(self, outcome, getattr(self, outcome) + 1)
+
+
+@dataclass
+class DetectionResult:
+    """The detected revision and how it was chosen"""
+
+    # best candidate, or None if no candidate decoded any frame cleanly
+    revision: str | None
+    # every candidate, best first. Empty when taken from the cache
+    scores: list[RevisionScore] = field(default_factory=list)
+    frames: int = 0
+    # the best candidate decoded enough frames, and enough more than the
+    # runner up
+    decisive: bool = False
+    cached: bool = False
+
+    def as_dict(self) -> dict[str, Any]:
+        """
+        as_dict gets the result as json serializable values
+
+        Returns:
+            dict[str, Any]: result with each candidate's counts and rate
+        """
+        return {
+            **asdict(self),
+            "scores": [{**asdict(s), "rate": s.rate} for s in self.scores],
+        }
+
+
+def trial_decode(msg_def: DMLMessageDef, frame: bytes) -> str:
+    """
+    trial_decode checks whether a message definition fits a DML frame
+
+    Args:
+        msg_def (DMLMessageDef): definition to decode with
+        frame (bytes): KI frame holding a DML message
+
+    Returns:
+        str: `CLEAN` if the fields consume exactly the DML length, `PARTIAL`
+            if they decode but don't, `FAILED` if they don't decode
+    """
+    _, _, message_len = _DML_HEADER.unpack_from(frame, PACKET_HEADER_LEN)
+    reader = BytestreamReader(frame)
+    reader.advance(_FIELDS_OFFSET)
+    try:
+        msg_def.decode_message(reader)
+    except ValueError:
+        return FAILED
+    # the DML length counts its own header
+    if reader.buffer_position() == PACKET_HEADER_LEN + message_len:
+        return CLEAN
+    return PARTIAL
+
+
+def _message_def(
+    registry: DMLProtocolRegistry, service_id: int, message_id: int
+) -> DMLMessageDef | None:
+    try:
+        protocol = registry.protocol_map.get(service_id)
+    except ValueError:
+        # lazily loaded definitions that turn out to be invalid
+        return None
+    return protocol.message_map.get(message_id) if protocol is not None else None
+
+
+def _rank(scores: Iterable[RevisionScore]) -> list[RevisionScore]:
+    # sorted is stable, so ties keep the candidates' order
+    return sorted(scores, key=lambda s: (-s.clean, s.failed))
+
+
+def _decisive(ranked: list[RevisionScore], lead: int, min_rate: float) -> bool:
+    if not ranked or not ranked[0].clean or ranked[0].rate < min_rate:
+        return False
+    return len(ranked) == 1 or ranked[0].clean - ranked[1].clean >= lead
+
+
+def detect_revision(
+    candidates: Mapping[str, DMLProtocolRegistry],
+    frames: Iterable[bytes],
+    max_frames: int = 200,
+    min_frames: int = 20,
+    lead: int = 3,
+    min_rate: float = 0.9,
+) -> DetectionResult:
+    """
+    detect_revision trial decodes DML frames with every candidate and picks
+        the one decoding the most cleanly
+
+    Args:
+        candidates (Mapping[str, DMLProtocolRegistry]): definitions by
+            revision name, such as a `RevisionRegistry`. Ties go to the
+            earlier candidate.
+        frames (Iterable[bytes]): KI frames to sample. Control frames are
+            skipped.
+        max_frames (int, optional): most DML frames to sample. Defaults to
+            200.
+        min_frames (int, optional): DML frames to sample before stopping
+            early. Defaults to 20.
+        lead (int, optional): frames the best candidate has to decode
+            cleanly beyond the runner up for the result to be decisive.
+            Revisions usually share most messages, so only a few frames
+            tell them apart. Defaults to 3.
+        min_rate (float, optional): share of frames the best candidate has
+            to decode cleanly for the result to be decisive. Defaults to
+            0.9.
+
+    Returns:
+        DetectionResult: best candidate with every candidate's score
+    """
+    names = list(candidates)
+    scores = {name: RevisionScore(name) for name in names}
+    sampled = 0
+    for frame in frames:
+        if sampled >= max_frames:
+            break
+        if len(frame) < _FIELDS_OFFSET or frame[4]:
+            continue
+        sampled += 1
+        service_id, message_id, _ = _DML_HEADER.unpack_from(frame, PACKET_HEADER_LEN)
+        # shared definitions give the same result for every revision
+        outcomes: dict[int, str] = {}
+        for name in names:
+            msg_def = _message_def(candidates[name], service_id, message_id)
+            if msg_def is None:
+                outcome = FAILED
+            else:
+                outcome = outcomes.get(id(msg_def))
+                if outcome is None:
+                    outcome = outcomes[id(msg_def)] = trial_decode(msg_def, frame)
+            scores[name].add(outcome)
+        if sampled >= min_frames and _decisive(_rank(scores.values()), lead, min_rate):
+            logger.debug("Revision detected after %d frames", sampled)
+            break
+
+    ranked = _rank(scores.values())
+    best = ranked[0] if ranked and ranked[0].clean else None
+    return DetectionResult(
+        revision=best.name if best is not None else None,
+        scores=ranked,
+        frames=sampled,
+        decisive=_decisive(ranked, lead, min_rate),
+    )
+
+
+def sample_frames(
+    source: PathLike | str | BinaryIO, threaded_decompression: bool = False
+) -> Iterator[bytes]:
+    """
+    sample_frames reads the complete DML frames of a capture in order
+
+    Args:
+        source (PathLike | str | BinaryIO): capture, optionally compressed
+        threaded_decompression (bool, optional): decompress on a background
+            thread. Defaults to False.
+
+    Yields:
+        bytes: KI frame
+    """
+    with contextlib.closing(
+        scan_capture(source, threaded_decompression=threaded_decompression)
+    ) as frames:
+        for _, record, _, frame in frames:
+            if frame.is_control or not frame.complete:
+                continue
+            yield bytes(record.raw[frame.offset : frame.offset + frame.length])
+
+
+def capture_hash(capture_path: PathLike | str) -> str:
+    """
+    capture_hash identifies a capture by its size and first
+        `HASH_SAMPLE_BYTES` bytes, which hold its first packets
+
+    Args:
+        capture_path (PathLike | str): capture file
+
+    Returns:
+        str: sha256 hex digest
+    """
+    digest = hashlib.sha256()
+    with open(capture_path, "rb") as file:
+        digest.update(os.fstat(file.fileno()).st_size.to_bytes(8, "little"))
+        digest.update(file.read(HASH_SAMPLE_BYTES))
+    return digest.hexdigest()
+
+
+def default_cache_path() -> Path:
+    """
+    default_cache_path gets the revision cache shared by moonlight commands
+
+    Returns:
+        Path: `moonlight/revisions.json` in the user's cache directory
+    """
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "moonlight" / "revisions.json"
+
+
+def candidate_hashes(folders: Mapping[str, PathLike | None]) -> dict[str, str] | None:
+    """
+    candidate_hashes fingerprints the definitions of candidate revisions
+
+    Args:
+        folders (Mapping[str, PathLike | None]): definition folder by
+            revision name
+
+    Returns:
+        dict[str, str] | None: `definition_hash` by revision name, or None
+            if a candidate has no folder
+    """
+    hashes = {}
+    for name, folder in folders.items():
+        if folder is None:
+            return None
+        hashes[name] = definition_hash(definition_files(folder))
+    return hashes
+
+
+class RevisionCache:
+    """
+    Detected revisions by capture hash, kept as json. Each entry records the
+    candidates it was detected among, see `candidate_hashes`.
+    """
+
+    def __init__(self, path: PathLike | str) -> None:
+        """
+        Args:
+            path (PathLike | str): cache file. Created on the first `put`.
+        """
+        self.path = Path(path)
+        self.entries: dict[str, dict[str, Any]] = {}
+        try:
+            with open(self.path, encoding="utf8") as file:
+                self.entries = json.load(file).get("captures", {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as err:
+            logger.warning("Ignoring unreadable revision cache %s: %s", self.path, err)
+
+    def get(self, key: str, candidates: Mapping[str, str]) -> str | None:
+        """
+        get looks up the revision of a capture
+
+        Args:
+            key (str): capture hash, see `capture_hash`
+            candidates (Mapping[str, str]): definition hash by candidate
+                revision, see `candidate_hashes`
+
+        Returns:
+            str | None: revision name, or None if not cached or detected
+                among other candidates or definitions
+        """
+        entry = self.entries.get(key)
+        if entry is None or entry.get("candidates") != dict(candidates):
+            return None
+        return entry["revision"]
+
+    def put(
+        self, key: str, result: DetectionResult, candidates: Mapping[str, str]
+    ) -> None:
+        """
+        put stores a detected revision and rewrites the cache atomically
+
+        Args:
+            key (str): capture hash
+            result (DetectionResult): detection with a revision
+            candidates (Mapping[str, str]): definition hash by candidate
+                revision
+        """
+        best = result.scores[0] if result.scores else None
+        self.entries[key] = {
+            "revision": result.revision,
+            "frames": result.frames,
+            "rate": best.rate if best is not None else None,
+            "candidates": dict(candidates),
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "w", encoding="utf8") as file:
+            json.dump({"captures": self.entries}, file, indent=2)
+        os.replace(tmp, self.path)
+
+
+def detect_capture_revision(
+    candidates: Mapping[str, DMLProtocolRegistry],
+    source: PathLike | str | BinaryIO,
+    cache: RevisionCache | None = None,
+    folders: Mapping[str, PathLike | None] | None = None,
+    threaded_decompression: bool = False,
+    **kwargs: Any,
+) -> DetectionResult:
+    """
+    detect_capture_revision detects the revision of a capture, see
+        `detect_revision`. Decisive results are cached when a cache is given,
+        the capture is a file and the folder of every candidate is known.
+
+    Args:
+        candidates (Mapping[str, DMLProtocolRegistry]): definitions by
+            revision name
+        source (PathLike | str | BinaryIO): capture, optionally compressed
+        cache (RevisionCache | None, optional): cache to look up and record
+            the result in. Revisions cached for other candidates or
+            definitions are detected again. Defaults to None.
+        folders (Mapping[str, PathLike | None] | None, optional): definition
+            folder of each candidate, fingerprinted to validate the cache.
+            Defaults to None.
+        threaded_decompression (bool, optional): decompress on a background
+            thread. Defaults to False.
+        **kwargs: `detect_revision` sampling options
+
+    Returns:
+        DetectionResult: detected revision
+    """
+    key = None
+    hashes = (
+        candidate_hashes(folders) if cache is not None and folders is not None else None
+    )
+    if hashes is not None and isinstance(source, (str, PathLike)):
+        key = capture_hash(source)
+        revision = cache.get(key, hashes)
+        if revision is not None and revision in candidates:
+            return DetectionResult(revision=revision, decisive=True, cached=True)
+
+    frames = sample_frames(source, threaded_decompression=threaded_decompression)
+    with contextlib.closing(frames):
+        result = detect_revision(candidates, frames, **kwargs)
+    if key is not None and result.revision is not None and result.decisive:
+        cache.put(key, result, hashes)
+    return result
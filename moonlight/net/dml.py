@@ -4,13 +4,32 @@ Parser for DML message definitions and parsing messages based on them
 
 from __future__ import annotations
 
+import hashlib
+import io
 import logging
+import multiprocessing
+import os
+import threading
 import xml.etree.ElementTree as ET
+from collections.abc import MutableMapping
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from dataclasses import dataclass
 from os import PathLike
-from typing import Any, Dict, List, Tuple, Type, cast
+from typing import (
+    Any,
+    BinaryIO,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Tuple,
+    Type,
+    cast,
+)
 
-from moonlight.util import SerdeMixin, bytes_to_pretty_str
+from moonlight.util import SerdeMixin, bytes_to_pretty_str, stage
 from printrospector.object import DynamicObject
 from printrospector.type_cache import TypeCache
 
@@ -18,14 +37,19 @@ from .common import (
     DML_HEADER_LEN,
     PACKET_HEADER_LEN,
     BytestreamReader,
+    BytestreamWriter,
     DMLType,
     KIHeader,
     Message,
 )
+from .errors import DMLDecodeError
 from .object_property import ObjectPropertyDecoder, build_typecache
 
 SERVICE_ID_SIZE = 1
 MESSAGE_ID_SIZE = 1
+# fewest protocol files `DMLProtocolRegistry` reads in parallel by default.
+# Below this, starting worker processes costs more than it saves
+PARALLEL_LOAD_MIN_FILES = 8
 
 logger = logging.getLogger(__name__)
 
@@ -139,7 +163,8 @@ class FieldDef(SerdeMixin):
         if not isinstance(field.value, bytes):
             raise AttributeError("Field value is not stored as bytes")
 
-        return self.po_decoder.deserialize(field.value)
+        with stage("property_object"):
+            return self.po_decoder.deserialize(field.value)
 
     # TODO: python 11, change to typing.Self
     @classmethod
@@ -330,6 +355,15 @@ class DMLMessage(Message):
         """
         return self.definition.protocol
 
+    def to_bytes(self) -> bytes:
+        """
+        to_bytes encodes the message's field values back into a KI frame
+
+        Returns:
+            bytes: KI frame
+        """
+        return self.definition.encode_packet({f.name(): f.value for f in self.fields})
+
     def get_val(self, field_name: str) -> Any:
         """
         get_val returns the value stored in a given field name
@@ -388,6 +422,36 @@ class DMLMessage(Message):
         }
 
 
+@dataclass
+class DMLMessageSpec:
+    """
+    Plain data read from a message definition. Specs can be pickled, so
+    definitions can be read in other processes, see `DMLProtocolRegistry`.
+    """
+
+    name: str
+    order_id: int | None
+    desc: str | None
+    handler: str | None
+    # name, `DMLType` name and noxfer of each field. Type names pickle
+    # several times faster than the members. The type name is None for
+    # types moonlight doesn't know
+    fields: list[tuple[str, str | None, bool]]
+
+
+@dataclass
+class DMLProtocolSpec:
+    """Plain data read from a protocol definition file"""
+
+    id: int  # pylint: disable=invalid-name
+    type: str
+    version: int
+    desc: str
+    messages: list[DMLMessageSpec]
+    # names of messages defined more than once. Only the first is kept
+    duplicates: list[str]
+
+
 class DMLMessageDef:
     """Defines a DML interface message and its structure.
     Provides a deserializer for the represented message."""
@@ -405,20 +469,32 @@ class DMLMessageDef:
             order (int): id/order number
             xml_def (Element): XML Element to load (parent of RECORD)
         """
+        self._load_spec(protocol, self.read_xml(xml_def, order_id))
 
-        # The assigned id (order) to the message
-        self.order_id = order_id
-        # Parent protocol
-        self.protocol = protocol
+    @staticmethod
+    def read_xml(xml_def: ET.Element, order_id: int | None = None) -> DMLMessageSpec:
+        """
+        read_xml reads a message definition without building it
+
+        Args:
+            xml_def (Element): XML Element to load (parent of RECORD)
+            order_id (int | None, optional): id to use when the definition
+                has no `_MsgOrder`. Defaults to None.
+
+        Raises:
+            ValueError: the definition has no `RECORD`
+
+        Returns:
+            DMLMessageSpec: the definition's metadata and fields
+        """
         # that _MsgName field? It's often wrong.
         # #KI_Problems
-        self.name = xml_def.tag
-        self.fields: List[FieldDef] = []
+        name = xml_def.tag
 
         # only one child ever exists, the record tag
         xml_record = xml_def.find("RECORD")
         if xml_record is None:
-            raise ValueError("Missing `RECORD` in msg def `{self.name}`")
+            raise ValueError(f"Missing `RECORD` in msg def `{name}`")
 
 
         ### Metadata fields ###
@@ -427,11 +503,11 @@ class DMLMessageDef:
 
         xml_desc = xml_record.find("_MsgDescription")
         if xml_desc is None:
-            logger.debug(f"Missing `_MsgDescription` on msg def `{self.name}`")
+            logger.debug(f"Missing `_MsgDescription` on msg def `{name}`")
 
         xml_handler = xml_record.find("_MsgHandler")
         if xml_handler is None:
-            logger.debug(f"Missing `_MsgHandler` on msg def `{self.name}")
+            logger.debug(f"Missing `_MsgHandler` on msg def `{name}")
 
         xml_order_id = xml_record.find("_MsgOrder")
         # Fallthrough: defaults to init parameter
@@ -439,22 +515,17 @@ class DMLMessageDef:
             if xml_order_id.text.isdigit():
                 order_id = int(xml_order_id.text)
             else:
-                logger.warning(f"Nonnumeric `_MsgOrder` on msg `{self.name}`")
-        
-
-        self.desc = xml_desc.text if xml_desc is not None else None
-        self.handler = xml_handler.text if xml_handler is not None else None
-        self.order_id = order_id
+                logger.warning(f"Nonnumeric `_MsgOrder` on msg `{name}`")
 
 
         ### Message fields ###
 
+        fields = []
         for xml_field in xml_record:
             # Ignore metadata tags except `name` because it's used in the
             # field definition constructor
             if xml_field.tag.startswith("_"):
                 continue
-            field_map: dict[str, Any] = {"name": xml_field.tag}
             # Game likely doesn't actually read this field
             dirty_type = xml_field.attrib.get("TYPE")
             dirty_type = dirty_type or xml_field.attrib.get("TYP")
@@ -469,27 +540,99 @@ class DMLMessageDef:
                     "current files, assuming it's the GlobalID missing the GID type"
                 )
                 # safety check in case this ever expands
-                assert field_map["name"] == "GlobalID"
-                field_map["dml_type"] = DMLType.GID
+                assert xml_field.tag == "GlobalID"
+                dml_type = DMLType.GID
             elif dirty_type == "UBYTE":
                 # Again, probably not read by the game or gross code fixes
-                field_map["dml_type"] = DMLType.UBYT
+                dml_type = DMLType.UBYT
             else:
-                field_map["dml_type"] = DMLType.from_str(dirty_type)
-
-            # FIXME: Proper handling of property object loading
-            field_map["property_object_flags"] = None
-            field_map["property_object_mask"] = None
-            field_map["property_object_exhaustive"] = None
-            # field_map["property_object_flags"] = DMLType.from_str(
-            #     xml_field.attrib.get("PO_FLAGS")
-            # )
-            # field_map["property_object_mask"] = xml_field.attrib.get("PO_MASK")
-            # field_map["property_object_exhaustive"] = xml_field.attrib.get(
-            #     "PO_EXHAUSTIVE"
-            # )
-            field_map["noxfer"] = xml_field.attrib.get("NOXFER") == "TRUE"
-            self.fields.append(FieldDef(**field_map))
+                dml_type = DMLType.from_str(dirty_type)
+            fields.append(
+                (
+                    xml_field.tag,
+                    dml_type.name if dml_type is not None else None,
+                    xml_field.attrib.get("NOXFER") == "TRUE",
+                )
+            )
+
+        return DMLMessageSpec(
+            name=name,
+            order_id=order_id,
+            desc=xml_desc.text if xml_desc is not None else None,
+            handler=xml_handler.text if xml_handler is not None else None,
+            fields=fields,
+        )
+
+    @classmethod
+    def from_spec(cls, protocol: DMLProtocol, spec: DMLMessageSpec) -> DMLMessageDef:
+        """
+        from_spec builds a definition from one read by `read_xml`
+
+        Args:
+            protocol (DMLProtocol): parent protocol
+            spec (DMLMessageSpec): the definition's metadata and fields
+
+        Returns:
+            DMLMessageDef: definition of the message
+        """
+        msg_def = cls.__new__(cls)
+        msg_def._load_spec(protocol, spec)  # pylint: disable=protected-access
+        return msg_def
+
+    def _load_spec(self, protocol: DMLProtocol, spec: DMLMessageSpec) -> None:
+        # The assigned id (order) to the message
+        self.order_id = spec.order_id
+        # Parent protocol
+        self.protocol = protocol
+        self.name = spec.name
+        self.desc = spec.desc
+        self.handler = spec.handler
+        # generated class decoding this message, see `moonlight.net.codegen`
+        self.compiled: Any = None
+        # FIXME: Proper handling of property object loading
+        # property_object_flags = DMLType.from_str(xml_field.attrib.get("PO_FLAGS"))
+        # property_object_mask = xml_field.attrib.get("PO_MASK")
+        # property_object_exhaustive = xml_field.attrib.get("PO_EXHAUSTIVE")
+        self.fields: List[FieldDef] = [
+            FieldDef(
+                name=name,
+                dml_type=DMLType[dml_type] if dml_type is not None else None,
+                property_object_flags=None,
+                property_object_mask=None,
+                property_object_exhaustive=None,
+                noxfer=noxfer,
+            )
+            for name, dml_type, noxfer in spec.fields
+        ]
+
+    @classmethod
+    def from_generated(cls, protocol: DMLProtocol, generated: Any) -> DMLMessageDef:
+        """
+        from_generated recreates a definition from a class generated by
+            `moonlight codegen`. The definition decodes with that class.
+
+        Args:
+            protocol (DMLProtocol): parent protocol
+            generated (Any): generated message class
+
+        Returns:
+            DMLMessageDef: definition of the message
+        """
+        msg_def = cls.from_spec(
+            protocol,
+            DMLMessageSpec(
+                name=generated.NAME,
+                order_id=generated.MESSAGE_ID,
+                desc=generated.DESCRIPTION,
+                handler=generated.HANDLER,
+                fields=[
+                    (name, dml_type, noxfer)
+                    for name, _, dml_type, noxfer in generated.FIELDS
+                ],
+            ),
+        )
+        msg_def.compiled = generated
+        return msg_def
 
     def get_field(self, name: str) -> FieldDef | None:  # sourcery skip: use-next
         """Finds and returns the field container matching the given name
@@ -551,10 +694,22 @@ class DMLMessageDef:
         elif has_dml_header:
             reader.advance(DML_HEADER_LEN)
 
-        decoded_fields = [
-            Field(field_def=field_def, value=reader.read(field_def.dml_type))
-            for field_def in self.fields
-        ]
+        if self.compiled is not None:
+            buffer = reader.stream.getbuffer()
+            try:
+                values, end = self.compiled.unpack(buffer, reader.buffer_position())
+            finally:
+                buffer.release()
+            reader.stream.seek(end)
+            decoded_fields = [
+                Field(field_def=field_def, value=value)
+                for field_def, value in zip(self.fields, values)
+            ]
+        else:
+            decoded_fields = [
+                Field(field_def=field_def, value=reader.read(field_def.dml_type))
+                for field_def in self.fields
+            ]
 
         return DMLMessage(
             fields=decoded_fields,
@@ -563,6 +718,60 @@ class DMLMessageDef:
             order_id=self.order_id or -1,
         )
 
+    def encode_message(self, values: Mapping[str, Any]) -> bytes:
+        """
+        encode_message packs field values into a message payload. The
+        inverse of `decode_message` without headers.
+
+        Args:
+            values (Mapping[str, Any]): value of every field by field name,
+                as decoding would produce them
+
+        Raises:
+            ValueError: a field is missing or its value doesn't fit its type
+
+        Returns:
+            bytes: message payload
+        """
+        writer = BytestreamWriter()
+        for field_def in self.fields:
+            if field_def.name not in values:
+                raise ValueError(f"Missing field `{field_def.name}` of `{self.name}`")
+            writer.write(field_def.dml_type, values[field_def.name])
+        return writer.getvalue()
+
+    def encode_packet(self, values: Mapping[str, Any]) -> bytes:
+        """
+        encode_packet packs field values into a complete KI frame, ready
+        to be decoded by `DMLProtocolRegistry.decode_packet`
+
+        Args:
+            values (Mapping[str, Any]): value of every field by field name
+
+        Raises:
+            ValueError: a field is missing or its value doesn't fit its type,
+                or the message has no service or order id
+
+        Returns:
+            bytes: KI frame
+        """
+        if self.protocol is None or self.protocol.id is None or self.order_id is None:
+            raise ValueError(f"`{self.name}` has no service or message id to encode")
+        payload = self.encode_message(values)
+        # the DML length counts the ids and itself
+        message_len = SERVICE_ID_SIZE + MESSAGE_ID_SIZE + 2 + len(payload)
+        if message_len > 0xFFFF:
+            raise ValueError(
+                f"`{self.name}` is too long to encode: {message_len} bytes"
+            )
+        writer = BytestreamWriter()
+        writer.write(DMLType.UBYT, self.protocol.id)
+        writer.write(DMLType.UBYT, self.order_id)
+        writer.write(DMLType.USHRT, message_len)
+        writer.write_raw(payload)
+        content = writer.getvalue()
+        return KIHeader.for_content(content).to_bytes() + content
+
     def __str__(self) -> str:
         return f"{self.order_id}: {self.name}"
 
@@ -611,42 +820,103 @@ class DMLProtocol:
     protocol
     """
 
-    def parse_dml_file(self, filename: PathLike) -> None:
-        """Loads the protocol according to the given xml
+    @staticmethod
+    def read_dml_file(filename: PathLike | BinaryIO) -> DMLProtocolSpec:
+        """
+        read_dml_file reads a protocol file without building its
+            definitions. This is the expensive part of loading a protocol,
+            and it can run in another process.
 
         Args:
-            filename (str): [Protocol to load]
-        """
+            filename (PathLike | BinaryIO): protocol file or its open stream
+
+        Raises:
+            ValueError: a message definition is invalid
 
+        Returns:
+            DMLProtocolSpec: the protocol's metadata and messages
+        """
         tree = ET.parse(filename)
         root = tree.getroot()
-        message_defs: List[DMLMessageDef] = []
 
-        # store protocol block as our own instance vars, not as a block
         metadata_block = root.find("_ProtocolInfo/RECORD")
-        self.id = int(metadata_block.find("ServiceID").text)
-        self.type = metadata_block.find("ProtocolType").text
-        self.version = int(metadata_block.find("ProtocolVersion").text)
-        self.desc = metadata_block.find("ProtocolDescription").text
-
+        messages: List[DMLMessageSpec] = []
+        duplicates: List[str] = []
         known_names = set()
         for block in list(root):
             if block.tag == "_ProtocolInfo":
                 continue
             # KI has a habit of just pasting messages in more than once...
             if block.tag in known_names:
-                logger.warning(
-                    "Duplicate message definition '%s' found within protocol %d",
-                    block.tag,
-                    self.id,
-                )
+                duplicates.append(block.tag)
                 continue
-            message_defs.append(DMLMessageDef(protocol=self, xml_def=block))
+            messages.append(DMLMessageDef.read_xml(block))
             known_names.add(block.tag)
 
+        return DMLProtocolSpec(
+            id=int(metadata_block.find("ServiceID").text),
+            type=metadata_block.find("ProtocolType").text,
+            version=int(metadata_block.find("ProtocolVersion").text),
+            desc=metadata_block.find("ProtocolDescription").text,
+            messages=messages,
+            duplicates=duplicates,
+        )
+
+    @staticmethod
+    def read_service_id(filename: PathLike) -> int:
+        """
+        read_service_id reads only the service id of a protocol file. Stops
+            parsing at the id, which comes before the messages.
+
+        Args:
+            filename (PathLike): protocol file
+
+        Raises:
+            ValueError: the file has no service id
+
+        Returns:
+            int: service id
+        """
+        in_info = False
+        with open(filename, "rb") as file:
+            for event, elem in ET.iterparse(file, events=("start", "end")):
+                if elem.tag == "_ProtocolInfo":
+                    in_info = event == "start"
+                elif in_info and event == "end" and elem.tag == "ServiceID":
+                    return int(elem.text)
+        raise ValueError(f"No ServiceID in protocol file {filename}")
+
+    def load_spec(self, spec: DMLProtocolSpec) -> None:
+        """
+        load_spec builds the protocol from a file read by `read_dml_file`
+
+        Args:
+            spec (DMLProtocolSpec): the protocol's metadata and messages
+        """
+        # store protocol block as our own instance vars, not as a block
+        self.id = spec.id
+        self.type = spec.type
+        self.version = spec.version
+        self.desc = spec.desc
+        for name in spec.duplicates:
+            logger.warning(
+                "Duplicate message definition '%s' found within protocol %d",
+                name,
+                self.id,
+            )
+        message_defs = [DMLMessageDef.from_spec(self, msg) for msg in spec.messages]
+
         # sort the message blocks and assign their record id
         self.message_map = DMLMessageDef.list_to_id_map(message_defs)
 
+    def parse_dml_file(self, filename: PathLike) -> None:
+        """Loads the protocol according to the given xml
+
+        Args:
+            filename (str): [Protocol to load]
+        """
+        self.load_spec(self.read_dml_file(filename))
+
     def __init__(self, filename: PathLike | None = None) -> None:
         """
         __init__
@@ -680,11 +950,22 @@ class DMLProtocol:
             has_service_id (bool, optional): [description]. Defaults to False.
 
         Raises:
-            ValueError: [description] # TODO: complete and add some kind of doc linter
+            DMLDecodeError: the message id isn't defined or the payload
+                doesn't match its definition. Failures are left to the caller
+                to count, see `moonlight.net.errors.DecodeErrorTracker`
 
         Returns:
             [type]: [description]
         """
+        with stage("dml"):
+            return self._decode_bytes(bites, original_bites, has_protocol_id)
+
+    def _decode_bytes(
+        self,
+        bites: BytestreamReader,
+        original_bites: bytes | None,
+        has_protocol_id: bool,
+    ):
         # sanity check
         if has_protocol_id:
             service_id = bites.read(DMLType.UBYT)
@@ -693,44 +974,237 @@ class DMLProtocol:
 
         message_id: int = bites.read(DMLType.UBYT)
         message_len: int = bites.read(DMLType.USHRT)
+        msg_def = self.message_map.get(message_id)
+        if msg_def is None:
+            raise DMLDecodeError(
+                f"unknown message {message_id} of dml protocol {self.id}",
+                self.id,
+                message_id,
+            )
         try:
-            dml_object: DMLMessage = self.message_map[message_id].decode_message(
+            dml_object: DMLMessage = msg_def.decode_message(
                 bites, packet_bytes=original_bites
             )
         except ValueError as err:
-            logger.error(
-                'Failed to decode message. err: "%s", protocol_id: %d, msg_id: %d, packet_data: %s',
-                err,
-                self.id,
-                message_id,
-                original_bites,
-            )
-            return None
+            raise DMLDecodeError(
+                f"failed to decode {msg_def.name}: {err}", self.id, message_id
+            ) from err
         if dml_object is not None:
             dml_object.protocol_id = self.id
             dml_object.protocol_desc = self.desc
         return dml_object
 
 
+def _pool_context() -> multiprocessing.context.BaseContext:
+    """
+    Start method for definition readers: fork is the cheapest, but forking
+    while other threads run (e.g. the metrics reporter) can copy a held lock
+    into the child, so those processes use forkserver or spawn
+    """
+    methods = multiprocessing.get_all_start_methods()
+    if "fork" in methods and threading.active_count() == 1:
+        return multiprocessing.get_context("fork")
+    if "forkserver" in methods:
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+def _read_protocol_files(
+    files: list[PathLike], workers: int | None
+) -> Iterable[DMLProtocolSpec]:
+    """Reads protocol files in file order, in worker processes if worthwhile"""
+    if workers is None:
+        workers = (os.cpu_count() or 1) if len(files) >= PARALLEL_LOAD_MIN_FILES else 1
+    workers = min(workers, len(files))
+    # daemonic processes, such as multiprocessing pool workers, can't fork
+    if workers <= 1 or multiprocessing.current_process().daemon:
+        return map(DMLProtocol.read_dml_file, files)
+
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=_pool_context()
+        ) as pool:
+            return list(pool.map(DMLProtocol.read_dml_file, files))
+    except (OSError, BrokenProcessPool) as err:
+        logger.debug("Reading definitions in this process, workers failed: %s", err)
+        return map(DMLProtocol.read_dml_file, files)
+
+
+class LazyProtocolMap(MutableMapping):
+    """
+    Protocols by service id that are parsed the first time they are looked
+    up. Checking for a service and listing service ids don't parse anything,
+    iterating values or items parses every protocol. Thread safe.
+
+    Maps given the same `shared` dict parse byte-identical files once and
+    share the protocol, e.g. the unchanged services of several revisions.
+    """
+
+    def __init__(
+        self,
+        paths: Mapping[int, PathLike],
+        shared: dict[bytes, DMLProtocol] | None = None,
+    ) -> None:
+        """
+        Args:
+            paths (Mapping[int, PathLike]): protocol file of each service id
+            shared (dict[bytes, DMLProtocol] | None, optional): protocols by
+                digest of their file, shared with other maps. Defaults to
+                None.
+        """
+        # service id -> protocol file, replaced by the protocol once loaded
+        self._entries: dict[int, DMLProtocol | PathLike] = dict(paths)
+        self._shared = shared
+        self._lock = threading.Lock()
+
+    def _parse(self, path: PathLike) -> DMLProtocol:
+        if self._shared is None:
+            return DMLProtocol(path)
+        with open(path, "rb") as file:
+            content = file.read()
+        digest = hashlib.sha256(content).digest()
+        protocol = self._shared.get(digest)
+        if protocol is None:
+            protocol = DMLProtocol()
+            protocol.load_spec(DMLProtocol.read_dml_file(io.BytesIO(content)))
+            protocol = self._shared.setdefault(digest, protocol)
+        return protocol
+
+    def _load(self, service_id: int) -> DMLProtocol:
+        with self._lock:
+            entry = self._entries[service_id]
+            if isinstance(entry, DMLProtocol):
+                return entry
+            try:
+                protocol = self._parse(entry)
+            except ValueError as err:
+                raise ValueError("Failed to load dml protocol definition") from err
+            logger.debug(
+                "loaded protocol %d on first use: %s", protocol.id, protocol.desc
+            )
+            self._entries[service_id] = protocol
+            return protocol
+
+    def __getitem__(self, service_id: int) -> DMLProtocol:
+        entry = self._entries[service_id]
+        if isinstance(entry, DMLProtocol):
+            return entry
+        return self._load(service_id)
+
+    def __contains__(self, service_id: object) -> bool:
+        return service_id in self._entries
+
+    def __setitem__(self, service_id: int, protocol: DMLProtocol) -> None:
+        self._entries[service_id] = protocol
+
+    def __delitem__(self, service_id: int) -> None:
+        del self._entries[service_id]
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._entries)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def loaded(self) -> list[int]:
+        """
+        loaded lists the services parsed so far
+
+        Returns:
+            list[int]: service ids
+        """
+        return [k for k, v in self._entries.items() if isinstance(v, DMLProtocol)]
+
+
 class DMLProtocolRegistry:
     """
     A collection of dml protocols sharing a typedef
     """
 
-    def __init__(self, *protocol_files, typedef_path: PathLike | None = None) -> None:
-        self.protocol_map: Dict[int, DMLProtocol] = {}
+    def __init__(
+        self,
+        *protocol_files,
+        typedef_path: PathLike | None = None,
+        workers: int | None = None,
+        lazy: bool = False,
+        shared_protocols: dict[bytes, DMLProtocol] | None = None,
+    ) -> None:
+        """
+        __init__
+
+        Args:
+            *protocol_files (PathLike): protocol definition files to load.
+                A service defined in several files is taken from the last.
+            typedef_path (PathLike | None, optional): wizwalker typedefs.
+                Defaults to None.
+            workers (int | None, optional): processes reading the files.
+                Files are read in this process when 1. `None` uses a process
+                per core when there are at least `PARALLEL_LOAD_MIN_FILES`
+                files. Defaults to None.
+            lazy (bool, optional): only read the service id of each file
+                now and parse a protocol when it is first used, see
+                `LazyProtocolMap`. Saves time and memory when only a few
+                services are decoded. Defaults to False.
+            shared_protocols (dict[bytes, DMLProtocol] | None, optional):
+                with `lazy`, protocols shared with other registries given the
+                same dict, see `LazyProtocolMap`. Defaults to None.
+
+        Raises:
+            ValueError: a protocol file is invalid. With `lazy`, only missing
+                service ids are found up front and other problems raise when
+                the protocol is first used.
+        """
+        self.protocol_map: MutableMapping[int, DMLProtocol] = {}
         self.typedef_path = typedef_path
         self.typedef_cache: TypeCache = None
 
-        for file in protocol_files:
-            try:
-                self.load_service(file)
-            except ValueError as err:
-                raise ValueError("Failed to load dml protocol definition") from err
+        try:
+            if lazy:
+                self.protocol_map = LazyProtocolMap(
+                    {
+                        DMLProtocol.read_service_id(file): file
+                        for file in protocol_files
+                    },
+                    shared=shared_protocols,
+                )
+            else:
+                for spec in _read_protocol_files(list(protocol_files), workers):
+                    protocol = DMLProtocol()
+                    protocol.load_spec(spec)
+                    self._add_protocol(protocol)
+        except ValueError as err:
+            raise ValueError("Failed to load dml protocol definition") from err
 
         if typedef_path:
             raise NotImplementedError
 
+    @classmethod
+    def from_generated(cls, package: Any) -> DMLProtocolRegistry:
+        """
+        from_generated builds a registry from a package generated by
+            `moonlight codegen` instead of parsing xml. Messages decode with
+            the generated code. See `moonlight.net.codegen.load_generated`.
+
+        Args:
+            package (module): generated package
+
+        Returns:
+            DMLProtocolRegistry: registry of the generated definitions
+        """
+        registry = cls()
+        for service_id, (type_, version, desc, module) in package.SERVICES.items():
+            protocol = DMLProtocol()
+            protocol.id = service_id
+            protocol.type = type_
+            protocol.version = version
+            protocol.desc = desc
+            protocol.message_map = {
+                msg_id: DMLMessageDef.from_generated(protocol, generated)
+                for msg_id, generated in module.MESSAGES.items()
+            }
+            registry.protocol_map[service_id] = protocol
+        return registry
+
     def load_service(self, protocol_file: PathLike):
         """
         load_service adds another protocol to the registry, automatically
@@ -739,10 +1213,13 @@ class DMLProtocolRegistry:
         Args:
             protocol_file (PathLike): path to protocol file to load
         """
-        protocol = DMLProtocol(protocol_file)
+        self._add_protocol(DMLProtocol(protocol_file))
+
+    def _add_protocol(self, protocol: DMLProtocol) -> None:
         logger.debug("loaded protocol %d: %s", protocol.id, protocol.desc)
-        for msg in protocol.message_map.values():
-            logger.debug("\t%s", repr(msg))
+        if logger.isEnabledFor(logging.DEBUG):
+            for msg in protocol.message_map.values():
+                logger.debug("\t%r", msg)
         self.protocol_map[protocol.id] = protocol
 
     def get_by_id(self, id_: int) -> DMLProtocol:
@@ -0,0 +1,225 @@
+"""
+Accounting of messages that fail to decode
+
+A capture recorded against mismatched definitions can fail on nearly every
+message, and logging each failure with its payload then costs more than
+decoding. `DecodeErrorTracker` counts failures instead, grouped by
+service, message id and error class. It keeps a few sample payloads per
+group and logs a summary at most once per interval.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+from moonlight.util import bytes_to_pretty_str
+
+from .common import PACKET_HEADER_LEN
+
+logger = logging.getLogger(__name__)
+
+
+class DMLDecodeError(ValueError):
+    """A DML message of a known service couldn't be decoded"""
+
+    def __init__(self, message: str, service_id: int, message_id: int) -> None:
+        super().__init__(message)
+        self.service_id = service_id
+        self.message_id = message_id
+
+
+@dataclass(frozen=True)
+class ErrorBucket:
+    """What failed: the message, as far as it's known, and the error class"""
+
+    service_id: int | None
+    message_id: int | None
+    error: str
+    control: bool = False
+
+    def __str__(self) -> str:
+        if self.control:
+            what = f"control opcode {self.message_id}"
+        elif self.service_id is None:
+            what = "unknown message"
+        else:
+            what = f"{self.service_id}:{self.message_id}"
+        return f"{what} {self.error}"
+
+
+@dataclass
+class _BucketState:
+    count: int = 0
+    first_error: str = ""
+    samples: list[bytes] = field(default_factory=list)
+
+
+def _root_cause(exc: BaseException) -> BaseException:
+    seen = set()
+    while exc.__cause__ is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        exc = exc.__cause__
+    return exc
+
+
+def classify(exc: BaseException, payload: bytes | None) -> ErrorBucket:
+    """
+    classify finds the bucket of a decode failure. Ids come from the error
+        when it carries them and are read from the payload's headers
+        otherwise.
+
+    Args:
+        exc (BaseException): the error raised while decoding
+        payload (bytes | None): the KI frame that failed
+
+    Returns:
+        ErrorBucket: bucket of the failure
+    """
+    cause = _root_cause(exc)
+    error = type(cause).__name__
+    for err in (exc, cause):
+        if isinstance(err, DMLDecodeError):
+            return ErrorBucket(err.service_id, err.message_id, error)
+    if isinstance(payload, (bytes, bytearray)) and payload[:2] == b"\x0D\xF0":
+        if len(payload) > 5 and payload[4]:
+            return ErrorBucket(None, payload[5], error, control=True)
+        if len(payload) > PACKET_HEADER_LEN + 1:
+            return ErrorBucket(
+                payload[PACKET_HEADER_LEN], payload[PACKET_HEADER_LEN + 1], error
+            )
+    return ErrorBucket(None, None, error)
+
+
+class DecodeErrorTracker:
+    """
+    Thread safe counts of decode failures with bounded samples
+    """
+
+    def __init__(
+        self,
+        samples_per_bucket: int = 3,
+        max_sample_bytes: int = 256,
+        max_buckets: int = 1000,
+        log_interval: float | None = 30.0,
+    ) -> None:
+        """
+        Args:
+            samples_per_bucket (int, optional): payloads kept per bucket.
+                Defaults to 3.
+            max_sample_bytes (int, optional): kept samples are cut to this
+                length. Defaults to 256.
+            max_buckets (int, optional): buckets tracked before new kinds
+                of failures are only counted in the total. Defaults to 1000.
+            log_interval (float | None, optional): least seconds between
+                logged summaries. The first failure is logged right away.
+                `None` disables logging. Defaults to 30.0.
+        """
+        self.samples_per_bucket = samples_per_bucket
+        self.max_sample_bytes = max_sample_bytes
+        self.max_buckets = max_buckets
+        self.log_interval = log_interval
+        self.total = 0
+        self.untracked = 0
+        self._buckets: dict[ErrorBucket, _BucketState] = {}
+        self._logged_total = 0
+        self._last_log: float | None = None
+        self._lock = threading.Lock()
+
+    def record(self, exc: BaseException, payload: bytes | None = None) -> ErrorBucket:
+        """
+        record counts a decode failure
+
+        Args:
+            exc (BaseException): the error raised while decoding
+            payload (bytes | None, optional): the KI frame that failed.
+                Defaults to None.
+
+        Returns:
+            ErrorBucket: bucket the failure was counted in
+        """
+        bucket = classify(exc, payload)
+        with self._lock:
+            self.total += 1
+            state = self._buckets.get(bucket)
+            if state is None:
+                if len(self._buckets) >= self.max_buckets:
+                    self.untracked += 1
+                    state = None
+                else:
+                    state = self._buckets[bucket] = _BucketState(first_error=str(exc))
+            if state is not None:
+                state.count += 1
+                if payload is not None and len(state.samples) < self.samples_per_bucket:
+                    state.samples.append(bytes(payload[: self.max_sample_bytes]))
+            now = time.monotonic()
+            due = self.log_interval is not None and (
+                self._last_log is None or now - self._last_log >= self.log_interval
+            )
+            if due:
+                self._last_log = now
+        if due:
+            self.log_summary()
+        return bucket
+
+    def buckets(self) -> list[tuple[ErrorBucket, int]]:
+        """
+        buckets gets the failure counts, most frequent first
+
+        Returns:
+            list[tuple[ErrorBucket, int]]: bucket and count
+        """
+        with self._lock:
+            counts = [(bucket, state.count) for bucket, state in self._buckets.items()]
+        return sorted(counts, key=lambda item: -item[1])
+
+    def log_summary(self, top: int = 5) -> None:
+        """
+        log_summary logs the totals and most frequent failures
+
+        Args:
+            top (int, optional): buckets to name. Defaults to 5.
+        """
+        with self._lock:
+            new = self.total - self._logged_total
+            self._logged_total = self.total
+        if not self.total:
+            return
+        buckets = self.buckets()
+        logger.warning(
+            "%d messages failed to decode (%d new) in %d kinds: %s%s",
+            self.total,
+            new,
+            len(buckets),
+            ", ".join(f"{bucket} x{count}" for bucket, count in buckets[:top]),
+            ", ..." if len(buckets) > top else "",
+        )
+
+    def summary(self) -> dict[str, Any]:
+        """
+        summary gets the totals with every bucket and its samples
+
+        Returns:
+            dict[str, Any]: json serializable totals
+        """
+        with self._lock:
+            items = sorted(self._buckets.items(), key=lambda item: -item[1].count)
+            return {
+                "total": self.total,
+                "untracked": self.untracked,
+                "buckets": [
+                    {
+                        "service_id": bucket.service_id,
+                        "message_id": bucket.message_id,
+                        "control": bucket.control,
+                        "error": bucket.error,
+                        "count": state.count,
+                        "first_error": state.first_error,
+                        "samples": [bytes_to_pretty_str(s) for s in state.samples],
+                    }
+                    for bucket, state in items
+                ],
+            }
@@ -0,0 +1,297 @@
+"""
+Definition-free filtering and sanitization of packet captures
+
+Filtering only needs to know whether a packet carries KI traffic, which is
+decided from the link/IP/TCP headers and the first bytes of the payload.
+Matching records are copied byte-for-byte from input to output without
+dissecting or rebuilding them, so no message definitions or scapy are needed.
+"""
+
+from __future__ import annotations
+
+import gzip
+import logging
+import struct
+from dataclasses import dataclass
+from os import PathLike
+from typing import TYPE_CHECKING, BinaryIO
+
+from .common import PACKET_HEADER_LEN, MessageSender
+from .control import SessionAcceptMessage, SessionOfferMessage
+from .pcap import CaptureFileReader, TcpSegment, fix_tcp_checksum, parse_tcp
+
+if TYPE_CHECKING:
+    from .dedupe import SegmentDeduplicator
+    from .redact import Redactor
+
+logger = logging.getLogger(__name__)
+
+KI_MAGIC = b"\x0D\xF0"
+_U32_LE = struct.Struct("<I")
+
+# Offset of the weirdo timestamp within control frames that carry a signed
+# message. See the sizing charts in `moonlight.net.scapy.sanitize_signed_msg`.
+_SIGNED_MSG_TIMESTAMP_OFFSET = {
+    SessionOfferMessage.OPCODE: PACKET_HEADER_LEN + 2,  # after session_id
+    SessionAcceptMessage.OPCODE: PACKET_HEADER_LEN + 2,  # after reserved_start
+}
+# Fields between the end of the timestamp and the signed message length
+_SIGNED_MSG_LEN_GAP = {
+    SessionOfferMessage.OPCODE: 4,  # millis_into
+    SessionAcceptMessage.OPCODE: 6,  # millis_into, session_id
+}
+
+
+def is_ki_segment(buffer: bytes, segment: TcpSegment) -> bool:
+    """
+    is_ki_segment naively determines if a TCP segment holds KI or flagtool
+        traffic, the same way `moonlight.net.scapy.is_ki_packet_naive` and
+        `is_flagtool_packet_naive` do for scapy packets
+
+    Args:
+        buffer (bytes): buffer the segment was parsed from
+        segment (TcpSegment): parsed segment
+
+    Returns:
+        bool: `True` if moonlight can decode the segment's payload
+    """
+    if segment.payload_len <= 0:
+        return False
+    if segment.dport == MessageSender.FLAGTOOL.value:
+        return True
+    start = segment.payload_offset
+    return buffer[start : start + 2] == KI_MAGIC
+
+
+def signed_msg_span(
+    buffer: bytes, start: int = 0, end: int | None = None
+) -> tuple[int, int] | None:
+    """
+    signed_msg_span locates the signed message of a session offer or accept
+        control frame using only the control header
+
+    Args:
+        buffer (bytes): buffer holding a full KI frame
+        start (int, optional): start of the KI frame. Defaults to 0.
+        end (int | None, optional): end of the available bytes.
+            Defaults to the end of the buffer.
+
+    Raises:
+        ValueError: the frame is a session offer/accept but is truncated
+
+    Returns:
+        tuple[int, int] | None: absolute (offset, length) of the signed
+            message or `None` if the frame doesn't carry one
+    """
+    if end is None:
+        end = len(buffer)
+    if end - start < PACKET_HEADER_LEN or buffer[start : start + 2] != KI_MAGIC:
+        return None
+    if not buffer[start + 4]:
+        return None
+    opcode = buffer[start + 5]
+    if opcode not in _SIGNED_MSG_TIMESTAMP_OFFSET:
+        return None
+
+    pos = start + _SIGNED_MSG_TIMESTAMP_OFFSET[opcode]
+    # mirrors `moonlight.net.control._unpack_weirdo_timestamp`
+    while True:
+        if pos + 4 > end:
+            raise ValueError("Control frame truncated before signed message")
+        high_bits = _U32_LE.unpack_from(buffer, pos)[0]
+        pos += 4
+        if high_bits == 0:
+            break
+    pos += 4 + _SIGNED_MSG_LEN_GAP[opcode]
+    if pos + 4 > end:
+        raise ValueError("Control frame truncated before signed message")
+    (length,) = _U32_LE.unpack_from(buffer, pos)
+    pos += 4
+    if pos + length > end:
+        raise ValueError("Signed message length runs past the end of the frame")
+    return pos, length
+
+
+@dataclass(kw_only=True)
+class FilterStats:
+    """Totals of a `filter_pcap` run"""
+
+    records: int = 0
+    kept: int = 0
+    sanitized: int = 0
+    sanitize_failures: int = 0
+    duplicates: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+
+
+def _sanitize_record(raw: bytes, segment: TcpSegment) -> bytes | None:
+    """Returns a sanitized copy of the record or `None` if nothing changed"""
+    span = signed_msg_span(
+        raw, segment.payload_offset, segment.payload_offset + segment.payload_len
+    )
+    if span is None:
+        return None
+    offset, length = span
+    patched = bytearray(raw)
+    patched[offset : offset + length] = bytes(length)
+    # the checksum covers the patched bytes
+    fix_tcp_checksum(patched, segment)
+    return bytes(patched)
+
+
+def _redact_record(raw: bytes, segment: TcpSegment, redactor: Redactor) -> bytes | None:
+    """Returns a redacted copy of the record or `None` if nothing changed"""
+    patched = bytearray(raw)
+    changes = redactor.redact(
+        patched, segment.payload_offset, segment.payload_offset + segment.payload_len
+    )
+    if not changes:
+        return None
+    fix_tcp_checksum(patched, segment)
+    return bytes(patched)
+
+
+def filter_pcap(
+    p_in: PathLike | str | BinaryIO,
+    p_out: PathLike | str | BinaryIO,
+    compress: bool = False,
+    sanitize: bool = False,
+    redactor: Redactor | None = None,
+    deduplicator: SegmentDeduplicator | None = None,
+    threaded_decompression: bool = False,
+) -> FilterStats:
+    """
+    filter_pcap removes traffic that moonlight cannot parse from a pcap file.
+        Optionally, it can also remove sensitive data from Wizard101 messages,
+        mainly session information.
+
+    Kept records are copied byte-for-byte. Sanitized records only have their
+    signed message bytes (and any fields chosen by `redactor`) zeroed and
+    their TCP checksum recomputed.
+
+    Args:
+        p_in (PathLike | str | BinaryIO): pcap or pcapng file to filter,
+            optionally gzip, xz or bzip2 compressed
+        p_out (PathLike | str | BinaryIO): path to write new, filtered capture to.
+            The output keeps the input's format.
+        compress (bool, optional): compresses the output pcap using the
+            gz algorithm. Defaults to False.
+        sanitize (bool, optional): Remove sensitive information from packets
+            while filtering. Defaults to False.
+        redactor (Redactor | None, optional): blanks DML fields in every
+            kept packet. When given it replaces `sanitize`, and its own
+            `signed_messages` setting decides whether signatures are zeroed.
+            Defaults to None.
+        deduplicator (SegmentDeduplicator | None, optional): drops
+            retransmitted and duplicated segments instead of keeping them
+            again. Defaults to None.
+        threaded_decompression (bool, optional): decompress compressed input
+            on a background thread. Defaults to False.
+
+    Raises:
+        RuntimeError: when the input capture cannot be read
+
+    Returns:
+        FilterStats: totals of what was kept and sanitized
+    """
+    stats = FilterStats()
+    logger.info("Filtering pcap to ki traffic only: in=%s, out=%s", p_in, p_out)
+    if redactor is not None:
+        logger.info("Redacting %d field rule(s) from kept packets", len(redactor.rules))
+    elif sanitize:
+        logger.info(
+            "Sanitation is on. SessionOffer and Accept control message signatures will be zeroed out"
+        )
+
+    reader = CaptureFileReader(p_in, threaded_decompression=threaded_decompression)
+    owns_out = not hasattr(p_out, "write")
+    out: BinaryIO = open(p_out, "wb") if owns_out else p_out  # type: ignore # pylint: disable=consider-using-with
+    writer: BinaryIO = (
+        gzip.GzipFile(fileobj=out, mode="wb", compresslevel=6) if compress else out  # type: ignore
+    )
+    try:
+        writer.write(reader.header)
+        stats.bytes_out += len(reader.header)
+        for record in reader.blocks():
+            raw = record.raw
+            stats.bytes_in += len(raw)
+            if not record.is_packet:
+                # pcapng section/interface/stats blocks are always kept
+                writer.write(raw)
+                stats.bytes_out += len(raw)
+                continue
+
+            stats.records += 1
+            segment = parse_tcp(
+                record.linktype,
+                raw,
+                record.data_offset,
+                record.data_offset + record.caplen,
+            )
+            if segment is None or not is_ki_segment(raw, segment):
+                continue
+            if deduplicator is not None and deduplicator.is_duplicate_segment(segment):
+                stats.duplicates += 1
+                continue
+
+            if redactor is not None:
+                failures = redactor.stats.failures
+                sanitized = _redact_record(raw, segment, redactor)
+                if redactor.stats.failures != failures:
+                    stats.sanitize_failures += 1
+                if sanitized is not None:
+                    raw = sanitized
+                    stats.sanitized += 1
+            elif (
+                sanitize
+                and segment.payload_len > 4
+                and raw[segment.payload_offset + 4]  # content_is_control
+            ):
+                try:
+                    sanitized = _sanitize_record(raw, segment)
+                except ValueError:
+                    stats.sanitize_failures += 1
+                    logger.error(
+                        "Message sanitation failed for record at offset %d",
+                        record.offset,
+                        exc_info=True,
+                    )
+                    sanitized = None
+                if sanitized is not None:
+                    raw = sanitized
+                    stats.sanitized += 1
+
+            writer.write(raw)
+            stats.kept += 1
+            stats.bytes_out += len(raw)
+            if stats.kept % 100000 == 0:
+                logger.info(
+                    "Filtering in progress. Found %s interesting packets so far",
+                    stats.kept,
+                )
+    except KeyboardInterrupt:
+        logger.warning("Cutting filtering short and finalizing")
+    except ValueError as err:
+        raise RuntimeError(
+            "Unrecoverable error occurred while filtering pcap file"
+        ) from err
+    finally:
+        reader.close()
+        if writer is not out:
+            writer.close()
+        if owns_out:
+            out.close()
+        else:
+            out.flush()
+
+    logger.info(
+        "Filtering done. Kept %d of %d packets (%d sanitized, %d failed sanitation)",
+        stats.kept,
+        stats.records,
+        stats.sanitized,
+        stats.sanitize_failures,
+    )
+    if deduplicator is not None:
+        deduplicator.log_summary()
+    return stats
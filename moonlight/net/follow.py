@@ -0,0 +1,265 @@
+"""
+Following captures that are still being written
+
+`CaptureFollower` reads a capture like `tail -f`: it keeps the file open,
+hands out records as they are appended, waits out records that are only
+partially written and moves on when a ring buffer rotates to its next file.
+On Linux it sleeps on inotify so new data is picked up right away. Elsewhere,
+or if inotify can't be used, it polls with exponential backoff.
+"""
+
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import re
+import select
+import threading
+import time
+from os import PathLike
+from pathlib import Path
+from typing import Iterator
+
+from .pcap import CaptureFileReader, PcapRecord, TruncatedCaptureError
+
+logger = logging.getLogger(__name__)
+
+# dumpcap ring buffer files are named <prefix>_<number>_<YYYYmmddHHMMSS><ext>
+_RING_FILE = re.compile(
+    r"^(?P<prefix>.*)_(?P<number>\d{5,})_(?P<stamp>\d{14})(?P<ext>\.\w+)$"
+)
+
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+
+
+def next_ring_file(path: PathLike | str) -> Path | None:
+    """
+    next_ring_file finds the file a dumpcap ring buffer rotated to after
+        `path`
+
+    Args:
+        path (PathLike | str): current ring buffer file
+
+    Returns:
+        Path | None: the next existing file of the same ring buffer or `None`
+            if there is none yet or `path` isn't a ring buffer file
+    """
+    path = Path(path)
+    match = _RING_FILE.match(path.name)
+    if match is None:
+        return None
+    candidates = []
+    for sibling in path.parent.iterdir():
+        other = _RING_FILE.match(sibling.name)
+        if (
+            other is not None
+            and other["prefix"] == match["prefix"]
+            and other["ext"] == match["ext"]
+            and int(other["number"]) > int(match["number"])
+        ):
+            candidates.append((int(other["number"]), sibling))
+    return min(candidates)[1] if candidates else None
+
+
+class _DirectoryWatch:
+    """
+    Wakes up when something in a directory is written, created or moved in.
+    Falls back to plain sleeping where inotify isn't available.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self._fd: int | None = None
+        self._libc = None
+        libc_name = ctypes.util.find_library("c")
+        if not libc_name or not hasattr(select, "poll"):
+            return
+        try:
+            libc = ctypes.CDLL(libc_name, use_errno=True)
+            fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return
+        if fd < 0:
+            return
+        mask = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+        if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+            os.close(fd)
+            return
+        self._fd = fd
+        self._poller = select.poll()
+        self._poller.register(fd, select.POLLIN)
+        logger.debug("Watching %s with inotify", directory)
+
+    @property
+    def is_inotify(self) -> bool:
+        """Whether changes are noticed right away"""
+        return self._fd is not None
+
+    def wait(self, timeout: float, stop: threading.Event) -> None:
+        """Blocks until the directory changes, `timeout` passes or `stop` is set"""
+        if self._fd is None:
+            stop.wait(timeout)
+            return
+        # wake up regularly to notice `stop`
+        deadline = time.monotonic() + timeout
+        while not stop.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            if self._poller.poll(min(remaining, 0.5) * 1000):
+                try:
+                    os.read(self._fd, 4096)
+                except BlockingIOError:
+                    pass
+                return
+
+    def close(self) -> None:
+        """Releases the inotify descriptor"""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class CaptureFollower:
+    """
+    Iterates the packet records of a capture as they are written, including
+    any ring buffer files it rotates to. Iteration ends when `stop` is called,
+    or after `idle_timeout` seconds without new records.
+    """
+
+    def __init__(
+        self,
+        path: PathLike | str,
+        poll_interval: float = 0.1,
+        max_poll_interval: float = 2.0,
+        rotate: bool = True,
+        idle_timeout: float | None = None,
+    ) -> None:
+        """
+        Args:
+            path (PathLike | str): capture to follow. It may not exist yet.
+            poll_interval (float, optional): first wait in seconds after
+                reaching the end of the file. Defaults to 0.1.
+            max_poll_interval (float, optional): the wait doubles while no
+                data arrives, up to this many seconds. Defaults to 2.0.
+            rotate (bool, optional): move on to the next file of a dumpcap
+                ring buffer once this one is finished. Defaults to True.
+            idle_timeout (float | None, optional): stop after this many
+                seconds without new records. Defaults to following forever.
+        """
+        if poll_interval <= 0 or max_poll_interval < poll_interval:
+            raise ValueError("Poll intervals must be positive and ordered")
+        self.path = Path(path)
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.rotate = rotate
+        self.idle_timeout = idle_timeout
+        self.files_followed = 0
+        self._stop = threading.Event()
+        self._reader: CaptureFileReader | None = None
+        self._watch = _DirectoryWatch(self.path.parent)
+
+    def stop(self) -> None:
+        """
+        stop ends iteration at the next wait. Safe to call from other threads
+            and signal handlers.
+        """
+        self._stop.set()
+
+    def _open(self) -> CaptureFileReader | None:
+        try:
+            reader = CaptureFileReader(self.path)
+        except (FileNotFoundError, TruncatedCaptureError):
+            return None
+        self.files_followed += 1
+        logger.info("Following %s", self.path)
+        return reader
+
+    def _rotate(self) -> bool:
+        if not self.rotate:
+            return False
+        next_path = next_ring_file(self.path)
+        if next_path is None:
+            return False
+        logger.info("Capture rotated from %s to %s", self.path.name, next_path.name)
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        self.path = next_path
+        return True
+
+    def _read_available(self) -> Iterator[PcapRecord]:
+        """Yields every complete record, leaving the reader at the last boundary"""
+        assert self._reader is not None
+        try:
+            for record in self._reader.blocks():
+                if record.is_packet:
+                    yield record
+        except TruncatedCaptureError as err:
+            self._reader.rewind(err.offset)
+
+    def __iter__(self) -> Iterator[PcapRecord]:
+        delay = self.poll_interval
+        idle_since = time.monotonic()
+        # a partial record seen while the next ring file already existed
+        stalled_at: int | None = None
+        try:
+            while not self._stop.is_set():
+                if self._reader is None:
+                    self._reader = self._open()
+
+                got_records = False
+                if self._reader is not None:
+                    for record in self._read_available():
+                        got_records = True
+                        yield record
+                        if self._stop.is_set():
+                            return
+
+                if got_records:
+                    delay = self.poll_interval
+                    idle_since = time.monotonic()
+                    stalled_at = None
+                    continue
+
+                # nothing new. The writer only rotates after finishing a file,
+                # so move on unless a record is still partially written
+                position = self._reader.position if self._reader else None
+                at_end = position is not None and position == os.path.getsize(self.path)
+                if self._reader is not None and (at_end or stalled_at == position):
+                    if stalled_at is not None and not at_end:
+                        logger.warning(
+                            "Abandoning truncated record at offset %d of %s",
+                            position,
+                            self.path,
+                        )
+                    if self._rotate():
+                        stalled_at = None
+                        continue
+                elif self._reader is not None and next_ring_file(self.path) is not None:
+                    stalled_at = position
+
+                if (
+                    self.idle_timeout is not None
+                    and time.monotonic() - idle_since >= self.idle_timeout
+                ):
+                    return
+                self._watch.wait(delay, self._stop)
+                delay = min(delay * 2, self.max_poll_interval)
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """
+        close releases the open capture and directory watch
+        """
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        self._watch.close()
@@ -0,0 +1,430 @@
+"""
+Synthetic KI traffic for load and scaling tests
+
+`TrafficGenerator` produces captures of made-up sessions from a loaded
+`DMLProtocolRegistry`. DML messages are encoded from random field values
+with `DMLMessageDef.encode_packet`, and control messages with their
+`to_bytes`, so everything written decodes like real traffic. A
+`TrafficProfile` controls:
+- how often each message type is picked
+- how long strings are
+- how many connections there are and the message rate
+- how many KI frames share a TCP segment
+- how segments are split
+
+Output only depends on the registry, the profile and the seed. The same
+inputs always produce the same capture, byte for byte when uncompressed.
+
+Encoding is the slow part, so every message type gets a pool of encoded
+variants up front and traffic is assembled from those. Captures of any
+size can then be written at disk speed rather than encoder speed.
+"""
+
+from __future__ import annotations
+
+import bisect
+import ipaddress
+import itertools
+import logging
+import random
+import struct
+from dataclasses import dataclass, field
+from os import PathLike
+from typing import Any, BinaryIO, Iterator, Mapping
+
+from .common import DMLType
+from .control import (
+    KeepAliveMessage,
+    KeepAliveResponseMessage,
+    SessionAcceptMessage,
+    SessionOfferMessage,
+)
+from .dml import DMLMessageDef, DMLProtocolRegistry
+from .pcap import PCAP_GLOBAL_HEADER, PCAP_RECORD_HEADER, PcapWriter, build_tcp_frame
+
+logger = logging.getLogger(__name__)
+
+_LETTERS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 "
+_STRING_TYPES = (DMLType.STR, DMLType.PO_STR, DMLType.WSTR, DMLType.PO_WSTR)
+_FLOAT_TYPES = (DMLType.FLOAT32, DMLType.FLT, DMLType.FLOAT64, DMLType.DBL)
+_SERVER_NET = ipaddress.IPv4Address("10.100.0.1")
+_CLIENT_NET = ipaddress.IPv4Address("10.200.0.1")
+
+
+def random_field_value(
+    dml_type: DMLType, rng: random.Random, string_length: tuple[int, int] = (4, 32)
+) -> Any:
+    """
+    random_field_value picks a value that fits a DML type
+
+    Args:
+        dml_type (DMLType): type of the field
+        rng (random.Random): source of randomness
+        string_length (tuple[int, int], optional): inclusive range of string
+            lengths in characters. Defaults to (4, 32).
+
+    Returns:
+        Any: value as decoding would produce it
+    """
+    if dml_type in _STRING_TYPES:
+        return "".join(rng.choices(_LETTERS, k=rng.randint(*string_length)))
+    if dml_type is DMLType.BOOL:
+        return rng.random() < 0.5
+    if dml_type in _FLOAT_TYPES:
+        return rng.uniform(-1e6, 1e6)
+    bits = struct.calcsize(dml_type.struct_code) * 8
+    if dml_type.struct_code[-1].islower():
+        return rng.randint(-(1 << (bits - 1)), (1 << (bits - 1)) - 1)
+    return rng.getrandbits(bits)
+
+
+@dataclass(kw_only=True)
+class TrafficProfile:  # pylint: disable=too-many-instance-attributes
+    """What generated traffic looks like"""
+
+    # relative frequency of messages, keyed by name or (service id, message
+    # id). Messages not listed aren't sent. Defaults to every message equally.
+    message_weights: Mapping[str | tuple[int, int], float] | None = None
+    # inclusive range of string field lengths in characters
+    string_length: tuple[int, int] = (4, 32)
+    # concurrent client connections
+    flows: int = 4
+    # DML messages per second over all flows
+    messages_per_second: float = 200.0
+    # share of DML messages sent by clients rather than servers
+    client_share: float = 0.5
+    # seconds between keep alives on each flow, 0 for none
+    keep_alive_interval: float = 10.0
+    # inclusive range of KI frames sent together in one TCP segment
+    batch: tuple[int, int] = (1, 1)
+    # longest TCP payload. Longer batches are split across segments.
+    mss: int = 1460
+    # chance that a segment is split at a random point even if it fits
+    fragment_rate: float = 0.0
+    # port the servers listen on
+    server_port: int = 12000
+    # encoded variants kept of each message type
+    pool_size: int = 32
+
+    def __post_init__(self) -> None:
+        if self.flows < 1:
+            raise ValueError("At least one flow is needed")
+        if self.messages_per_second <= 0:
+            raise ValueError("Message rate must be positive")
+        if not 1 <= self.batch[0] <= self.batch[1]:
+            raise ValueError("Batch sizes must be an ordered range of at least 1")
+        if not 0 <= self.string_length[0] <= self.string_length[1]:
+            raise ValueError("String lengths must be an ordered range")
+        if self.mss < 1:
+            raise ValueError("MSS must be positive")
+        if not 0 <= self.fragment_rate <= 1 or not 0 <= self.client_share <= 1:
+            raise ValueError("Rates must be between 0 and 1")
+        if self.pool_size < 1:
+            raise ValueError("Pool size must be at least 1")
+
+
+@dataclass
+class _Flow:
+    client: str
+    client_port: int
+    server: str
+    session_id: int
+    client_seq: int
+    server_seq: int
+    next_keep_alive: float
+
+
+@dataclass
+class GenerateStats:
+    """What a generator wrote"""
+
+    packets: int = 0
+    dml_messages: int = 0
+    control_messages: int = 0
+    bytes: int = 0
+    first_timestamp: float | None = None
+    last_timestamp: float | None = None
+    messages_by_type: dict[str, int] = field(default_factory=dict)
+
+
+class TrafficGenerator:
+    """
+    Endless, deterministic synthetic KI traffic. Every flow starts with a
+    session offer and accept, then carries randomly picked DML messages in
+    both directions with periodic keep alives.
+    """
+
+    def __init__(
+        self,
+        registry: DMLProtocolRegistry,
+        profile: TrafficProfile | None = None,
+        seed: int = 0,
+        start: float = 1650000000.0,
+    ) -> None:
+        """
+        Args:
+            registry (DMLProtocolRegistry): definitions of the messages to
+                send
+            profile (TrafficProfile | None, optional): shape of the traffic.
+                Defaults to `TrafficProfile()`.
+            seed (int, optional): seed of all randomness. Defaults to 0.
+            start (float, optional): unix timestamp of the first packet.
+                Defaults to 1650000000.0.
+
+        Raises:
+            ValueError: a weighted message isn't in the registry, or there
+                are no messages to send
+        """
+        self.registry = registry
+        self.profile = profile or TrafficProfile()
+        self.seed = seed
+        self.start = start
+        self.stats = GenerateStats()
+        self._rng = random.Random(seed)
+        self._defs = self._weighted_defs()
+        self._cumulative_weights = list(
+            itertools.accumulate(weight for _, weight in self._defs)
+        )
+        self._pools: dict[int, list[bytes]] = {}
+
+    def _weighted_defs(self) -> list[tuple[DMLMessageDef, float]]:
+        by_id: dict[tuple[int, int], DMLMessageDef] = {}
+        by_name: dict[str, DMLMessageDef] = {}
+        for protocol in self.registry.protocol_map.values():
+            for msg_id, msg_def in protocol.message_map.items():
+                by_id[(protocol.id, msg_id)] = msg_def
+                by_name[msg_def.name] = msg_def
+
+        weights = self.profile.message_weights
+        if weights is None:
+            defs = [(msg_def, 1.0) for _, msg_def in sorted(by_id.items())]
+        else:
+            defs = []
+            for key, weight in weights.items():
+                msg_def = by_name.get(key) if isinstance(key, str) else by_id.get(key)
+                if msg_def is None:
+                    raise ValueError(f"Unknown message {key}")
+                if weight < 0:
+                    raise ValueError(f"Negative weight for message {key}")
+                if weight > 0:
+                    defs.append((msg_def, float(weight)))
+        if not defs:
+            raise ValueError("No messages to generate")
+        return defs
+
+    def random_values(self, msg_def: DMLMessageDef) -> dict[str, Any]:
+        """
+        random_values picks a value for every field of a message
+
+        Args:
+            msg_def (DMLMessageDef): message to fill
+
+        Returns:
+            dict[str, Any]: value by field name
+        """
+        return {
+            f.name: random_field_value(
+                f.dml_type, self._rng, self.profile.string_length
+            )
+            for f in msg_def.fields
+        }
+
+    def _pick_message(self) -> tuple[DMLMessageDef, bytes]:
+        index = bisect.bisect_right(
+            self._cumulative_weights, self._rng.random() * self._cumulative_weights[-1]
+        )
+        index = min(index, len(self._defs) - 1)
+        msg_def = self._defs[index][0]
+        pool = self._pools.setdefault(index, [])
+        if len(pool) < self.profile.pool_size:
+            pool.append(msg_def.encode_packet(self.random_values(msg_def)))
+            return msg_def, pool[-1]
+        return msg_def, pool[self._rng.randrange(len(pool))]
+
+    def _new_flow(self, number: int) -> _Flow:
+        return _Flow(
+            client=str(_CLIENT_NET + number),
+            client_port=self._rng.randint(49152, 65535),
+            server=str(_SERVER_NET + number % 8),
+            session_id=self._rng.getrandbits(16),
+            client_seq=self._rng.getrandbits(32),
+            server_seq=self._rng.getrandbits(32),
+            next_keep_alive=self.start + self.profile.keep_alive_interval,
+        )
+
+    def _handshake(self, flow: _Flow, now: float) -> list[tuple[bool, bytes]]:
+        seconds = int(now)
+        millis = int((now - seconds) * 1000)
+        signed = self._rng.randbytes(256)
+        offer = SessionOfferMessage(
+            original_bytes=None,
+            session_id=flow.session_id,
+            unix_timestamp_seconds=seconds,
+            unix_timestamp_millis_into_second=millis,
+            signed_msg_len=len(signed),
+            signed_msg=signed,
+        )
+        accept = SessionAcceptMessage(
+            original_bytes=None,
+            reserved_start=0,
+            session_id=flow.session_id,
+            unix_timestamp_seconds=seconds,
+            unix_timestamp_millis_into_second=millis,
+            signed_msg_len=len(signed),
+            signed_msg=signed,
+        )
+        return [(False, offer.to_bytes()), (True, accept.to_bytes())]
+
+    def _keep_alive(self, flow: _Flow, now: float) -> list[tuple[bool, bytes]]:
+        millis = int(now * 1000) % 1000
+        minutes = int((now - self.start) // 60)
+        request = KeepAliveMessage(
+            original_bytes=None,
+            session_id=flow.session_id,
+            variable_timestamp=struct.pack("<HH", millis, minutes),
+        )
+        response = KeepAliveResponseMessage(
+            original_bytes=None,
+            session_id=flow.session_id,
+            variable_timestamp=struct.pack(
+                "<I", int((now - self.start) * 1000) & 0xFFFFFFFF
+            ),
+        )
+        return [(True, request.to_bytes()), (False, response.to_bytes())]
+
+    def _segments(self, payload: bytes) -> Iterator[bytes]:
+        mss = self.profile.mss
+        while payload:
+            cut = min(len(payload), mss)
+            if cut > 1 and self._rng.random() < self.profile.fragment_rate:
+                cut = self._rng.randint(1, cut - 1)
+            yield payload[:cut]
+            payload = payload[cut:]
+
+    def _send(
+        self, flow: _Flow, from_client: bool, frames: list[bytes], now: float
+    ) -> Iterator[tuple[float, bytes]]:
+        profile = self.profile
+        if from_client:
+            src, dst, sport, dport = (
+                flow.client,
+                flow.server,
+                flow.client_port,
+                profile.server_port,
+            )
+        else:
+            src, dst, sport, dport = (
+                flow.server,
+                flow.client,
+                profile.server_port,
+                flow.client_port,
+            )
+        for segment in self._segments(b"".join(frames)):
+            seq, ack = (
+                (flow.client_seq, flow.server_seq)
+                if from_client
+                else (flow.server_seq, flow.client_seq)
+            )
+            self.stats.packets += 1
+            yield now, build_tcp_frame(segment, src, dst, sport, dport, seq, ack)
+            if from_client:
+                flow.client_seq = (flow.client_seq + len(segment)) & 0xFFFFFFFF
+            else:
+                flow.server_seq = (flow.server_seq + len(segment)) & 0xFFFFFFFF
+            # segments of one batch follow each other closely
+            now += 0.000001
+
+    def _count(self, name: str, control: bool) -> None:
+        if control:
+            self.stats.control_messages += 1
+        else:
+            self.stats.dml_messages += 1
+        self.stats.messages_by_type[name] = self.stats.messages_by_type.get(name, 0) + 1
+
+    def packets(self) -> Iterator[tuple[float, bytes]]:
+        """
+        packets generates traffic forever
+
+        Yields:
+            tuple[float, bytes]: timestamp and Ethernet frame
+        """
+        profile = self.profile
+        now = self.start
+        flows = [self._new_flow(i) for i in range(profile.flows)]
+        for flow in flows:
+            for from_client, frame in self._handshake(flow, now):
+                self._count(
+                    "SessionAcceptMessage" if from_client else "SessionOfferMessage",
+                    True,
+                )
+                yield from self._send(flow, from_client, [frame], now)
+
+        while True:
+            now += self._rng.expovariate(profile.messages_per_second)
+            flow = flows[self._rng.randrange(len(flows))]
+            if profile.keep_alive_interval > 0 and now >= flow.next_keep_alive:
+                flow.next_keep_alive += profile.keep_alive_interval
+                for from_client, frame in self._keep_alive(flow, now):
+                    self._count(
+                        "KeepAliveMessage"
+                        if from_client
+                        else "KeepAliveResponseMessage",
+                        True,
+                    )
+                    yield from self._send(flow, from_client, [frame], now)
+
+            from_client = self._rng.random() < profile.client_share
+            frames = []
+            for _ in range(self._rng.randint(*profile.batch)):
+                msg_def, frame = self._pick_message()
+                self._count(msg_def.name, False)
+                frames.append(frame)
+            yield from self._send(flow, from_client, frames, now)
+
+    def write_pcap(
+        self,
+        target: PathLike | str | BinaryIO,
+        max_bytes: int | None = None,
+        max_messages: int | None = None,
+        compress: bool = False,
+    ) -> GenerateStats:
+        """
+        write_pcap writes generated traffic to a capture until it reaches a
+            size or message count
+
+        Args:
+            target (PathLike | str | BinaryIO): path or writable binary file
+            max_bytes (int | None, optional): stop once the uncompressed
+                capture is at least this big. Defaults to None.
+            max_messages (int | None, optional): stop once this many DML
+                messages are written. Defaults to None.
+            compress (bool, optional): gzip the capture. Defaults to False.
+
+        Raises:
+            ValueError: neither limit is given
+
+        Returns:
+            GenerateStats: what was written
+        """
+        if max_bytes is None and max_messages is None:
+            raise ValueError("A size or message limit is needed")
+        stats = self.stats
+        stats.bytes = PCAP_GLOBAL_HEADER.size
+        with PcapWriter(target, compress=compress) as writer:
+            for timestamp, frame in self.packets():
+                writer.write(timestamp, frame)
+                stats.bytes += PCAP_RECORD_HEADER.size + len(frame)
+                if stats.first_timestamp is None:
+                    stats.first_timestamp = timestamp
+                stats.last_timestamp = timestamp
+                if (max_bytes is not None and stats.bytes >= max_bytes) or (
+                    max_messages is not None and stats.dml_messages >= max_messages
+                ):
+                    break
+        logger.debug(
+            "Generated %d packets holding %d DML and %d control messages",
+            stats.packets,
+            stats.dml_messages,
+            stats.control_messages,
+        )
+        return stats
@@ -0,0 +1,362 @@
+"""
+Sidecar indexes of KI frames for random access into large captures
+
+`build_index` scans a capture once and writes one fixed size entry per KI
+frame: where its record is in the file, when it was captured, its flow and
+what message it holds. `CaptureIndex` memory maps that file, so opening an
+index is instant regardless of its size. Time ranges are found by
+bisection, and matching frames are read straight from their offsets in
+the capture.
+
+Layout, little endian::
+
+    header      magic, version, capture size and mtime, entry count, flags,
+                flow table offset
+    entries     `_ENTRY` records in capture order
+    flow table  json list of [src, dst, sport, dport], indexed by flow id
+"""
+
+from __future__ import annotations
+
+import ipaddress
+import json
+import logging
+import mmap
+import os
+import struct
+from dataclasses import dataclass
+from os import PathLike
+from pathlib import Path
+from typing import Iterator
+
+from .compression import is_compressed
+from .pcap import CaptureFileReader
+from .scan import scan_capture
+
+logger = logging.getLogger(__name__)
+
+INDEX_MAGIC = b"MLIDX"
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".mlidx"
+# all entries are in non-decreasing timestamp order
+FLAG_TIME_SORTED = 0x1
+
+# magic, version, capture size, capture mtime_ns, entries, flags, flow table offset
+_HEADER = struct.Struct("<5sB2xQQQIQ")
+# record offset, timestamp, record number, flow id, frame position within the
+# record, frame length, is control, service id or 0, message id or opcode
+_ENTRY = struct.Struct("<QdIIII?BBx")
+_TIMESTAMP_OFFSET = 8
+
+
+class StaleIndexError(ValueError):
+    """The capture changed after its index was built"""
+
+
+@dataclass(frozen=True, slots=True)
+class IndexEntry:
+    """One KI frame of an indexed capture"""
+
+    record_offset: int
+    timestamp: float
+    record_number: int
+    flow_id: int
+    frame_pos: int
+    frame_len: int
+    is_control: bool
+    service_id: int
+    # DML message id, or the opcode of control frames
+    message_id: int
+
+
+@dataclass(frozen=True, slots=True)
+class Flow:
+    """One direction of a TCP connection"""
+
+    src: str
+    dst: str
+    sport: int
+    dport: int
+
+    def __str__(self) -> str:
+        return f"{self.src}:{self.sport} -> {self.dst}:{self.dport}"
+
+
+def default_index_path(capture_path: PathLike | str) -> Path:
+    """
+    default_index_path gives the sidecar path of a capture's index
+
+    Args:
+        capture_path (PathLike | str): capture file
+
+    Returns:
+        Path: index path next to the capture
+    """
+    capture_path = Path(capture_path)
+    return capture_path.with_name(capture_path.name + INDEX_SUFFIX)
+
+
+def _capture_fingerprint(capture_path: PathLike | str) -> tuple[int, int]:
+    stat = os.stat(capture_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def build_index(
+    capture_path: PathLike | str, index_path: PathLike | str | None = None
+) -> int:
+    """
+    build_index writes the sidecar index of a capture in one sequential pass
+
+    Args:
+        capture_path (PathLike | str): uncompressed pcap or pcapng capture
+        index_path (PathLike | str | None, optional): where to write the
+            index. Defaults to `default_index_path`.
+
+    Raises:
+        ValueError: the capture is compressed, so offsets can't be seeked to
+
+    Returns:
+        int: number of frames indexed
+    """
+    if is_compressed(capture_path):
+        raise ValueError("Compressed captures can't be indexed, decompress them first")
+    index_path = Path(index_path) if index_path else default_index_path(capture_path)
+    size, mtime_ns = _capture_fingerprint(capture_path)
+
+    flows: dict[tuple, int] = {}
+    count = 0
+    time_sorted = True
+    last_timestamp = float("-inf")
+    tmp_path = index_path.with_name(index_path.name + ".tmp")
+    with open(tmp_path, "wb") as out:
+        out.write(bytes(_HEADER.size))
+        for number, record, segment, frame in scan_capture(capture_path):
+            key = (segment.src, segment.dst, segment.sport, segment.dport)
+            flow_id = flows.setdefault(key, len(flows))
+            if record.timestamp < last_timestamp:
+                time_sorted = False
+            last_timestamp = record.timestamp
+            out.write(
+                _ENTRY.pack(
+                    record.offset,
+                    record.timestamp,
+                    number,
+                    flow_id,
+                    frame.offset,
+                    frame.length,
+                    frame.is_control,
+                    frame.service_id,
+                    frame.opcode if frame.is_control else frame.message_id,
+                )
+            )
+            count += 1
+
+        flow_table_offset = out.tell()
+        flow_table = [
+            [
+                str(ipaddress.ip_address(src)),
+                str(ipaddress.ip_address(dst)),
+                sport,
+                dport,
+            ]
+            for (src, dst, sport, dport) in flows
+        ]
+        out.write(json.dumps(flow_table).encode("utf8"))
+        out.seek(0)
+        out.write(
+            _HEADER.pack(
+                INDEX_MAGIC,
+                INDEX_VERSION,
+                size,
+                mtime_ns,
+                count,
+                FLAG_TIME_SORTED if time_sorted else 0,
+                flow_table_offset,
+            )
+        )
+    os.replace(tmp_path, index_path)
+    logger.info("Indexed %d frames in %d flows to %s", count, len(flows), index_path)
+    return count
+
+
+class CaptureIndex:
+    """
+    Read access to a sidecar index. Entries are unpacked from the memory
+    mapped file on demand, so even huge indexes open instantly.
+    """
+
+    def __init__(
+        self, index_path: PathLike | str, capture_path: PathLike | str | None = None
+    ) -> None:
+        """
+        Args:
+            index_path (PathLike | str): index file
+            capture_path (PathLike | str | None, optional): capture the index
+                was built from. If given, it's checked to be unchanged and
+                `frames` reads from it. Defaults to None.
+
+        Raises:
+            ValueError: the file isn't a moonlight index of a known version
+            StaleIndexError: the capture changed since it was indexed
+        """
+        self.path = Path(index_path)
+        self.capture_path = Path(capture_path) if capture_path else None
+        with open(self.path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if len(self._map) < _HEADER.size:
+                raise ValueError(f"{self.path} is not a moonlight index")
+            (
+                magic,
+                version,
+                self.capture_size,
+                self.capture_mtime_ns,
+                self._count,
+                flags,
+                flow_table_offset,
+            ) = _HEADER.unpack_from(self._map)
+            if magic != INDEX_MAGIC:
+                raise ValueError(f"{self.path} is not a moonlight index")
+            if version != INDEX_VERSION:
+                raise ValueError(f"Unsupported index version {version}")
+            self.time_sorted = bool(flags & FLAG_TIME_SORTED)
+            self.flows = [
+                Flow(*flow) for flow in json.loads(self._map[flow_table_offset:])
+            ]
+            if self.capture_path is not None:
+                fingerprint = _capture_fingerprint(self.capture_path)
+                if fingerprint != (self.capture_size, self.capture_mtime_ns):
+                    raise StaleIndexError(
+                        f"{self.capture_path} changed since {self.path} was built"
+                    )
+        except Exception:
+            self.close()
+            raise
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, i: int) -> IndexEntry:
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError("index entry out of range")
+        return IndexEntry(
+            *_ENTRY.unpack_from(self._map, _HEADER.size + i * _ENTRY.size)
+        )
+
+    def __iter__(self) -> Iterator[IndexEntry]:
+        for i in range(self._count):
+            yield self[i]
+
+    def _timestamp(self, i: int) -> float:
+        return struct.unpack_from(
+            "<d", self._map, _HEADER.size + i * _ENTRY.size + _TIMESTAMP_OFFSET
+        )[0]
+
+    def bisect_time(self, timestamp: float) -> int:
+        """
+        bisect_time finds the first entry at or after a timestamp. Only
+            meaningful when `time_sorted`.
+
+        Args:
+            timestamp (float): unix timestamp
+
+        Returns:
+            int: entry position
+        """
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._timestamp(mid) < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def select(  # pylint: disable=too-many-arguments
+        self,
+        start: float | None = None,
+        end: float | None = None,
+        service_id: int | None = None,
+        message_id: int | None = None,
+        is_control: bool | None = None,
+        flow_id: int | None = None,
+        records: range | None = None,
+    ) -> Iterator[IndexEntry]:
+        """
+        select yields the entries matching every given criteria
+
+        Args:
+            start (float | None, optional): earliest timestamp, inclusive
+            end (float | None, optional): latest timestamp, exclusive
+            service_id (int | None, optional): DML service id
+            message_id (int | None, optional): DML message id or control opcode
+            is_control (bool | None, optional): only control or DML frames
+            flow_id (int | None, optional): position in `flows`
+            records (range | None, optional): packet record numbers
+
+        Yields:
+            IndexEntry: matching entries in capture order
+        """
+        lo, hi = 0, self._count
+        if self.time_sorted:
+            if start is not None:
+                lo = self.bisect_time(start)
+            if end is not None:
+                hi = self.bisect_time(end)
+        for i in range(lo, hi):
+            entry = self[i]
+            if (
+                (start is not None and entry.timestamp < start)
+                or (end is not None and entry.timestamp >= end)
+                or (service_id is not None and entry.service_id != service_id)
+                or (message_id is not None and entry.message_id != message_id)
+                or (is_control is not None and entry.is_control != is_control)
+                or (flow_id is not None and entry.flow_id != flow_id)
+                or (records is not None and entry.record_number not in records)
+            ):
+                continue
+            yield entry
+
+    def frames(
+        self, entries: Iterator[IndexEntry]
+    ) -> Iterator[tuple[IndexEntry, bytes]]:
+        """
+        frames reads the bytes of indexed frames from the capture by seeking
+            to their records. Frames that continue in a later segment are
+            returned as far as they were captured.
+
+        Args:
+            entries (Iterator[IndexEntry]): entries of this index
+
+        Raises:
+            ValueError: the index wasn't opened with its capture
+
+        Yields:
+            tuple[IndexEntry, bytes]: entry and frame bytes
+        """
+        if self.capture_path is None:
+            raise ValueError("Reading frames requires the indexed capture")
+        with CaptureFileReader(self.capture_path) as reader:
+            if reader.format == "pcapng":
+                # interface descriptions come before the first packet
+                next(iter(reader), None)
+            for entry in entries:
+                reader.rewind(entry.record_offset)
+                record = next(reader.blocks())
+                yield entry, record.raw[
+                    entry.frame_pos : entry.frame_pos + entry.frame_len
+                ]
+
+    def close(self) -> None:
+        """
+        close unmaps the index
+        """
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
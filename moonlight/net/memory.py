@@ -0,0 +1,302 @@
+"""
+Memory accounting for decoding jobs
+
+`MemoryReporter` samples the process while a job runs. Every interval it
+records:
+- resident set size
+- memory traced by `tracemalloc`
+- a census of live moonlight objects
+
+At the end it adds the allocation sites holding the most memory. The census
+(`census`) finds live messages, fields, headers, property objects and the
+raw payloads they reference through the garbage collector. It sizes them
+per type and per message definition.
+
+All of it is expensive: tracemalloc slows allocation-heavy code by a
+large factor and a census walks every tracked object. The report is meant
+for sizing workers and checking memory fixes, not for production runs.
+"""
+
+from __future__ import annotations
+
+import gc
+import io
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any
+
+from printrospector.object import DynamicObject
+
+from .common import KIHeader, Message
+from .dml import DMLMessage, Field
+
+logger = logging.getLogger(__name__)
+
+RAW_BYTES = "bytes"
+_RAW_TYPES = (bytes, bytearray, memoryview, io.BytesIO)
+
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+def rss_bytes() -> int | None:
+    """
+    rss_bytes gets the resident set size of this process
+
+    Returns:
+        int | None: resident bytes, or the peak resident bytes where the
+            current value isn't available, or `None` on platforms with
+            neither
+    """
+    try:
+        with open("/proc/self/statm", "rb") as file:
+            return int(file.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        pass
+    try:
+        import resource  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _kind(obj: Any) -> str | None:
+    if isinstance(obj, DMLMessage):
+        return "DMLMessage"
+    if isinstance(obj, Message):
+        return type(obj).__name__
+    if isinstance(obj, Field):
+        return "Field"
+    if isinstance(obj, KIHeader):
+        return "KIHeader"
+    if isinstance(obj, DynamicObject):
+        return "DynamicObject"
+    return None
+
+
+def _shallow_size(obj: Any) -> int:
+    size = sys.getsizeof(obj)
+    attrs = getattr(obj, "__dict__", None)
+    if attrs is not None:
+        size += sys.getsizeof(attrs)
+    return size
+
+
+def _raw_values(obj: Any) -> list:
+    attrs = getattr(obj, "__dict__", None)
+    if attrs is None:
+        return []
+    raw = [v for v in attrs.values() if isinstance(v, _RAW_TYPES)]
+    # readers kept as original bytes hold their buffer in a BytesIO
+    raw.extend(
+        v.stream
+        for v in attrs.values()
+        if isinstance(getattr(v, "stream", None), io.BytesIO)
+    )
+    return raw
+
+
+def census() -> dict[str, Any]:
+    """
+    census sizes the live moonlight objects of the process. Sizes are
+        shallow: a message counts its own attributes but not the fields,
+        headers and payloads it refers to, which are counted by their own
+        types. Raw payloads referenced by several objects are counted once.
+
+    Returns:
+        dict[str, Any]: count and bytes by type, including referenced raw
+            payloads as "bytes", and by DML message name including each
+            message's fields and payloads
+    """
+    by_type: dict[str, list[int]] = {}
+    by_message: dict[str, list[int]] = {}
+    seen_raw: set[int] = set()
+
+    def add(table: dict[str, list[int]], key: str, size: int) -> None:
+        entry = table.get(key)
+        if entry is None:
+            entry = table[key] = [0, 0]
+        entry[0] += 1
+        entry[1] += size
+
+    def raw_size(obj: Any, counted: set[int]) -> int:
+        size = 0
+        for value in _raw_values(obj):
+            if id(value) not in counted:
+                counted.add(id(value))
+                size += sys.getsizeof(value)
+        return size
+
+    for obj in gc.get_objects():
+        kind = _kind(obj)
+        if kind is None:
+            continue
+        add(by_type, kind, _shallow_size(obj))
+        size = raw_size(obj, seen_raw)
+        if size:
+            add(by_type, RAW_BYTES, size)
+        if kind == "DMLMessage":
+            counted: set[int] = set()
+            size = (
+                _shallow_size(obj) + sys.getsizeof(obj.fields) + raw_size(obj, counted)
+            )
+            for field in obj.fields:
+                size += _shallow_size(field) + raw_size(field, counted)
+            add(by_message, obj.name(), size)
+
+    def as_list(table: dict[str, list[int]]) -> list[dict[str, Any]]:
+        return [
+            {"name": name, "count": count, "bytes": size}
+            for name, (count, size) in sorted(
+                table.items(), key=lambda item: -item[1][1]
+            )
+        ]
+
+    return {
+        "by_type": as_list(by_type),
+        "by_message": as_list(by_message),
+        "total": sum(size for _, size in by_type.values()),
+    }
+
+
+class MemoryReporter:
+    """
+    Samples memory use on a background thread while running
+    """
+
+    def __init__(
+        self, interval: float = 5.0, top: int = 10, trace_frames: int = 1
+    ) -> None:
+        """
+        Args:
+            interval (float, optional): seconds between samples. Defaults to
+                5.0.
+            top (int, optional): allocation sites to keep in the final
+                report. Defaults to 10.
+            trace_frames (int, optional): stack frames tracemalloc keeps per
+                allocation. More frames give better sites but cost more.
+                Defaults to 1.
+        """
+        self.interval = interval
+        self.top = top
+        self.trace_frames = trace_frames
+        self.samples: list[dict[str, Any]] = []
+        self.final: dict[str, Any] | None = None
+        self._started = 0.0
+        self._started_tracing = False
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def sample(self) -> dict[str, Any]:
+        """
+        sample records the current memory use
+
+        Returns:
+            dict[str, Any]: seconds since start, rss, traced memory and the
+                census totals by type
+        """
+        traced, peak = (
+            tracemalloc.get_traced_memory()
+            if tracemalloc.is_tracing()
+            else (None, None)
+        )
+        counts = census()
+        entry = {
+            "elapsed": time.monotonic() - self._started,
+            "rss": rss_bytes(),
+            "traced": traced,
+            "traced_peak": peak,
+            "census": {e["name"]: e["bytes"] for e in counts["by_type"]},
+        }
+        self.samples.append(entry)
+        return entry
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            entry = self.sample()
+            logger.info(
+                "Memory: rss %s, traced %s",
+                _mib(entry["rss"]),
+                _mib(entry["traced"]),
+            )
+
+    def start(self) -> None:
+        """
+        start begins tracing allocations and sampling
+        """
+        self._started = time.monotonic()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.trace_frames)
+            self._started_tracing = True
+        self.sample()
+        self._thread = threading.Thread(
+            target=self._run, name="moonlight-memory", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> dict[str, Any]:
+        """
+        stop takes the final sample and snapshot and stops tracing
+
+        Returns:
+            dict[str, Any]: the report, see `report`
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        last = self.sample()
+        sites = []
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                (tracemalloc.Filter(False, tracemalloc.__file__),)
+            )
+            for stat in snapshot.statistics("lineno")[: self.top]:
+                frame = stat.traceback[0]
+                sites.append(
+                    {
+                        "site": f"{frame.filename}:{frame.lineno}",
+                        "bytes": stat.size,
+                        "count": stat.count,
+                    }
+                )
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        self.final = {**last, "census": census(), "sites": sites}
+        return self.report()
+
+    def __enter__(self) -> MemoryReporter:
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def report(self) -> dict[str, Any]:
+        """
+        report gets everything recorded so far
+
+        Returns:
+            dict[str, Any]: peak rss and traced memory, the timeline of
+                samples and the final census and allocation sites
+        """
+        rss = [s["rss"] for s in self.samples if s["rss"] is not None]
+        peaks = [s["traced_peak"] for s in self.samples if s["traced_peak"] is not None]
+        return {
+            "peak_rss": max(rss, default=None),
+            "peak_traced": max(peaks, default=None),
+            "samples": self.samples,
+            "final": self.final,
+        }
+
+
+def _mib(value: int | None) -> str:
+    return "n/a" if value is None else f"{value / 1024 / 1024:.1f} MiB"
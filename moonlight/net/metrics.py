@@ -0,0 +1,402 @@
+"""
+Throughput, latency and error instrumentation for decoding
+
+`DecodeMetrics` keeps running counters and histograms that `LiveSniffer`,
+`PcapReader` and `DecodePipeline` update as they work. The numbers can be
+scraped through a local OpenMetrics endpoint (`MetricsServer`) and/or
+written to the log periodically (`MetricsLogReporter`).
+"""
+
+from __future__ import annotations
+
+import bisect
+import logging
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Sequence
+
+from .common import Message
+from .dml import DMLMessage
+
+logger = logging.getLogger(__name__)
+
+# seconds. Decoding a single message usually lands in the 10us-1ms range.
+DEFAULT_LATENCY_BUCKETS = (
+    0.00001,
+    0.000025,
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+)
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+def message_type_name(msg: Message) -> str:
+    """
+    message_type_name gets a short, stable name for the type of a message,
+        such as the DML message name or the control message class
+
+    Args:
+        msg (Message): decoded message
+
+    Returns:
+        str: message type name
+    """
+    if isinstance(msg, DMLMessage):
+        return msg.name()
+    return type(msg).__name__
+
+
+class Histogram:
+    """
+    Cumulative histogram over fixed bucket bounds. Not thread safe on its
+    own; `DecodeMetrics` guards it with its lock.
+    """
+
+    def __init__(self, bounds: Sequence[float]) -> None:
+        self.bounds = tuple(sorted(bounds))
+        # one extra bucket for +Inf
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """
+        observe adds a value to the histogram
+
+        Args:
+            value (float): observed value
+        """
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list[tuple[float, int]]:
+        """
+        cumulative gets the (upper bound, count of values <= bound) pairs,
+            ending with +Inf
+
+        Returns:
+            list[tuple[float, int]]: cumulative bucket counts
+        """
+        total = 0
+        result = []
+        for bound, count in zip((*self.bounds, float("inf")), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q: float) -> float | None:
+        """
+        quantile estimates a quantile as the upper bound of the bucket it
+            falls in
+
+        Args:
+            q (float): quantile in [0, 1]
+
+        Returns:
+            float | None: estimated quantile or `None` if nothing was observed
+        """
+        if self.count == 0:
+            return None
+        target = q * self.count
+        for bound, total in self.cumulative():
+            if total >= target:
+                return bound
+        return float("inf")
+
+
+class DecodeMetrics:
+    """
+    Thread safe counters describing a decoding session
+    """
+
+    def __init__(
+        self,
+        latency_buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS,
+        queue_depth: Callable[[], int] | None = None,
+    ) -> None:
+        """
+        Args:
+            latency_buckets (Sequence[float], optional): decode latency
+                histogram bounds in seconds. Defaults to DEFAULT_LATENCY_BUCKETS.
+            queue_depth (Callable[[], int] | None, optional): gauge callback
+                reporting how many packets are waiting to be decoded.
+                Defaults to None.
+        """
+        self.started = time.monotonic()
+        self.queue_depth = queue_depth
+        self.packets = 0
+        self.bytes = 0
+        self.decoded = 0
+        self.errors = 0
+        self.dropped = 0
+        self.messages_by_type: Counter[str] = Counter()
+        self.decode_latency = Histogram(latency_buckets)
+        self._lock = threading.Lock()
+
+    def record_packet(self, nbytes: int) -> None:
+        """
+        record_packet counts a captured packet of interest
+
+        Args:
+            nbytes (int): payload length
+        """
+        with self._lock:
+            self.packets += 1
+            self.bytes += nbytes
+
+    def record_decode(self, msg: Message | None, seconds: float) -> None:
+        """
+        record_decode counts a finished decode attempt
+
+        Args:
+            msg (Message | None): decoded message or `None` if the payload
+                was skipped
+            seconds (float): time spent decoding
+        """
+        with self._lock:
+            self.decode_latency.observe(seconds)
+            if msg is not None:
+                self.decoded += 1
+                self.messages_by_type[message_type_name(msg)] += 1
+
+    def record_error(self, count: int = 1) -> None:
+        """
+        record_error counts payloads that failed to decode
+
+        Args:
+            count (int, optional): number of failures. Defaults to 1.
+        """
+        with self._lock:
+            self.errors += count
+
+    def record_drop(self, count: int = 1) -> None:
+        """
+        record_drop counts payloads discarded before decoding
+
+        Args:
+            count (int, optional): number of drops. Defaults to 1.
+        """
+        with self._lock:
+            self.dropped += count
+
+    def snapshot(self) -> dict[str, Any]:
+        """
+        snapshot gets a consistent copy of the current values
+
+        Returns:
+            dict[str, Any]: current values
+        """
+        with self._lock:
+            return {
+                "uptime_seconds": time.monotonic() - self.started,
+                "packets": self.packets,
+                "bytes": self.bytes,
+                "decoded": self.decoded,
+                "errors": self.errors,
+                "dropped": self.dropped,
+                "queue_depth": self.queue_depth() if self.queue_depth else 0,
+                "messages_by_type": dict(self.messages_by_type),
+                "decode_latency": {
+                    "count": self.decode_latency.count,
+                    "sum": self.decode_latency.sum,
+                    "buckets": self.decode_latency.cumulative(),
+                    "p50": self.decode_latency.quantile(0.5),
+                    "p99": self.decode_latency.quantile(0.99),
+                },
+            }
+
+    def render_openmetrics(self) -> str:
+        """
+        render_openmetrics formats the current values in the OpenMetrics
+            text exposition format
+
+        Returns:
+            str: OpenMetrics document
+        """
+        snap = self.snapshot()
+        lines = []
+
+        def counter(name: str, help_str: str, value: Any) -> None:
+            lines.append(f"# TYPE moonlight_{name} counter")
+            lines.append(f"# HELP moonlight_{name} {help_str}")
+            lines.append(f"moonlight_{name}_total {value}")
+
+        counter("packets", "KI packets captured", snap["packets"])
+        counter("bytes", "KI payload bytes captured", snap["bytes"])
+        counter("decoded", "Messages decoded", snap["decoded"])
+        counter("errors", "Payloads that failed to decode", snap["errors"])
+        counter("dropped", "Payloads dropped before decoding", snap["dropped"])
+
+        lines.append("# TYPE moonlight_queue_depth gauge")
+        lines.append("# HELP moonlight_queue_depth Payloads waiting to be decoded")
+        lines.append(f"moonlight_queue_depth {snap['queue_depth']}")
+
+        lines.append("# TYPE moonlight_messages counter")
+        lines.append("# HELP moonlight_messages Messages decoded by type")
+        for name, count in sorted(snap["messages_by_type"].items()):
+            lines.append(f'moonlight_messages_total{{type="{_escape(name)}"}} {count}')
+
+        latency = snap["decode_latency"]
+        lines.append("# TYPE moonlight_decode_latency_seconds histogram")
+        lines.append("# HELP moonlight_decode_latency_seconds Time spent decoding")
+        for bound, total in latency["buckets"]:
+            le_str = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(
+                f'moonlight_decode_latency_seconds_bucket{{le="{le_str}"}} {total}'
+            )
+        lines.append(f"moonlight_decode_latency_seconds_sum {latency['sum']}")
+        lines.append(f"moonlight_decode_latency_seconds_count {latency['count']}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(label: str) -> str:
+    return label.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsServer:
+    """
+    Serves `DecodeMetrics` over HTTP at `/metrics` from a daemon thread
+    """
+
+    def __init__(
+        self, metrics: DecodeMetrics, port: int, host: str = "127.0.0.1"
+    ) -> None:
+        """
+        Args:
+            metrics (DecodeMetrics): metrics to serve
+            port (int): port to listen on. 0 picks a free port.
+            host (str, optional): address to bind. Defaults to localhost only.
+        """
+        self.metrics = metrics
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):  # pylint: disable=invalid-name
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render_openmetrics().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", OPENMETRICS_CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                logger.debug("metrics request: " + format, *args)
+
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def port(self) -> int:
+        """Port the server is bound to"""
+        return self.httpd.server_address[1]
+
+    def start(self) -> None:
+        """
+        start begins serving in the background
+        """
+        self._thread = threading.Thread(
+            target=self.httpd.serve_forever, name="moonlight-metrics", daemon=True
+        )
+        self._thread.start()
+        logger.info(
+            "Serving metrics on http://%s:%d/metrics", *self.httpd.server_address[:2]
+        )
+
+    def stop(self) -> None:
+        """
+        stop shuts the server down
+        """
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread:
+            self._thread.join()
+
+
+class MetricsLogReporter:
+    """
+    Logs a one-line summary of `DecodeMetrics` at a fixed interval
+    """
+
+    def __init__(
+        self, metrics: DecodeMetrics, interval: float, level: int = logging.INFO
+    ) -> None:
+        """
+        Args:
+            metrics (DecodeMetrics): metrics to summarize
+            interval (float): seconds between summaries
+            level (int, optional): log level of summaries. Defaults to INFO.
+        """
+        self.metrics = metrics
+        self.interval = interval
+        self.level = level
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._last: tuple[float, int] = (time.monotonic(), 0)
+
+    def log_summary(self) -> None:
+        """
+        log_summary logs the current totals and the packet rate since the
+            last summary
+        """
+        snap = self.metrics.snapshot()
+        now = time.monotonic()
+        last_time, last_packets = self._last
+        elapsed = now - last_time
+        rate = (snap["packets"] - last_packets) / elapsed if elapsed > 0 else 0.0
+        self._last = (now, snap["packets"])
+        p99 = snap["decode_latency"]["p99"]
+        logger.log(
+            self.level,
+            "metrics: packets=%d (%.1f/s) decoded=%d errors=%d dropped=%d "
+            "queue_depth=%d decode_p99=%s",
+            snap["packets"],
+            rate,
+            snap["decoded"],
+            snap["errors"],
+            snap["dropped"],
+            snap["queue_depth"],
+            "n/a" if p99 is None else f"<={p99 * 1000:g}ms",
+        )
+
+    def start(self) -> None:
+        """
+        start begins logging summaries in the background
+        """
+        self._thread = threading.Thread(
+            target=self._run, name="moonlight-metrics-log", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, final_summary: bool = True) -> None:
+        """
+        stop ends the background logging
+
+        Args:
+            final_summary (bool, optional): log one last summary.
+                Defaults to True.
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        if final_summary:
+            self.log_summary()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.log_summary()
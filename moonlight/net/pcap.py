@@ -0,0 +1,696 @@
+"""
+Scapy-free reading and writing of pcap capture files
+
+Scapy dissects every packet it reads and rebuilds every packet it writes,
+which is wasted work when all that's needed is to move records around.
+These utilities deal with capture records as plain bytes and only look at
+the link, IP and TCP headers needed to find KI traffic.
+"""
+
+from __future__ import annotations
+
+import gzip
+import ipaddress
+import lzma
+import struct
+import zlib
+import sys
+from array import array
+from dataclasses import dataclass
+from os import PathLike
+from typing import BinaryIO, Iterator
+
+from .compression import CaptureInput
+
+# https://www.tcpdump.org/linktypes.html
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LOOP = 108
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+PCAP_MAGIC_USEC = 0xA1B2C3D4
+PCAP_MAGIC_NSEC = 0xA1B23C4D
+PCAP_GLOBAL_HEADER = struct.Struct("<IHHiIII")
+PCAP_RECORD_HEADER = struct.Struct("<IIII")
+DEFAULT_SNAPLEN = 262144
+
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_IDB = 0x00000001
+PCAPNG_OPB = 0x00000002  # obsolete packet block
+PCAPNG_SPB = 0x00000003
+PCAPNG_EPB = 0x00000006
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+PCAPNG_OPT_IF_TSRESOL = 9
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = (0x8100, 0x88A8, 0x9100)
+IPPROTO_TCP = 6
+# IPv6 extension headers that can sit between the fixed header and TCP
+_IPV6_EXT_HEADERS = (0, 43, 60)
+
+_U16_BE = struct.Struct("!H")
+_U32_BE = struct.Struct("!I")
+_TCP_PORTS_SEQ = struct.Struct("!HHII")
+
+
+@dataclass(slots=True)
+class PcapRecord:
+    """
+    A record exactly as stored in a capture file. For classic pcap this is
+    the record header and frame, for pcapng the whole block. Only packet
+    records carry a link layer frame, found at `raw[data_offset:][:caplen]`.
+    """
+
+    raw: bytes
+    offset: int
+    is_packet: bool = True
+    timestamp: float = 0.0
+    linktype: int = LINKTYPE_ETHERNET
+    data_offset: int = 0
+    caplen: int = 0
+    orig_len: int = 0
+
+    @property
+    def data(self) -> bytes:
+        """The captured link layer frame"""
+        return self.raw[self.data_offset : self.data_offset + self.caplen]
+
+
+class CaptureFormatError(ValueError):
+    """The input is not a capture file this module understands"""
+
+
+class TruncatedCaptureError(CaptureFormatError):
+    """
+    The capture ends part way through a record. Captures that are still
+    being written can be read again from `offset` once more data arrives.
+    """
+
+    def __init__(self, message: str, offset: int) -> None:
+        super().__init__(message)
+        self.offset = offset
+
+
+class CaptureFileReader:
+    """
+    Sequential reader of classic pcap and pcapng files that hands out
+    records without dissecting them.
+
+    Iterating yields packet records only. `blocks` also yields the pcapng
+    blocks that don't hold packets so a file can be copied verbatim.
+    """
+
+    def __init__(
+        self, source: PathLike | str | BinaryIO, threaded_decompression: bool = False
+    ) -> None:
+        """
+        Args:
+            source (PathLike | str | BinaryIO): path or readable binary file
+                object positioned at the start of the capture. gzip, xz and
+                bzip2 compressed captures are decompressed while reading.
+                File objects are not closed by `close`.
+            threaded_decompression (bool, optional): decompress on a
+                background thread. Defaults to False.
+
+        Raises:
+            CaptureFormatError: the input isn't a pcap or pcapng file
+        """
+        self._input = CaptureInput(source, threaded=threaded_decompression)
+        self.file: BinaryIO = self._input.file
+        self.name = self._input.name
+        self.compression = self._input.compression
+        self.position = 0
+        # classic pcap global header, empty for pcapng
+        self.header = b""
+        self.linktype = LINKTYPE_ETHERNET
+        self.snaplen = DEFAULT_SNAPLEN
+
+        self._endian = "<"
+        self._ts_scale = 1e-6
+        # pcapng per interface (linktype, snaplen, timestamp scale)
+        self._interfaces: list[tuple[int, int, float]] = []
+
+        try:
+            magic = self._read(4)
+        except CaptureFormatError:
+            self.close()
+            raise
+        if len(magic) < 4:
+            self.close()
+            raise TruncatedCaptureError("Capture is empty or truncated", 0)
+        if _U32_BE.unpack(magic)[0] == PCAPNG_SHB:
+            self.format = "pcapng"
+            self._pending = magic
+        else:
+            self.format = "pcap"
+            self._pending = b""
+            self._read_global_header(magic)
+
+    def _read(self, size: int) -> bytes:
+        try:
+            bites = self.file.read(size)
+        except EOFError as err:
+            # gzip, xz and bzip2 streams that end before their trailer
+            raise TruncatedCaptureError(
+                f"Compressed capture is truncated after {self.position} bytes: {err}",
+                self.position,
+            ) from err
+        except (lzma.LZMAError, zlib.error, OSError) as err:
+            if self.compression is None:
+                raise
+            raise CaptureFormatError(f"Compressed capture is corrupt: {err}") from err
+        self.position += len(bites)
+        return bites
+
+    def _read_global_header(self, magic: bytes) -> None:
+        for endian in ("<", ">"):
+            (value,) = struct.unpack(endian + "I", magic)
+            if value in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC):
+                self._endian = endian
+                self._ts_scale = 1e-6 if value == PCAP_MAGIC_USEC else 1e-9
+                break
+        else:
+            self.close()
+            raise CaptureFormatError("Not a pcap or pcapng capture")
+        rest = self._read(PCAP_GLOBAL_HEADER.size - 4)
+        if len(rest) != PCAP_GLOBAL_HEADER.size - 4:
+            raise TruncatedCaptureError("Truncated pcap global header", 0)
+        self.header = magic + rest
+        _, _, _, _, _, self.snaplen, self.linktype = struct.unpack(
+            self._endian + "IHHiIII", self.header
+        )
+        # upper bits hold FCS info on some writers
+        self.linktype &= 0x0FFFFFFF
+        self._record_header = struct.Struct(self._endian + "IIII")
+
+    def __iter__(self) -> Iterator[PcapRecord]:
+        return (record for record in self.blocks() if record.is_packet)
+
+    def blocks(self) -> Iterator[PcapRecord]:
+        """
+        blocks yields every record in the file, including pcapng blocks
+            that don't contain packets
+
+        Raises:
+            CaptureFormatError: the file is corrupt or ends mid-record
+
+        Yields:
+            PcapRecord: next record
+        """
+        read_next = self._next_pcap if self.format == "pcap" else self._next_pcapng
+        while True:
+            record = read_next()
+            if record is None:
+                return
+            yield record
+
+    def _next_pcap(self) -> PcapRecord | None:
+        offset = self.position
+        header = self._read(PCAP_RECORD_HEADER.size)
+        if not header:
+            return None
+        if len(header) != PCAP_RECORD_HEADER.size:
+            raise TruncatedCaptureError(
+                f"Truncated record header at offset {offset}", offset
+            )
+        sec, frac, caplen, orig_len = self._record_header.unpack(header)
+        data = self._read(caplen)
+        if len(data) != caplen:
+            raise TruncatedCaptureError(f"Truncated record at offset {offset}", offset)
+        return PcapRecord(
+            raw=header + data,
+            offset=offset,
+            timestamp=sec + frac * self._ts_scale,
+            linktype=self.linktype,
+            data_offset=PCAP_RECORD_HEADER.size,
+            caplen=caplen,
+            orig_len=orig_len,
+        )
+
+    def _next_pcapng(self) -> PcapRecord | None:
+        offset = self.position - len(self._pending)
+        head = self._pending + self._read(8 - len(self._pending))
+        self._pending = b""
+        if not head:
+            return None
+        if len(head) != 8:
+            raise TruncatedCaptureError(
+                f"Truncated block header at offset {offset}", offset
+            )
+
+        (block_type,) = struct.unpack(self._endian + "I", head[:4])
+        if block_type == PCAPNG_SHB:
+            # the byte order magic decides how the length is read
+            order = self._read(4)
+            if len(order) != 4:
+                raise TruncatedCaptureError("Truncated section header block", offset)
+            self._endian = (
+                "<" if struct.unpack("<I", order)[0] == PCAPNG_BYTE_ORDER_MAGIC else ">"
+            )
+            head += order
+            self._interfaces = []
+        (total_len,) = struct.unpack(self._endian + "I", head[4:8])
+        if total_len < 12 or total_len % 4:
+            raise CaptureFormatError(f"Bad block length {total_len} at offset {offset}")
+        body = self._read(total_len - len(head))
+        if len(body) != total_len - len(head):
+            raise TruncatedCaptureError(f"Truncated block at offset {offset}", offset)
+        raw = head + body
+        return self._parse_block(block_type, raw, offset)
+
+    def _parse_block(self, block_type: int, raw: bytes, offset: int) -> PcapRecord:
+        endian = self._endian
+        if block_type == PCAPNG_IDB:
+            linktype, _, snaplen = struct.unpack_from(endian + "HHI", raw, 8)
+            self._interfaces.append((linktype, snaplen, _pcapng_ts_scale(raw, endian)))
+            if len(self._interfaces) == 1:
+                self.linktype, self.snaplen = linktype, snaplen
+            return PcapRecord(raw=raw, offset=offset, is_packet=False)
+
+        if block_type in (PCAPNG_EPB, PCAPNG_OPB):
+            if block_type == PCAPNG_EPB:
+                iface, ts_high, ts_low, caplen, orig_len = struct.unpack_from(
+                    endian + "IIIII", raw, 8
+                )
+            else:
+                iface, _, ts_high, ts_low, caplen, orig_len = struct.unpack_from(
+                    endian + "HHIIII", raw, 8
+                )
+            linktype, _, scale = self._interface(iface)
+            return PcapRecord(
+                raw=raw,
+                offset=offset,
+                timestamp=((ts_high << 32) | ts_low) * scale,
+                linktype=linktype,
+                data_offset=28,
+                caplen=min(caplen, len(raw) - 32),
+                orig_len=orig_len,
+            )
+
+        if block_type == PCAPNG_SPB:
+            (orig_len,) = struct.unpack_from(endian + "I", raw, 8)
+            linktype, snaplen, _ = self._interface(0)
+            return PcapRecord(
+                raw=raw,
+                offset=offset,
+                linktype=linktype,
+                data_offset=12,
+                caplen=min(orig_len, snaplen or orig_len, len(raw) - 16),
+                orig_len=orig_len,
+            )
+
+        return PcapRecord(raw=raw, offset=offset, is_packet=False)
+
+    def rewind(self, offset: int) -> None:
+        """
+        rewind moves back to the start of a record, typically the offset of a
+            `TruncatedCaptureError`, so it can be read again once complete
+
+        Args:
+            offset (int): file offset of a record boundary
+        """
+        self.file.seek(offset)
+        self.position = offset
+        self._pending = b""
+
+    def _interface(self, iface: int) -> tuple[int, int, float]:
+        try:
+            return self._interfaces[iface]
+        except IndexError as err:
+            raise CaptureFormatError(
+                f"Packet references unknown interface {iface}"
+            ) from err
+
+    def close(self) -> None:
+        """
+        close closes the underlying file if this reader opened it
+        """
+        self._input.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _pcapng_ts_scale(idb: bytes, endian: str) -> float:
+    """Reads the if_tsresol option of an interface description block"""
+    pos = 16
+    end = len(idb) - 4
+    while pos + 4 <= end:
+        code, length = struct.unpack_from(endian + "HH", idb, pos)
+        if code == 0:
+            break
+        if code == PCAPNG_OPT_IF_TSRESOL and length >= 1:
+            resol = idb[pos + 4]
+            if resol & 0x80:
+                return 2.0 ** -(resol & 0x7F)
+            return 10.0**-resol
+        pos += 4 + length + (-length % 4)
+    return 1e-6
+
+
+@dataclass(slots=True)
+class TcpSegment:
+    """
+    Location of a TCP segment within a buffer, as found by `parse_tcp`.
+    Offsets are absolute positions in the parsed buffer.
+    """
+
+    ip_version: int
+    src: bytes
+    dst: bytes
+    sport: int
+    dport: int
+    seq: int
+    ip_offset: int
+    tcp_offset: int
+    payload_offset: int
+    payload_len: int
+    # TCP length according to the IP header, even if the capture was truncated
+    tcp_len: int
+
+    def payload(self, buffer: bytes) -> bytes:
+        """
+        payload slices the TCP payload out of the buffer that was parsed
+
+        Args:
+            buffer (bytes): buffer given to `parse_tcp`
+
+        Returns:
+            bytes: TCP payload
+        """
+        return buffer[self.payload_offset : self.payload_offset + self.payload_len]
+
+    def is_complete(self, buffer: bytes) -> bool:
+        """
+        is_complete checks that the whole segment was captured, which is
+            required to recompute its checksum
+
+        Args:
+            buffer (bytes): buffer given to `parse_tcp`
+
+        Returns:
+            bool: the full segment is within the buffer
+        """
+        return self.tcp_offset + self.tcp_len <= len(buffer)
+
+
+def parse_tcp(  # pylint: disable=too-many-return-statements,too-many-branches
+    linktype: int, buffer: bytes, offset: int = 0, end: int | None = None
+) -> TcpSegment | None:
+    """
+    parse_tcp walks the link, IP and TCP headers of a frame
+
+    Args:
+        linktype (int): pcap link type of the frame
+        buffer (bytes): buffer holding the frame
+        offset (int, optional): start of the frame in the buffer. Defaults to 0.
+        end (int | None, optional): end of the captured frame in the buffer.
+            Defaults to the end of the buffer.
+
+    Returns:
+        TcpSegment | None: location of the TCP segment, or `None` if the
+            frame isn't an unfragmented TCP segment over IP
+    """
+    if end is None:
+        end = len(buffer)
+    pos = offset
+
+    # link layer
+    if linktype == LINKTYPE_ETHERNET:
+        if end - pos < 14:
+            return None
+        ethertype = _U16_BE.unpack_from(buffer, pos + 12)[0]
+        pos += 14
+        while ethertype in ETHERTYPE_VLAN:
+            if end - pos < 4:
+                return None
+            ethertype = _U16_BE.unpack_from(buffer, pos + 2)[0]
+            pos += 4
+    elif linktype == LINKTYPE_LINUX_SLL:
+        if end - pos < 16:
+            return None
+        ethertype = _U16_BE.unpack_from(buffer, pos + 14)[0]
+        pos += 16
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        if end - pos < 20:
+            return None
+        ethertype = _U16_BE.unpack_from(buffer, pos)[0]
+        pos += 20
+    elif linktype in (LINKTYPE_NULL, LINKTYPE_LOOP):
+        if end - pos < 4:
+            return None
+        # address family, host byte order for NULL. Just look at the IP version.
+        pos += 4
+        ethertype = None
+    elif linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        ethertype = None
+    else:
+        return None
+
+    if pos >= end:
+        return None
+    if ethertype is None:
+        version = buffer[pos] >> 4
+    elif ethertype == ETHERTYPE_IPV4:
+        version = 4
+    elif ethertype == ETHERTYPE_IPV6:
+        version = 6
+    else:
+        return None
+
+    # network layer
+    ip_offset = pos
+    if version == 4:
+        if end - pos < 20:
+            return None
+        ihl = (buffer[pos] & 0x0F) * 4
+        total_len = _U16_BE.unpack_from(buffer, pos + 2)[0]
+        frag = _U16_BE.unpack_from(buffer, pos + 6)[0]
+        if buffer[pos + 9] != IPPROTO_TCP or frag & 0x3FFF or ihl < 20:
+            return None
+        src = bytes(buffer[pos + 12 : pos + 16])
+        dst = bytes(buffer[pos + 16 : pos + 20])
+        tcp_len = total_len - ihl
+        pos += ihl
+    elif version == 6:
+        if end - pos < 40:
+            return None
+        tcp_len = _U16_BE.unpack_from(buffer, pos + 4)[0]
+        next_header = buffer[pos + 6]
+        src = bytes(buffer[pos + 8 : pos + 24])
+        dst = bytes(buffer[pos + 24 : pos + 40])
+        pos += 40
+        while next_header in _IPV6_EXT_HEADERS:
+            if end - pos < 8:
+                return None
+            ext_len = (buffer[pos + 1] + 1) * 8
+            next_header = buffer[pos]
+            tcp_len -= ext_len
+            pos += ext_len
+        if next_header != IPPROTO_TCP:
+            return None
+    else:
+        return None
+
+    # transport layer
+    if end - pos < 20:
+        return None
+    sport, dport, seq, _ = _TCP_PORTS_SEQ.unpack_from(buffer, pos)
+    data_offset = (buffer[pos + 12] >> 4) * 4
+    if data_offset < 20:
+        return None
+    payload_offset = pos + data_offset
+    # IP length excludes link layer padding, the capture length excludes
+    # whatever was cut off by the snaplen
+    payload_len = max(0, min(pos + tcp_len, end) - payload_offset)
+    return TcpSegment(
+        ip_version=version,
+        src=src,
+        dst=dst,
+        sport=sport,
+        dport=dport,
+        seq=seq,
+        ip_offset=ip_offset,
+        tcp_offset=pos,
+        payload_offset=payload_offset,
+        payload_len=payload_len,
+        tcp_len=tcp_len,
+    )
+
+
+def _ones_complement_sum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b"\x00"
+    words = array("H", data)
+    if sys.byteorder == "little":
+        words.byteswap()
+    total = sum(words)
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return total
+
+
+def fix_tcp_checksum(buffer: bytearray, segment: TcpSegment) -> None:
+    """
+    fix_tcp_checksum recomputes the checksum of a TCP segment in place
+
+    Args:
+        buffer (bytearray): buffer holding the segment, as given to `parse_tcp`
+        segment (TcpSegment): location of the segment
+
+    Raises:
+        ValueError: the segment was not fully captured
+    """
+    if not segment.is_complete(buffer):
+        raise ValueError("Cannot checksum a truncated TCP segment")
+    start = segment.tcp_offset
+    buffer[start + 16 : start + 18] = b"\x00\x00"
+    if segment.ip_version == 4:
+        pseudo = (
+            segment.src
+            + segment.dst
+            + struct.pack("!BBH", 0, IPPROTO_TCP, segment.tcp_len)
+        )
+    else:
+        pseudo = (
+            segment.src
+            + segment.dst
+            + struct.pack("!IxxxB", segment.tcp_len, IPPROTO_TCP)
+        )
+    total = _ones_complement_sum(pseudo) + _ones_complement_sum(
+        bytes(buffer[start : start + segment.tcp_len])
+    )
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    checksum = ~total & 0xFFFF
+    buffer[start + 16 : start + 18] = _U16_BE.pack(checksum)
+
+
+def build_tcp_frame(  # pylint: disable=too-many-arguments
+    payload: bytes,
+    src: str = "10.0.0.1",
+    dst: str = "10.0.0.2",
+    sport: int = 12000,
+    dport: int = 12000,
+    seq: int = 1,
+    ack: int = 0,
+) -> bytes:
+    """
+    build_tcp_frame wraps a payload in Ethernet, IPv4 and TCP headers with
+        a valid TCP checksum
+
+    Args:
+        payload (bytes): TCP payload
+        src (str, optional): source IPv4 address. Defaults to "10.0.0.1".
+        dst (str, optional): destination IPv4 address. Defaults to "10.0.0.2".
+        sport (int, optional): source port. Defaults to 12000.
+        dport (int, optional): destination port. Defaults to 12000.
+        seq (int, optional): sequence number. Defaults to 1.
+        ack (int, optional): acknowledgment number. Defaults to 0.
+
+    Returns:
+        bytes: LINKTYPE_ETHERNET frame
+    """
+    ether = b"\x02" * 6 + b"\x04" * 6 + _U16_BE.pack(ETHERTYPE_IPV4)
+    ip = struct.pack(
+        "!BBHHHBBH4s4s",
+        0x45,
+        0,
+        20 + 20 + len(payload),
+        0,
+        0x4000,  # don't fragment
+        64,
+        IPPROTO_TCP,
+        0,
+        ipaddress.IPv4Address(src).packed,
+        ipaddress.IPv4Address(dst).packed,
+    )
+    # PSH ACK
+    tcp = struct.pack("!HHIIBBHHH", sport, dport, seq, ack, 5 << 4, 0x18, 65535, 0, 0)
+    frame = bytearray(ether + ip + tcp + payload)
+    fix_tcp_checksum(frame, parse_tcp(LINKTYPE_ETHERNET, frame))  # type: ignore
+    return bytes(frame)
+
+
+class PcapWriter:
+    """
+    Writes classic (libpcap) capture files with microsecond timestamps
+    """
+
+    def __init__(
+        self,
+        target: PathLike | str | BinaryIO,
+        linktype: int = LINKTYPE_ETHERNET,
+        snaplen: int = DEFAULT_SNAPLEN,
+        compress: bool = False,
+    ) -> None:
+        """
+        Args:
+            target (PathLike | str | BinaryIO): path or writable binary
+                file object. File objects are not closed by `close`.
+            linktype (int, optional): link layer of every record.
+                Defaults to LINKTYPE_ETHERNET.
+            snaplen (int, optional): advertised max record length.
+                Defaults to DEFAULT_SNAPLEN.
+            compress (bool, optional): gzip the output. Defaults to False.
+        """
+        self.linktype = linktype
+        self._owns_file = not hasattr(target, "write")
+        if self._owns_file:
+            raw = open(target, "wb")  # pylint: disable=consider-using-with
+        else:
+            raw = target
+        self._raw = raw
+        self.file: BinaryIO = (
+            gzip.GzipFile(fileobj=raw, mode="wb") if compress else raw  # type: ignore
+        )
+        self.file.write(
+            PCAP_GLOBAL_HEADER.pack(PCAP_MAGIC_USEC, 2, 4, 0, 0, snaplen, linktype)
+        )
+
+    def write(self, timestamp: float, data: bytes, orig_len: int | None = None):
+        """
+        write appends a record to the capture
+
+        Args:
+            timestamp (float): unix timestamp of the record
+            data (bytes): captured link layer frame
+            orig_len (int | None, optional): length of the frame on the wire
+                if it was truncated while capturing. Defaults to len(data).
+        """
+        sec = int(timestamp)
+        usec = int(round((timestamp - sec) * 1_000_000))
+        if usec >= 1_000_000:
+            sec += 1
+            usec -= 1_000_000
+        self.file.write(
+            PCAP_RECORD_HEADER.pack(
+                sec, usec, len(data), len(data) if orig_len is None else orig_len
+            )
+        )
+        self.file.write(data)
+
+    def close(self) -> None:
+        """
+        close flushes and closes the capture
+        """
+        if self.file is not self._raw:
+            self.file.close()
+        if self._owns_file:
+            self._raw.close()
+        else:
+            self._raw.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
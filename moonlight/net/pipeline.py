@@ -0,0 +1,249 @@
+"""
+Decoupling of packet capture from packet decoding
+
+Sniffing threads must never wait on decoding or user code, otherwise the
+kernel starts dropping packets. `DecodePipeline` accepts raw payloads from
+a capture thread into a bounded queue and leaves the decoding and callback
+work to a pool of worker threads.
+"""
+
+from __future__ import annotations
+
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from enum import Enum
+from typing import Any, Callable
+
+from .common import Message
+from .metrics import DecodeMetrics
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class OverflowPolicy(Enum):
+    """What to do with a payload when the decode queue is full"""
+
+    # wait for a worker to make room. Capture stalls, nothing is lost here.
+    BLOCK = "block"
+    # discard the oldest queued payload to make room for the new one
+    DROP_OLDEST = "drop-oldest"
+    # discard the new payload
+    DROP_NEWEST = "drop-newest"
+
+    @classmethod
+    def from_str(cls, name: str | OverflowPolicy) -> OverflowPolicy:
+        """
+        from_str gets the policy with the given value, passing through
+            existing policies
+
+        Args:
+            name (str | OverflowPolicy): policy value such as "drop-oldest"
+
+        Raises:
+            ValueError: no policy goes by the given name
+
+        Returns:
+            OverflowPolicy: policy described by the given name
+        """
+        if isinstance(name, cls):
+            return name
+        return cls(str(name).lower().replace("_", "-"))
+
+
+@dataclass(kw_only=True)
+class CapturedPayload:
+    """
+    Raw KI payload and the capture metadata needed to decode it later
+    """
+
+    payload: bytes
+    timestamp: datetime
+    sport: int | None = None
+    dport: int | None = None
+    # source packet handed back to callbacks. Never touched by the pipeline.
+    packet: Any = None
+
+
+@dataclass(kw_only=True)
+class PipelineCounters:
+    """Running totals of what happened to submitted payloads"""
+
+    enqueued: int = 0
+    dropped_oldest: int = 0
+    dropped_newest: int = 0
+    decoded: int = 0
+    errors: int = 0
+
+    @property
+    def dropped(self) -> int:
+        """Total number of payloads dropped for any reason"""
+        return self.dropped_oldest + self.dropped_newest
+
+
+class DecodePipeline:
+    """
+    Bounded queue of captured payloads consumed by decode worker threads.
+
+    Payloads are decoded with `decode` and every message that comes out of
+    it is handed to `callback` along with the payload it came from. With
+    more than one worker, callbacks may be invoked out of capture order and
+    from several threads at once.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        decode: Callable[[CapturedPayload], Message | None],
+        callback: Callable[[Message, CapturedPayload], None],
+        queue_size: int = 10000,
+        workers: int = 1,
+        overflow: OverflowPolicy | str = OverflowPolicy.BLOCK,
+        metrics: DecodeMetrics | None = None,
+    ) -> None:
+        """
+        Args:
+            decode (Callable): turns a captured payload into a message. May
+                return `None` for payloads that should be skipped.
+            callback (Callable): receives each decoded message
+            queue_size (int, optional): maximum number of payloads waiting
+                to be decoded. Defaults to 10000.
+            workers (int, optional): number of decode threads. Defaults to 1.
+            overflow (OverflowPolicy | str, optional): behavior when the
+                queue is full. Defaults to OverflowPolicy.BLOCK.
+            metrics (DecodeMetrics | None, optional): instrumentation to
+                update with packet, drop, latency and queue depth numbers.
+                Defaults to None.
+        """
+        if queue_size < 1:
+            raise ValueError("queue_size must be at least 1")
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+
+        self.decode = decode
+        self.callback = callback
+        self.workers = workers
+        self.overflow = OverflowPolicy.from_str(overflow)
+        self.counters = PipelineCounters()
+        self.metrics = metrics
+        if metrics is not None and metrics.queue_depth is None:
+            metrics.queue_depth = self.depth
+
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._submit_lock = threading.Lock()
+        self._counter_lock = threading.Lock()
+        self._threads: list[threading.Thread] = []
+
+    def start(self) -> None:
+        """
+        start launches the worker threads. Does nothing if already running.
+        """
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._work, name=f"moonlight-decode-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, drain: bool = True, timeout: float | None = None) -> None:
+        """
+        stop shuts down the worker threads
+
+        Args:
+            drain (bool, optional): decode everything still queued before
+                stopping. Otherwise, queued payloads are discarded and
+                counted as dropped. Defaults to True.
+            timeout (float | None, optional): seconds to wait for each
+                worker to exit. Defaults to None (forever).
+        """
+        if not drain:
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not _STOP:
+                    self._count("dropped_oldest")
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, item: CapturedPayload) -> bool:
+        """
+        submit queues a payload for decoding, applying the overflow policy
+            if the queue is full. Safe to call from the capture thread.
+
+        Args:
+            item (CapturedPayload): payload to decode
+
+        Returns:
+            bool: `True` if the payload was queued, `False` if it was dropped
+        """
+        if self.metrics is not None:
+            self.metrics.record_packet(len(item.payload))
+        if self.overflow is OverflowPolicy.BLOCK:
+            self._queue.put(item)
+            self._count("enqueued")
+            return True
+
+        with self._submit_lock:
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                if self.overflow is OverflowPolicy.DROP_NEWEST:
+                    self._count("dropped_newest")
+                    return False
+                # DROP_OLDEST: a worker may empty the queue between these
+                # calls, in which case there's nothing to drop
+                try:
+                    self._queue.get_nowait()
+                    self._count("dropped_oldest")
+                except queue.Empty:
+                    pass
+                self._queue.put_nowait(item)
+        self._count("enqueued")
+        return True
+
+    def depth(self) -> int:
+        """
+        depth is the approximate number of payloads waiting to be decoded
+
+        Returns:
+            int: queue depth
+        """
+        return self._queue.qsize()
+
+    def _count(self, counter: str, amount: int = 1) -> None:
+        with self._counter_lock:
+            setattr(self.counters, counter, getattr(self.counters, counter) + amount)
+        if self.metrics is not None and counter.startswith("dropped"):
+            self.metrics.record_drop(amount)
+
+    def _work(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            try:
+                start = time.perf_counter()
+                msg = self.decode(item)
+                if self.metrics is not None:
+                    self.metrics.record_decode(msg, time.perf_counter() - start)
+                if msg is None:
+                    continue
+                self._count("decoded")
+                self.callback(msg, item)
+            except Exception:  # pylint: disable=broad-except
+                # a worker must survive anything a single payload throws at it
+                self._count("errors")
+                if self.metrics is not None:
+                    self.metrics.record_error()
+                logger.exception("Decode worker failed to process a payload")
@@ -0,0 +1,298 @@
+"""
+Fixed-memory recording of recent traffic
+
+`RingRecorder` keeps the most recent captured KI frames in memory so the
+traffic leading up to an interesting moment can be written out after the
+fact, without recording everything to disk all the time.
+"""
+
+from __future__ import annotations
+
+import logging
+import signal
+import threading
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from os import PathLike
+from pathlib import Path
+from typing import Callable, cast
+
+from .common import Message
+from .pcap import LINKTYPE_ETHERNET, PcapWriter
+
+logger = logging.getLogger(__name__)
+
+# rough per-frame bookkeeping cost on top of the frame itself
+_FRAME_OVERHEAD = 128
+
+
+@dataclass(kw_only=True, frozen=True)
+class RecordedFrame:
+    """A captured link layer frame and its flow metadata"""
+
+    timestamp: float
+    frame: bytes
+    linktype: int = LINKTYPE_ETHERNET
+    sport: int | None = None
+    dport: int | None = None
+
+
+class RingRecorder:
+    """
+    In-memory ring buffer of recently captured frames, bounded by total
+    size and optionally by age. Frames are evicted oldest first.
+
+    Dumps are written to pcap on a background thread so that neither the
+    capture thread nor the decode workers wait on disk. Dumps requested by a
+    signal are started from a watcher thread, see `install_signal_handler`.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 64 * 1024 * 1024,
+        max_age: float | None = None,
+        dump_dir: PathLike | str = ".",
+        compress: bool = False,
+        min_dump_interval: float = 0.0,
+    ) -> None:
+        """
+        Args:
+            max_bytes (int, optional): memory budget for held frames.
+                Defaults to 64 MiB.
+            max_age (float | None, optional): seconds of traffic to keep,
+                measured back from the newest frame. Defaults to None
+                (only limited by size).
+            dump_dir (PathLike | str, optional): folder that dumps without an
+                explicit path are written to. Defaults to ".".
+            compress (bool, optional): gzip dumps. Defaults to False.
+            min_dump_interval (float, optional): minimum seconds between
+                dumps started by triggers, so a burst of matching messages
+                doesn't produce a burst of files. Defaults to 0.
+        """
+        if max_bytes < 1:
+            raise ValueError("max_bytes must be positive")
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.dump_dir = Path(dump_dir)
+        self.compress = compress
+        self.min_dump_interval = min_dump_interval
+        self.triggers: list[Callable[[Message], bool]] = []
+        self.held_bytes = 0
+        self.evicted = 0
+
+        self._frames: deque[RecordedFrame] = deque()
+        self._lock = threading.Lock()
+        self._last_triggered_dump: float | None = None
+        # dumps may be started from any decode worker
+        self._dump_threads_lock = threading.Lock()
+        self._dump_threads: list[threading.Thread] = []
+        self._dump_requested: threading.Event | None = None
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def record(
+        self,
+        timestamp: float,
+        frame: bytes,
+        linktype: int = LINKTYPE_ETHERNET,
+        sport: int | None = None,
+        dport: int | None = None,
+    ) -> None:
+        """
+        record adds a frame to the buffer, evicting old frames as needed.
+            Cheap enough to call from a capture thread.
+
+        Args:
+            timestamp (float): unix capture time
+            frame (bytes): full link layer frame
+            linktype (int, optional): pcap link type of the frame.
+                Defaults to LINKTYPE_ETHERNET.
+            sport (int | None, optional): TCP source port. Defaults to None.
+            dport (int | None, optional): TCP destination port. Defaults to None.
+        """
+        item = RecordedFrame(
+            timestamp=timestamp,
+            frame=frame,
+            linktype=linktype,
+            sport=sport,
+            dport=dport,
+        )
+        with self._lock:
+            self._frames.append(item)
+            self.held_bytes += len(frame) + _FRAME_OVERHEAD
+            self._evict(timestamp)
+
+    def _evict(self, newest: float) -> None:
+        frames = self._frames
+        while frames and (
+            self.held_bytes > self.max_bytes
+            or (
+                self.max_age is not None and newest - frames[0].timestamp > self.max_age
+            )
+        ):
+            old = frames.popleft()
+            self.held_bytes -= len(old.frame) + _FRAME_OVERHEAD
+            self.evicted += 1
+
+    def snapshot(self) -> list[RecordedFrame]:
+        """
+        snapshot copies the frames currently held, oldest first
+
+        Returns:
+            list[RecordedFrame]: held frames
+        """
+        with self._lock:
+            return list(self._frames)
+
+    def clear(self) -> None:
+        """
+        clear drops every held frame
+        """
+        with self._lock:
+            self._frames.clear()
+            self.held_bytes = 0
+
+    def default_dump_path(self) -> Path:
+        """
+        default_dump_path makes a timestamped path within `dump_dir`
+
+        Returns:
+            Path: unused dump path
+        """
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        suffix = ".pcap.gz" if self.compress else ".pcap"
+        return self.dump_dir / f"moonlight-ring-{stamp}{suffix}"
+
+    def dump(self, path: PathLike | str | None = None, background: bool = True) -> Path:
+        """
+        dump writes the frames currently held to a pcap file. The frames
+            are copied immediately, so traffic recorded after this call is
+            not included.
+
+        Args:
+            path (PathLike | str | None, optional): output path. Defaults to
+                a timestamped file in `dump_dir`.
+            background (bool, optional): write on a background thread and
+                return immediately. Defaults to True.
+
+        Returns:
+            Path: path being written to
+        """
+        frames = self.snapshot()
+        out = Path(path) if path is not None else self.default_dump_path()
+        if not background:
+            self._write(out, frames)
+            return out
+
+        thread = threading.Thread(
+            target=self._write, args=(out, frames), name="moonlight-ring-dump"
+        )
+        thread.start()
+        with self._dump_threads_lock:
+            self._dump_threads = [t for t in self._dump_threads if t.is_alive()]
+            self._dump_threads.append(thread)
+        return out
+
+    def wait_for_dumps(self, timeout: float | None = None) -> None:
+        """
+        wait_for_dumps blocks until background dumps finish
+
+        Args:
+            timeout (float | None, optional): seconds to wait for each dump.
+                Defaults to None (forever).
+        """
+        with self._dump_threads_lock:
+            threads = list(self._dump_threads)
+        for thread in threads:
+            thread.join(timeout)
+        with self._dump_threads_lock:
+            self._dump_threads = [t for t in self._dump_threads if t.is_alive()]
+
+    def _write(self, out: Path, frames: list[RecordedFrame]) -> None:
+        if not frames:
+            logger.warning("Ring buffer is empty. Writing an empty capture to %s", out)
+        linktype = frames[0].linktype if frames else LINKTYPE_ETHERNET
+        skipped = 0
+        try:
+            with PcapWriter(out, linktype=linktype, compress=self.compress) as writer:
+                for frame in frames:
+                    # a pcap file can only hold a single link type
+                    if frame.linktype != linktype:
+                        skipped += 1
+                        continue
+                    writer.write(frame.timestamp, frame.frame)
+        except OSError:
+            logger.exception("Failed to dump ring buffer to %s", out)
+            return
+        if skipped:
+            logger.warning(
+                "Skipped %d frames with a link type other than %d", skipped, linktype
+            )
+        logger.info(
+            "Dumped %d frames from ring buffer to %s", len(frames) - skipped, out
+        )
+
+    def add_trigger(self, predicate: Callable[[Message], bool]) -> None:
+        """
+        add_trigger registers a condition on decoded messages that starts a
+            dump when met. See `check_triggers`.
+
+        Args:
+            predicate (Callable[[Message], bool]): returns `True` for
+                messages that should cause a dump
+        """
+        self.triggers.append(predicate)
+
+    def check_triggers(self, msg: Message) -> Path | None:
+        """
+        check_triggers starts a background dump if the message matches any
+            trigger and the last triggered dump is old enough
+
+        Args:
+            msg (Message): decoded message
+
+        Returns:
+            Path | None: dump path if one was started
+        """
+        if not any(trigger(msg) for trigger in self.triggers):
+            return None
+        with self._lock:
+            now = self._frames[-1].timestamp if self._frames else 0.0
+            last = self._last_triggered_dump
+            if last is not None and now - last < self.min_dump_interval:
+                return None
+            self._last_triggered_dump = now
+        return self.dump()
+
+    def install_signal_handler(self, signum: int | None = None) -> None:
+        """
+        install_signal_handler dumps the buffer whenever the process
+            receives a signal. Must be called from the main thread.
+
+            The handler only flags the request and a watcher thread starts
+            the dump. The signal can interrupt the main thread while it
+            holds the buffer's lock in `record`, so the handler itself
+            must not take it.
+
+        Args:
+            signum (int | None, optional): signal to listen for.
+                Defaults to SIGUSR1.
+        """
+        if signum is None:
+            signum = signal.SIGUSR1  # not defined on windows
+        if self._dump_requested is None:
+            self._dump_requested = threading.Event()
+            threading.Thread(
+                target=self._dump_on_request, name="moonlight-ring-signal", daemon=True
+            ).start()
+        requested = self._dump_requested
+        signal.signal(signum, lambda _signum, _frame: requested.set())
+
+    def _dump_on_request(self) -> None:
+        requested = cast(threading.Event, self._dump_requested)
+        while True:
+            requested.wait()
+            requested.clear()
+            self.dump()
@@ -0,0 +1,268 @@
+"""
+Rules-driven redaction of DML message fields in raw KI payloads
+
+A `Redactor` precomputes where each redacted field sits within its
+message from the `DMLMessageDef` layout, then blanks those bytes in place.
+Fields before the first variable length field are at a fixed offset, so
+only messages that redact something after a string need to walk the
+length prefixes. Nothing is decoded into `DMLMessage` objects, and
+redacted payloads keep their length so TCP framing is untouched.
+"""
+
+from __future__ import annotations
+
+import logging
+import struct
+from dataclasses import dataclass, field
+from typing import Iterable
+
+from .common import DML_HEADER_LEN, PACKET_HEADER_LEN, DMLType
+from .dml import DMLMessageDef, DMLProtocolRegistry
+from .filter import KI_MAGIC, signed_msg_span
+
+logger = logging.getLogger(__name__)
+
+# uint16 length prefix followed by that many bytes
+VARIABLE_LENGTH_TYPES = (DMLType.STR, DMLType.WSTR, DMLType.PO_STR, DMLType.PO_WSTR)
+# service id, message id, message length
+_DML_FRAME_PREFIX = PACKET_HEADER_LEN + DML_HEADER_LEN + 2
+_U16_LE = struct.Struct("<H")
+
+
+@dataclass(frozen=True)
+class RedactionRule:
+    """
+    A field to redact. `message` of `None` matches the field in every
+    message that has it.
+    """
+
+    field: str
+    message: str | None = None
+
+    @classmethod
+    def parse(cls, rule: str) -> RedactionRule:
+        """
+        parse reads a rule written as "MSG_NAME.FieldName" or "FieldName"
+
+        Args:
+            rule (str): rule string
+
+        Raises:
+            ValueError: rule is empty or malformed
+
+        Returns:
+            RedactionRule: parsed rule
+        """
+        message, _, field_name = rule.strip().rpartition(".")
+        if not field_name or (message == "" and "." in rule):
+            raise ValueError(f"Malformed redaction rule '{rule}'")
+        return cls(field=field_name, message=message or None)
+
+    def matches(self, msg_def: DMLMessageDef, field_name: str) -> bool:
+        """
+        matches checks whether this rule covers a field of a message
+
+        Args:
+            msg_def (DMLMessageDef): message definition
+            field_name (str): field name within the message
+
+        Returns:
+            bool: the field should be redacted
+        """
+        return field_name == self.field and self.message in (None, msg_def.name)
+
+
+@dataclass
+class _MessagePlan:
+    # (offset, length) relative to the start of the fields, all fixed
+    static_spans: list[tuple[int, int]] = field(default_factory=list)
+    # first field that isn't at a fixed offset and its offset
+    walk_from: int = 0
+    walk_offset: int = 0
+    # field types from walk_from up to the last redacted field, with whether
+    # each should be redacted
+    walk: list[tuple[DMLType, bool]] = field(default_factory=list)
+
+
+def _plan_message(
+    msg_def: DMLMessageDef, rules: list[RedactionRule]
+) -> _MessagePlan | None:
+    redacted = [any(r.matches(msg_def, f.name) for r in rules) for f in msg_def.fields]
+    if not any(redacted):
+        return None
+
+    plan = _MessagePlan()
+    offset = 0
+    index = 0
+    for index, field_def in enumerate(msg_def.fields):
+        if field_def.dml_type in VARIABLE_LENGTH_TYPES:
+            break
+        if redacted[index]:
+            plan.static_spans.append((offset, field_def.dml_type.length))
+        offset += field_def.dml_type.length
+    else:
+        index = len(msg_def.fields)
+
+    plan.walk_from = index
+    plan.walk_offset = offset
+    if any(redacted[index:]):
+        last = max(i for i, is_redacted in enumerate(redacted) if is_redacted)
+        plan.walk = [
+            (msg_def.fields[i].dml_type, redacted[i]) for i in range(index, last + 1)
+        ]
+    return plan
+
+
+@dataclass(kw_only=True)
+class RedactionStats:
+    """Totals of what a `Redactor` changed"""
+
+    frames: int = 0
+    fields: int = 0
+    signed_messages: int = 0
+    truncated: int = 0
+    failures: int = 0
+
+
+class Redactor:
+    """
+    Blanks configured DML fields and, optionally, session offer/accept
+    signatures within raw KI payloads.
+    """
+
+    def __init__(
+        self,
+        registry: DMLProtocolRegistry | None = None,
+        rules: Iterable[str | RedactionRule] = (),
+        signed_messages: bool = True,
+    ) -> None:
+        """
+        Args:
+            registry (DMLProtocolRegistry | None, optional): message
+                definitions used to locate fields. Required if any rules
+                are given. Defaults to None.
+            rules (Iterable[str | RedactionRule], optional): fields to blank.
+                See `RedactionRule.parse` for the string form. Defaults to ().
+            signed_messages (bool, optional): also zero session offer/accept
+                signed messages. Defaults to True.
+
+        Raises:
+            ValueError: a rule doesn't match any field in the registry
+        """
+        self.rules = [
+            r if isinstance(r, RedactionRule) else RedactionRule.parse(r) for r in rules
+        ]
+        self.signed_messages = signed_messages
+        self.stats = RedactionStats()
+        self._plans: dict[tuple[int, int], _MessagePlan] = {}
+
+        if self.rules and registry is None:
+            raise ValueError("Message definitions are required to redact fields")
+        if registry is not None:
+            self._build_plans(registry)
+
+    def _build_plans(self, registry: DMLProtocolRegistry) -> None:
+        used: set[RedactionRule] = set()
+        for protocol in registry.protocol_map.values():
+            for msg_id, msg_def in protocol.message_map.items():
+                plan = _plan_message(msg_def, self.rules)
+                if plan is None:
+                    continue
+                self._plans[(protocol.id, msg_id)] = plan
+                used.update(
+                    r
+                    for r in self.rules
+                    for f in msg_def.fields
+                    if r.matches(msg_def, f.name)
+                )
+        unused = [r for r in self.rules if r not in used]
+        if unused:
+            raise ValueError(f"Redaction rules match no message field: {unused}")
+        logger.debug("Redacting fields in %d message types", len(self._plans))
+
+    def redact(self, buffer: bytearray, start: int = 0, end: int | None = None) -> int:
+        """
+        redact blanks every configured field in the KI frames of a payload,
+            in place. Frames that run past `end` are left untouched.
+
+        Args:
+            buffer (bytearray): buffer holding the payload
+            start (int, optional): start of the payload. Defaults to 0.
+            end (int | None, optional): end of the payload. Defaults to the
+                end of the buffer.
+
+        Returns:
+            int: number of fields and signatures redacted
+        """
+        if end is None:
+            end = len(buffer)
+        changes = 0
+        pos = start
+        while end - pos >= PACKET_HEADER_LEN and buffer[pos : pos + 2] == KI_MAGIC:
+            frame_end = pos + 4 + _U16_LE.unpack_from(buffer, pos + 2)[0]
+            if frame_end > end:
+                self.stats.truncated += 1
+                break
+            self.stats.frames += 1
+            if buffer[pos + 4]:
+                changes += self._redact_control(buffer, pos, frame_end)
+            elif self._plans:
+                changes += self._redact_dml(buffer, pos, frame_end)
+            pos = frame_end
+        return changes
+
+    def _redact_control(self, buffer: bytearray, start: int, end: int) -> int:
+        if not self.signed_messages:
+            return 0
+        try:
+            span = signed_msg_span(buffer, start, end)
+        except ValueError:
+            self.stats.failures += 1
+            logger.error(
+                "Could not locate signed message in control frame", exc_info=True
+            )
+            return 0
+        if span is None:
+            return 0
+        offset, length = span
+        buffer[offset : offset + length] = bytes(length)
+        self.stats.signed_messages += 1
+        return 1
+
+    def _redact_dml(self, buffer: bytearray, start: int, end: int) -> int:
+        if end - start < _DML_FRAME_PREFIX:
+            return 0
+        plan = self._plans.get(
+            (buffer[start + PACKET_HEADER_LEN], buffer[start + PACKET_HEADER_LEN + 1])
+        )
+        if plan is None:
+            return 0
+
+        base = start + _DML_FRAME_PREFIX
+        changes = 0
+        for offset, length in plan.static_spans:
+            if base + offset + length > end:
+                self.stats.truncated += 1
+                return changes
+            buffer[base + offset : base + offset + length] = bytes(length)
+            changes += 1
+
+        pos = base + plan.walk_offset
+        for dml_type, is_redacted in plan.walk:
+            if dml_type in VARIABLE_LENGTH_TYPES:
+                if pos + 2 > end:
+                    self.stats.truncated += 1
+                    break
+                length = _U16_LE.unpack_from(buffer, pos)[0]
+                pos += 2
+            else:
+                length = dml_type.length
+            if pos + length > end:
+                self.stats.truncated += 1
+                break
+            if is_redacted:
+                buffer[pos : pos + length] = bytes(length)
+                changes += 1
+            pos += length
+        self.stats.fields += changes
+        return changes
@@ -0,0 +1,361 @@
+"""
+Message definitions of several client revisions at once
+
+Definitions change a little with every game update, so captures from
+different clients need different definition folders. `RevisionRegistry`
+holds one `DMLProtocolRegistry` per revision. Identical definitions are
+shared between revisions through a `DefinitionInterner`:
+- fields with the same name, type and flags are one `FieldDef`
+- messages with the same metadata and fields in a protocol with the same
+  metadata are one `DMLMessageDef`
+- protocols with the same metadata and messages are one `DMLProtocol`
+
+Revisions that mostly match cost little more memory than a single one.
+
+Shared definitions belong to whichever revision loaded them first. A
+message's `protocol()` may therefore be another revision's protocol object,
+but always one with the same id, type, version and description.
+"""
+
+from __future__ import annotations
+
+import threading
+from os import PathLike
+from typing import Any, BinaryIO, Hashable, Iterator
+
+from .decode import PacketReader
+from .detect import DetectionResult, RevisionCache, detect_capture_revision
+from .dml import DMLMessage, DMLMessageDef, DMLProtocol, DMLProtocolRegistry, FieldDef
+
+
+class DefinitionInterner:
+    """
+    Canonical instances of structurally identical definitions
+    """
+
+    def __init__(self) -> None:
+        self._fields: dict[tuple, FieldDef] = {}
+        self._messages: dict[tuple, DMLMessageDef] = {}
+        self._protocols: dict[tuple, DMLProtocol] = {}
+        # seen and kept definitions by kind
+        self.seen = {"fields": 0, "messages": 0, "protocols": 0}
+
+    def field(self, field_def: FieldDef) -> FieldDef:
+        """
+        field gets the canonical instance of a field definition
+
+        Args:
+            field_def (FieldDef): field definition
+
+        Returns:
+            FieldDef: first identical definition interned
+        """
+        decoder = field_def.po_decoder
+        key = (
+            field_def.name,
+            field_def.dml_type,
+            field_def.noxfer,
+            decoder.flags,
+            decoder.property_mask,
+            decoder.exhaustive,
+        )
+        self.seen["fields"] += 1
+        return self._fields.setdefault(key, field_def)
+
+    @staticmethod
+    def _protocol_key(protocol: DMLProtocol) -> tuple:
+        return (protocol.id, protocol.type, protocol.version, protocol.desc)
+
+    def message(self, msg_def: DMLMessageDef) -> DMLMessageDef:
+        """
+        message gets the canonical instance of a message definition,
+            interning its fields first
+
+        Args:
+            msg_def (DMLMessageDef): message definition. Its fields are
+                replaced by their canonical instances.
+
+        Returns:
+            DMLMessageDef: first identical definition interned
+        """
+        msg_def.fields = [self.field(f) for f in msg_def.fields]
+        key = (
+            self._protocol_key(msg_def.protocol),
+            msg_def.name,
+            msg_def.order_id,
+            msg_def.desc,
+            msg_def.handler,
+            msg_def.compiled,
+            # fields are canonical, so their identity is their structure
+            tuple(id(f) for f in msg_def.fields),
+        )
+        self.seen["messages"] += 1
+        return self._messages.setdefault(key, msg_def)
+
+    def protocol(self, protocol: DMLProtocol) -> DMLProtocol:
+        """
+        protocol gets the canonical instance of a protocol, interning its
+            messages first
+
+        Args:
+            protocol (DMLProtocol): protocol. Its messages are replaced by
+                their canonical instances.
+
+        Returns:
+            DMLProtocol: first identical protocol interned
+        """
+        protocol.message_map = {
+            msg_id: self.message(msg_def)
+            for msg_id, msg_def in protocol.message_map.items()
+        }
+        key = (
+            self._protocol_key(protocol),
+            tuple(
+                (msg_id, id(m)) for msg_id, m in sorted(protocol.message_map.items())
+            ),
+        )
+        self.seen["protocols"] += 1
+        return self._protocols.setdefault(key, protocol)
+
+    def registry(self, registry: DMLProtocolRegistry) -> DMLProtocolRegistry:
+        """
+        registry interns every protocol of a registry in place
+
+        Args:
+            registry (DMLProtocolRegistry): registry to share definitions of
+
+        Returns:
+            DMLProtocolRegistry: `registry`
+        """
+        for service_id in list(registry.protocol_map):
+            registry.protocol_map[service_id] = self.protocol(
+                registry.protocol_map[service_id]
+            )
+        return registry
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """
+        stats counts the definitions seen and the distinct ones kept
+
+        Returns:
+            dict[str, dict[str, int]]: "seen" and "unique" count by kind
+        """
+        unique = {
+            "fields": len(self._fields),
+            "messages": len(self._messages),
+            "protocols": len(self._protocols),
+        }
+        return {
+            kind: {"seen": self.seen[kind], "unique": unique[kind]} for kind in unique
+        }
+
+
+class RevisionRegistry:
+    """
+    Named revisions of message definitions sharing identical definitions.
+    Revisions are chosen per capture by name, or per flow with
+    `assign_flow`. Thread safe.
+    """
+
+    def __init__(self, workers: int | None = None) -> None:
+        """
+        Args:
+            workers (int | None, optional): processes parsing each
+                revision's definitions, see `DMLProtocolRegistry`.
+                Defaults to None.
+        """
+        self.workers = workers
+        self.interner = DefinitionInterner()
+        # revision used for flows without one
+        self.default: str | None = None
+        self._revisions: dict[str, DMLProtocolRegistry] = {}
+        self._folders: dict[str, PathLike | None] = {}
+        self._flows: dict[Hashable, str] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, msg_def_folder: PathLike) -> DMLProtocolRegistry:
+        """
+        add loads a revision from a message definition folder. The first
+            revision added becomes the default.
+
+        Args:
+            name (str): revision name, such as the client version
+            msg_def_folder (PathLike): folder containing the revision's
+                message definitions
+
+        Raises:
+            ValueError: the name is taken or the definitions are invalid
+
+        Returns:
+            DMLProtocolRegistry: the revision's definitions
+        """
+        registry = PacketReader(msg_def_folder, load_workers=self.workers).dml_protocol
+        return self.add_registry(name, registry, msg_def_folder)
+
+    def add_registry(
+        self,
+        name: str,
+        registry: DMLProtocolRegistry,
+        msg_def_folder: PathLike | None = None,
+    ) -> DMLProtocolRegistry:
+        """
+        add_registry adds already loaded definitions as a revision. Their
+            definitions are replaced in place by shared ones.
+
+        Args:
+            name (str): revision name
+            registry (DMLProtocolRegistry): the revision's definitions
+            msg_def_folder (PathLike | None, optional): folder the
+                definitions came from. Defaults to None.
+
+        Raises:
+            ValueError: the name is taken
+
+        Returns:
+            DMLProtocolRegistry: `registry`
+        """
+        with self._lock:
+            if name in self._revisions:
+                raise ValueError(f"Revision {name} is already loaded")
+            self.interner.registry(registry)
+            self._revisions[name] = registry
+            self._folders[name] = msg_def_folder
+            if self.default is None:
+                self.default = name
+        return registry
+
+    def __getitem__(self, name: str) -> DMLProtocolRegistry:
+        return self._revisions[name]
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._revisions
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._revisions))
+
+    def __len__(self) -> int:
+        return len(self._revisions)
+
+    def folder(self, name: str) -> PathLike | None:
+        """
+        folder gets the definition folder a revision was loaded from
+
+        Args:
+            name (str): revision name
+
+        Returns:
+            PathLike | None: folder, or None if added as a registry
+        """
+        return self._folders[name]
+
+    def reader(self, name: str, **kwargs: Any) -> PacketReader:
+        """
+        reader makes a `PacketReader` decoding with a revision
+
+        Args:
+            name (str): revision name
+            **kwargs: other `PacketReader` arguments
+
+        Returns:
+            PacketReader: reader sharing the revision's definitions
+        """
+        return PacketReader(self._folders[name], dml_protocol=self[name], **kwargs)
+
+    def assign_flow(self, flow_key: Hashable, name: str) -> None:
+        """
+        assign_flow decodes a flow with a revision from now on
+
+        Args:
+            flow_key (Hashable): identifies a connection, such as its
+                addresses and ports
+            name (str): revision name
+
+        Raises:
+            KeyError: the revision isn't loaded
+        """
+        if name not in self._revisions:
+            raise KeyError(name)
+        with self._lock:
+            self._flows[flow_key] = name
+
+    def forget_flow(self, flow_key: Hashable) -> None:
+        """
+        forget_flow drops a flow's revision, e.g. once it is closed
+
+        Args:
+            flow_key (Hashable): flow to forget
+        """
+        with self._lock:
+            self._flows.pop(flow_key, None)
+
+    def revision_for(self, flow_key: Hashable | None = None) -> str:
+        """
+        revision_for gets the revision a flow is decoded with
+
+        Args:
+            flow_key (Hashable | None, optional): flow. Defaults to None,
+                the default revision.
+
+        Raises:
+            KeyError: no revision is loaded
+
+        Returns:
+            str: revision name
+        """
+        name = (
+            self._flows.get(flow_key, self.default)
+            if flow_key is not None
+            else self.default
+        )
+        if name is None:
+            raise KeyError("No revision loaded")
+        return name
+
+    def decode_packet(
+        self, bites: bytes, flow_key: Hashable | None = None, has_ki_header: bool = True
+    ) -> DMLMessage:
+        """
+        decode_packet decodes a DML message with the revision of its flow
+
+        Args:
+            bites (bytes): message payload
+            flow_key (Hashable | None, optional): flow the message belongs
+                to. Defaults to None, the default revision.
+            has_ki_header (bool, optional): `bites` starts with the KI
+                frame header. Defaults to True.
+
+        Raises:
+            ValueError: the payload isn't a message of the revision
+
+        Returns:
+            DMLMessage: decoded message
+        """
+        return self[self.revision_for(flow_key)].decode_packet(
+            bites, has_ki_header=has_ki_header
+        )
+
+    def detect(
+        self,
+        source: PathLike | str | BinaryIO,
+        cache: RevisionCache | None = None,
+        **kwargs: Any,
+    ) -> DetectionResult:
+        """
+        detect finds the loaded revision a capture was recorded with, see
+            `moonlight.net.detect.detect_capture_revision`
+
+        Args:
+            source (PathLike | str | BinaryIO): capture, optionally
+                compressed
+            cache (RevisionCache | None, optional): detected revisions by
+                capture hash, only used if every revision was added with
+                its folder. Defaults to None.
+            **kwargs: sampling options
+
+        Returns:
+            DetectionResult: detected revision
+        """
+        folders = {name: self._folders[name] for name in self}
+        return detect_capture_revision(
+            self, source, cache=cache, folders=folders, **kwargs
+        )
@@ -0,0 +1,133 @@
+"""
+Header-only scanning of KI frames in captures
+
+Indexing and statistics only need to know where each KI frame is and what
+kind of message it holds. `scan_capture` finds that from the link/IP/TCP
+headers, the KI header and the DML service and message ids, without
+decoding any message fields or needing message definitions.
+"""
+
+from __future__ import annotations
+
+import struct
+from dataclasses import dataclass
+from os import PathLike
+from typing import BinaryIO, Iterator
+
+from .common import PACKET_HEADER_LEN
+from .dedupe import SegmentDeduplicator
+from .filter import KI_MAGIC
+from .pcap import CaptureFileReader, PcapRecord, TcpSegment, parse_tcp
+
+_U16_LE = struct.Struct("<H")
+# KI header followed by the DML service and message ids
+_DML_IDS_LEN = PACKET_HEADER_LEN + 2
+
+
+@dataclass(slots=True)
+class KIFrame:
+    """
+    A KI frame found in a TCP payload. `length` is the full frame length the
+    KI header declares, which may run past the end of the segment.
+    """
+
+    offset: int
+    length: int
+    available: int
+    is_control: bool
+    # control opcode for control frames, 0 otherwise
+    opcode: int
+    # DML ids, 0 for control frames
+    service_id: int
+    message_id: int
+
+    @property
+    def complete(self) -> bool:
+        """Whether the whole frame is within the segment"""
+        return self.available >= self.length
+
+
+def iter_ki_frames(
+    buffer: bytes, start: int = 0, end: int | None = None
+) -> Iterator[KIFrame]:
+    """
+    iter_ki_frames walks the KI frames laid back to back in a payload,
+        stopping at anything that doesn't start with the KI magic
+
+    Args:
+        buffer (bytes): buffer holding the payload
+        start (int, optional): start of the payload. Defaults to 0.
+        end (int | None, optional): end of the payload. Defaults to the end
+            of the buffer.
+
+    Yields:
+        KIFrame: frames with at least their headers present
+    """
+    if end is None:
+        end = len(buffer)
+    pos = start
+    while end - pos >= PACKET_HEADER_LEN and buffer[pos : pos + 2] == KI_MAGIC:
+        length = _U16_LE.unpack_from(buffer, pos + 2)[0] + 4
+        is_control = bool(buffer[pos + 4])
+        if is_control:
+            frame = KIFrame(pos, length, end - pos, True, buffer[pos + 5], 0, 0)
+        elif end - pos >= _DML_IDS_LEN:
+            frame = KIFrame(
+                pos,
+                length,
+                end - pos,
+                False,
+                0,
+                buffer[pos + PACKET_HEADER_LEN],
+                buffer[pos + PACKET_HEADER_LEN + 1],
+            )
+        else:
+            return
+        yield frame
+        if length < PACKET_HEADER_LEN:
+            return
+        pos += length
+
+
+def scan_capture(
+    source: PathLike | str | BinaryIO,
+    deduplicator: SegmentDeduplicator | None = None,
+    threaded_decompression: bool = False,
+) -> Iterator[tuple[int, PcapRecord, TcpSegment, KIFrame]]:
+    """
+    scan_capture finds every KI frame in a capture in a single sequential
+        pass
+
+    Args:
+        source (PathLike | str | BinaryIO): capture to scan, optionally
+            compressed
+        deduplicator (SegmentDeduplicator | None, optional): skips
+            retransmitted and duplicated segments. Defaults to None.
+        threaded_decompression (bool, optional): decompress on a background
+            thread. Defaults to False.
+
+    Yields:
+        tuple[int, PcapRecord, TcpSegment, KIFrame]: packet record number
+            (from 0, counting every packet), its record, TCP segment and a
+            frame within it
+    """
+    with CaptureFileReader(
+        source, threaded_decompression=threaded_decompression
+    ) as reader:
+        for number, record in enumerate(reader):
+            raw = record.raw
+            segment = parse_tcp(
+                record.linktype,
+                raw,
+                record.data_offset,
+                record.data_offset + record.caplen,
+            )
+            if segment is None or segment.payload_len < PACKET_HEADER_LEN:
+                continue
+            start = segment.payload_offset
+            if raw[start : start + 2] != KI_MAGIC:
+                continue
+            if deduplicator is not None and deduplicator.is_duplicate_segment(segment):
+                continue
+            for frame in iter_ki_frames(raw, start, start + segment.payload_len):
+                yield number, record, segment, frame
@@ -3,4 +3,12 @@ Classes related to working with pcap files. Since importing `scapy`
 is a very heavy operation, lazily import this package whenever possible.
 """
 
-from .capture import is_ki_packet_naive, LiveSniffer, PcapReader, filter_pcap
+from .capture import (
+    is_ki_packet_naive,
+    LiveSniffer,
+    MergedPcapReader,
+    PcapReader,
+    PcapReplayer,
+    ReplayStats,
+    filter_pcap,
+)
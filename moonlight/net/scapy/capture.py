@@ -2,39 +2,55 @@
 
 from __future__ import annotations
 
+import heapq
 import logging
 import os
 import os.path
-import traceback
+import threading
+import time
+from dataclasses import dataclass
 from datetime import datetime
 from os import PathLike, listdir
 from os.path import isfile
 from pathlib import Path
-from typing import Callable, cast
+from typing import BinaryIO, Callable, cast
 from moonlight.net.control import ControlMessage
 
 # scapy on import prints warnings about system interfaces
 # pylint: disable=wrong-import-position disable=wrong-import-order
 logging.getLogger("scapy.runtime").setLevel(logging.ERROR)
+from scapy.config import conf
 from scapy.layers.inet import TCP
 from scapy.packet import Packet, Raw
 from scapy.sendrecv import AsyncSniffer
 from scapy.sessions import TCPSession
 from scapy.utils import PcapReader as Scapy_PcapReader
-from scapy.utils import PcapWriter as Scapy_PcapWriter
 
 # and now let's set that back
 logging.getLogger("scapy.runtime").setLevel(logging.WARNING)
 # pylint: enable=wrong-import-position
 
 from moonlight.net import (
+    CapturedPayload,
+    DecodeMetrics,
+    DecodePipeline,
+    DMLProtocolRegistry,
     KIHeader,
     Message,
     MessageSender,
+    OverflowPolicy,
     PacketReader,
+    RingRecorder,
+    SegmentDeduplicator,
     SessionAcceptMessage,
     SessionOfferMessage,
 )
+from moonlight.net.compression import is_compressed
+from moonlight.net.filter import filter_pcap  # pylint: disable=unused-import
+from moonlight.net.follow import CaptureFollower
+from moonlight.net.metrics import message_type_name
+from moonlight.net.pcap import LINKTYPE_ETHERNET, CaptureFileReader, CaptureFormatError
+from moonlight.util import active_profiler, stage
 
 logger = logging.getLogger(__name__)
 SENSITIVE_MSG_OPCODES = [SessionAcceptMessage.OPCODE, SessionOfferMessage.OPCODE]
@@ -83,32 +99,111 @@ def is_flagtool_packet_naive(packet: Packet) -> bool:
     return packet[TCP].dport == MessageSender.FLAGTOOL.value
 
 
+class _RecordScapyReader:
+    """
+    Adapts moonlight's own capture readers to the interface of scapy's
+    `PcapReader`, for inputs scapy can't read such as pipes
+    """
+
+    def __init__(self, source: CaptureFileReader | CaptureFollower) -> None:
+        self.source = source
+        self._records = iter(source)
+
+    def next(self) -> Packet:
+        """Reads the next record, blocking if the source is live, and dissects it"""
+        record = next(self._records)
+        layer = conf.l2types.get(record.linktype, conf.raw_layer)
+        packet = layer(record.data)
+        packet.time = record.timestamp
+        return packet
+
+    def close(self) -> None:
+        """Stops reading and closes the source"""
+        if isinstance(self.source, CaptureFollower):
+            self.source.stop()
+        self._records.close()
+        self.source.close()
+
+
 class PcapReader(PacketReader):
     """
     PcapReader is a wrapper around `scapy.utils.PcapReader` for traffic
         moonlight is capable of decoding. Packets that are not determined
         to be from a supported system are ignored.
+
+    A capture that ends part way through a record, the usual end of a
+    stream from `tcpdump -w -`, or that turns out to be corrupt ends
+    iteration like the end of the capture. The error is kept in
+    `capture_error`.
     """
 
     def __init__(
         self,
-        pcap_path: PathLike,
+        pcap_path: PathLike | BinaryIO,
         msg_def_folder: PathLike,
         typedef_path: PathLike | None = None,
         silence_decode_errors: bool = False,
+        metrics: DecodeMetrics | None = None,
+        deduplicator: SegmentDeduplicator | None = None,
+        dml_protocol: DMLProtocolRegistry | None = None,
+        follower: CaptureFollower | None = None,
+        threaded_decompression: bool = False,
+        lazy_definitions: bool = False,
     ) -> None:
+        """
+        Args:
+            pcap_path (PathLike | BinaryIO): capture file to read, or a
+                readable binary stream such as stdin. Streams are read
+                incrementally and don't need to be seekable. gzip, xz and
+                bzip2 compressed captures are decompressed while reading.
+            msg_def_folder (PathLike): folder containing extracted root wad
+                message definitions
+            typedef_path (PathLike | None, optional): wizwalker typedefs.
+                Defaults to None.
+            silence_decode_errors (bool, optional): return None instead of
+                raising when a message cannot be decoded. Defaults to False.
+            metrics (DecodeMetrics | None, optional): instrumentation updated
+                as packets are read and decoded. Defaults to None.
+            deduplicator (SegmentDeduplicator | None, optional): skips
+                retransmitted and duplicated TCP segments. Defaults to None.
+            dml_protocol (DMLProtocolRegistry | None, optional): already
+                loaded definitions to use instead of `msg_def_folder`.
+                Defaults to None.
+            follower (CaptureFollower | None, optional): read records from
+                this follower as they are written instead of stopping at the
+                end of `pcap_path`. Defaults to None.
+            threaded_decompression (bool, optional): decompress compressed
+                captures on a background thread. Defaults to False.
+            lazy_definitions (bool, optional): parse each protocol when a
+                message of it is first decoded. Defaults to False.
+        """
         super().__init__(
             msg_def_folder,
             typedef_path=typedef_path,
             silence_decode_errors=silence_decode_errors,
+            dml_protocol=dml_protocol,
+            lazy_definitions=lazy_definitions,
         )
-        if not isfile(pcap_path):
-            raise ValueError("Provided pcap filepath doesn't exist")
-
+        self.metrics = metrics
+        self.deduplicator = deduplicator
         self.pcap_path = pcap_path
-        self.pcap_reader = Scapy_PcapReader(filename=str(pcap_path))
+        if follower is not None:
+            self.pcap_reader = _RecordScapyReader(follower)
+        elif not hasattr(pcap_path, "read") and not isfile(pcap_path):
+            raise ValueError("Provided pcap filepath doesn't exist")
+        elif hasattr(pcap_path, "read") or is_compressed(pcap_path):
+            # streams and compressed files are read by moonlight itself
+            self.pcap_reader = _RecordScapyReader(
+                CaptureFileReader(
+                    pcap_path, threaded_decompression=threaded_decompression
+                )
+            )
+        else:
+            self.pcap_reader = Scapy_PcapReader(filename=str(pcap_path))
         self.last_decoded: Message | None = None
         self.last_decoded_raw: Packet | None = None
+        # why reading stopped before the end of the capture, if it did
+        self.capture_error: CaptureFormatError | None = None
 
     def __iter__(self):
         return self
@@ -123,26 +218,66 @@ class PcapReader(PacketReader):
                 the end of the capture
         """
         while True:
-            packet = self.pcap_reader.next()
+            with stage("read"):
+                try:
+                    packet = self.pcap_reader.next()
+                except CaptureFormatError as err:
+                    self.capture_error = err
+                    logger.warning("Stopped reading %s: %s", self._input_name(), err)
+                    raise StopIteration() from err
             if not (
                 is_interesting_packet_naive(packet)
                 and (is_ki_packet_naive(packet) or is_flagtool_packet_naive(packet))
             ):
                 continue
+            if self.deduplicator is not None and self._is_duplicate(packet):
+                continue
             self.last_decoded = None
             self.last_decoded_raw = packet
             return packet
         return None
 
+    def _input_name(self) -> str:
+        if hasattr(self.pcap_path, "read"):
+            return str(getattr(self.pcap_path, "name", "stream"))
+        return str(self.pcap_path)
+
+    def _is_duplicate(self, packet: Packet) -> bool:
+        tcp = packet[TCP]
+        ip_layer = tcp.underlayer
+        return self.deduplicator.is_duplicate(
+            (ip_layer.src, ip_layer.dst, tcp.sport, tcp.dport),
+            tcp.seq,
+            len(tcp.payload),
+        )
+
     def __next__(self) -> Message:
         pkt = self.next_interesting_raw()
         if pkt is None:
             raise StopIteration()
 
-        if is_flagtool_packet_naive(pkt):
-            msg = self.decode_flagtool_packet(bytes(pkt[TCP].payload))
-        else:  # this is an already checked assumption in next_interesting_raw
-            msg = self.decode_ki_packet(bytes(pkt[TCP].payload))
+        payload = bytes(pkt[TCP].payload)
+        start = time.perf_counter()
+        try:
+            if is_flagtool_packet_naive(pkt):
+                msg = self.decode_flagtool_packet(payload)
+            else:  # this is an already checked assumption in next_interesting_raw
+                msg = self.decode_ki_packet(payload)
+        except ValueError:
+            if self.metrics is not None:
+                self.metrics.record_packet(len(payload))
+                self.metrics.record_error()
+            raise
+        if self.metrics is not None:
+            self.metrics.record_packet(len(payload))
+            self.metrics.record_decode(msg, time.perf_counter() - start)
+            if msg is None:
+                self.metrics.record_error()
+        profiler = active_profiler()
+        if profiler is not None and msg is not None:
+            profiler.add_message(
+                message_type_name(msg), "decode", time.perf_counter() - start
+            )
 
         # populate capture-only data since, well, this is a capture
         if msg is not None:
@@ -164,12 +299,144 @@ class PcapReader(PacketReader):
         self.close()
 
 
+class MergedPcapReader(PcapReader):
+    """
+    MergedPcapReader reads several captures as if they were one, yielding
+        messages in global timestamp order. Useful for rotated captures or
+        client and server sides recorded separately.
+
+    Files are merged with a heap holding only the next interesting packet of
+    each file, so memory doesn't grow with capture size. Message definitions
+    are loaded once and shared by every file. Deduplication happens after
+    merging, so a segment recorded in two files is only decoded once.
+    """
+
+    def __init__(  # pylint: disable=super-init-not-called too-many-arguments
+        self,
+        pcap_paths: list[PathLike | BinaryIO],
+        msg_def_folder: PathLike,
+        typedef_path: PathLike | None = None,
+        silence_decode_errors: bool = False,
+        metrics: DecodeMetrics | None = None,
+        deduplicator: SegmentDeduplicator | None = None,
+        dml_protocol: DMLProtocolRegistry | None = None,
+        threaded_decompression: bool = False,
+        lazy_definitions: bool = False,
+    ) -> None:
+        """
+        Args:
+            pcap_paths (list[PathLike | BinaryIO]): capture files or streams
+                to read
+            msg_def_folder (PathLike): folder containing extracted root wad
+                message definitions
+            typedef_path (PathLike | None, optional): wizwalker typedefs.
+                Defaults to None.
+            silence_decode_errors (bool, optional): return None instead of
+                raising when a message cannot be decoded. Defaults to False.
+            metrics (DecodeMetrics | None, optional): instrumentation updated
+                as packets are read and decoded. Defaults to None.
+            deduplicator (SegmentDeduplicator | None, optional): skips
+                retransmitted and duplicated TCP segments across all files.
+                Defaults to None.
+            dml_protocol (DMLProtocolRegistry | None, optional): already
+                loaded definitions to use instead of `msg_def_folder`.
+                Defaults to None.
+            threaded_decompression (bool, optional): decompress compressed
+                captures on background threads. Defaults to False.
+            lazy_definitions (bool, optional): parse each protocol when a
+                message of it is first decoded. Defaults to False.
+        """
+        if not pcap_paths:
+            raise ValueError("At least one pcap file is required")
+        PacketReader.__init__(
+            self,
+            msg_def_folder,
+            typedef_path=typedef_path,
+            silence_decode_errors=silence_decode_errors,
+            dml_protocol=dml_protocol,
+            lazy_definitions=lazy_definitions,
+        )
+        self.metrics = metrics
+        self.deduplicator = deduplicator
+        self.pcap_paths = list(pcap_paths)
+        self.last_decoded: Message | None = None
+        self.last_decoded_raw: Packet | None = None
+
+        self.readers: list[PcapReader] = []
+        try:
+            for path in self.pcap_paths:
+                self.readers.append(
+                    PcapReader(
+                        path,
+                        None,
+                        dml_protocol=self.dml_protocol,
+                        threaded_decompression=threaded_decompression,
+                    )
+                )
+        except Exception:
+            self.close()
+            raise
+
+        # (timestamp, file index, packet). The index breaks ties by file order
+        self._heap: list[tuple[float, int, Packet]] = []
+        for index in range(len(self.readers)):
+            self._refill(index)
+
+    def _refill(self, index: int) -> None:
+        try:
+            packet = self.readers[index].next_interesting_raw()
+        except StopIteration:
+            return
+        if packet is not None:
+            heapq.heappush(self._heap, (float(packet.time), index, packet))
+
+    def next_interesting_raw(self) -> Packet | None:
+        """
+        next_interesting_raw gets the earliest packet of interest across all
+            captures
+
+        Raises:
+            StopIteration: every capture is exhausted
+
+        Returns:
+            scapy.packet.Packet | None: next interesting packet
+        """
+        while self._heap:
+            _, index, packet = heapq.heappop(self._heap)
+            self._refill(index)
+            if self.deduplicator is not None and self._is_duplicate(packet):
+                continue
+            self.last_decoded = None
+            self.last_decoded_raw = packet
+            return packet
+        raise StopIteration()
+
+    @property
+    def capture_error(self) -> CaptureFormatError | None:
+        """The error that stopped the first capture read only in part"""
+        return next(
+            (r.capture_error for r in self.readers if r.capture_error is not None), None
+        )
+
+    def close(self) -> None:
+        """
+        close closes every wrapped pcap reader
+        """
+        for reader in self.readers:
+            reader.close()
+
+
 class LiveSniffer(PacketReader):
     """
     Live traffic sniffer for Wizard101. Relies on the connection being unencrypted
+
+    The sniffing thread only copies KI payloads into a bounded queue. Decoding,
+    logging and the user callback happen on a pool of worker threads so that
+    slow callbacks don't cause the capture itself to drop packets. See
+    `moonlight.net.pipeline.DecodePipeline` for the queue's behavior.
     """
 
-    def __init__(
+    def __init__(  # pylint: disable=too-many-arguments
         self,
         filter_str: str,
         callback: Callable[[Message, Packet], None],
@@ -178,37 +445,94 @@ class LiveSniffer(PacketReader):
         client_port: int | None = None,
         typedef_path: PathLike | None = None,
         silence_decode_errors: bool = False,
+        queue_size: int = 10000,
+        workers: int = 1,
+        overflow: OverflowPolicy | str = OverflowPolicy.BLOCK,
+        metrics: DecodeMetrics | None = None,
+        recorder: RingRecorder | None = None,
     ):
+        """
+        Args:
+            queue_size (int, optional): maximum number of captured payloads
+                waiting to be decoded. Defaults to 10000.
+            workers (int, optional): number of decode threads. Callbacks are
+                only guaranteed to be called in capture order with a single
+                worker. Defaults to 1.
+            overflow (OverflowPolicy | str, optional): what to do when the
+                queue is full. Defaults to OverflowPolicy.BLOCK.
+            metrics (DecodeMetrics | None, optional): instrumentation updated
+                with capture rates, queue depth and decode results.
+                Defaults to None.
+            recorder (RingRecorder | None, optional): ring buffer receiving
+                every captured KI frame. Its triggers are checked against
+                each decoded message. Defaults to None.
+        """
         super().__init__(msg_def_folder, typedef_path, silence_decode_errors)
+        self.metrics = metrics
+        self.recorder = recorder
         self.filter_str = filter_str
         self.callback = callback
         self.iface = iface
         self.client_port = client_port
         self.sniffer = None
+        self.pipeline = DecodePipeline(
+            decode=self._decode_captured,
+            callback=self._deliver,
+            queue_size=queue_size,
+            workers=workers,
+            overflow=overflow,
+            metrics=metrics,
+        )
 
     def _scapy_callback(self, pkt: Packet):
+        # runs on the sniffing thread: keep this as cheap as possible
         if not is_interesting_packet_naive(pkt) or not is_ki_packet_naive(pkt):
             return
+        if self.recorder is not None:
+            self.recorder.record(
+                float(pkt.time),
+                bytes(pkt),
+                linktype=conf.l2types.layer2num.get(type(pkt), LINKTYPE_ETHERNET),
+                sport=pkt[TCP].sport,
+                dport=pkt[TCP].dport,
+            )
+        self.pipeline.submit(
+            CapturedPayload(
+                payload=bytes(pkt[TCP].payload),
+                timestamp=datetime.fromtimestamp(float(pkt.time)),
+                sport=pkt[TCP].sport,
+                dport=pkt[TCP].dport,
+                packet=pkt,
+            )
+        )
+
+    def _decode_captured(self, item: CapturedPayload) -> Message | None:
         try:
-            self._extracted_from__scapy_callback_5(pkt)
+            message = self.decode_ki_packet(item.payload)
         except ValueError as err:
             if str(err).startswith("Not a KI game protocol packet."):
                 logger.debug(err)
-                return
-            logger.error("Cannot parse packet: %s", traceback.print_exc())
-
-    # TODO Rename this here and in `_scapy_callback`
-    def _extracted_from__scapy_callback_5(self, pkt):
-        bites = bytes(pkt[TCP].payload)
-        message = self.decode_ki_packet(bites)
-        message.timestamp = datetime.now()
-        if pkt[TCP].dport == self.client_port:
+                return None
+            # counted and periodically logged by self.error_tracker
+            if self.metrics is not None:
+                self.metrics.record_error()
+            return None
+        if message is None:
+            return None
+
+        message.timestamp = item.timestamp
+        if item.dport == self.client_port:
             message.sender = MessageSender.CLIENT
         elif self.client_port:
             message.sender = MessageSender.SERVER
 
         logger.debug("Captured message: %s", message)
-        self.callback(message, pkt)
+        return message
+
+    def _deliver(self, message: Message, item: CapturedPayload):
+        if self.recorder is not None:
+            self.recorder.check_triggers(message)
+        self.callback(message, item.packet)
 
     def open_livestream(self):
         """
@@ -221,10 +545,26 @@ class LiveSniffer(PacketReader):
             prn=self._scapy_callback,
             iface=self.iface,
         )
+        self.pipeline.start()
         logger.info("Starting sniffer")
         self.sniffer.start()
         logger.info("Waiting for end signal (SIGINT)")
-        self.sniffer.join()
+        try:
+            self.sniffer.join()
+        finally:
+            self._stop_pipeline()
+
+    def _stop_pipeline(self):
+        self.pipeline.stop()
+        counters = self.pipeline.counters
+        logger.info(
+            "Sniffer stopped. queued=%d decoded=%d dropped=%d errors=%d",
+            counters.enqueued,
+            counters.decoded,
+            counters.dropped,
+            counters.errors,
+        )
+        self.error_tracker.log_summary()
 
     def close_livestream(self, join=True):
         """
@@ -240,6 +580,139 @@ class LiveSniffer(PacketReader):
             self.sniffer.stop(join=join)
 
 
+@dataclass(kw_only=True)
+class ReplayStats:
+    """Throughput of a finished `PcapReplayer` run"""
+
+    packets: int
+    ki_packets: int
+    elapsed: float
+    capture_duration: float
+
+    @property
+    def packets_per_second(self) -> float:
+        """KI packets fed into the pipeline per wall clock second"""
+        return self.ki_packets / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def speedup(self) -> float:
+        """How much faster than real time the capture was replayed"""
+        return self.capture_duration / self.elapsed if self.elapsed > 0 else 0.0
+
+
+class PcapReplayer(LiveSniffer):
+    """
+    Feeds a capture file through the same queue, workers and callbacks as
+    `LiveSniffer`, paced by the packet timestamps. Useful for load testing
+    live consumers without a network interface.
+    """
+
+    def __init__(
+        self,
+        pcap_path: PathLike | BinaryIO,
+        callback: Callable[[Message, Packet], None],
+        msg_def_folder: PathLike,
+        speed: float | None = 1.0,
+        threaded_decompression: bool = False,
+        **kwargs,
+    ):
+        """
+        Args:
+            pcap_path (PathLike | BinaryIO): capture file to replay, or a
+                readable binary stream such as stdin. gzip, xz and bzip2
+                compressed captures are decompressed while reading.
+            callback (Callable[[Message, Packet], None]): see `LiveSniffer`
+            msg_def_folder (PathLike): see `LiveSniffer`
+            speed (float | None, optional): replay speed relative to the
+                capture's timestamps. 1 is real time, 10 is ten times faster.
+                `None` or 0 replays as fast as possible. Defaults to 1.0.
+            threaded_decompression (bool, optional): decompress compressed
+                captures on a background thread. Defaults to False.
+            kwargs: any other `LiveSniffer` argument
+        """
+        kwargs.setdefault("filter_str", None)
+        kwargs.setdefault("iface", None)
+        super().__init__(callback=callback, msg_def_folder=msg_def_folder, **kwargs)
+        if not hasattr(pcap_path, "read") and not isfile(pcap_path):
+            raise ValueError("Provided pcap filepath doesn't exist")
+        if speed is not None and speed < 0:
+            raise ValueError("speed cannot be negative")
+        self.pcap_path = pcap_path
+        self.speed = speed or None
+        self.threaded_decompression = threaded_decompression
+        self.replay_stats: ReplayStats | None = None
+        self._stop_replay = threading.Event()
+
+    def open_livestream(self):
+        """
+        open_livestream replays the capture, returning once every packet has
+            been decoded and delivered or `close_livestream` was called
+        """
+        self._stop_replay.clear()
+        self.pipeline.start()
+        logger.info("Replaying %s at %s", self.pcap_path, self._speed_str())
+        packets = 0
+        ki_before = self.pipeline.counters.enqueued
+        first_ts = last_ts = None
+        wall_start = time.monotonic()
+        reader = None
+        try:
+            reader = _RecordScapyReader(
+                CaptureFileReader(
+                    self.pcap_path, threaded_decompression=self.threaded_decompression
+                )
+            )
+            while not self._stop_replay.is_set():
+                try:
+                    pkt = reader.next()
+                except StopIteration:
+                    break
+                pkt_ts = float(pkt.time)
+                if first_ts is None:
+                    first_ts = pkt_ts
+                last_ts = pkt_ts
+                if self.speed is not None:
+                    delay = (
+                        wall_start + (pkt_ts - first_ts) / self.speed - time.monotonic()
+                    )
+                    if delay > 0 and self._stop_replay.wait(delay):
+                        break
+                packets += 1
+                self._scapy_callback(pkt)
+        finally:
+            if reader is not None:
+                reader.close()
+            self._stop_pipeline()
+            self.replay_stats = ReplayStats(
+                packets=packets,
+                ki_packets=self.pipeline.counters.enqueued - ki_before,
+                elapsed=time.monotonic() - wall_start,
+                capture_duration=0.0 if first_ts is None else last_ts - first_ts,
+            )
+            logger.info(
+                "Replay finished: %d packets (%d KI) in %.3fs, %.1f KI packets/s, "
+                "%.2fx real time",
+                self.replay_stats.packets,
+                self.replay_stats.ki_packets,
+                self.replay_stats.elapsed,
+                self.replay_stats.packets_per_second,
+                self.replay_stats.speedup,
+            )
+
+    def close_livestream(self, join=True):
+        """
+        close_livestream stops an ongoing replay. Packets already queued are
+            still decoded before `open_livestream` returns.
+
+        Args:
+            join (bool, optional): unused, kept for `LiveSniffer` compatibility.
+        """
+        self._stop_replay.set()
+
+    def _speed_str(self) -> str:
+        return "full speed" if self.speed is None else f"{self.speed:g}x"
+
+
 def sanitize_signed_msg(pkt_reader: PacketReader, payload: bytes) -> bytes:
     """
     sanitize_signed_msg takes messages with sensitive info (session offer/accept)
@@ -317,75 +790,3 @@ def sanitize_signed_msg(pkt_reader: PacketReader, payload: bytes) -> bytes:
                 "Unable to sanitize session accept due to decode error"
             ) from exc
     return payload
-
-
-def filter_pcap(
-    msg_def_folder: PathLike,
-    p_in: Path,
-    p_out: Path,
-    compress: bool = False,
-    sanitize: bool = False,
-) -> None:
-    """
-    filter_pcap removes traffic that moonlight cannot parse from a pcap file.
-        Optionally, it can also remove sensitive data from Wizard101 messages,
-        mainly session information.
-
-    Args:
-        msg_def_folder: path to message definitions
-        p_in (Path): pcap file to filter
-        p_out (Path): path to write new, filtered pcap to
-        compress (bool, optional): compresses the output pcap using the
-            gz algorithm. Defaults to False.
-        sanitize (bool, optional): Remove sensitive information from packets
-            while filtering. Defaults to False.
-
-    Raises:
-        Exception: when underlying pcap message cannot be parsed or
-            something should have been sanitized but failed
-    """
-    reader = PcapReader(p_in.absolute().resolve(), msg_def_folder=msg_def_folder)
-    writer = Scapy_PcapWriter(str(p_out.absolute().resolve()), gz=compress)
-    logger.info("Filtering pcap to ki traffic only: in=%s, out=%s", p_in, p_out)
-    if sanitize:
-        logger.info(
-            "Sanitation is on. SessionOffer and Accept control message signatures will be zeroed out"
-        )
-    try:
-        i = 1
-        while True:
-            packet = reader.next_interesting_raw()
-            if packet is None:
-                raise StopIteration()
-            if (
-                sanitize
-                and is_ki_packet_naive(packet)
-                and KIHeader.from_bytes(bytes(packet[TCP].payload)).content_is_control
-            ):
-                try:
-                    dirty_data = bytes(packet[TCP].payload)
-                    sanitized_data = sanitize_signed_msg(reader, dirty_data)
-                    if sanitized_data != dirty_data:
-                        packet[TCP].payload = sanitize_signed_msg(
-                            reader, packet[TCP].payload
-                        )
-                        packet[TCP].checksum = None
-                except ValueError:
-                    logger.error("Message sanitation failed", exc_info=True)
-            writer.write(packet)
-            i += 1
-            if i % 100 == 0:
-                logger.info(
-                    "Filtering in progress. Found %s interesting packets so far", i
-                )
-    except StopIteration:
-        pass
-    except KeyboardInterrupt:
-        logger.warning("Cutting filtering short and finalizing")
-    except Exception as err:  # pylint: disable=broad-except
-        raise RuntimeError(
-            "Unrecoverable error occurred while filtering pcap file"
-        ) from err
-    finally:
-        reader.close()
-        writer.close()
@@ -0,0 +1,368 @@
+"""
+Overview statistics of captures without decoding them
+
+`CaptureStats` tallies KI frames found by `scan_capture` by service, DML
+message, control opcode, sender and TCP flow, plus a histogram over time.
+Only frame headers are read, so no message definitions are needed while
+counting. Names are looked up in a `DMLProtocolRegistry` when the report
+is made.
+
+KI frames are at most 64 KiB, so frame sizes are tallied exactly per size
+and percentiles cost the same no matter how big the capture is.
+"""
+
+from __future__ import annotations
+
+import ipaddress
+import logging
+import math
+from collections import Counter, defaultdict
+from os import PathLike
+from typing import Any, BinaryIO, Iterable
+
+from .common import MessageSender
+from .control import (
+    KeepAliveMessage,
+    KeepAliveResponseMessage,
+    SessionAcceptMessage,
+    SessionOfferMessage,
+)
+from .dedupe import SegmentDeduplicator
+from .dml import DMLProtocolRegistry
+from .pcap import PcapRecord, TcpSegment
+from .scan import KIFrame, scan_capture
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (50, 90, 99)
+
+# control opcode -> message class name, for the report
+CONTROL_NAMES = {
+    cls.OPCODE: cls.__name__
+    for cls in (
+        SessionOfferMessage,
+        SessionAcceptMessage,
+        KeepAliveMessage,
+        KeepAliveResponseMessage,
+    )
+}
+
+
+class SizeTally:
+    """Frame count, bytes and size distribution of one group of frames"""
+
+    __slots__ = ("sizes",)
+
+    def __init__(self) -> None:
+        self.sizes: Counter[int] = Counter()
+
+    def add(self, size: int) -> None:
+        """Counts one frame of `size` bytes"""
+        self.sizes[size] += 1
+
+    def update(self, other: SizeTally) -> None:
+        """Adds the frames counted by another tally"""
+        self.sizes.update(other.sizes)
+
+    @property
+    def count(self) -> int:
+        """Frames counted"""
+        return sum(self.sizes.values())
+
+    @property
+    def bytes(self) -> int:
+        """Total size of the frames counted"""
+        return sum(size * count for size, count in self.sizes.items())
+
+    def percentile(self, percent: float) -> int:
+        """
+        percentile gives the frame size `percent` percent of frames are at
+            most, by the nearest rank method
+
+        Args:
+            percent (float): 0 to 100
+
+        Returns:
+            int: frame size, or 0 without any frames
+        """
+        count = self.count
+        if not count:
+            return 0
+        rank = max(1, math.ceil(percent / 100 * count))
+        seen = 0
+        for size in sorted(self.sizes):
+            seen += self.sizes[size]
+            if seen >= rank:
+                return size
+        return max(self.sizes)
+
+    def as_dict(self, duration: float) -> dict[str, Any]:
+        """
+        as_dict summarizes the tally
+
+        Args:
+            duration (float): seconds the frames were captured over, used
+                for rates
+
+        Returns:
+            dict[str, Any]: counts, bytes, rates and size percentiles
+        """
+        count = self.count
+        total = self.bytes
+        return {
+            "frames": count,
+            "bytes": total,
+            "frames_per_sec": round(count / duration, 3) if duration > 0 else None,
+            "bytes_per_sec": round(total / duration, 3) if duration > 0 else None,
+            "size": {
+                "min": min(self.sizes, default=0),
+                "mean": round(total / count, 1) if count else 0,
+                **{f"p{p}": self.percentile(p) for p in PERCENTILES},
+                "max": max(self.sizes, default=0),
+            },
+        }
+
+
+def _sender_name(dport: int) -> str:
+    sender = MessageSender.from_capture_port(dport)
+    return sender.name if sender is not None else "UNKNOWN"
+
+
+class CaptureStats:
+    """
+    Running totals of the KI frames of one or more captures, grouped by
+    service, message, control opcode, sender, flow and time
+    """
+
+    def __init__(self, bucket_seconds: float = 60.0) -> None:
+        """
+        Args:
+            bucket_seconds (float, optional): width of the time histogram
+                buckets. Defaults to 60.
+        """
+        if bucket_seconds <= 0:
+            raise ValueError("Bucket width must be positive")
+        self.bucket_seconds = bucket_seconds
+        self.incomplete = 0
+        self.first_timestamp: float | None = None
+        self.last_timestamp: float | None = None
+        # Counting touches as few dicts as possible per frame. The groups
+        # are broken out of these keys by `report`.
+        # (is control, service id, message id or opcode, size) -> frames
+        self._frames: Counter[tuple[bool, int, int, int]] = Counter()
+        # (src, dst, sport, dport, size) -> frames
+        self._flows: Counter[tuple[bytes, bytes, int, int, int]] = Counter()
+        # bucket number -> frames and bytes
+        self._bucket_frames: Counter[int] = Counter()
+        self._bucket_bytes: Counter[int] = Counter()
+
+    def add(self, record: PcapRecord, segment: TcpSegment, frame: KIFrame) -> None:
+        """
+        add counts one frame found by `scan_capture`
+
+        Args:
+            record (PcapRecord): packet record holding the frame
+            segment (TcpSegment): TCP segment of the record
+            frame (KIFrame): the frame
+        """
+        size = frame.length
+        timestamp = record.timestamp
+        if self.first_timestamp is None or timestamp < self.first_timestamp:
+            self.first_timestamp = timestamp
+        if self.last_timestamp is None or timestamp > self.last_timestamp:
+            self.last_timestamp = timestamp
+        if frame.available < size:
+            self.incomplete += 1
+
+        if frame.is_control:
+            self._frames[(True, 0, frame.opcode, size)] += 1
+        else:
+            self._frames[(False, frame.service_id, frame.message_id, size)] += 1
+        self._flows[(segment.src, segment.dst, segment.sport, segment.dport, size)] += 1
+        bucket = int(timestamp // self.bucket_seconds)
+        self._bucket_frames[bucket] += 1
+        self._bucket_bytes[bucket] += size
+
+    @property
+    def total(self) -> SizeTally:
+        """Every frame counted"""
+        tally = SizeTally()
+        for (_, _, _, size), count in self._frames.items():
+            tally.sizes[size] += count
+        return tally
+
+    def _group(self, counts: Counter, key) -> defaultdict[Any, SizeTally]:
+        groups: defaultdict[Any, SizeTally] = defaultdict(SizeTally)
+        for counted, count in counts.items():
+            group = key(counted)
+            if group is not None:
+                groups[group].sizes[counted[-1]] += count
+        return groups
+
+    def scan(
+        self,
+        source: PathLike | str | BinaryIO,
+        deduplicator: SegmentDeduplicator | None = None,
+        threaded_decompression: bool = False,
+    ) -> int:
+        """
+        scan counts every KI frame of a capture
+
+        Args:
+            source (PathLike | str | BinaryIO): capture, optionally compressed
+            deduplicator (SegmentDeduplicator | None, optional): skips
+                retransmitted and duplicated segments. Defaults to None.
+            threaded_decompression (bool, optional): decompress on a
+                background thread. Defaults to False.
+
+        Returns:
+            int: frames counted from this capture
+        """
+        counted = 0
+        for _, record, segment, frame in scan_capture(
+            source,
+            deduplicator=deduplicator,
+            threaded_decompression=threaded_decompression,
+        ):
+            self.add(record, segment, frame)
+            counted += 1
+        logger.debug(
+            "Counted %d frames in %s", counted, getattr(source, "name", source)
+        )
+        return counted
+
+    @property
+    def duration(self) -> float:
+        """Seconds between the first and last frame"""
+        if self.first_timestamp is None or self.last_timestamp is None:
+            return 0.0
+        return self.last_timestamp - self.first_timestamp
+
+    def report(
+        self, registry: DMLProtocolRegistry | None = None, top: int | None = None
+    ) -> dict[str, Any]:
+        """
+        report summarizes everything counted so far
+
+        Args:
+            registry (DMLProtocolRegistry | None, optional): message
+                definitions to name services and messages with. Defaults
+                to None.
+            top (int | None, optional): only the busiest groups of each
+                kind, by bytes. The time histogram is always complete.
+                Defaults to every group.
+
+        Returns:
+            dict[str, Any]: json serializable report
+        """
+        duration = self.duration
+        services = self._group(self._frames, lambda k: None if k[0] else k[1])
+        messages = self._group(self._frames, lambda k: None if k[0] else k[1:3])
+        opcodes = self._group(self._frames, lambda k: k[2] if k[0] else None)
+        flows = self._group(self._flows, lambda k: k[:4])
+        senders: defaultdict[str, SizeTally] = defaultdict(SizeTally)
+        for (_, _, _, dport), tally in flows.items():
+            senders[_sender_name(dport)].update(tally)
+
+        def ranked(groups: dict) -> list:
+            items = sorted(groups.items(), key=lambda item: item[1].bytes, reverse=True)
+            return items[:top] if top is not None else items
+
+        def service_name(service_id: int) -> str | None:
+            if registry is None or service_id not in registry.protocol_map:
+                return None
+            return registry.protocol_map[service_id].type
+
+        def message_name(service_id: int, message_id: int) -> str | None:
+            if registry is None or service_id not in registry.protocol_map:
+                return None
+            msg_def = registry.protocol_map[service_id].message_map.get(message_id)
+            return msg_def.name if msg_def is not None else None
+
+        return {
+            "total": {
+                **self.total.as_dict(duration),
+                "incomplete_frames": self.incomplete,
+                "first_timestamp": self.first_timestamp,
+                "last_timestamp": self.last_timestamp,
+                "duration": round(duration, 6),
+            },
+            "services": [
+                {
+                    "service_id": sid,
+                    "name": service_name(sid),
+                    **tally.as_dict(duration),
+                }
+                for sid, tally in ranked(services)
+            ],
+            "messages": [
+                {
+                    "service_id": sid,
+                    "message_id": mid,
+                    "name": message_name(sid, mid),
+                    **tally.as_dict(duration),
+                }
+                for (sid, mid), tally in ranked(messages)
+            ],
+            "control_opcodes": [
+                {
+                    "opcode": opcode,
+                    "name": CONTROL_NAMES.get(opcode),
+                    **tally.as_dict(duration),
+                }
+                for opcode, tally in ranked(opcodes)
+            ],
+            "senders": [
+                {"sender": sender, **tally.as_dict(duration)}
+                for sender, tally in ranked(senders)
+            ],
+            "flows": [
+                {
+                    "flow": f"{ipaddress.ip_address(src)}:{sport} -> "
+                    f"{ipaddress.ip_address(dst)}:{dport}",
+                    **tally.as_dict(duration),
+                }
+                for (src, dst, sport, dport), tally in ranked(flows)
+            ],
+            "timeline": {
+                "bucket_seconds": self.bucket_seconds,
+                "buckets": [
+                    {
+                        "start": number * self.bucket_seconds,
+                        "frames": frames,
+                        "bytes": self._bucket_bytes[number],
+                    }
+                    for number, frames in sorted(self._bucket_frames.items())
+                ],
+            },
+        }
+
+
+def collect_stats(
+    sources: Iterable[PathLike | str | BinaryIO],
+    bucket_seconds: float = 60.0,
+    dedupe: bool = False,
+    threaded_decompression: bool = False,
+) -> CaptureStats:
+    """
+    collect_stats counts the KI frames of several captures together
+
+    Args:
+        sources (Iterable[PathLike | str | BinaryIO]): captures to count
+        bucket_seconds (float, optional): width of the time histogram
+            buckets. Defaults to 60.
+        dedupe (bool, optional): skip retransmitted and duplicated
+            segments. Defaults to False.
+        threaded_decompression (bool, optional): decompress on a background
+            thread. Defaults to False.
+
+    Returns:
+        CaptureStats: totals over every capture
+    """
+    stats = CaptureStats(bucket_seconds)
+    deduplicator = SegmentDeduplicator() if dedupe else None
+    for source in sources:
+        stats.scan(source, deduplicator, threaded_decompression)
+    if deduplicator is not None:
+        deduplicator.log_summary()
+    return stats
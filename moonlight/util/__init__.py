@@ -1,6 +1,7 @@
 """Project utilities"""
 
 from .serde_mixin import SerdeMixin, SerdeJSONEncoder
+from .profiling import StageProfiler, active_profiler, stage
 
 
 def bytes_to_pretty_str(bites: bytes) -> str:
@@ -0,0 +1,219 @@
+"""
+Optional timing of the stages of decoding
+
+The decoding path marks its stages with `stage`:
+- reading and dissecting packets
+- KI headers
+- DML and control messages
+- property objects
+- json encoding
+- writing output
+
+Nothing is measured unless a `StageProfiler` is running, and then
+`stage` only costs a function call and a shared null context, so the
+markers stay in place permanently.
+
+Stages nest. Every stage records both its total time and its own time,
+meaning the total minus the stages inside it. Own times add up to the
+profiled wall time, apart from time spent outside any stage.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import threading
+import time
+from typing import Any, ContextManager
+
+_NULL_STAGE = contextlib.nullcontext()
+_active: StageProfiler | None = None
+
+
+def active_profiler() -> StageProfiler | None:
+    """
+    active_profiler gets the running profiler
+
+    Returns:
+        StageProfiler | None: running profiler or `None` if nothing is being
+            profiled
+    """
+    return _active
+
+
+def stage(name: str) -> ContextManager:
+    """
+    stage times the enclosed code as a stage of the running profiler. Does
+        nothing when no profiler is running.
+
+    Args:
+        name (str): stage name such as "dml"
+
+    Returns:
+        ContextManager: context timing the stage
+    """
+    profiler = _active
+    if profiler is None:
+        return _NULL_STAGE
+    return _Stage(profiler, name)
+
+
+class _Stage:
+    __slots__ = ("profiler", "name")
+
+    def __init__(self, profiler: StageProfiler, name: str) -> None:
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self) -> None:
+        self.profiler.begin(self.name)
+
+    def __exit__(self, *exc_info) -> None:
+        self.profiler.end()
+
+
+class StageProfiler:
+    """
+    Thread safe totals of stage times and of time per message type. Each
+    thread keeps its own stack of open stages.
+    """
+
+    def __init__(self) -> None:
+        # name -> [calls, total seconds, own seconds]
+        self.stages: dict[str, list] = {}
+        # (message type, stage) -> [count, seconds]
+        self.messages: dict[tuple[str, str], list] = {}
+        self.started: float | None = None
+        self.stopped: float | None = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def start(self) -> None:
+        """
+        start makes this the running profiler
+
+        Raises:
+            RuntimeError: another profiler is already running
+        """
+        global _active  # pylint: disable=global-statement
+        if _active is not None and _active is not self:
+            raise RuntimeError("Another profiler is already running")
+        _active = self
+        self.started = time.perf_counter()
+        self.stopped = None
+
+    def stop(self) -> None:
+        """
+        stop ends profiling. Totals are kept for `report`.
+        """
+        global _active  # pylint: disable=global-statement
+        if _active is self:
+            _active = None
+        self.stopped = time.perf_counter()
+
+    def __enter__(self) -> StageProfiler:
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def _stack(self) -> list[list]:
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def begin(self, name: str) -> None:
+        """
+        begin opens a stage on the current thread. Prefer `stage`.
+
+        Args:
+            name (str): stage name
+        """
+        # name, start, time spent in nested stages
+        self._stack().append([name, time.perf_counter(), 0.0])
+
+    def end(self) -> None:
+        """
+        end closes the innermost open stage of the current thread
+        """
+        now = time.perf_counter()
+        stack = self._stack()
+        name, start, nested = stack.pop()
+        elapsed = now - start
+        if stack:
+            stack[-1][2] += elapsed
+        with self._lock:
+            totals = self.stages.get(name)
+            if totals is None:
+                totals = self.stages[name] = [0, 0.0, 0.0]
+            totals[0] += 1
+            totals[1] += elapsed
+            totals[2] += elapsed - nested
+
+    def add_message(self, message_type: str, stage_name: str, seconds: float) -> None:
+        """
+        add_message attributes time to a type of message
+
+        Args:
+            message_type (str): message type, see
+                `moonlight.net.metrics.message_type_name`
+            stage_name (str): what the time was spent on, such as "decode"
+            seconds (float): time spent
+        """
+        with self._lock:
+            totals = self.messages.get((message_type, stage_name))
+            if totals is None:
+                totals = self.messages[(message_type, stage_name)] = [0, 0.0]
+            totals[0] += 1
+            totals[1] += seconds
+
+    @property
+    def wall_time(self) -> float:
+        """Seconds between start and stop, or until now while running"""
+        if self.started is None:
+            return 0.0
+        end = self.stopped if self.stopped is not None else time.perf_counter()
+        return end - self.started
+
+    def report(self) -> dict[str, Any]:
+        """
+        report summarizes the recorded times
+
+        Returns:
+            dict[str, Any]: wall time, stages by own time and message types by
+                total time, as json serializable values
+        """
+        wall = self.wall_time
+        with self._lock:
+            stages = sorted(self.stages.items(), key=lambda item: -item[1][2])
+            messages = dict(self.messages)
+        own_total = sum(totals[2] for _, totals in stages)
+
+        by_type: dict[str, dict[str, Any]] = {}
+        for (message_type, stage_name), (count, seconds) in messages.items():
+            entry = by_type.setdefault(message_type, {"name": message_type, "count": 0})
+            entry["count"] = max(entry["count"], count)
+            entry[stage_name] = seconds
+        for entry in by_type.values():
+            seconds = sum(v for k, v in entry.items() if k not in ("name", "count"))
+            entry["total"] = seconds
+            entry["per_message"] = seconds / entry["count"]
+
+        return {
+            "wall": wall,
+            "unstaged": max(wall - own_total, 0.0),
+            "stages": [
+                {
+                    "name": name,
+                    "calls": calls,
+                    "total": total,
+                    "own": own,
+                    "share": own / wall if wall else 0.0,
+                    "per_call": total / calls,
+                }
+                for name, (calls, total, own) in stages
+            ],
+            "messages": sorted(by_type.values(), key=lambda e: -e["total"]),
+        }
@@ -4,6 +4,8 @@ from json import JSONEncoder
 from types import LambdaType
 from typing import Any, Tuple
 
+from .profiling import stage
+
 
 class SerdeMixin:
     SERDE_TRANSIENT: tuple[str] | tuple[()] = ()
@@ -63,6 +65,10 @@ class SerdeJSONEncoder(JSONEncoder):
         super().__init__(indent=indent)
         self.passthrough: dict = kwargs
 
+    def encode(self, o) -> str:
+        with stage("serde"):
+            return super().encode(o)
+
     def default(self, o):
         # sourcery skip: assign-if-exp, dict-comprehension, inline-immediately-returned-variable
         if isinstance(o, SerdeMixin):
@@ -0,0 +1,115 @@
+import io
+import logging
+import os
+from pathlib import Path
+
+import pytest
+
+from moonlight.net.batch import (
+    MANIFEST_NAME,
+    assign_outputs,
+    dump_capture_json,
+    expand_inputs,
+    filter_file,
+    run_batch,
+)
+
+from .fixtures import build_tcp_frame, write_capture
+
+
+def _captures(folder: Path, count: int) -> list[Path]:
+    folder.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = folder / f"cap{i}.pcap"
+        write_capture(
+            path, [build_tcp_frame(b"\x0D\xF0" + bytes([i])), build_tcp_frame(b"x")]
+        )
+        paths.append(path)
+    return paths
+
+
+def test_expand_inputs_and_names(tmp_path):
+    first = _captures(tmp_path / "a", 2)
+    second = _captures(tmp_path / "b", 1)
+    (tmp_path / "a" / "notes.txt").write_text("not a capture")
+
+    inputs = expand_inputs([tmp_path / "a", str(tmp_path / "b" / "*.pcap"), first[0]])
+    assert inputs == sorted(p.resolve() for p in first + second)
+    with pytest.raises(ValueError):
+        expand_inputs([tmp_path / "missing*.pcap"])
+
+    outputs = assign_outputs(inputs, tmp_path / "out", lambda p: p.stem + ".json")
+    assert sorted(p.name for p in outputs.values()) == [
+        "b_cap0.json",
+        "cap0.json",
+        "cap1.json",
+    ]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_run_batch_resumes(tmp_path, workers):
+    inputs = _captures(tmp_path / "in", 3)
+    out = tmp_path / "out"
+
+    def name(path):
+        return path.stem + ".filtered.pcap"
+
+    summary = run_batch(filter_file, inputs, out, name, workers=workers)
+    assert (summary.succeeded, summary.failed, summary.skipped) == (3, 0, 0)
+    assert summary.totals["kept"] == 3
+    assert (out / MANIFEST_NAME).is_file()
+
+    (out / "cap1.filtered.pcap").unlink()
+    summary = run_batch(filter_file, inputs, out, name, workers=workers)
+    assert (summary.succeeded, summary.skipped) == (1, 2)
+
+
+def test_run_batch_records_failures(tmp_path):
+    inputs = _captures(tmp_path / "in", 1)
+    broken = tmp_path / "in" / "broken.pcap"
+    broken.write_bytes(b"definitely not a pcap")
+
+    summary = run_batch(
+        filter_file, inputs + [broken], tmp_path / "out", lambda p: p.name, workers=1
+    )
+    assert (summary.succeeded, summary.failed) == (1, 1)
+    assert summary.failures[0].input == str(broken)
+
+
+def crash_on_broken(input_f: Path, output_f: Path) -> dict[str, int]:
+    if input_f.name.startswith("broken"):
+        # like a worker killed for running out of memory
+        os._exit(1)
+    return filter_file(input_f, output_f)
+
+
+def test_run_batch_survives_dead_worker(tmp_path):
+    inputs = _captures(tmp_path / "in", 4)
+    broken = tmp_path / "in" / "broken.pcap"
+    broken.write_bytes(inputs[0].read_bytes())
+    out = tmp_path / "out"
+
+    summary = run_batch(
+        crash_on_broken, [broken] + inputs, out, lambda p: p.name, workers=2
+    )
+    assert (summary.succeeded, summary.failed) == (4, 1)
+    assert summary.failures[0].input == str(broken)
+    assert "BrokenProcessPool" in summary.failures[0].error
+
+    # the failure is in the manifest, so it runs again with the missing output
+    (out / "cap1.pcap").unlink()
+    summary = run_batch(
+        crash_on_broken, [broken] + inputs, out, lambda p: p.name, workers=2
+    )
+    assert (summary.skipped, summary.succeeded, summary.failed) == (3, 1, 1)
+
+
+def test_progress_counts_entries(caplog):
+    caplog.set_level(logging.INFO, logger="moonlight.net.batch")
+    dump_capture_json(iter([None] * 99), io.StringIO())
+    assert not caplog.records
+    dump_capture_json(iter([None] * 100), io.StringIO())
+    assert [r.getMessage() for r in caplog.records] == [
+        "Progress: completed 100 so far"
+    ]
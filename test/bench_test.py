@@ -0,0 +1,53 @@
+import random
+
+from moonlight.net import PacketReader
+from moonlight.net.bench import (
+    build_suite,
+    compare_results,
+    run_case,
+    select_cases,
+    synthetic_control_frames,
+    synthetic_dml_frame,
+)
+
+from .fixtures import dml_protocol
+
+
+def test_synthetic_frames_decode(dml_protocol):
+    reader = PacketReader(None, dml_protocol=dml_protocol)
+    msg_def = dml_protocol.get_by_id(1).message_map[1]
+    frame = synthetic_dml_frame(1, 1, msg_def, random.Random(3))
+    assert frame == synthetic_dml_frame(1, 1, msg_def, random.Random(3))
+    assert len(reader.decode_ki_packet(frame).fields) == 19
+    for frame in synthetic_control_frames(random.Random(3)):
+        assert reader.decode_ki_packet(frame) is not None
+
+
+def test_suite_runs(dml_protocol, tmp_path):
+    cases = build_suite(dml_protocol, tmp_path, messages=20)
+    assert [c.name for c in select_cases(cases, ["dml.*", "pcap.*"])] == [
+        "dml.decode_message",
+        "pcap.decode",
+    ]
+    for case in cases:
+        result = run_case(case, repeat=2, min_time=0)
+        assert result["items"] == 20
+        assert result["per_sec"] > 0
+
+
+def test_compare_results():
+    baseline = {
+        "results": [{"name": "a", "per_sec": 100.0}, {"name": "b", "per_sec": 100.0}]
+    }
+    results = {
+        "results": [
+            {"name": "a", "per_sec": 95.0},
+            {"name": "b", "per_sec": 80.0},
+            {"name": "new", "per_sec": 1.0},
+        ]
+    }
+    comparison = compare_results(results, baseline, tolerance=0.1)
+    assert [(c["name"], c["regression"]) for c in comparison] == [
+        ("a", False),
+        ("b", True),
+    ]
@@ -0,0 +1,115 @@
+import io
+import json
+import os
+
+from click.testing import CliRunner
+
+from moonlight.cli.decode import decode
+from moonlight.net import SegmentDeduplicator
+from moonlight.net.batch import dump_capture_json
+from moonlight.net.pcap import TruncatedCaptureError
+from moonlight.net.scapy import MergedPcapReader, PcapReader
+from moonlight.util import SerdeJSONEncoder
+
+from .fixtures import build_tcp_frame, load_packet, write_capture
+
+MESSAGES = os.path.join(os.path.dirname(__file__), "fixtures", "dml", "messages")
+
+
+def test_merged_reader_orders_by_time(tmp_path):
+    dml = load_packet("dml_proto1_fake.bin")
+    # client side at even seconds, server side at odd seconds
+    write_capture(
+        tmp_path / "client.pcap",
+        [build_tcp_frame(dml, dport=1337, seq=i * 1000) for i in range(3)],
+        start=100.0,
+    )
+    write_capture(
+        tmp_path / "server.pcap",
+        [build_tcp_frame(dml, sport=1337, dport=12000, seq=i * 1000) for i in range(2)],
+        start=100.5,
+    )
+
+    with MergedPcapReader(
+        [tmp_path / "server.pcap", tmp_path / "client.pcap"],
+        MESSAGES,
+        silence_decode_errors=True,
+    ) as reader:
+        times = []
+        while True:
+            try:
+                times.append(float(reader.next_interesting_raw().time))
+            except StopIteration:
+                break
+    assert times == [100.0, 100.5, 101.0, 101.5, 102.0]
+
+
+def test_merged_reader_dedupes_across_files(tmp_path):
+    frames = [build_tcp_frame(load_packet("dml_proto1_fake.bin"))]
+    write_capture(tmp_path / "a.pcap", frames)
+    write_capture(tmp_path / "b.pcap", frames)
+
+    deduplicator = SegmentDeduplicator()
+    with MergedPcapReader(
+        [tmp_path / "a.pcap", tmp_path / "b.pcap"], MESSAGES, deduplicator=deduplicator
+    ) as reader:
+        assert len(list(reader)) == 1
+    assert deduplicator.stats.retransmissions == 1
+
+
+class _Pipe(io.RawIOBase):
+    """Readable, non-seekable stream like stdin fed by tcpdump"""
+
+    def __init__(self, data: bytes) -> None:
+        self._data = io.BytesIO(data)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        # hand out small chunks like a pipe would
+        chunk = self._data.read(min(len(buffer), 7))
+        buffer[: len(chunk)] = chunk
+        return len(chunk)
+
+
+def test_reader_accepts_streams(tmp_path):
+    dml = load_packet("dml_proto1_fake.bin")
+    write_capture(
+        tmp_path / "in.pcap", [build_tcp_frame(dml), build_tcp_frame(b"x")] * 2
+    )
+    stream = io.BufferedReader(_Pipe((tmp_path / "in.pcap").read_bytes()))
+
+    with PcapReader(stream, MESSAGES) as reader:
+        out = io.StringIO()
+        decoded, errors = dump_capture_json(reader, out)
+    assert (decoded, errors) == (2, 0)
+    assert json.loads(out.getvalue())[1]["data"]["name"] == "MSG_PROTO1_FAKE"
+
+    with PcapReader(tmp_path / "in.pcap", MESSAGES) as reader:
+        expected = json.dumps(list(reader), cls=SerdeJSONEncoder, indent=2)
+    assert out.getvalue() == expected
+
+
+def test_stream_cut_mid_record(tmp_path):
+    dml = load_packet("dml_proto1_fake.bin")
+    write_capture(
+        tmp_path / "in.pcap", [build_tcp_frame(dml, seq=i * 100) for i in range(3)]
+    )
+    # tcpdump stopped part way through the last record
+    data = (tmp_path / "in.pcap").read_bytes()[:-10]
+
+    with PcapReader(io.BufferedReader(_Pipe(data)), MESSAGES) as reader:
+        out = io.StringIO()
+        decoded, errors = dump_capture_json(reader, out)
+    assert (decoded, errors) == (2, 0)
+    assert isinstance(reader.capture_error, TruncatedCaptureError)
+    assert reader.error_tracker.total == 0
+    assert all("error" not in entry for entry in json.loads(out.getvalue()))
+
+    # the normal end of piped input, not an error
+    result = CliRunner(mix_stderr=False).invoke(
+        decode, ["pcap", MESSAGES, "-", "-"], input=data
+    )
+    assert result.exit_code == 0, result.output
+    assert len(json.loads(result.stdout)) == 2
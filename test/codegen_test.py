@@ -0,0 +1,96 @@
+import os
+import random
+import shutil
+from os.path import join
+
+import pytest
+from click.testing import CliRunner
+
+from moonlight.cli.codegen import codegen
+from moonlight.net import DMLProtocolRegistry, PacketReader
+from moonlight.net.bench import synthetic_dml_frame
+from moonlight.net.codegen import (
+    StaleCodegenError,
+    _identifier,
+    generate_package,
+    load_generated,
+)
+
+from .fixtures import load_packet
+
+RES_FOLDER = join(os.path.dirname(__file__), "fixtures", "dml", "messages")
+
+
+@pytest.fixture
+def generated(tmp_path):
+    return load_generated(
+        generate_package(RES_FOLDER, tmp_path, "fake_msgs"), RES_FOLDER
+    )
+
+
+def test_generated_package(generated):
+    assert set(generated.SERVICES) == {1}
+    cls = generated.MESSAGES[(1, 1)]
+    assert cls.NAME == "MSG_PROTO1_FAKE"
+    assert len(cls.FIELDS) == 19
+    assert "TestField_00_INT8" in cls.__slots__
+
+    msg = generated.decode(load_packet("dml_proto1_fake.bin"))
+    assert isinstance(msg, cls)
+    assert msg.TestField_00_INT8 == msg.as_dict()["TestField_00_INT8"]
+    with pytest.raises(AttributeError):
+        msg.not_a_field = 1
+
+
+def test_generated_matches_xml(generated):
+    xml = PacketReader(RES_FOLDER)
+    reader = PacketReader(RES_FOLDER, generated=generated)
+    msg_def = xml.dml_protocol.get_by_id(1).message_map[1]
+    rng = random.Random(7)
+    frames = [synthetic_dml_frame(1, 1, msg_def, rng) for _ in range(200)]
+    frames.append(load_packet("dml_proto1_fake.bin"))
+    for frame in frames:
+        expected = xml.decode_ki_packet(frame)
+        decoded = reader.decode_ki_packet(frame)
+        assert [(f.name(), f.value) for f in decoded.fields] == [
+            (f.name(), f.value) for f in expected.fields
+        ]
+        assert generated.decode(frame).values() == tuple(
+            f.value for f in expected.fields
+        )
+
+
+def test_generated_registry_errors(generated):
+    registry = DMLProtocolRegistry.from_generated(generated)
+    with pytest.raises(ValueError):
+        registry.decode_packet(load_packet("dml_proto1_fake.bin")[:30])
+
+
+def test_stale_package(tmp_path):
+    definitions = tmp_path / "messages"
+    shutil.copytree(RES_FOLDER, definitions)
+    package = generate_package(definitions, tmp_path / "out", "stale_msgs")
+    load_generated(package, definitions)
+
+    for path in definitions.iterdir():
+        path.write_bytes(path.read_bytes() + b"\n")
+    with pytest.raises(StaleCodegenError):
+        load_generated(package, definitions)
+    with pytest.raises(StaleCodegenError):
+        PacketReader(definitions, generated=package)
+
+
+def test_identifier():
+    taken = set()
+    assert _identifier("class", taken) == "class_"
+    assert _identifier("1st field", taken) == "_1st_field"
+    assert _identifier("values", taken) == "values_"
+    assert _identifier("class", taken) == "class__2"
+
+
+def test_help_keeps_example():
+    result = CliRunner().invoke(codegen, ["--help"])
+    assert result.exit_code == 0
+    lines = result.output.splitlines()
+    assert "      import moonlight_messages" in lines
+    assert "      msg = moonlight_messages.decode(frame)" in lines
@@ -0,0 +1,102 @@
+import bz2
+import gzip
+import io
+import json
+import lzma
+import os
+import random
+
+import pytest
+from click.testing import CliRunner
+
+from moonlight.cli.decode import decode
+from moonlight.cli.pcap import pcap
+from moonlight.cli.stats import stats
+from moonlight.net.compression import detect_compression
+from moonlight.net.filter import filter_pcap
+from moonlight.net.pcap import CaptureFileReader, TruncatedCaptureError
+
+from .fixtures import build_tcp_frame, load_packet, write_capture
+
+MESSAGES = os.path.join(os.path.dirname(__file__), "fixtures", "dml", "messages")
+COMPRESSORS = {"gzip": gzip.compress, "xz": lzma.compress, "bzip2": bz2.compress}
+
+
+def test_detect_compression():
+    for name, compress in COMPRESSORS.items():
+        assert detect_compression(compress(b"data")[:6]) == name
+    assert detect_compression(b"\xd4\xc3\xb2\xa1\x02\x00") is None
+    assert detect_compression(b"BZ") is None
+
+
+@pytest.mark.parametrize("name", COMPRESSORS)
+@pytest.mark.parametrize("threaded", [False, True])
+def test_reader_decompresses(tmp_path, name, threaded):
+    frames = [build_tcp_frame(b"\x0D\xF0" + bytes([i]) * 100) for i in range(50)]
+    write_capture(tmp_path / "in.pcap", frames)
+    packed = tmp_path / "in.pcap.z"
+    packed.write_bytes(COMPRESSORS[name]((tmp_path / "in.pcap").read_bytes()))
+
+    with CaptureFileReader(packed, threaded_decompression=threaded) as reader:
+        assert reader.compression == name
+        assert [r.data for r in reader] == frames
+
+    # non-seekable streams are sniffed without losing the magic bytes
+    stream = io.BufferedReader(io.BytesIO(packed.read_bytes()))
+    stream.seekable = lambda: False
+    with CaptureFileReader(stream, threaded_decompression=threaded) as reader:
+        assert len(list(reader)) == 50
+
+
+def test_filter_reads_own_gzip_output(tmp_path):
+    frames = [build_tcp_frame(b"\x0D\xF0hi"), build_tcp_frame(b"nope")]
+    write_capture(tmp_path / "in.pcap", frames)
+    filter_pcap(tmp_path / "in.pcap", tmp_path / "once.pcap.gz", compress=True)
+
+    stats = filter_pcap(tmp_path / "once.pcap.gz", tmp_path / "twice.pcap")
+    assert (stats.records, stats.kept) == (1, 1)
+    with CaptureFileReader(tmp_path / "twice.pcap") as reader:
+        assert [r.data for r in reader] == frames[:1]
+
+
+@pytest.mark.parametrize("name", COMPRESSORS)
+@pytest.mark.parametrize("threaded", [False, True])
+def test_truncated_archive(tmp_path, name, threaded):
+    frames = [build_tcp_frame(bytes([i]) * 200) for i in range(100)]
+    write_capture(tmp_path / "in.pcap", frames)
+    packed = tmp_path / "in.pcap.z"
+    packed.write_bytes(COMPRESSORS[name]((tmp_path / "in.pcap").read_bytes())[:-40])
+
+    # bzip2 only produces output once a whole block is decompressed, so it
+    # already fails reading the capture header
+    with pytest.raises(TruncatedCaptureError):
+        with CaptureFileReader(packed, threaded_decompression=threaded) as reader:
+            list(reader)
+
+
+def test_truncated_archive_cli(tmp_path):
+    # random payloads, so the archive is cut part way through the capture
+    noise = random.Random(0)
+    dml = load_packet("dml_proto1_fake.bin")
+    frames = [build_tcp_frame(dml + noise.randbytes(200)) for _ in range(100)]
+    write_capture(tmp_path / "in.pcap", frames)
+    packed = tmp_path / "in.pcap.gz"
+    archive = gzip.compress((tmp_path / "in.pcap").read_bytes())
+    packed.write_bytes(archive[: len(archive) // 2])
+    out = tmp_path / "out.json"
+
+    runner = CliRunner(mix_stderr=False)
+    result = runner.invoke(decode, ["pcap", MESSAGES, str(packed), str(out)])
+    assert result.exit_code == 1
+    assert "Capture is truncated" in result.stderr
+    # the messages read before the cut are still valid json
+    assert isinstance(json.loads(out.read_text(encoding="utf8")), list)
+
+    commands = [
+        (pcap, ["filter", str(packed), str(tmp_path / "out.pcap")]),
+        (stats, [str(packed)]),
+    ]
+    for command, args in commands:
+        result = runner.invoke(command, args)
+        assert result.exit_code == 1
+        assert "Capture is truncated" in result.stderr
@@ -37,3 +37,19 @@ def test_session_accept(control_protocol, control_session_accept):
     assert message.unix_timestamp_millis_into_second == 288
     assert message.unix_timestamp_seconds == 1639851231
     assert message.signed_msg == (b"\xff" * 257)
+
+
+def test_encode_round_trip(
+    control_protocol, control_session_offer, control_session_accept
+):
+    for bites in (control_session_offer, control_session_accept):
+        message = control_protocol.decode_packet(
+            bites, KIHeader.from_bytes(bites), has_ki_header=True
+        )
+        encoded = message.to_bytes()
+        again = control_protocol.decode_packet(
+            encoded, KIHeader.from_bytes(encoded), has_ki_header=True
+        )
+        assert again.to_bytes() == encoded
+        assert again.session_id == message.session_id
+        assert again.signed_msg == message.signed_msg
@@ -0,0 +1,64 @@
+import base64
+import json
+import os
+import struct
+
+import pytest
+from click.testing import CliRunner
+
+from moonlight.cli.decode import decode
+
+from .fixtures import load_packet
+
+RES_FOLDER = os.path.join(os.path.dirname(__file__), "fixtures", "dml", "messages")
+
+
+def _run_batch(in_fmt: str, stdin: bytes) -> list[dict]:
+    result = CliRunner().invoke(
+        decode, ["packet", RES_FOLDER, "--batch", "-F", in_fmt], input=stdin
+    )
+    assert result.exit_code == 0, result.output
+    return [json.loads(line) for line in result.output.splitlines() if line]
+
+
+@pytest.fixture
+def packets() -> list[bytes]:
+    return [load_packet("ctrl_session_offer.bin"), load_packet("dml_proto1_fake.bin")]
+
+
+def test_batch_hex(packets):
+    # spaced hex, as copied from a hex dump
+    lines = [" ".join(f"{b:02x}" for b in packets[0]), packets[1].hex(), "", "zz"]
+    out = _run_batch("hex", "\n".join(lines).encode())
+    assert [line["record"] for line in out] == [0, 1, 2]
+    assert out[0]["data"]["name"] == "SessionOfferMessage"
+    assert out[1]["data"]["name"] == "MSG_PROTO1_FAKE"
+    assert "error" in out[2]
+
+
+def test_batch_base64(packets):
+    lines = [base64.b64encode(p) for p in packets]
+    # not a KI frame
+    lines.insert(1, base64.b64encode(b"\x00\x01\x02"))
+    out = _run_batch("base64", b"\n".join(lines))
+    assert [line["record"] for line in out] == [0, 1, 2]
+    assert "error" in out[1]
+    assert out[2]["data"]["name"] == "MSG_PROTO1_FAKE"
+
+
+def test_batch_raw(packets):
+    stdin = b"".join(struct.pack("<I", len(p)) + p for p in packets)
+    # cut off mid frame
+    stdin += struct.pack("<I", 100) + b"\x0D\xF0"
+    out = _run_batch("raw", stdin)
+    assert [line["record"] for line in out] == [0, 1, 2]
+    assert out[0]["data"]["name"] == "SessionOfferMessage"
+    assert out[2]["error"].startswith("Truncated frame")
+
+
+def test_single_hex(packets):
+    result = CliRunner().invoke(
+        decode, ["packet", RES_FOLDER, "-F", "hex", "-i", packets[1].hex(" ")]
+    )
+    assert result.exit_code == 0, result.output
+    assert json.loads(result.output)["data"]["name"] == "MSG_PROTO1_FAKE"
@@ -0,0 +1,55 @@
+from moonlight.net import SegmentDeduplicator
+from moonlight.net.filter import filter_pcap
+
+from .fixtures import build_tcp_frame, write_capture
+
+FLOW = ("a", "b", 1, 2)
+
+
+def test_retransmission_and_overlap():
+    dedupe = SegmentDeduplicator()
+    assert not dedupe.is_duplicate(FLOW, 100, 10)
+    assert not dedupe.is_duplicate(FLOW, 110, 10)
+    assert dedupe.is_duplicate(FLOW, 100, 10)
+    # covered by both earlier segments without matching either
+    assert dedupe.is_duplicate(FLOW, 105, 10)
+    # new bytes at the end are kept
+    assert not dedupe.is_duplicate(FLOW, 115, 10)
+    # other direction is its own flow
+    assert not dedupe.is_duplicate(("b", "a", 2, 1), 100, 10)
+
+    stats = dedupe.stats
+    assert (stats.retransmissions, stats.overlaps, stats.partial_overlaps) == (1, 1, 1)
+    assert stats.dropped == 2
+
+
+def test_out_of_order_and_wraparound():
+    dedupe = SegmentDeduplicator()
+    start = (1 << 32) - 10
+    assert not dedupe.is_duplicate(FLOW, start, 10)
+    # skips ahead past the wrap, then the gap gets filled
+    assert not dedupe.is_duplicate(FLOW, 10, 10)
+    assert not dedupe.is_duplicate(FLOW, 0, 10)
+    assert dedupe.is_duplicate(FLOW, start + 5, 10)
+
+
+def test_bounded_flows():
+    dedupe = SegmentDeduplicator(max_flows=1)
+    assert not dedupe.is_duplicate(FLOW, 0, 10)
+    assert not dedupe.is_duplicate(("c", "d", 3, 4), 0, 10)
+    # the first flow was evicted and is forgotten
+    assert not dedupe.is_duplicate(FLOW, 0, 10)
+    assert dedupe.stats.evicted_flows == 2
+
+
+def test_filter_drops_duplicates(tmp_path):
+    frames = [
+        build_tcp_frame(b"\x0D\xF0first", seq=1),
+        build_tcp_frame(b"\x0D\xF0first", seq=1),
+        build_tcp_frame(b"\x0D\xF0next", seq=8),
+    ]
+    write_capture(tmp_path / "in.pcap", frames)
+    stats = filter_pcap(
+        tmp_path / "in.pcap", tmp_path / "out.pcap", deduplicator=SegmentDeduplicator()
+    )
+    assert (stats.kept, stats.duplicates) == (2, 1)
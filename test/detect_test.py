@@ -0,0 +1,109 @@
+import shutil
+import struct
+
+from moonlight.net import RevisionRegistry
+from moonlight.net.detect import (
+    CLEAN,
+    FAILED,
+    PARTIAL,
+    RevisionCache,
+    capture_hash,
+    detect_revision,
+    trial_decode,
+)
+from moonlight.net.generate import TrafficGenerator
+
+from .fixtures import load_packet, revisions
+
+
+def _frames(revisions: RevisionRegistry) -> tuple[bytes, bytes]:
+    old = revisions.decode_packet(load_packet("dml_proto1_fake.bin"))
+    values = {f.name(): f.value for f in old.fields}
+    old_def = revisions["old"].get_by_id(1).message_map[1]
+    changed_def = revisions["changed"].get_by_id(1).message_map[1]
+    return old_def.encode_packet(values), changed_def.encode_packet(
+        {**values, "Extra": 5}
+    )
+
+
+def _padded(frame: bytes, extra: int) -> bytes:
+    # KI and DML lengths both cover the padding
+    (ki_len,) = struct.unpack_from("<H", frame, 2)
+    (dml_len,) = struct.unpack_from("<H", frame, 10)
+    padded = bytearray(frame + bytes(extra))
+    struct.pack_into("<H", padded, 2, ki_len + extra)
+    struct.pack_into("<H", padded, 10, dml_len + extra)
+    return bytes(padded)
+
+
+def test_trial_decode(revisions: RevisionRegistry):
+    old_frame, changed_frame = _frames(revisions)
+    old_def = revisions["old"].get_by_id(1).message_map[1]
+    changed_def = revisions["changed"].get_by_id(1).message_map[1]
+    assert trial_decode(old_def, old_frame) == CLEAN
+    assert trial_decode(changed_def, changed_frame) == CLEAN
+    # the added field shifts the rest of the message
+    assert trial_decode(old_def, changed_frame) == FAILED
+    assert trial_decode(changed_def, old_frame) == FAILED
+    # stops short of the length in the DML header
+    assert trial_decode(old_def, _padded(old_frame, 4)) == PARTIAL
+
+
+def test_detect_revision(revisions: RevisionRegistry):
+    old_frame, changed_frame = _frames(revisions)
+    result = detect_revision(revisions, [changed_frame] * 50, min_frames=5)
+    assert result.revision == "changed"
+    assert result.decisive
+    # stopped once the lead was clear
+    assert result.frames == 5
+    assert [s.name for s in result.scores] == ["changed", "old"]
+    assert result.scores[1].failed == 5
+
+    result = detect_revision(revisions, [old_frame] * 10, min_frames=5)
+    assert result.revision == "old"
+
+    # a single differing frame isn't enough to be sure
+    result = detect_revision(revisions, [old_frame], min_frames=1, lead=3)
+    assert result.revision == "old"
+    assert not result.decisive
+
+    result = detect_revision(
+        revisions, [b"\x0D\xF0\x04\x00\x00\x00\x00\x00\x07\x01\x04\x00"]
+    )
+    assert result.revision is None
+
+
+def test_detect_capture_cached(revisions: RevisionRegistry, tmp_path):
+    capture = tmp_path / "changed.pcap"
+    TrafficGenerator(revisions["changed"], seed=3).write_pcap(capture, max_messages=40)
+    cache = RevisionCache(tmp_path / "cache" / "revisions.json")
+
+    result = revisions.detect(capture, cache=cache, min_frames=10)
+    assert result.revision == "changed"
+    assert not result.cached
+    assert result.as_dict()["scores"][0]["rate"] == 1.0
+
+    # a copy is recognised by its content
+    copy = tmp_path / "copy.pcap"
+    shutil.copy(capture, copy)
+    assert capture_hash(copy) == capture_hash(capture)
+    result = revisions.detect(copy, cache=RevisionCache(cache.path))
+    assert result.revision == "changed"
+    assert result.cached
+
+    # other candidates detect again
+    fewer = RevisionRegistry(workers=1)
+    fewer.add("old", revisions.folder("old"))
+    result = fewer.detect(capture, cache=RevisionCache(cache.path))
+    assert result.revision is None
+    assert not result.cached
+
+    # as does editing a candidate's definitions
+    assert revisions.detect(capture, cache=RevisionCache(cache.path)).cached
+    definitions = tmp_path / "changed" / "FakeMessages.xml"
+    definitions.write_text(
+        definitions.read_text(encoding="utf8") + "\n", encoding="utf8"
+    )
+    result = revisions.detect(capture, cache=RevisionCache(cache.path), min_frames=10)
+    assert result.revision == "changed"
+    assert not result.cached
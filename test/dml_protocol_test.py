@@ -1,8 +1,10 @@
 import os
+import threading
 from os.path import isfile, join
 from posix import listdir
 
 from moonlight.net import DMLProtocolRegistry
+from moonlight.net.dml import DMLProtocol, LazyProtocolMap, _pool_context
 from .fixtures import load_packet
 
 import pytest
@@ -85,3 +87,111 @@ def test_decode_dml(dml_protocol: DMLProtocolRegistry):
     assert obj.fields[16].dml_type() is DMLType.GID
     assert obj.fields[17].dml_type() is DMLType.STR
     assert obj.fields[18].dml_type() is DMLType.STR
+
+
+def test_encode_round_trip(dml_protocol: DMLProtocolRegistry):
+    bites = load_packet("dml_proto1_fake.bin")
+    obj = dml_protocol.decode_packet(bites)
+    again = dml_protocol.decode_packet(obj.to_bytes())
+    assert [(f.name(), f.value) for f in again.fields] == [
+        (f.name(), f.value) for f in obj.fields
+    ]
+    with pytest.raises(ValueError):
+        obj.definition.encode_message({})
+
+
+def _definitions(registry: DMLProtocolRegistry) -> dict:
+    return {
+        service_id: (
+            protocol.type,
+            protocol.desc,
+            {
+                msg_id: (
+                    msg.name,
+                    msg.desc,
+                    [(f.name, f.dml_type, f.noxfer) for f in msg.fields],
+                )
+                for msg_id, msg in protocol.message_map.items()
+            },
+        )
+        for service_id, protocol in registry.protocol_map.items()
+    }
+
+
+def test_parallel_load(tmp_path):
+    res_folder = os.path.join(os.path.dirname(__file__), "fixtures", "dml", "messages")
+    with open(join(res_folder, "FakeMessages.xml"), encoding="utf8") as file:
+        source = file.read()
+    duplicate = '<MSG_ZZZ_LAST><RECORD><A TYPE="INT" /></RECORD></MSG_ZZZ_LAST>\n'
+    files = []
+    for service_id in range(1, 6):
+        text = source.replace(
+            '<ServiceID TYPE="UBYT">1</ServiceID>',
+            f'<ServiceID TYPE="UBYT">{service_id}</ServiceID>',
+        ).replace("</FAKEMESSAGES1>", duplicate * 2 + "</FAKEMESSAGES1>")
+        path = tmp_path / f"Fake{service_id}Messages.xml"
+        path.write_text(text, encoding="utf8")
+        files.append(path)
+    # a later file redefining a service replaces it
+    files.append(files[0])
+
+    sequential = DMLProtocolRegistry(*files, workers=1)
+    parallel = DMLProtocolRegistry(*files, workers=2)
+    assert _definitions(parallel) == _definitions(sequential)
+    assert set(parallel.protocol_map) == {1, 2, 3, 4, 5}
+    # ids follow name order and the duplicate is only kept once
+    assert [m.name for m in parallel.get_by_id(3).message_map.values()] == [
+        "MSG_PROTO1_FAKE",
+        "MSG_ZZZ_LAST",
+    ]
+    assert (
+        parallel.decode_packet(load_packet("dml_proto1_fake.bin")).name()
+        == "MSG_PROTO1_FAKE"
+    )
+
+    # with another thread running the workers aren't forked
+    stop = threading.Event()
+    thread = threading.Thread(target=stop.wait)
+    thread.start()
+    try:
+        assert _pool_context().get_start_method() != "fork"
+        threaded = DMLProtocolRegistry(*files, workers=2)
+    finally:
+        stop.set()
+        thread.join()
+    assert _definitions(threaded) == _definitions(sequential)
+
+
+def test_lazy_load(tmp_path):
+    res_folder = os.path.join(os.path.dirname(__file__), "fixtures", "dml", "messages")
+    with open(join(res_folder, "FakeMessages.xml"), encoding="utf8") as file:
+        source = file.read()
+    files = []
+    for service_id in (1, 2, 3):
+        path = tmp_path / f"Fake{service_id}Messages.xml"
+        path.write_text(
+            source.replace(
+                '<ServiceID TYPE="UBYT">1</ServiceID>',
+                f'<ServiceID TYPE="UBYT">{service_id}</ServiceID>',
+            ),
+            encoding="utf8",
+        )
+        files.append(path)
+    (tmp_path / "Fake2Messages.xml").write_text(
+        "<FAKE><_ProtocolInfo><RECORD /></_ProtocolInfo></FAKE>", encoding="utf8"
+    )
+    assert DMLProtocol.read_service_id(files[0]) == 1
+    with pytest.raises(ValueError):
+        DMLProtocolRegistry(*files, lazy=True)
+
+    del files[1]
+    registry = DMLProtocolRegistry(*files, lazy=True)
+    assert isinstance(registry.protocol_map, LazyProtocolMap)
+    assert 3 in registry.protocol_map and 2 not in registry.protocol_map
+    assert registry.protocol_map.loaded() == []
+
+    msg = registry.decode_packet(load_packet("dml_proto1_fake.bin"))
+    assert msg.name() == "MSG_PROTO1_FAKE"
+    assert registry.protocol_map.loaded() == [1]
+    assert [p.id for p in registry.protocol_map.values()] == [1, 3]
+    assert registry.protocol_map.loaded() == [1, 3]
@@ -0,0 +1,61 @@
+import logging
+import os
+from os.path import join
+
+import pytest
+
+from moonlight.net import PacketReader
+from moonlight.net.errors import (
+    DecodeErrorTracker,
+    DMLDecodeError,
+    ErrorBucket,
+    classify,
+)
+
+from .fixtures import load_packet
+
+
+@pytest.fixture
+def reader() -> PacketReader:
+    res_folder = join(os.path.dirname(__file__), "fixtures", "dml", "messages")
+    return PacketReader(res_folder)
+
+
+def test_failures_are_bucketed(reader: PacketReader):
+    good = load_packet("dml_proto1_fake.bin")
+    unknown = bytearray(good)
+    unknown[9] = 77
+    for _ in range(5):
+        with pytest.raises(ValueError) as info:
+            reader.decode_ki_packet(bytes(unknown))
+        assert isinstance(info.value.__cause__, DMLDecodeError)
+        with pytest.raises(ValueError):
+            reader.decode_ki_packet(good[:40])
+
+    summary = reader.error_tracker.summary()
+    assert summary["total"] == 10
+    buckets = {
+        (b["service_id"], b["message_id"], b["error"]): b for b in summary["buckets"]
+    }
+    assert buckets[(1, 77, "DMLDecodeError")]["count"] == 5
+    assert buckets[(1, 1, "ValueError")]["count"] == 5
+    assert all(len(b["samples"]) == 3 for b in summary["buckets"])
+
+
+def test_classify_headers():
+    control = b"\x0D\xF0\x06\x00\x01\x03\x00\x00\x01\x00"
+    assert classify(ValueError(), control) == ErrorBucket(
+        None, 3, "ValueError", control=True
+    )
+    assert classify(ValueError(), b"junk") == ErrorBucket(None, None, "ValueError")
+
+
+def test_summary_logging_is_rate_limited(caplog):
+    tracker = DecodeErrorTracker(log_interval=3600, max_buckets=1, max_sample_bytes=2)
+    with caplog.at_level(logging.WARNING, logger="moonlight.net.errors"):
+        for i in range(100):
+            tracker.record(DMLDecodeError("bad", 1, i % 2), b"\x01\x02\x03")
+    assert len(caplog.records) == 1
+    summary = tracker.summary()
+    assert (summary["total"], summary["untracked"]) == (100, 50)
+    assert summary["buckets"][0]["samples"][0] == "01 02"
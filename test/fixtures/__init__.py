@@ -1,9 +1,13 @@
+import shutil
+import struct
 import xml.etree.ElementTree as ET
-from os import chdir
-from os.path import join, dirname
+from os import chdir, listdir
+from os.path import dirname, isfile, join
 
 import pytest
-from moonlight.net.dml import FieldDef
+from moonlight.net import RevisionRegistry
+from moonlight.net.dml import DMLProtocolRegistry, FieldDef
+from moonlight.net.pcap import PcapWriter, build_tcp_frame
 from moonlight.net.object_property import build_typecache
 
 this_folder = dirname(__file__)
@@ -39,6 +43,35 @@ def typecache():
     )
 
 
+@pytest.fixture
+def dml_protocol() -> DMLProtocolRegistry:
+    res_folder = join(this_folder, "dml", "messages")
+    return DMLProtocolRegistry(
+        *filter(isfile, (join(res_folder, f) for f in listdir(res_folder)))
+    )
+
+
+@pytest.fixture
+def revisions(tmp_path) -> RevisionRegistry:
+    """Revisions "old", the fixture definitions, and "changed", which adds a field"""
+    res_folder = join(this_folder, "dml", "messages")
+    changed = tmp_path / "changed"
+    shutil.copytree(res_folder, changed)
+    path = changed / "FakeMessages.xml"
+    # a field added at the end of the only message
+    path.write_text(
+        path.read_text(encoding="utf8").replace(
+            '<TestField_0F_DBL TYPE="DBL" />',
+            '<TestField_0F_DBL TYPE="DBL" /><Extra TYPE="INT" />',
+        ),
+        encoding="utf8",
+    )
+    revisions = RevisionRegistry(workers=1)
+    revisions.add("old", res_folder)
+    revisions.add("changed", changed)
+    return revisions
+
+
 @pytest.fixture
 def control_session_offer():
     return load_packet("ctrl_session_offer.bin")
@@ -47,3 +80,24 @@ def control_session_offer():
 @pytest.fixture
 def control_session_accept():
     return load_packet("ctrl_session_accept.bin")
+
+
+def build_dml_frame(
+    service_id: int, message_id: int, body: bytes = b"\x00" * 4
+) -> bytes:
+    """KI frame of a DML message with the given body"""
+    frame = b"\x00\x00\x00\x00" + bytes([service_id, message_id]) + body
+    return b"\x0D\xF0" + struct.pack("<H", len(frame)) + frame
+
+
+def build_control_frame(opcode: int) -> bytes:
+    """KI control frame with an empty body"""
+    frame = bytes([1, opcode, 0, 0]) + b"\x00" * 6
+    return b"\x0D\xF0" + struct.pack("<H", len(frame)) + frame
+
+
+def write_capture(path, frames, start: float = 1650000000.0) -> None:
+    """Writes frames to a classic pcap, one second apart"""
+    with PcapWriter(path) as writer:
+        for i, frame in enumerate(frames):
+            writer.write(start + i, frame)
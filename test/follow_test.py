@@ -0,0 +1,63 @@
+import threading
+
+from moonlight.net.follow import CaptureFollower, next_ring_file
+from moonlight.net.pcap import PCAP_GLOBAL_HEADER
+
+from .fixtures import build_tcp_frame, write_capture
+
+
+def _capture_bytes(tmp_path, frames, name="src.pcap") -> bytes:
+    write_capture(tmp_path / name, frames)
+    return (tmp_path / name).read_bytes()
+
+
+def test_next_ring_file(tmp_path):
+    for name in (
+        "cap_00001_20240101000000.pcapng",
+        "cap_00002_20240101000100.pcapng",
+        "cap_00003_20240101000200.pcapng",
+        "other_00004_20240101000300.pcapng",
+    ):
+        (tmp_path / name).touch()
+    assert next_ring_file(tmp_path / "cap_00001_20240101000000.pcapng").name == (
+        "cap_00002_20240101000100.pcapng"
+    )
+    assert next_ring_file(tmp_path / "cap_00003_20240101000200.pcapng") is None
+    assert next_ring_file(tmp_path / "plain.pcap") is None
+
+
+def test_follow_waits_for_partial_records(tmp_path):
+    frames = [build_tcp_frame(b"\x0D\xF0" + bytes([i]) * 10) for i in range(3)]
+    data = _capture_bytes(tmp_path, frames)
+    record_len = (len(data) - PCAP_GLOBAL_HEADER.size) // 3
+    split = PCAP_GLOBAL_HEADER.size + record_len + 5
+
+    live = tmp_path / "live.pcap"
+    live.write_bytes(data[:split])
+    follower = CaptureFollower(
+        live, poll_interval=0.01, max_poll_interval=0.05, idle_timeout=2
+    )
+
+    def append_rest():
+        with open(live, "ab") as file:
+            file.write(data[split:])
+
+    seen = []
+    for record in follower:
+        seen.append(record.data)
+        if len(seen) == 1:
+            threading.Timer(0.1, append_rest).start()
+        if len(seen) == 3:
+            follower.stop()
+    assert seen == frames
+
+
+def test_follow_rotates(tmp_path):
+    first = tmp_path / "cap_00001_20240101000000.pcap"
+    second = tmp_path / "cap_00002_20240101000100.pcap"
+    write_capture(first, [build_tcp_frame(b"\x0D\xF0a")])
+    write_capture(second, [build_tcp_frame(b"\x0D\xF0b")])
+
+    follower = CaptureFollower(first, poll_interval=0.01, idle_timeout=0.2)
+    assert len(list(follower)) == 2
+    assert follower.files_followed == 2
@@ -0,0 +1,127 @@
+import json
+import os
+from datetime import datetime
+
+import pytest
+from click.testing import CliRunner
+
+from moonlight.cli.pcap import pcap
+from moonlight.net import MessageSender, PacketReader
+from moonlight.net.index import (
+    CaptureIndex,
+    StaleIndexError,
+    build_index,
+    default_index_path,
+)
+from moonlight.net.scan import iter_ki_frames
+
+from .fixtures import (
+    build_control_frame,
+    build_dml_frame,
+    build_tcp_frame,
+    load_packet,
+    write_capture,
+)
+
+MESSAGES = os.path.join(os.path.dirname(__file__), "fixtures", "dml", "messages")
+
+
+@pytest.fixture
+def indexed_capture(tmp_path):
+    payloads = [
+        build_control_frame(0),
+        build_dml_frame(5, 1),
+        build_dml_frame(5, 2) + build_dml_frame(7, 1, b"\x01\x02"),
+        b"not ki at all",
+        build_dml_frame(5, 1, b"\xff" * 6),
+    ]
+    capture = tmp_path / "game.pcap"
+    write_capture(
+        capture,
+        [build_tcp_frame(p, sport=12000 + i % 2) for i, p in enumerate(payloads)],
+    )
+    assert build_index(capture) == 5
+    return capture, payloads
+
+
+def test_iter_ki_frames_back_to_back():
+    payload = build_dml_frame(5, 2) + build_dml_frame(7, 1, b"\x01\x02") + b"\x0D"
+    frames = list(iter_ki_frames(payload))
+    assert [(f.service_id, f.message_id) for f in frames] == [(5, 2), (7, 1)]
+    assert frames[1].offset == len(build_dml_frame(5, 2))
+    assert all(f.complete for f in frames)
+
+
+def test_select(indexed_capture):
+    capture, _ = indexed_capture
+    with CaptureIndex(default_index_path(capture), capture) as index:
+        assert index.time_sorted
+        assert len(index.flows) == 2
+        assert [e.record_number for e in index.select(service_id=5, message_id=1)] == [
+            1,
+            4,
+        ]
+        assert [e.message_id for e in index.select(is_control=True)] == [0]
+        # records are written one second apart
+        by_time = list(index.select(start=1650000001.0, end=1650000003.0))
+        assert [(e.service_id, e.message_id) for e in by_time] == [
+            (5, 1),
+            (5, 2),
+            (7, 1),
+        ]
+        assert [e.record_number for e in index.select(records=range(2, 3))] == [2, 2]
+
+
+def test_frames(indexed_capture):
+    capture, payloads = indexed_capture
+    with CaptureIndex(default_index_path(capture), capture) as index:
+        frames = [frame for _, frame in index.frames(index.select(is_control=False))]
+    assert frames == [
+        payloads[1],
+        build_dml_frame(5, 2),
+        build_dml_frame(7, 1, b"\x01\x02"),
+        payloads[4],
+    ]
+
+
+def test_stale_index(indexed_capture):
+    capture, _ = indexed_capture
+    stat = os.stat(capture)
+    os.utime(capture, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    with pytest.raises(StaleIndexError):
+        CaptureIndex(default_index_path(capture), capture)
+    # the index itself can still be read without its capture
+    with CaptureIndex(default_index_path(capture)) as index:
+        assert len(index) == 5
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "junk.mlidx"
+    path.write_bytes(b"\x00" * 64)
+    with pytest.raises(ValueError):
+        CaptureIndex(path)
+
+
+def test_query_decode_adds_capture_data(tmp_path):
+    capture = tmp_path / "game.pcap"
+    registry = PacketReader(MESSAGES).dml_protocol
+    msg = registry.decode_packet(load_packet("dml_proto1_fake.bin"))
+    # the fixture's lengths are fake, so the index would cut it short
+    msg_def = registry.get_by_id(1).message_map[1]
+    dml = msg_def.encode_packet({f.name(): f.value for f in msg.fields})
+    # netpack captures give the sender as the destination port
+    sent = MessageSender.SERVER.netpack_port
+    frames = [build_tcp_frame(build_control_frame(0)), build_tcp_frame(dml, dport=sent)]
+    write_capture(capture, frames)
+    build_index(capture)
+
+    result = CliRunner(mix_stderr=False).invoke(
+        pcap, ["query", str(capture), "--records", "1:2", "-m", MESSAGES, "--decode"]
+    )
+    assert result.exit_code == 0, result.output
+    (line,) = [json.loads(line) for line in result.stdout.splitlines()]
+    message = line["message"]
+    assert message["data"]["name"] == "MSG_PROTO1_FAKE"
+    assert message["sender"] == "SERVER"
+    assert message["timestamp"] == datetime.fromtimestamp(line["timestamp"]).isoformat()
+    assert "raw" not in message
@@ -0,0 +1,36 @@
+import gc
+
+from moonlight.net.memory import MemoryReporter, census, rss_bytes
+
+from .fixtures import dml_protocol, load_packet
+
+
+def test_census_counts_live_messages(dml_protocol):
+    # messages left in cycles by earlier tests would be freed mid test
+    gc.collect()
+    before = {e["name"]: e["count"] for e in census()["by_message"]}
+    messages = [
+        dml_protocol.decode_packet(load_packet("dml_proto1_fake.bin")) for _ in range(3)
+    ]
+
+    result = census()
+    by_type = {e["name"]: e for e in result["by_type"]}
+    by_message = {e["name"]: e for e in result["by_message"]}
+    assert (
+        by_message["MSG_PROTO1_FAKE"]["count"] == before.get("MSG_PROTO1_FAKE", 0) + 3
+    )
+    assert by_type["DMLMessage"]["count"] >= 3
+    assert by_type["Field"]["count"] >= 3 * len(messages[0].fields)
+    assert by_type["KIHeader"]["count"] >= 3
+    assert result["total"] == sum(e["bytes"] for e in result["by_type"])
+
+
+def test_reporter_samples():
+    assert rss_bytes() > 0
+    with MemoryReporter(interval=60, top=3) as reporter:
+        data = [bytes(1000) for _ in range(100)]
+    report = reporter.report()
+    assert len(report["samples"]) == 2
+    assert report["peak_traced"] >= 100 * 1000
+    assert 0 < len(report["final"]["sites"]) <= 3
+    assert data
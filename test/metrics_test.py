@@ -0,0 +1,30 @@
+from moonlight.net import DecodeMetrics, KeepAliveMessage
+from moonlight.net.metrics import Histogram
+
+
+def test_histogram_cumulative_buckets():
+    hist = Histogram([1, 5, 10])
+    for value in (0.5, 1, 3, 7, 100):
+        hist.observe(value)
+    assert hist.cumulative() == [(1, 2), (5, 3), (10, 4), (float("inf"), 5)]
+    assert hist.quantile(0.5) == 5
+    assert hist.count == 5
+
+
+def test_render_openmetrics():
+    metrics = DecodeMetrics(queue_depth=lambda: 7)
+    msg = KeepAliveMessage(original_bytes=None, session_id=1, variable_timestamp=b"")
+    metrics.record_packet(20)
+    metrics.record_decode(msg, 0.0002)
+    metrics.record_error()
+    metrics.record_drop(3)
+
+    text = metrics.render_openmetrics()
+    assert "moonlight_packets_total 1\n" in text
+    assert "moonlight_bytes_total 20\n" in text
+    assert "moonlight_errors_total 1\n" in text
+    assert "moonlight_dropped_total 3\n" in text
+    assert "moonlight_queue_depth 7\n" in text
+    assert 'moonlight_messages_total{type="KeepAliveMessage"} 1\n' in text
+    assert 'moonlight_decode_latency_seconds_bucket{le="+Inf"} 1\n' in text
+    assert text.endswith("# EOF\n")
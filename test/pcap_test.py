@@ -0,0 +1,67 @@
+from moonlight.net.filter import filter_pcap, signed_msg_span
+from moonlight.net.pcap import (
+    LINKTYPE_ETHERNET,
+    CaptureFileReader,
+    fix_tcp_checksum,
+    parse_tcp,
+)
+
+from .fixtures import build_tcp_frame, load_packet, write_capture
+
+
+def test_parse_tcp():
+    frame = build_tcp_frame(b"\x0D\xF0hello", sport=1, dport=2, seq=99)
+    # ethernet padding must not count as payload
+    segment = parse_tcp(LINKTYPE_ETHERNET, frame + b"\x00" * 8)
+    assert segment is not None
+    assert (segment.sport, segment.dport, segment.seq) == (1, 2, 99)
+    assert segment.payload(frame) == b"\x0D\xF0hello"
+
+
+def test_checksum_roundtrip():
+    frame = bytearray(build_tcp_frame(b"abc"))
+    original = bytes(frame)
+    fix_tcp_checksum(frame, parse_tcp(LINKTYPE_ETHERNET, frame))
+    assert bytes(frame) == original
+
+
+def test_reader_roundtrip(tmp_path):
+    frames = [build_tcp_frame(b"\x0D\xF0" + bytes([i])) for i in range(3)]
+    write_capture(tmp_path / "in.pcap", frames)
+    with CaptureFileReader(tmp_path / "in.pcap") as reader:
+        records = list(reader)
+    assert [r.data for r in records] == frames
+    assert records[1].timestamp - records[0].timestamp == 1.0
+
+
+def test_signed_msg_span():
+    assert signed_msg_span(load_packet("ctrl_session_offer.bin")) == (26, 281)
+    assert signed_msg_span(load_packet("ctrl_session_accept.bin")) == (28, 257)
+    assert signed_msg_span(load_packet("dml_proto1_fake.bin")) is None
+
+
+def test_filter_copies_and_sanitizes(tmp_path):
+    offer = load_packet("ctrl_session_offer.bin")
+    dml = load_packet("dml_proto1_fake.bin")
+    frames = [
+        build_tcp_frame(b"not ki"),
+        build_tcp_frame(dml),
+        build_tcp_frame(offer),
+        build_tcp_frame(b"", dport=3),
+    ]
+    write_capture(tmp_path / "in.pcap", frames)
+
+    stats = filter_pcap(tmp_path / "in.pcap", tmp_path / "out.pcap", sanitize=True)
+    assert (stats.records, stats.kept, stats.sanitized) == (4, 2, 1)
+
+    with CaptureFileReader(tmp_path / "out.pcap") as reader:
+        kept = [r.data for r in reader]
+    assert kept[0] == frames[1]
+    sanitized = parse_tcp(LINKTYPE_ETHERNET, kept[1])
+    payload = sanitized.payload(kept[1])
+    assert payload[:26] == offer[:26]
+    assert payload[26:] == bytes(281) + offer[26 + 281 :]
+    # checksum must already be valid
+    rechecked = bytearray(kept[1])
+    fix_tcp_checksum(rechecked, sanitized)
+    assert bytes(rechecked) == kept[1]
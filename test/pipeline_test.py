@@ -0,0 +1,83 @@
+import threading
+from datetime import datetime
+
+from moonlight.net import CapturedPayload, DecodePipeline, OverflowPolicy
+
+
+def _payload(i: int) -> CapturedPayload:
+    return CapturedPayload(payload=bytes([i]), timestamp=datetime.now())
+
+
+def _blocked_pipeline(overflow: OverflowPolicy, received: list):
+    gate = threading.Event()
+
+    def decode(item):
+        gate.wait()
+        return item.payload
+
+    pipeline = DecodePipeline(
+        decode=decode,
+        callback=lambda msg, item: received.append(msg),
+        queue_size=2,
+        overflow=overflow,
+    )
+    return pipeline, gate
+
+
+def test_block_decodes_everything_in_order():
+    received = []
+    pipeline = DecodePipeline(
+        decode=lambda item: item.payload,
+        callback=lambda msg, item: received.append(msg),
+        queue_size=1,
+    )
+    pipeline.start()
+    for i in range(50):
+        assert pipeline.submit(_payload(i))
+    pipeline.stop()
+    assert received == [bytes([i]) for i in range(50)]
+    assert pipeline.counters.dropped == 0
+    assert pipeline.counters.decoded == 50
+
+
+def test_drop_newest_keeps_queued():
+    received = []
+    pipeline, gate = _blocked_pipeline(OverflowPolicy.DROP_NEWEST, received)
+    results = [pipeline.submit(_payload(i)) for i in range(5)]
+    pipeline.start()
+    gate.set()
+    pipeline.stop()
+    assert results == [True, True, False, False, False]
+    assert received == [b"\x00", b"\x01"]
+    assert pipeline.counters.dropped_newest == 3
+
+
+def test_drop_oldest_keeps_newest():
+    received = []
+    pipeline, gate = _blocked_pipeline(OverflowPolicy.from_str("drop-oldest"), received)
+    for i in range(5):
+        assert pipeline.submit(_payload(i))
+    pipeline.start()
+    gate.set()
+    pipeline.stop()
+    assert received == [b"\x03", b"\x04"]
+    assert pipeline.counters.dropped_oldest == 3
+
+
+def test_worker_survives_errors():
+    received = []
+
+    def decode(item):
+        if item.payload == b"\x01":
+            raise RuntimeError("bad payload")
+        return item.payload
+
+    pipeline = DecodePipeline(
+        decode=decode, callback=lambda msg, item: received.append(msg)
+    )
+    pipeline.start()
+    for i in range(3):
+        pipeline.submit(_payload(i))
+    pipeline.stop()
+    assert received == [b"\x00", b"\x02"]
+    assert pipeline.counters.errors == 1
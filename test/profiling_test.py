@@ -0,0 +1,51 @@
+import time
+
+import pytest
+
+from moonlight.util import SerdeJSONEncoder, StageProfiler, active_profiler, stage
+
+
+def test_stage_without_profiler():
+    assert active_profiler() is None
+    with stage("nothing"):
+        pass
+
+
+def test_nested_stages():
+    with StageProfiler() as profiler:
+        assert active_profiler() is profiler
+        with stage("outer"):
+            time.sleep(0.01)
+            for _ in range(2):
+                with stage("inner"):
+                    time.sleep(0.01)
+        SerdeJSONEncoder().encode({"a": 1})
+        profiler.add_message("Msg", "decode", 0.5)
+        profiler.add_message("Msg", "encode", 0.25)
+    assert active_profiler() is None
+
+    report = profiler.report()
+    stages = {s["name"]: s for s in report["stages"]}
+    assert stages["inner"]["calls"] == 2
+    assert stages["outer"]["total"] >= stages["inner"]["total"] + 0.01
+    assert stages["outer"]["own"] == pytest.approx(
+        stages["outer"]["total"] - stages["inner"]["total"]
+    )
+    assert stages["serde"]["calls"] == 1
+    assert report["wall"] >= sum(s["own"] for s in report["stages"])
+    assert report["messages"] == [
+        {
+            "name": "Msg",
+            "count": 1,
+            "decode": 0.5,
+            "encode": 0.25,
+            "total": 0.75,
+            "per_message": 0.75,
+        }
+    ]
+
+
+def test_one_profiler_at_a_time():
+    with StageProfiler():
+        with pytest.raises(RuntimeError):
+            StageProfiler().start()
@@ -0,0 +1,75 @@
+import os
+import signal
+import time
+
+from moonlight.net import RingRecorder
+from moonlight.net.pcap import PCAP_GLOBAL_HEADER, PCAP_RECORD_HEADER
+
+
+def _read_records(path):
+    with open(path, "rb") as file:
+        data = file.read()
+    offset = PCAP_GLOBAL_HEADER.size
+    records = []
+    while offset < len(data):
+        sec, usec, incl_len, _ = PCAP_RECORD_HEADER.unpack_from(data, offset)
+        offset += PCAP_RECORD_HEADER.size
+        records.append((sec + usec / 1_000_000, data[offset : offset + incl_len]))
+        offset += incl_len
+    return records
+
+
+def test_evicts_by_size():
+    recorder = RingRecorder(max_bytes=3 * (100 + 128))
+    for i in range(10):
+        recorder.record(float(i), bytes([i]) * 100)
+    frames = recorder.snapshot()
+    assert [f.timestamp for f in frames] == [7.0, 8.0, 9.0]
+    assert recorder.evicted == 7
+
+
+def test_evicts_by_age():
+    recorder = RingRecorder(max_age=2.5)
+    for i in range(10):
+        recorder.record(float(i), b"\x00")
+    assert [f.timestamp for f in recorder.snapshot()] == [7.0, 8.0, 9.0]
+
+
+def test_dump_writes_pcap(tmp_path):
+    recorder = RingRecorder(dump_dir=tmp_path)
+    recorder.record(1.5, b"\x0D\xF0one")
+    recorder.record(2.25, b"\x0D\xF0two")
+    out = recorder.dump(background=False)
+    assert out.parent == tmp_path
+    assert _read_records(out) == [(1.5, b"\x0D\xF0one"), (2.25, b"\x0D\xF0two")]
+
+
+def test_trigger_respects_interval(tmp_path):
+    recorder = RingRecorder(dump_dir=tmp_path, min_dump_interval=10)
+    recorder.add_trigger(lambda msg: msg == "boom")
+    recorder.record(1.0, b"\x00")
+    assert recorder.check_triggers("quiet") is None
+    assert recorder.check_triggers("boom") is not None
+    recorder.record(2.0, b"\x00")
+    assert recorder.check_triggers("boom") is None
+    recorder.wait_for_dumps()
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+def test_signal_while_recording(tmp_path):
+    recorder = RingRecorder(dump_dir=tmp_path)
+    recorder.install_signal_handler()
+    recorder.record(1.0, b"\x0D\xF0one")
+    # as if the signal arrived mid `record`
+    with recorder._lock:
+        os.kill(os.getpid(), signal.SIGUSR1)
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        dumps = list(tmp_path.iterdir())
+        if dumps and _read_records(dumps[0]) == [(1.0, b"\x0D\xF0one")]:
+            break
+        time.sleep(0.01)
+    else:
+        raise AssertionError("signal did not dump the buffer")
+    recorder.wait_for_dumps()
+    signal.signal(signal.SIGUSR1, signal.SIG_DFL)
@@ -0,0 +1,57 @@
+import struct
+
+import pytest
+
+from moonlight.net import Redactor
+from moonlight.net.filter import filter_pcap
+from moonlight.net.pcap import LINKTYPE_ETHERNET, CaptureFileReader, parse_tcp
+
+from .fixtures import build_tcp_frame, dml_protocol, load_packet, write_capture
+
+
+def _dml_frame() -> bytes:
+    # the fixture's KI header understates its length and carries padding
+    frame = bytearray(load_packet("dml_proto1_fake.bin")[:91])
+    struct.pack_into("<H", frame, 2, len(frame) - 4)
+    return bytes(frame)
+
+
+def test_redact_static_and_walked_fields(dml_protocol):
+    frame = _dml_frame()
+    redactor = Redactor(
+        dml_protocol,
+        ["TestField_05_UINT32", "MSG_PROTO1_FAKE.TestField_12_STR"],
+        signed_messages=False,
+    )
+    buffer = bytearray(frame * 2)
+    assert redactor.redact(buffer) == 4
+
+    expected = bytearray(frame)
+    expected[22:26] = bytes(4)
+    expected[82:91] = bytes(9)
+    assert bytes(buffer) == bytes(expected) * 2
+    assert (redactor.stats.frames, redactor.stats.fields) == (2, 4)
+
+
+def test_redact_unknown_rule(dml_protocol):
+    with pytest.raises(ValueError):
+        Redactor(dml_protocol, ["MSG_PROTO1_FAKE.NoSuchField"])
+    with pytest.raises(ValueError):
+        Redactor(None, ["TestField_05_UINT32"])
+
+
+def test_filter_redacts_in_one_pass(dml_protocol, tmp_path):
+    frame = _dml_frame()
+    offer = load_packet("ctrl_session_offer.bin")
+    write_capture(tmp_path / "in.pcap", [build_tcp_frame(frame + offer)])
+
+    redactor = Redactor(dml_protocol, ["TestField_11_STR"])
+    stats = filter_pcap(tmp_path / "in.pcap", tmp_path / "out.pcap", redactor=redactor)
+    assert (stats.kept, stats.sanitized) == (1, 1)
+    assert redactor.stats.signed_messages == 1
+
+    with CaptureFileReader(tmp_path / "out.pcap") as reader:
+        (data,) = [r.data for r in reader]
+    payload = parse_tcp(LINKTYPE_ETHERNET, data).payload(data)
+    assert payload[72:80] == b"\x06\x00" + bytes(6)
+    assert payload[len(frame) + 26 : len(frame) + 26 + 281] == bytes(281)
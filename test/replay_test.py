@@ -0,0 +1,87 @@
+import gzip
+import os
+import threading
+import time
+
+import pytest
+
+from moonlight.net.pcap import PcapWriter
+from moonlight.net.scapy import PcapReplayer
+
+from .fixtures import build_tcp_frame, load_packet
+
+MESSAGES = os.path.join(os.path.dirname(__file__), "fixtures", "dml", "messages")
+
+
+def _write_capture(path, gap: float, count: int = 4) -> None:
+    offer = load_packet("ctrl_session_offer.bin")
+    with PcapWriter(path) as writer:
+        for i in range(count):
+            writer.write(
+                100.0 + i * gap, build_tcp_frame(offer, seq=1 + i * len(offer))
+            )
+        # not KI, replayed but never queued
+        writer.write(100.0 + count * gap, build_tcp_frame(b"hello", seq=9999))
+
+
+def _replay(path, speed, **kwargs) -> tuple[PcapReplayer, list, float]:
+    delivered = []
+    replayer = PcapReplayer(
+        path, lambda msg, pkt: delivered.append(msg), MESSAGES, speed=speed, **kwargs
+    )
+    start = time.monotonic()
+    replayer.open_livestream()
+    return replayer, delivered, time.monotonic() - start
+
+
+@pytest.fixture
+def capture(tmp_path):
+    path = tmp_path / "replay.pcap"
+    _write_capture(path, gap=0.1)
+    return path
+
+
+def test_real_time(capture):
+    replayer, delivered, elapsed = _replay(capture, 1)
+    stats = replayer.replay_stats
+    assert stats.packets == 5
+    assert stats.ki_packets == len(delivered) == 4
+    assert stats.capture_duration == pytest.approx(0.4)
+    assert elapsed >= 0.4
+    assert stats.speedup == pytest.approx(1, rel=0.5)
+    assert stats.packets_per_second > 0
+
+
+def test_faster_than_real_time(capture):
+    replayer, _, elapsed = _replay(capture, 4)
+    assert 0.1 <= elapsed < 0.4
+    assert replayer.replay_stats.speedup > 2
+
+
+def test_full_speed(capture):
+    replayer, delivered, elapsed = _replay(capture, None)
+    assert len(delivered) == 4
+    assert elapsed < 0.2
+    assert replayer.replay_stats.ki_packets == 4
+
+
+def test_close_mid_replay(tmp_path):
+    path = tmp_path / "slow.pcap"
+    _write_capture(path, gap=30)
+    delivered = []
+    replayer = PcapReplayer(path, lambda msg, pkt: delivered.append(msg), MESSAGES)
+    threading.Timer(0.2, replayer.close_livestream).start()
+    start = time.monotonic()
+    replayer.open_livestream()
+    assert time.monotonic() - start < 5
+    assert replayer.replay_stats.packets == 1
+    assert len(delivered) == 1
+
+
+def test_compressed_stream(capture, tmp_path):
+    path = tmp_path / "replay.pcap.gz"
+    path.write_bytes(gzip.compress(capture.read_bytes()))
+    with open(path, "rb") as stream:
+        replayer, delivered, _ = _replay(stream, None)
+    assert replayer.replay_stats.packets == 5
+    assert len(delivered) == 4
@@ -0,0 +1,58 @@
+import os
+from os.path import join
+
+import pytest
+
+from moonlight.net import RevisionRegistry
+
+from .fixtures import load_packet, revisions
+
+RES_FOLDER = join(os.path.dirname(__file__), "fixtures", "dml", "messages")
+
+
+def test_definitions_are_shared(revisions: RevisionRegistry):
+    revisions.add("same", RES_FOLDER)
+    assert list(revisions) == ["old", "changed", "same"]
+    assert revisions.default == "old"
+    old = revisions["old"].get_by_id(1)
+    assert revisions["same"].get_by_id(1) is old
+
+    changed = revisions["changed"].get_by_id(1)
+    assert changed is not old
+    old_fields = old.message_map[1].fields
+    changed_fields = changed.message_map[1].fields
+    assert len(changed_fields) == len(old_fields) + 1
+    assert changed_fields[0] is old_fields[0]
+
+    stats = revisions.interner.stats()
+    assert stats["protocols"] == {"seen": 3, "unique": 2}
+    assert stats["messages"] == {"seen": 3, "unique": 2}
+    assert stats["fields"]["unique"] == len(changed_fields)
+
+    with pytest.raises(ValueError):
+        revisions.add("old", RES_FOLDER)
+
+
+def test_revision_per_flow(revisions: RevisionRegistry):
+    bites = load_packet("dml_proto1_fake.bin")
+    flow = ("127.0.0.1", 12000, "127.0.0.1", 50000)
+    old = revisions.decode_packet(bites, flow)
+    values = {f.name(): f.value for f in old.fields}
+    changed_def = revisions["changed"].get_by_id(1).message_map[1]
+    changed_bites = changed_def.encode_packet({**values, "Extra": 5})
+
+    revisions.assign_flow(flow, "changed")
+    assert revisions.revision_for(flow) == "changed"
+    assert revisions.revision_for() == "old"
+    msg = revisions.decode_packet(changed_bites, flow)
+    assert {f.name(): f.value for f in msg.fields}["Extra"] == 5
+    assert len(revisions.decode_packet(bites).fields) == len(old.fields)
+
+    revisions.forget_flow(flow)
+    assert revisions.revision_for(flow) == "old"
+    with pytest.raises(KeyError):
+        revisions.assign_flow(flow, "missing")
+
+    reader = revisions.reader("changed")
+    assert reader.dml_protocol is revisions["changed"]
+    assert reader.decode_ki_packet(changed_bites).fields[16].value == 5
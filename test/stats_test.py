@@ -0,0 +1,56 @@
+from moonlight.net.stats import SizeTally, collect_stats
+
+from .fixtures import (
+    build_control_frame,
+    build_dml_frame,
+    build_tcp_frame,
+    dml_protocol,
+    write_capture,
+)
+
+
+def test_size_tally_percentiles():
+    tally = SizeTally()
+    for size in range(1, 101):
+        tally.add(size)
+    assert (tally.count, tally.bytes) == (100, 5050)
+    assert [tally.percentile(p) for p in (1, 50, 90, 99, 100)] == [1, 50, 90, 99, 100]
+    assert SizeTally().percentile(50) == 0
+
+
+def test_collect_stats(dml_protocol, tmp_path):
+    first = tmp_path / "a.pcap"
+    second = tmp_path / "b.pcap"
+    write_capture(
+        first,
+        [
+            build_tcp_frame(build_control_frame(0)),
+            build_tcp_frame(
+                build_dml_frame(1, 1, bytes(10)) + build_dml_frame(1, 2, bytes(20))
+            ),
+            build_tcp_frame(b"plain tcp"),
+        ],
+    )
+    write_capture(
+        second,
+        [build_tcp_frame(build_dml_frame(1, 1, bytes(30)), sport=12001)],
+        start=1650000120.0,
+    )
+
+    stats = collect_stats([first, second], bucket_seconds=60)
+    report = stats.report(dml_protocol)
+
+    assert report["total"]["frames"] == 4
+    assert report["total"]["duration"] == 120
+    messages = {(m["service_id"], m["message_id"]): m for m in report["messages"]}
+    assert messages[(1, 1)]["frames"] == 2
+    assert messages[(1, 1)]["name"] == "MSG_PROTO1_FAKE"
+    assert messages[(1, 1)]["size"]["max"] == len(build_dml_frame(1, 1, bytes(30)))
+    assert messages[(1, 2)]["bytes"] == len(build_dml_frame(1, 2, bytes(20)))
+    assert report["services"][0]["frames"] == 3
+    assert [
+        (o["opcode"], o["name"], o["frames"]) for o in report["control_opcodes"]
+    ] == [(0, "SessionOfferMessage", 1)]
+    assert len(report["flows"]) == 2
+    assert [b["frames"] for b in report["timeline"]["buckets"]] == [3, 1]
+    assert len(stats.report(top=1)["flows"]) == 1